@@ -0,0 +1,290 @@
+# approach_controller.py
+# 视觉伺服接近控制：对目标方位角做PD转向，按剩余距离和碰撞时间规划前进速度，
+# 接近绕行起点时平滑减速到停车，代替比例转向加恒速直行
+import math
+
+# ===== 可配置参数（修改此处无需改动函数） =====
+# 1. 转向（PD，输出左右轮速度差，单位 转/秒）
+STEER_KP = 1.6             # 方位角比例增益（转/秒 每弧度）
+STEER_KD = 0.12            # 方位角变化率增益（转/秒 每 弧度/秒）
+BEARING_RATE_FILTER = 0.5  # 方位角变化率的低通系数，越小越平滑
+MAX_STEER = 0.6            # 左右轮速度差上限（转/秒）
+LOST_STEER_DECAY = 0.5     # 看不到目标时转向量每帧衰减比例
+
+# 2. 速度规划（转/秒）
+MAX_SPEED = 1.5            # 远处的最高速度
+MIN_SPEED = 0.3            # 接近停车点时的最低速度（爬行）
+UNKNOWN_DISTANCE_SPEED = 1.0  # 还没有任何有效距离时的速度
+MAX_ACCEL = 2.0            # 加速度上限（转/秒²）
+MAX_DECEL = 2.5            # 减速度上限（转/秒²），同时用于刹车曲线
+TIME_TO_CONTACT = 0.5      # 希望保持的最小碰撞时间（秒），剩余距离/速度不低于此值
+STOP_DISTANCE = 55.0       # 停车距离(cm)，即绕行起点
+STEER_FADE_DISTANCE = 15.0 # 剩余距离小于此值(cm)时逐渐减小转向，避免停车前摆头
+
+WHEEL_CIRCUMFERENCE_CM = math.pi * 6.5  # 车轮周长(cm)，与motor_controller中车轮直径一致
+
+
+class ApproachController:
+    """
+    接近魔方的控制器
+
+    每个控制周期调用update，传入最新的方位角和距离及其采集时间，返回左右轮目标速度。
+    距离在两次测量之间按已下发的速度外推，补偿测距周期和延迟；
+    期望速度取 最高速度、刹车曲线 sqrt(2·a·剩余距离)、剩余距离/碰撞时间 三者的最小值，
+    不低于爬行速度，到达停车距离后速度给0。
+    """
+
+    def __init__(self, stop_distance=STOP_DISTANCE, kp=STEER_KP, kd=STEER_KD,
+                 max_speed=MAX_SPEED, time_to_contact=TIME_TO_CONTACT):
+        self.stop_distance = stop_distance
+        self.kp = kp
+        self.kd = kd
+        self.max_speed = max_speed
+        self.time_to_contact = time_to_contact
+        self.reset()
+
+    def reset(self, initial_speed=0.0):
+        """开始新一次接近"""
+        self.speed = initial_speed   # 上一周期下发的前进速度（转/秒）
+        self.steer = 0.0
+        self.bearing = None
+        self.bearing_time = None
+        self.bearing_rate = 0.0
+        self.distance = None         # 最近一次有效距离(cm)
+        self.distance_time = None
+        self.travelled = 0.0         # 最近一次距离之后按下发速度外推的行驶距离(cm)
+        self.last_time = None
+        self.arrived = False
+
+    def _update_bearing(self, bearing, bearing_time):
+        """新帧到达时更新方位角和滤波后的变化率"""
+        if self.bearing is not None and bearing_time > self.bearing_time:
+            rate = (bearing - self.bearing) / (bearing_time - self.bearing_time)
+            self.bearing_rate += BEARING_RATE_FILTER * (rate - self.bearing_rate)
+        self.bearing = bearing
+        self.bearing_time = bearing_time
+
+    def predicted_distance(self):
+        """
+        Returns:
+            float: 外推到当前的距离(cm)，还没有有效距离时返回None
+        """
+        if self.distance is None:
+            return None
+        return self.distance - self.travelled
+
+    def target_speed(self, remaining):
+        """
+        按剩余距离规划期望速度
+
+        Args:
+            remaining: 到停车点的剩余距离(cm)，None表示未知
+
+        Returns:
+            float: 期望前进速度（转/秒）
+        """
+        if remaining is None:
+            return min(self.max_speed, UNKNOWN_DISTANCE_SPEED)
+        if remaining <= 0:
+            return 0.0
+        remaining_rev = remaining / WHEEL_CIRCUMFERENCE_CM
+        braking = math.sqrt(2.0 * MAX_DECEL * remaining_rev)
+        contact = remaining_rev / self.time_to_contact
+        return max(MIN_SPEED, min(self.max_speed, braking, contact))
+
+    def update(self, now, bearing=None, bearing_time=None, distance=None, distance_time=None):
+        """
+        计算一个控制周期的左右轮速度
+
+        Args:
+            now: 当前时间（秒）
+            bearing: 目标方位角（弧度，右侧为正），看不到目标时为None
+            bearing_time: 方位角对应帧的采集时间，同一帧重复传入时只用于转向
+            distance: 距离(cm)，无效时为None或<=0
+            distance_time: 距离的采集时间
+
+        Returns:
+            tuple: (左轮速度, 右轮速度)，到达后self.arrived为True
+        """
+        dt = 0.0 if self.last_time is None else max(0.0, now - self.last_time)
+        self.last_time = now
+        self.travelled += self.speed * WHEEL_CIRCUMFERENCE_CM * dt
+
+        if distance is not None and distance > 0:
+            if distance_time is None:
+                distance_time = now
+            if self.distance_time is None or distance_time > self.distance_time:
+                # 采集之后到现在的行驶距离按当前速度估计
+                self.distance = distance
+                self.distance_time = distance_time
+                self.travelled = self.speed * WHEEL_CIRCUMFERENCE_CM * max(0.0, now - distance_time)
+
+        if bearing is not None:
+            self._update_bearing(bearing, now if bearing_time is None else bearing_time)
+
+        # 前进速度：规划值经过加减速限制
+        predicted = self.predicted_distance()
+        remaining = None if predicted is None else predicted - self.stop_distance
+        if remaining is not None and remaining <= 0:
+            self.arrived = True
+        wanted = 0.0 if self.arrived else self.target_speed(remaining)
+        if dt > 0:
+            wanted = min(self.speed + MAX_ACCEL * dt, max(self.speed - MAX_DECEL * dt, wanted))
+        self.speed = wanted
+
+        # 转向：PD控制，看不到目标时逐渐回正
+        if bearing is not None and self.bearing is not None:
+            steer = self.kp * self.bearing + self.kd * self.bearing_rate
+        else:
+            steer = self.steer * (1.0 - LOST_STEER_DECAY)
+        if remaining is not None and remaining < STEER_FADE_DISTANCE:
+            steer *= max(0.0, remaining) / STEER_FADE_DISTANCE
+        self.steer = max(-MAX_STEER, min(MAX_STEER, steer))
+        if self.arrived:
+            self.steer = 0.0
+
+        # 方位角右侧为正：目标在右侧时左轮快、右轮慢
+        return self.speed + self.steer / 2.0, self.speed - self.steer / 2.0
+
+
+def target_bearing(color, color_data):
+    """
+    目标颜色最宽色段中心的方位角
+
+    Returns:
+        float: 方位角（弧度，右侧为正），看不到目标时返回None
+    """
+    from detect_color import pixel_to_bearing
+
+    segments = color_data.get(color, []) if color_data else []
+    if not segments:
+        return None
+    widest_segment = max(segments, key=lambda s: abs(s[1] - s[0]))
+    return pixel_to_bearing(widest_segment[2])
+
+
+# 以下仅用于测试
+
+# ===== 闭环仿真：对比原有的比例转向+恒速直行，并在网格上整定增益 =====
+def simulate_approach(step_fn, start, lateral, heading_deg, seed=0, dt=0.01, timeout=15.0,
+                      settle=1.0):
+    """
+    在仿真中接近一个魔方
+
+    Args:
+        step_fn: 控制函数 (sim, now) -> bool，返回True表示已到达并停车
+        start: 初始距离(cm)
+        lateral: 魔方的横向偏移(cm，左为正)
+        heading_deg: 小车初始航向偏差（度，逆时针为正）
+
+    Returns:
+        dict: {"time", "final_distance", "final_bearing_deg", "min_distance"}，超时time为None
+    """
+    from car_sim import CarSim
+
+    sim = CarSim([(start, lateral, "red")], pose=(0.0, 0.0, math.radians(heading_deg)), seed=seed)
+    arrived_at = None
+    min_distance = float('inf')
+    while sim.t < timeout:
+        if arrived_at is None and step_fn(sim, sim.t):
+            arrived_at = sim.t
+            sim.set_motor_speed(0, 0)
+        sim.step(dt)
+        min_distance = min(min_distance, sim.range_to())
+        if arrived_at is not None and sim.t - arrived_at >= settle:
+            break
+    return {"time": arrived_at, "final_distance": sim.range_to(),
+            "final_bearing_deg": math.degrees(sim.bearing_to()), "min_distance": min_distance}
+
+
+def make_baseline(stop_distance=STOP_DISTANCE, speed=1.0, offset_factor=0.2):
+    """原有控制：drive_with_color比例转向，恒速直到测距小于停车距离后立即停车"""
+    def step(sim, now):
+        distance = sim.get_latest_distance()
+        if 0 < distance <= stop_distance:
+            return True
+        segments = sim.get_latest_color_data().get("red", [])
+        left = right = speed
+        if segments:
+            x_center = max(segments, key=lambda s: abs(s[1] - s[0]))[2]
+            normalized_offset = min(1.0, abs(x_center) / 200.0)
+            if x_center > 0:
+                right = speed * (1 - offset_factor * normalized_offset)
+            else:
+                left = speed * (1 - offset_factor * normalized_offset)
+        sim.set_motor_speed(left, right)
+        return False
+    return step
+
+
+def make_servo(**kwargs):
+    """新控制器，与approach_cube_sequential的调用方式相同"""
+    controller = ApproachController(**kwargs)
+
+    def step(sim, now):
+        color_data = sim.get_latest_color_data()
+        bearing = target_bearing("red", color_data)
+        left, right = controller.update(now, bearing, sim.get_latest_color_timestamp(),
+                                        sim.get_latest_distance(), sim.get_latest_distance_timestamp())
+        sim.set_motor_speed(left, right)
+        return controller.arrived
+    return step
+
+
+def evaluate(make_step, scenarios, stop_distance=STOP_DISTANCE):
+    """
+    Returns:
+        dict: {"timeouts", "mean_time", "max_time", "mean_overshoot", "max_overshoot", "mean_bearing_deg"}
+        overshoot为停稳后比停车距离多前进的距离(cm)
+    """
+    times, overshoots, bearings = [], [], []
+    timeouts = 0
+    for index, (start, lateral, heading_deg) in enumerate(scenarios):
+        result = simulate_approach(make_step(), start, lateral, heading_deg, seed=index)
+        if result["time"] is None:
+            timeouts += 1
+            continue
+        times.append(result["time"])
+        overshoots.append(max(0.0, stop_distance - result["min_distance"]))
+        bearings.append(abs(result["final_bearing_deg"]))
+    n = max(1, len(times))
+    return {
+        "timeouts": timeouts,
+        "mean_time": sum(times) / n,
+        "max_time": max(times, default=0.0),
+        "mean_overshoot": sum(overshoots) / n,
+        "max_overshoot": max(overshoots, default=0.0),
+        "mean_bearing_deg": sum(bearings) / n,
+    }
+
+
+if __name__ == "__main__":
+    import itertools
+    import sys
+
+    scenarios = [(start, lateral, heading)
+                 for start in (120.0, 180.0, 250.0)
+                 for lateral in (-25.0, 0.0, 25.0)
+                 for heading in (-10.0, 0.0, 10.0)]
+
+    if "--tune" in sys.argv:
+        # 网格搜索：先保证过冲和末端方位误差，再比较用时
+        results = []
+        for kp, kd, ttc in itertools.product((0.6, 0.9, 1.2, 1.6), (0.0, 0.06, 0.12, 0.2), (0.5, 0.8, 1.2)):
+            stats = evaluate(lambda: make_servo(kp=kp, kd=kd, time_to_contact=ttc), scenarios)
+            cost = stats["mean_time"] + 0.2 * stats["max_overshoot"] + 0.1 * stats["mean_bearing_deg"] \
+                + 10.0 * stats["timeouts"]
+            results.append((cost, kp, kd, ttc, stats))
+        results.sort(key=lambda item: item[0])
+        print(f"{'kp':>5}{'kd':>6}{'ttc':>6}{'平均用时':>10}{'最大过冲':>10}{'末端方位':>10}")
+        for cost, kp, kd, ttc, stats in results[:8]:
+            print(f"{kp:>5}{kd:>6}{ttc:>6}{stats['mean_time']:>9.2f}s{stats['max_overshoot']:>8.1f}cm"
+                  f"{stats['mean_bearing_deg']:>8.1f}度")
+    else:
+        print(f"{len(scenarios)}个场景（初始距离、横向偏移、航向偏差组合），停车距离{STOP_DISTANCE:.0f}cm")
+        print(f"{'方法':<20}{'平均用时':>10}{'最长用时':>10}{'平均过冲':>10}{'最大过冲':>10}{'末端方位':>10}{'超时':>6}")
+        for name, make_step in (("比例转向+恒速", make_baseline), ("PD转向+速度规划", make_servo)):
+            stats = evaluate(make_step, scenarios)
+            print(f"{name:<20}{stats['mean_time']:>9.2f}s{stats['max_time']:>9.2f}s"
+                  f"{stats['mean_overshoot']:>8.1f}cm{stats['max_overshoot']:>8.1f}cm"
+                  f"{stats['mean_bearing_deg']:>8.1f}度{stats['timeouts']:>6}")
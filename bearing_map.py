@@ -0,0 +1,255 @@
+# bearing_map.py
+# 搜索旋转过程中的方位图：每处理一帧就记录当时的航向和各颜色色段，
+# 把色段换算为绝对方位角并聚类，图足够明确时即可停止搜索并直接转向最佳方位
+import math
+import threading
+import time
+
+from time_alignment import TimestampedHistory
+
+# ===== 可配置参数（修改此处无需改动函数） =====
+HEADING_SOURCE = 'encoder'   # 航向来源：'encoder'编码器里程计，'command'指令角速度×时间
+CLUSTER_TOLERANCE_DEG = 8.0  # 同一魔方在不同帧的方位角允许的差异（度）
+MIN_HITS = 3                 # 判定为明确目标所需的最少帧数
+DOMINANCE_RATIO = 2.0        # 最佳目标得分需超过次佳目标的倍数
+MIN_WIDTH_PX = 20            # 小于此宽度的色段不记入方位图
+HEADING_TOLERANCE_DEG = 3.0  # 转向目标方位时的允许误差（度）
+ROTATE_TIMEOUT = 3.0         # 转向目标方位的最长时间（秒）
+ROTATE_LEAD_TIME = 0.05      # 提前停止转向的时间（秒），补偿电机响应延迟
+
+
+def wrap_angle(angle):
+    """把角度（弧度）归一化到[-pi, pi)"""
+    return (angle + math.pi) % (2 * math.pi) - math.pi
+
+
+class HeadingTracker:
+    """
+    记录航向历史，按帧采集时间插值出拍摄时的航向
+
+    航向逆时针为正（与里程计一致），单位弧度。
+    """
+
+    def __init__(self, source=HEADING_SOURCE):
+        self.source = source
+        self.history = TimestampedHistory()
+        self.command_heading = 0.0
+        self.last_sample_time = None
+
+    def sample(self, now=None):
+        """
+        采样当前航向（搜索循环中按控制频率调用）
+
+        Returns:
+            float: 当前航向（弧度）
+        """
+        from motor_controller import get_odometry_pose, get_commanded_body_velocity
+
+        if now is None:
+            now = time.monotonic()
+        if self.source == 'encoder':
+            heading = get_odometry_pose()[2]
+        else:
+            # 指令角速度×时间积分
+            if self.last_sample_time is not None:
+                _, omega = get_commanded_body_velocity()
+                self.command_heading += omega * (now - self.last_sample_time)
+            heading = self.command_heading
+        self.last_sample_time = now
+        self.history.add(now, heading)
+        return heading
+
+    def heading_at(self, timestamp):
+        """
+        Returns:
+            float: 指定时刻的航向，无法插值时返回None
+        """
+        return self.history.interpolate(timestamp)
+
+
+class BearingMap:
+    """
+    颜色方位图
+
+    每条记录为绝对方位角 = 拍摄时航向 - 色段中心的像素方位角（像素方位角右侧为正）。
+    同一颜色、方位角相近的记录聚成一个候选目标，得分为各帧色段宽度之和。
+    """
+
+    def __init__(self):
+        self.clusters = []   # 每个候选: {"color", "bearing", "hits", "score", "last_seen"}
+        self.frames = 0
+
+    def add_frame(self, heading, color_data, timestamp):
+        """
+        把一帧检测结果加入方位图
+
+        Args:
+            heading: 拍摄时航向（弧度）
+            color_data: detect_color的检测结果
+            timestamp: 帧采集时间
+        """
+        from detect_color import pixel_to_bearing
+
+        self.frames += 1
+        tolerance = math.radians(CLUSTER_TOLERANCE_DEG)
+        for color, segments in color_data.items():
+            for x_start, x_end, x_center in segments:
+                width = abs(x_end - x_start)
+                if width < MIN_WIDTH_PX:
+                    continue
+                bearing = wrap_angle(heading - pixel_to_bearing(x_center))
+                cluster = self._find_cluster(color, bearing, tolerance)
+                if cluster is None:
+                    self.clusters.append({"color": color, "bearing": bearing, "hits": 1,
+                                          "score": float(width), "last_seen": timestamp})
+                else:
+                    # 按宽度加权更新方位角
+                    total = cluster["score"] + width
+                    delta = wrap_angle(bearing - cluster["bearing"])
+                    cluster["bearing"] = wrap_angle(cluster["bearing"] + delta * width / total)
+                    cluster["score"] = total
+                    cluster["hits"] += 1
+                    cluster["last_seen"] = timestamp
+
+    def _find_cluster(self, color, bearing, tolerance):
+        best = None
+        best_delta = tolerance
+        for cluster in self.clusters:
+            if cluster["color"] != color:
+                continue
+            delta = abs(wrap_angle(bearing - cluster["bearing"]))
+            if delta <= best_delta:
+                best, best_delta = cluster, delta
+        return best
+
+    def ranked(self):
+        """按得分从高到低排列的候选目标"""
+        return sorted(self.clusters, key=lambda c: c["score"], reverse=True)
+
+    def best_target(self):
+        """
+        Returns:
+            dict: 得分最高且帧数足够的候选目标，没有时返回None
+        """
+        for cluster in self.ranked():
+            if cluster["hits"] >= MIN_HITS:
+                return cluster
+        return None
+
+    def is_unambiguous(self):
+        """
+        方位图是否已经明确：最佳目标帧数足够，且得分明显高于其他候选
+
+        Returns:
+            bool: 是否可以停止搜索
+        """
+        ranked = self.ranked()
+        if not ranked or ranked[0]["hits"] < MIN_HITS:
+            return False
+        if len(ranked) == 1:
+            return True
+        return ranked[0]["score"] >= DOMINANCE_RATIO * ranked[1]["score"]
+
+
+class SweepRecorder:
+    """
+    把颜色检测线程的帧和搜索循环的航向采样组合成方位图
+
+    帧在检测线程中到达，先放入待处理列表；搜索循环每次采样航向后，
+    处理那些航向历史已覆盖其采集时间的帧。
+    """
+
+    def __init__(self, source=HEADING_SOURCE):
+        self.tracker = HeadingTracker(source)
+        self.map = BearingMap()
+        self.pending = []
+        self.lock = threading.Lock()
+
+    def on_color_frame(self, color_data, timestamp):
+        """颜色检测回调"""
+        with self.lock:
+            self.pending.append((timestamp, color_data))
+
+    def update(self, now=None):
+        """
+        采样航向并处理待处理的帧
+
+        Returns:
+            float: 当前航向（弧度）
+        """
+        heading = self.tracker.sample(now)
+        with self.lock:
+            pending, self.pending = self.pending, []
+        for timestamp, color_data in pending:
+            frame_heading = self.tracker.heading_at(timestamp)
+            if frame_heading is None:
+                frame_heading = heading
+            self.map.add_frame(frame_heading, color_data, timestamp)
+        return heading
+
+
+def rotate_to_heading(tracker, target, speed, set_rotation, sleep=None):
+    """
+    闭环原地旋转到目标航向
+
+    Args:
+        tracker: HeadingTracker
+        target: 目标航向（弧度）
+        speed: 旋转速度（转/秒）
+        set_rotation: 旋转函数，参数为(direction, speed)，同rotate_in_place
+        sleep: 等待函数，默认为time.sleep
+
+    Returns:
+        bool: 是否在超时前到达
+    """
+    from motor_controller import get_commanded_body_velocity
+
+    if sleep is None:
+        sleep = time.sleep  # 调用时再取，离线回放替换time.sleep后也能生效
+    tolerance = math.radians(HEADING_TOLERANCE_DEG)
+    start = time.monotonic()
+    direction = None
+    while time.monotonic() - start < ROTATE_TIMEOUT:
+        error = wrap_angle(target - tracker.sample())
+        _, omega = get_commanded_body_velocity()
+        if abs(error) <= tolerance + abs(omega) * ROTATE_LEAD_TIME:
+            return True
+        wanted = 'counterclockwise' if error > 0 else 'clockwise'
+        if wanted != direction:
+            direction = wanted
+            set_rotation(direction, speed)
+        sleep(0.02)
+    return False
+
+
+# 以下仅用于测试
+
+# ===== 离线仿真：匀速旋转扫描两个魔方 =====
+if __name__ == "__main__":
+    import random
+
+    def fake_color_data(heading):
+        """魔方方位：红色在左侧25度，蓝色在右侧40度（逆时针为正）"""
+        from detect_color import CAMERA_HFOV_DEG, FRAME_WIDTH
+        focal = (FRAME_WIDTH / 2) / math.tan(math.radians(CAMERA_HFOV_DEG) / 2)
+        result = {}
+        for color, bearing_deg, width in (("red", 25, 80), ("blue", -40, 40)):
+            relative = heading - math.radians(bearing_deg)  # 像素方位角，右侧为正
+            if abs(relative) < math.radians(CAMERA_HFOV_DEG) / 2 - 0.05:
+                x = int(focal * math.tan(relative)) + random.randint(-4, 4)
+                result[color] = [(x - width // 2, x + width // 2, x)]
+        return result
+
+    test_map = BearingMap()
+    heading = 0.0
+    omega = math.radians(60)  # 60度/秒逆时针
+    t = 0.0
+    while t < 2.0:
+        test_map.add_frame(heading, fake_color_data(heading), t)
+        if test_map.is_unambiguous():
+            break
+        t += 0.1
+        heading += omega * 0.1
+    best = test_map.best_target()
+    print(f"{t:.1f}s后停止扫描，共{test_map.frames}帧")
+    print(f"最佳目标: {best['color']}，方位 {math.degrees(best['bearing']):.1f}度，{best['hits']}帧")
@@ -0,0 +1,268 @@
+# bypass_path.py
+# 圆弧绕行：围绕估计的魔方位置生成曲率有界的连续路径（四段等半径圆弧加直线），
+# 用纯追踪(pure pursuit)按里程计位姿跟踪，绕行全程不停车
+import math
+import time
+
+# ===== 可配置参数（修改此处无需改动函数） =====
+# 1. 路径
+BYPASS_LATERAL_CM = 25.0   # 经过魔方时车体中心到魔方中心的横向距离(cm)
+BYPASS_RADIUS_CM = 35.0    # 圆弧半径(cm)，放不下时自动减小
+MIN_TURN_RADIUS_CM = 15.0  # 最小转弯半径(cm)，即曲率上限
+PASS_MARGIN_CM = 12.0      # 横移完成点到魔方中心的纵向余量(cm)，车头不会擦到魔方
+EXIT_LENGTH_CM = 20.0      # 路径末端继续直行的长度(cm)
+REJOIN_LINE = True         # 经过魔方后是否转回原直线（否则保持横移后的直线，与矩形绕行相同）
+PATH_SPACING_CM = 1.0      # 路径点间距(cm)
+
+# 2. 跟踪
+BYPASS_SPEED = 1.3         # 绕行速度（转/秒）
+MAX_WHEEL_SPEED = 1.6      # 外侧轮速度上限（转/秒），超出时整体降速
+LOOKAHEAD_CM = 15.0        # 前视距离(cm)
+TRACK_INTERVAL = 0.02      # 跟踪控制周期（秒）
+TRACK_TIMEOUT = 8.0        # 跟踪超时（秒）
+
+WHEEL_CIRCUMFERENCE_CM = math.pi * 6.5  # 车轮周长(cm)，与motor_controller一致
+WHEEL_BASE_CM = 15.0                    # 左右轮间距(cm)，与motor_controller一致
+
+
+def _arc_length_for(radius, lateral):
+    """横移lateral所需的一组S形（两段反向圆弧）的圆心角和纵向长度"""
+    cos_theta = 1.0 - lateral / (2.0 * radius)
+    if cos_theta < 0:
+        # 半径太小，单段圆弧转不到90度以内
+        return None, None
+    theta = math.acos(cos_theta)
+    return theta, 2.0 * radius * math.sin(theta)
+
+
+def generate_bypass_path(cube_x, cube_y, side, lateral=BYPASS_LATERAL_CM, radius=BYPASS_RADIUS_CM,
+                         spacing=PATH_SPACING_CM, rejoin=REJOIN_LINE):
+    """
+    生成绕过魔方的路径（以当前车体为原点，x向前，y向左）
+
+    路径由四段等半径圆弧组成：向绕行侧转出、回正、经过魔方后转回、回正，
+    两组S形之间用直线连接，最后沿原直线继续直行EXIT_LENGTH_CM。
+    rejoin为False时只做第一组S形，沿魔方侧面直行到魔方后方后结束。
+    相邻段的航向连续，曲率不超过1/半径。
+
+    Args:
+        cube_x: 魔方中心的纵向距离(cm)
+        cube_y: 魔方中心的横向偏移(cm，左为正)
+        side: 绕行方向，'left'或'right'
+        lateral: 经过魔方时相对魔方中心的横向距离(cm)
+        radius: 期望圆弧半径(cm)
+        rejoin: 是否转回原直线
+
+    Returns:
+        tuple: (路径点列表[(x, y), ...], 实际半径)，放不下时返回(None, None)
+    """
+    sign = 1.0 if side == 'left' else -1.0
+    # 需要横移的距离：从原直线y=0移到魔方旁的y
+    target_y = cube_y + sign * lateral
+    shift = abs(target_y)
+    turn = 1.0 if target_y >= 0 else -1.0
+    available = cube_x - PASS_MARGIN_CM
+
+    # 半径从期望值开始减小，直到S形能在魔方前完成
+    theta, length = _arc_length_for(radius, shift)
+    while (theta is None or length > available) and radius > MIN_TURN_RADIUS_CM:
+        radius = max(MIN_TURN_RADIUS_CM, radius - 1.0)
+        theta, length = _arc_length_for(radius, shift)
+    if theta is None or length > available:
+        return None, None
+
+    points = [(0.0, 0.0)]
+    pose = [0.0, 0.0, 0.0]
+
+    def arc(direction, angle):
+        # direction为+1逆时针（左转），-1顺时针
+        steps = max(1, int(math.ceil(radius * angle / spacing)))
+        for _ in range(steps):
+            d_heading = direction * angle / steps
+            chord = 2.0 * radius * math.sin(angle / steps / 2.0)
+            mid = pose[2] + d_heading / 2.0
+            pose[0] += chord * math.cos(mid)
+            pose[1] += chord * math.sin(mid)
+            pose[2] += d_heading
+            points.append((pose[0], pose[1]))
+
+    def straight(distance):
+        steps = max(1, int(math.ceil(distance / spacing)))
+        for _ in range(steps):
+            pose[0] += distance / steps * math.cos(pose[2])
+            pose[1] += distance / steps * math.sin(pose[2])
+            points.append((pose[0], pose[1]))
+
+    # 转出并回正
+    arc(turn, theta)
+    arc(-turn, theta)
+    # 沿魔方侧面直行，魔方后方对称
+    pass_length = 2.0 * (cube_x - pose[0])
+    if pass_length > 0:
+        straight(pass_length)
+    if rejoin:
+        # 转回原直线并回正
+        arc(-turn, theta)
+        arc(turn, theta)
+    straight(EXIT_LENGTH_CM)
+    return points, radius
+
+
+def transform_path(points, pose):
+    """把车体坐标系下的路径转换到里程计坐标系"""
+    x0, y0, heading = pose
+    c, s = math.cos(heading), math.sin(heading)
+    return [(x0 + c * x - s * y, y0 + s * x + c * y) for x, y in points]
+
+
+class PurePursuit:
+    """
+    纯追踪路径跟踪
+
+    在路径上找到前视距离处的目标点，按车体坐标系下目标点的横向偏移计算曲率
+    κ = 2·y / L²，再换算为左右轮速度；外侧轮超过上限时整体降速。
+    """
+
+    def __init__(self, path, speed=BYPASS_SPEED, lookahead=LOOKAHEAD_CM, max_curvature=None):
+        self.path = path
+        self.speed = speed
+        self.lookahead = lookahead
+        self.max_curvature = max_curvature or 1.0 / MIN_TURN_RADIUS_CM
+        self.index = 0       # 最近点下标，只向前搜索
+        self.done = False
+
+    def update(self, pose):
+        """
+        根据当前位姿计算左右轮速度
+
+        Args:
+            pose: 里程计位姿 (x, y, heading)
+
+        Returns:
+            tuple: (左轮速度, 右轮速度)，到达终点后为(0, 0)且self.done为True
+        """
+        x, y, heading = pose
+        path = self.path
+        # 向前搜索最近点（限制搜索范围，避免S形路径上跳到后面的段）
+        best = self.index
+        best_distance = math.hypot(path[best][0] - x, path[best][1] - y)
+        limit = min(len(path), self.index + int(3 * self.lookahead / PATH_SPACING_CM) + 1)
+        for i in range(self.index + 1, limit):
+            distance = math.hypot(path[i][0] - x, path[i][1] - y)
+            if distance < best_distance:
+                best, best_distance = i, distance
+        self.index = best
+
+        # 车体已越过终点
+        end_x, end_y = path[-1]
+        c, s = math.cos(heading), math.sin(heading)
+        if self.index >= len(path) - 1 or c * (end_x - x) + s * (end_y - y) <= 0:
+            self.done = True
+            return 0.0, 0.0
+
+        # 前视目标点
+        target = path[-1]
+        for i in range(self.index, len(path)):
+            if math.hypot(path[i][0] - x, path[i][1] - y) >= self.lookahead:
+                target = path[i]
+                break
+        dx, dy = target[0] - x, target[1] - y
+        local_y = -s * dx + c * dy
+        distance_sq = max(1e-6, dx * dx + dy * dy)
+        curvature = max(-self.max_curvature, min(self.max_curvature, 2.0 * local_y / distance_sq))
+
+        # κ·B/2 为左右轮速度的相对差，外侧轮超限时降速
+        ratio = curvature * WHEEL_BASE_CM / 2.0
+        speed = min(self.speed, MAX_WHEEL_SPEED / (1.0 + abs(ratio)))
+        return speed * (1.0 - ratio), speed * (1.0 + ratio)
+
+
+def plan_bypass(direction, cube_x, cube_y, pose):
+    """
+    生成里程计坐标系下的绕行路径并创建跟踪器
+
+    Args:
+        direction: 'left'或'right'
+        cube_x, cube_y: 魔方相对车体的位置(cm，x向前，y向左)
+        pose: 当前里程计位姿
+
+    Returns:
+        PurePursuit: 跟踪器，路径放不下时返回None
+    """
+    points, radius = generate_bypass_path(cube_x, cube_y, direction)
+    if points is None:
+        return None
+    return PurePursuit(transform_path(points, pose), max_curvature=1.0 / radius)
+
+
+def follow_path(tracker, get_pose, set_speed, interval=TRACK_INTERVAL, timeout=TRACK_TIMEOUT,
+                sleep=None):
+    """
+    闭环跟踪路径直到终点
+
+    Args:
+        tracker: PurePursuit
+        get_pose: 获取里程计位姿的函数，如motor_controller.get_odometry_pose
+        set_speed: 下发轮速的函数，参数为(left, right)
+        sleep: 等待函数，默认为time.sleep
+
+    Returns:
+        bool: 是否在超时前到达终点
+    """
+    if sleep is None:
+        sleep = time.sleep  # 调用时再取，离线回放替换time.sleep后也能生效
+    start = time.monotonic()
+    while time.monotonic() - start < timeout:
+        left, right = tracker.update(get_pose())
+        if tracker.done:
+            return True
+        set_speed(left, right)
+        sleep(interval)
+    return False
+
+
+# 以下仅用于测试
+
+# ===== 闭环仿真：圆弧绕行与矩形绕行对比 =====
+if __name__ == "__main__":
+    from car_sim import CarSim, CUBE_SIZE_CM
+    from mission_plan import load_mission
+
+    def run_rectangular(sim, mission, direction, dt):
+        start, end = mission.manoeuvres[f"bypass_{direction}"]
+        for i in range(start, end):
+            sim.set_motor_speed(mission.left[i], mission.right[i])
+            elapsed = 0.0
+            while elapsed < mission.duration[i]:
+                sim.step(dt)
+                elapsed += dt
+        return True
+
+    def run_arc(sim, direction, cube_x, dt):
+        tracker = plan_bypass(direction, cube_x, 0.0, sim.get_odometry_pose())
+        if tracker is None:
+            return False
+        while not tracker.done and sim.t < TRACK_TIMEOUT:
+            left, right = tracker.update(sim.get_odometry_pose())
+            sim.set_motor_speed(left, right)
+            sim.step(dt)
+        sim.set_motor_speed(0, 0)
+        return tracker.done
+
+    mission = load_mission()
+    cube_x = 55.0 + CUBE_SIZE_CM / 2.0  # 接近结束时魔方中心的距离
+    dt = 0.01
+    print(f"魔方中心在前方{cube_x:.1f}cm，初速0（接近结束已停车）")
+    print(f"{'方式':<12}{'方向':<8}{'用时':>8}{'最近距离':>10}{'终点横向':>10}{'终点航向':>10}"
+          f"{'前进距离':>10}{'平均前进速度':>12}")
+    for name in ("矩形", "圆弧"):
+        for direction in ("left", "right"):
+            for seed in range(3):
+                sim = CarSim([(cube_x, 0.0, "red")], seed=seed)
+                if name == "矩形":
+                    ok = run_rectangular(sim, mission, direction, dt)
+                else:
+                    ok = run_arc(sim, direction, cube_x, dt)
+                print(f"{name:<12}{direction:<8}{sim.t:>7.2f}s{sim.min_clearance:>8.1f}cm"
+                      f"{sim.y:>8.1f}cm{math.degrees(sim.heading):>8.1f}度{sim.x:>8.1f}cm"
+                      f"{sim.x / sim.t:>9.1f}cm/s{'' if ok else '  未完成'}")
@@ -0,0 +1,221 @@
+# car_sim.py
+# 差速小车的简易闭环仿真：电机一阶响应、车轮打滑噪声、带延迟的摄像头色段和超声波测距，
+# 用于在电脑上调试接近、绕行等控制器（不依赖树莓派硬件）
+import math
+import random
+
+# ===== 可配置参数（修改此处无需改动函数） =====
+# 1. 车体（与motor_controller一致）
+WHEEL_DIAMETER_CM = 6.5   # 车轮直径(cm)
+WHEEL_BASE_CM = 15.0      # 左右轮间距(cm)
+MOTOR_TIME_CONSTANT = 0.15  # 电机PID速度环的等效一阶时间常数（秒）
+WHEEL_SLIP_NOISE = 0.03   # 车轮速度的相对噪声（打滑、地毯不平）
+# 原地转向时实际轮速与指令之比（编码器能测到，里程计不受影响），按逆时针、顺时针分别标定：
+# 实车上原地左转90度要0.45秒、右转只要0.25秒（mission_plan.json的bypass_left/right），
+# 取值使任务文件中矩形绕行的各次转向接近标注的角度
+TURN_RATE_CCW = 1.7
+TURN_RATE_CW = 2.3
+
+# 2. 摄像头（与detect_color一致）
+FRAME_WIDTH = 640
+CAMERA_HFOV_DEG = 60.0
+CAMERA_PERIOD = 0.066     # 颜色检测周期（秒）
+CAMERA_LATENCY = 0.05     # 采集到检测结果可用的延迟（秒）
+PIXEL_NOISE = 4.0         # 色段中心的像素噪声
+COLORS = ("red", "yellow", "blue", "green")  # 光照差时可能互相误认的颜色
+
+# 3. 超声波（与detect_distance一致）
+CUBE_SIZE_CM = 5.7
+ULTRASONIC_PERIOD = 0.1   # 测距周期（秒）
+ULTRASONIC_LATENCY = 0.06 # 测距结果可用的延迟（秒）
+ULTRASONIC_NOISE_CM = 1.0 # 测距标准差(cm)
+ULTRASONIC_HALF_ANGLE_DEG = 15.0  # 超声波波束半角（度）
+ULTRASONIC_MAX_CM = 300.0
+
+WHEEL_CIRCUMFERENCE_CM = math.pi * WHEEL_DIAMETER_CM
+
+
+class CarSim:
+    """
+    差速小车和场地上的魔方
+
+    世界坐标系：x向前，y向左，航向逆时针为正（与里程计一致），距离单位cm。
+    set_motor_speed与motor_controller同名同参（转/秒），里程计位姿用带噪声的实际轮速积分。
+    """
+
+    def __init__(self, cubes, pose=(0.0, 0.0, 0.0), seed=0, motor_tau=MOTOR_TIME_CONSTANT,
+                 slip_noise=WHEEL_SLIP_NOISE, camera_latency=CAMERA_LATENCY,
+                 ultrasonic_latency=ULTRASONIC_LATENCY, traction=1.0, pixel_noise=PIXEL_NOISE,
+                 drop_rate=0.0, confusion=0.0, turn_rate=(TURN_RATE_CCW, TURN_RATE_CW)):
+        """
+        Args:
+            cubes: [(x, y, 颜色), ...] 魔方中心位置
+            pose: 小车初始位姿 (x, y, heading)
+            seed: 随机种子
+            traction: 实际速度与编码器轮速之比（地面摩擦小时小于1，里程计偏大）
+            pixel_noise: 色段中心的像素噪声（光照差时增大）
+            drop_rate: 每个色段漏检的概率
+            confusion: 每个色段被误认成另一种颜色的概率
+            turn_rate: (逆时针, 顺时针) 原地转向时实际轮速与指令之比
+        """
+        self.rng = random.Random(seed)
+        self.cubes = list(cubes)
+        self.x, self.y, self.heading = pose
+        self.odom = [0.0, 0.0, 0.0]
+        self.motor_tau = motor_tau
+        self.slip_noise = slip_noise
+        self.camera_latency = camera_latency
+        self.ultrasonic_latency = ultrasonic_latency
+        self.traction = traction
+        self.pixel_noise = pixel_noise
+        self.drop_rate = drop_rate
+        self.confusion = confusion
+        self.turn_rate = turn_rate
+        self.left_target = self.right_target = 0.0
+        self.left_speed = self.right_speed = 0.0
+        self.t = 0.0
+        self.next_frame = 0.0
+        self.next_ping = 0.0
+        self.pending = []            # (可用时间, 类型, 采集时间, 数据)
+        self.latest_color = ({}, None)
+        self.latest_distance = (-1, None)
+        self.min_clearance = float('inf')  # 过程中车体中心到魔方中心的最近距离
+
+    # ===== 执行器 =====
+    def set_motor_speed(self, left_target, right_target):
+        self.left_target = left_target
+        self.right_target = right_target
+
+    def rotate_in_place(self, direction, speed):
+        if direction == 'clockwise':
+            self.set_motor_speed(speed, -speed)
+        else:
+            self.set_motor_speed(-speed, speed)
+
+    def get_odometry_pose(self):
+        return tuple(self.odom)
+
+    def get_body_velocity(self):
+        """
+        Returns:
+            tuple: (线速度cm/s, 角速度rad/s)，按里程计（无噪声的轮速）计算
+        """
+        v_left = self.left_speed * WHEEL_CIRCUMFERENCE_CM
+        v_right = self.right_speed * WHEEL_CIRCUMFERENCE_CM
+        return (v_left + v_right) / 2.0, (v_right - v_left) / WHEEL_BASE_CM
+
+    # ===== 仿真推进 =====
+    def step(self, dt):
+        """推进dt秒：电机响应、车体运动、传感器采样"""
+        alpha = 1.0 - math.exp(-dt / self.motor_tau) if self.motor_tau > 0 else 1.0
+        left_target, right_target = self.left_target, self.right_target
+        if left_target * right_target < 0:
+            # 原地转向：两侧电机负载不同，实际转速偏离指令，逆时针和顺时针不同
+            rate = self.turn_rate[0] if right_target > left_target else self.turn_rate[1]
+            left_target, right_target = left_target * rate, right_target * rate
+        self.left_speed += (left_target - self.left_speed) * alpha
+        self.right_speed += (right_target - self.right_speed) * alpha
+
+        # 里程计按编码器轮速积分
+        v, omega = self.get_body_velocity()
+        mid = self.odom[2] + omega * dt / 2
+        self.odom[0] += v * math.cos(mid) * dt
+        self.odom[1] += v * math.sin(mid) * dt
+        self.odom[2] += omega * dt
+
+        # 真实运动带打滑噪声
+        slip_left = 1.0 + self.rng.gauss(0, self.slip_noise)
+        slip_right = 1.0 + self.rng.gauss(0, self.slip_noise)
+        v_left = self.left_speed * slip_left * self.traction * WHEEL_CIRCUMFERENCE_CM
+        v_right = self.right_speed * slip_right * self.traction * WHEEL_CIRCUMFERENCE_CM
+        v = (v_left + v_right) / 2.0
+        omega = (v_right - v_left) / WHEEL_BASE_CM
+        mid = self.heading + omega * dt / 2
+        self.x += v * math.cos(mid) * dt
+        self.y += v * math.sin(mid) * dt
+        self.heading += omega * dt
+        self.t += dt
+
+        for cx, cy, _ in self.cubes:
+            self.min_clearance = min(self.min_clearance, math.hypot(cx - self.x, cy - self.y))
+
+        if self.t >= self.next_frame:
+            self.next_frame += CAMERA_PERIOD
+            self.pending.append((self.t + self.camera_latency, "color", self.t, self._camera()))
+        if self.t >= self.next_ping:
+            self.next_ping += ULTRASONIC_PERIOD
+            self.pending.append((self.t + self.ultrasonic_latency, "distance", self.t, self._ultrasonic()))
+
+        ready = [item for item in self.pending if item[0] <= self.t]
+        if ready:
+            self.pending = [item for item in self.pending if item[0] > self.t]
+            for _, kind, stamp, value in ready:
+                if kind == "color":
+                    self.latest_color = (value, stamp)
+                else:
+                    self.latest_distance = (value, stamp)
+
+    def _relative(self, cx, cy):
+        """魔方相对车体的距离和方位角（右侧为正）"""
+        dx, dy = cx - self.x, cy - self.y
+        c, s = math.cos(self.heading), math.sin(self.heading)
+        forward = c * dx + s * dy
+        left = -s * dx + c * dy
+        return math.hypot(forward, left), -math.atan2(left, forward)
+
+    def _camera(self):
+        """生成与detect_color相同格式的检测结果"""
+        focal = (FRAME_WIDTH / 2.0) / math.tan(math.radians(CAMERA_HFOV_DEG) / 2.0)
+        half_fov = math.radians(CAMERA_HFOV_DEG) / 2.0
+        result = {}
+        for cx, cy, color in self.cubes:
+            distance, bearing = self._relative(cx, cy)
+            if distance < CUBE_SIZE_CM or abs(bearing) >= half_fov:
+                continue
+            # 光照影响：漏检和误认（概率为0时不消耗随机数，保持原有随机序列）
+            if self.drop_rate > 0 and self.rng.random() < self.drop_rate:
+                continue
+            if self.confusion > 0 and self.rng.random() < self.confusion:
+                color = self.rng.choice([c for c in COLORS if c != color])
+            x_center = focal * math.tan(bearing) + self.rng.gauss(0, self.pixel_noise)
+            half_width = focal * CUBE_SIZE_CM / distance / 2.0
+            x_start = max(-FRAME_WIDTH / 2.0, x_center - half_width)
+            x_end = min(FRAME_WIDTH / 2.0, x_center + half_width)
+            if x_end > x_start:
+                result.setdefault(color, []).append((int(x_start), int(x_end), int((x_start + x_end) / 2)))
+        return result
+
+    def _ultrasonic(self):
+        """波束内最近魔方前表面的距离，没有时返回-1"""
+        nearest = -1
+        for cx, cy, _ in self.cubes:
+            distance, bearing = self._relative(cx, cy)
+            if abs(bearing) > math.radians(ULTRASONIC_HALF_ANGLE_DEG):
+                continue
+            surface = distance - CUBE_SIZE_CM / 2.0 + self.rng.gauss(0, ULTRASONIC_NOISE_CM)
+            if 0 < surface < ULTRASONIC_MAX_CM and (nearest < 0 or surface < nearest):
+                nearest = surface
+        return nearest
+
+    # ===== 读取传感器（与各模块的get_latest_*对应） =====
+    def get_latest_color_data(self):
+        return self.latest_color[0]
+
+    def get_latest_color_timestamp(self):
+        return self.latest_color[1]
+
+    def get_latest_distance(self):
+        return self.latest_distance[0]
+
+    def get_latest_distance_timestamp(self):
+        return self.latest_distance[1]
+
+    def range_to(self, index=0):
+        """真实的车体中心到魔方前表面距离（评估用）"""
+        cx, cy, _ = self.cubes[index]
+        return self._relative(cx, cy)[0] - CUBE_SIZE_CM / 2.0
+
+    def bearing_to(self, index=0):
+        """真实的魔方方位角（评估用，右侧为正）"""
+        cx, cy, _ = self.cubes[index]
+        return self._relative(cx, cy)[1]
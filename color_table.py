@@ -0,0 +1,282 @@
+# color_table.py
+# 颜色查找表：把HSV阈值编译成按(H, S, V)直接索引的逐像素分类表，
+# 一次查表得到每个像素的颜色编号，代替逐颜色、逐区间的cv2.inRange
+# 编译结果缓存在阈值文件旁（hsv_thresholds.table.npy 和 hsv_thresholds.cache.json），
+# 阈值文件没有变化时直接内存映射缓存，不再解析和编译
+import hashlib
+import json
+import os
+
+import numpy as np
+
+# ===== 可配置参数（修改此处无需改动函数） =====
+TABLE_SHAPE = (180, 256, 256)  # OpenCV的H取值0~179，S、V取值0~255
+NO_COLOR = 0                   # 不属于任何颜色的编号，颜色编号从1开始
+CACHE_TABLE_SUFFIX = ".table.npy"   # 查找表缓存（替换阈值文件的扩展名）
+CACHE_META_SUFFIX = ".cache.json"   # 缓存说明：源文件的修改时间、大小、哈希、阈值和查找表是否已编译
+CACHE_FORMAT = 2                    # 缓存格式版本，编译方式改变时加1使旧缓存失效
+
+
+def parse_color_ranges(thresholds, except_colors=()):
+    """
+    把阈值文件的JSON内容转换为 {颜色: ((lower, upper), ...)}（与detect_color.COLOR_RANGES格式一致）
+
+    Args:
+        thresholds: {颜色: [{"lower": [h, s, v], "upper": [h, s, v]}, ...]}
+        except_colors: 需要排除的颜色名称
+
+    Returns:
+        dict: 颜色阈值
+    """
+    return {
+        color: tuple((np.array(r["lower"]), np.array(r["upper"])) for r in ranges)
+        for color, ranges in thresholds.items() if color not in except_colors
+    }
+
+
+def compile_color_table(color_ranges):
+    """
+    编译查找表
+
+    各区间为闭区间，与cv2.inRange一致；多种颜色的区间重叠时，先出现的颜色优先。
+
+    Args:
+        color_ranges: {颜色: ((lower, upper), ...)}
+
+    Returns:
+        tuple: (查找表 uint8数组，形状TABLE_SHAPE；颜色名列表，编号i+1对应names[i])
+    """
+    names = list(color_ranges)
+    table = np.zeros(TABLE_SHAPE, dtype=np.uint8)
+    # 倒序写入，先出现的颜色最后写入，覆盖重叠部分
+    for index in reversed(range(len(names))):
+        for lower, upper in color_ranges[names[index]]:
+            lower = np.clip(np.asarray(lower, dtype=int), 0, np.array(TABLE_SHAPE) - 1)
+            upper = np.clip(np.asarray(upper, dtype=int), 0, np.array(TABLE_SHAPE) - 1)
+            if np.any(upper < lower):
+                continue
+            table[lower[0]:upper[0] + 1, lower[1]:upper[1] + 1, lower[2]:upper[2] + 1] = index + 1
+    return table, names
+
+
+def classify_hsv(hsv, table):
+    """
+    逐像素查表分类
+
+    Args:
+        hsv: HSV图像 (..., 3) uint8
+        table: compile_color_table得到的查找表
+
+    Returns:
+        np.ndarray: 与图像同形状的颜色编号 uint8，NO_COLOR表示不属于任何颜色
+    """
+    h = hsv[..., 0].astype(np.intp)
+    s = hsv[..., 1].astype(np.intp)
+    v = hsv[..., 2].astype(np.intp)
+    return table.reshape(-1)[(h << 16) | (s << 8) | v]
+
+
+def color_masks(labels, names):
+    """
+    把颜色编号拆成各颜色的掩码（与逐颜色inRange的结果相同，重叠部分只属于优先的颜色）
+
+    Returns:
+        dict: {颜色: uint8掩码(0/255)}
+    """
+    return {name: (labels == index + 1).astype(np.uint8) * 255 for index, name in enumerate(names)}
+
+
+def cache_paths(json_path):
+    """
+    Returns:
+        tuple: (查找表缓存路径, 缓存说明路径)
+    """
+    base = os.path.splitext(json_path)[0]
+    return base + CACHE_TABLE_SUFFIX, base + CACHE_META_SUFFIX
+
+
+def _atomic_write(path, write):
+    """先写临时文件再替换，读取方不会看到写了一半的文件"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            write(f)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _read_meta(meta_path):
+    """读取缓存说明，不存在或损坏时返回None"""
+    try:
+        with open(meta_path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def load_compiled_thresholds(json_path, except_colors=(), mmap=True, compile_table=True):
+    """
+    加载阈值和编译好的查找表，缓存有效时直接使用，否则重新编译并写入缓存
+
+    缓存按源文件的修改时间和大小快速判断；两者有变化时再比较内容哈希，
+    内容没变（如复制、touch）只更新缓存说明，不重新编译。写缓存失败（如只读文件系统）时
+    仍返回内存中的结果。
+    compile_table为False时只解析阈值、只写缓存说明，不编译也不读写查找表（约12MB），
+    之后需要查找表时再编译并补写缓存。
+
+    Args:
+        json_path: 阈值文件路径
+        except_colors: 需要排除的颜色名称（不同时缓存失效）
+        mmap: 是否内存映射查找表（只读，只在查表时才读入用到的页）
+        compile_table: 是否需要查找表
+
+    Returns:
+        tuple: (颜色阈值 {颜色: ((lower, upper), ...)}，查找表（compile_table为False时为None），
+                颜色名列表，是否重新编译)
+
+    Raises:
+        OSError, ValueError: 阈值文件不存在或格式错误
+    """
+    table_path, meta_path = cache_paths(json_path)
+    stat = os.stat(json_path)
+    meta = _read_meta(meta_path)
+    valid = (meta is not None and meta.get("format") == CACHE_FORMAT
+             and meta.get("except_colors") == list(except_colors))
+    if valid and (meta["mtime_ns"], meta["size"]) != (stat.st_mtime_ns, stat.st_size):
+        with open(json_path, "rb") as f:
+            valid = hashlib.sha1(f.read()).hexdigest() == meta["sha1"]
+        if valid:
+            meta["mtime_ns"], meta["size"] = stat.st_mtime_ns, stat.st_size
+            try:
+                _atomic_write(meta_path, lambda f: f.write(json.dumps(meta).encode()))
+            except OSError:
+                pass
+    if valid and not compile_table:
+        return parse_color_ranges(meta["thresholds"]), None, meta["names"], False
+    if valid and meta["table"]:
+        try:
+            table = np.load(table_path, mmap_mode="r" if mmap else None)
+            if table.shape == TABLE_SHAPE and table.dtype == np.uint8:
+                return parse_color_ranges(meta["thresholds"]), table, meta["names"], False
+        except (OSError, ValueError):
+            pass
+
+    if valid:
+        # 阈值没变，只是查找表未编译或已损坏
+        thresholds = meta["thresholds"]
+    else:
+        with open(json_path, "rb") as f:
+            raw = f.read()
+        thresholds = {color: ranges for color, ranges in json.loads(raw).items() if color not in except_colors}
+        meta = {"format": CACHE_FORMAT, "mtime_ns": stat.st_mtime_ns, "size": stat.st_size,
+                "sha1": hashlib.sha1(raw).hexdigest(), "except_colors": list(except_colors),
+                "names": list(thresholds), "thresholds": thresholds, "table": False}
+    color_ranges = parse_color_ranges(thresholds)
+    table = None
+    try:
+        if compile_table:
+            table, meta["names"] = compile_color_table(color_ranges)
+            # 先写查找表再写说明，说明中table为True即表示查找表完整
+            _atomic_write(table_path, lambda f: np.save(f, table))
+            meta["table"] = True
+        _atomic_write(meta_path, lambda f: f.write(json.dumps(meta).encode()))
+    except OSError as e:
+        print(f"写入阈值缓存出错: {e}")
+    return color_ranges, table, meta["names"], True
+
+
+# 以下仅用于测试
+
+# ===== 一致性检查：查表结果与逐颜色inRange相同 =====
+if __name__ == "__main__":
+    import json
+    import os
+    import time
+    import cv2
+
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    with open(os.path.join(current_dir, "hsv_thresholds.json")) as f:
+        ranges = parse_color_ranges(json.load(f), except_colors=("white", "oranges"))
+    start = time.perf_counter()
+    table, names = compile_color_table(ranges)
+    print(f"编译查找表: {(time.perf_counter() - start) * 1000:.0f}ms，{table.nbytes / 1e6:.1f}MB，颜色 {names}")
+
+    rng = np.random.default_rng(0)
+    hsv = np.stack([rng.integers(0, 180, (480, 640)), rng.integers(0, 256, (480, 640)),
+                    rng.integers(0, 256, (480, 640))], axis=-1).astype(np.uint8)
+    start = time.perf_counter()
+    labels = classify_hsv(hsv, table)
+    lookup_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    for name in names:
+        mask = np.zeros(hsv.shape[:2], np.uint8)
+        for lower, upper in ranges[name]:
+            mask = cv2.bitwise_or(mask, cv2.inRange(hsv, lower, upper))
+        # 重叠部分查表只给优先的颜色，比较时排除
+        claimed_by_earlier = (labels > 0) & (labels < names.index(name) + 1)
+        assert np.array_equal((mask > 0) & ~claimed_by_earlier, labels == names.index(name) + 1), name
+    inrange_ms = (time.perf_counter() - start) * 1000
+    print(f"640x480查表 {lookup_ms:.1f}ms，逐颜色inRange {inrange_ms:.1f}ms，结果一致")
+
+    # ===== 缓存：只在阈值文件内容变化时重新编译 =====
+    import shutil
+    import tempfile
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        json_path = os.path.join(tmp_dir, "hsv_thresholds.json")
+        shutil.copyfile(os.path.join(current_dir, "hsv_thresholds.json"), json_path)
+        table_path, meta_path = cache_paths(json_path)
+
+        def load(**kwargs):
+            start = time.perf_counter()
+            result = load_compiled_thresholds(json_path, ("white", "oranges"), **kwargs)
+            return result, (time.perf_counter() - start) * 1000
+
+        # 不用查找表时只解析阈值、写缓存说明，需要时再编译
+        _, no_table, lazy_names, rebuilt = load_compiled_thresholds(json_path, ("white", "oranges"), compile_table=False)
+        assert rebuilt and no_table is None and lazy_names == names, "不用查找表时应只解析阈值"
+        assert not os.path.exists(table_path) and os.path.exists(meta_path), "不用查找表时不应写查找表"
+        assert not load_compiled_thresholds(json_path, ("white", "oranges"), compile_table=False)[3]
+        (loaded, cold_table, cold_names, rebuilt), cold_ms = load()
+        assert rebuilt and os.path.exists(table_path) and os.path.exists(meta_path), "首次加载应编译并写缓存"
+        (loaded, warm_table, warm_names, rebuilt), warm_ms = load()
+        assert not rebuilt and isinstance(warm_table, np.memmap), "缓存有效时应直接内存映射"
+        assert np.array_equal(warm_table, table) and warm_names == names, "缓存与直接编译的结果不同"
+        assert all(np.array_equal(a, b) for color in ranges for pair_a, pair_b in zip(loaded[color], ranges[color])
+                   for a, b in zip(pair_a, pair_b)), "缓存的阈值与源文件不同"
+        print(f"首次加载（编译并写缓存）{cold_ms:.1f}ms，之后加载（内存映射）{warm_ms:.1f}ms")
+
+        # 只改修改时间、内容不变：不重新编译，更新缓存说明中的修改时间
+        os.utime(json_path, ns=(0, 10 ** 9))
+        _, _, _, rebuilt = load()[0]
+        assert not rebuilt and _read_meta(meta_path)["mtime_ns"] == 10 ** 9, "内容没变不应重新编译"
+        # 内容改变：重新编译
+        with open(json_path) as f:
+            thresholds = json.load(f)
+        thresholds["green"][0]["lower"][0] -= 1
+        with open(json_path, "w") as f:
+            json.dump(thresholds, f)
+        os.utime(json_path, ns=(0, 10 ** 9))   # 修改时间相同但大小改变，也应发现
+        (_, new_table, _, rebuilt), _ = load()
+        assert rebuilt and not np.array_equal(new_table, table), "内容改变应重新编译"
+        assert not load()[0][3]
+        # 排除的颜色不同、缓存说明或查找表损坏、格式版本改变：重新编译
+        assert load_compiled_thresholds(json_path, ("white",))[3], "排除的颜色不同应重新编译"
+        with open(table_path, "wb") as f:
+            f.write(b"broken")
+        assert load()[0][3], "查找表损坏应重新编译"
+        with open(meta_path, "w") as f:
+            f.write("{")
+        assert load()[0][3], "缓存说明损坏应重新编译"
+        meta = _read_meta(meta_path)
+        meta["format"] = CACHE_FORMAT - 1
+        with open(meta_path, "w") as f:
+            json.dump(meta, f)
+        assert load()[0][3], "格式版本不同应重新编译"
+        assert not load(mmap=False)[0][3] and not isinstance(load(mmap=False)[0][1], np.memmap)
+        print("缓存检查通过")
+    finally:
+        shutil.rmtree(tmp_dir)
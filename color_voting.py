@@ -0,0 +1,332 @@
+# color_voting.py
+# 多帧颜色投票：在滑动时间窗口内按色段宽度、居中程度和新旧程度给各颜色打分，
+# 后验置信度超过阈值即判定颜色，单帧噪声不会让确认过程从头开始
+import math
+import time
+from collections import deque
+
+# ===== 可配置参数（修改此处无需改动函数） =====
+VOTE_WINDOW = 0.8           # 参与投票的时间窗口（秒）
+VOTE_HALF_LIFE = 0.3        # 投票权重的半衰期（秒），越新的帧权重越大
+CENTRALITY_WEIGHT = 0.5     # 居中程度的影响，0表示不考虑位置，1表示画面边缘的色段不计分
+EMPTY_FRAME_SCORE = 0.05    # 没有检测到颜色的帧给“无目标”的分数
+CONFIDENCE_THRESHOLD = 0.7  # 判定颜色所需的后验置信度
+MIN_EVIDENCE = 0.15         # 判定颜色所需的最少有效分数（避免只有一帧就判定）
+MIN_FRAMES = 3              # 判定颜色所需的最少有效帧数（检测到颜色的帧）
+SHARPNESS = 16.0             # 同一帧内多个颜色按分数的SHARPNESS次方分配选票，越大越接近“最宽者全得”
+FRAME_WIDTH = 640           # 图像宽度（像素），用于归一化
+
+
+def score_frame(color_data, frame_width=FRAME_WIDTH):
+    """
+    计算一帧中各颜色的分数
+
+    分数 = 最宽色段的相对宽度 × 居中程度
+
+    Args:
+        color_data: detect_color的检测结果
+        frame_width: 图像宽度
+
+    Returns:
+        dict: {颜色: 分数}
+    """
+    half_width = frame_width / 2.0
+    scores = {}
+    for color, segments in color_data.items():
+        best = 0.0
+        for x_start, x_end, x_center in segments:
+            width = abs(x_end - x_start) / frame_width
+            centrality = 1.0 - CENTRALITY_WEIGHT * min(1.0, abs(x_center) / half_width)
+            best = max(best, width * centrality)
+        if best > 0:
+            scores[color] = best
+    return scores
+
+
+class ColorVoter:
+    """
+    滑动窗口颜色投票器
+
+    每帧的选票强度为该帧最高分数，按各颜色分数的SHARPNESS次方比例分给各颜色；
+    各颜色的证据 = Σ 选票 × 0.5^(帧龄/半衰期)，空帧给“无目标”计分；
+    后验置信度 = 该颜色证据 / 全部证据（含无目标）。
+    两个颜色宽度相近时置信度可能一直达不到阈值，设置fallback_after后超时判定为置信度最高的颜色。
+    """
+
+    def __init__(self, threshold=CONFIDENCE_THRESHOLD, window=VOTE_WINDOW,
+                 half_life=VOTE_HALF_LIFE, min_evidence=MIN_EVIDENCE, min_frames=MIN_FRAMES,
+                 fallback_after=None):
+        """
+        Args:
+            fallback_after: 开始投票后超过此时间（秒）仍未达到阈值时，判定为置信度最高的颜色；None不回退
+        """
+        self.threshold = threshold
+        self.fallback_after = fallback_after
+        self.fallback_count = 0   # 超时回退判定的次数
+        self.window = window
+        self.half_life = half_life
+        self.min_evidence = min_evidence
+        self.min_frames = min_frames
+        self.decision_times = []  # 每次判定用时（秒），从开始投票到判定
+        self.reset()
+
+    def reset(self):
+        """清空投票窗口，开始新一轮确认"""
+        self.frames = deque()      # (timestamp, {颜色: 分数})
+        self.last_timestamp = None
+        self.start_time = None
+        self.decided = None
+
+    def add_frame(self, color_data, timestamp=None):
+        """
+        加入一帧检测结果
+
+        Args:
+            color_data: detect_color的检测结果
+            timestamp: 帧采集时间，与上一帧相同时忽略（避免重复读取同一帧）
+
+        Returns:
+            bool: 是否为新帧
+        """
+        if timestamp is None:
+            timestamp = time.monotonic()
+        if self.last_timestamp is not None and timestamp <= self.last_timestamp:
+            return False
+        self.last_timestamp = timestamp
+        if self.start_time is None:
+            self.start_time = timestamp
+        self.frames.append((timestamp, score_frame(color_data)))
+        while self.frames and timestamp - self.frames[0][0] > self.window:
+            self.frames.popleft()
+        return True
+
+    def posterior(self, now=None):
+        """
+        计算各颜色的后验置信度
+
+        Returns:
+            tuple: ({颜色: 置信度}, 有效证据总量)
+        """
+        if not self.frames:
+            return {}, 0.0
+        if now is None:
+            now = self.frames[-1][0]
+        evidence = {}
+        empty = 0.0
+        for timestamp, scores in self.frames:
+            weight = 0.5 ** ((now - timestamp) / self.half_life)
+            if not scores:
+                empty += EMPTY_FRAME_SCORE * weight
+                continue
+            strength = max(scores.values())
+            sharpened = {color: score ** SHARPNESS for color, score in scores.items()}
+            norm = sum(sharpened.values())
+            for color, value in sharpened.items():
+                evidence[color] = evidence.get(color, 0.0) + strength * weight * value / norm
+        color_total = sum(evidence.values())
+        total = color_total + empty
+        if total <= 0:
+            return {}, 0.0
+        return {color: value / total for color, value in evidence.items()}, color_total
+
+    def decide(self):
+        """
+        根据当前窗口判定颜色
+
+        Returns:
+            str: 置信度达到阈值的颜色，尚未判定时返回None
+        """
+        if sum(1 for _, scores in self.frames if scores) < self.min_frames:
+            return None
+        posterior, evidence = self.posterior()
+        if not posterior or evidence < self.min_evidence:
+            return None
+        color, confidence = max(posterior.items(), key=lambda item: item[1])
+        if confidence < self.threshold:
+            if self.fallback_after is None or self.frames[-1][0] - self.start_time < self.fallback_after:
+                return None
+            if self.decided is None:
+                self.fallback_count += 1
+        if self.decided is None:
+            self.decided = color
+            self.decision_times.append(self.frames[-1][0] - self.start_time)
+        return color
+
+    def decision_stats(self):
+        """
+        判定用时统计
+
+        Returns:
+            dict: {"count", "mean", "p50", "p90", "max"}（秒）
+        """
+        values = sorted(self.decision_times)
+        n = len(values)
+        if n == 0:
+            return {"count": 0, "mean": 0.0, "p50": 0.0, "p90": 0.0, "max": 0.0}
+        return {
+            "count": n,
+            "mean": sum(values) / n,
+            "p50": values[n // 2],
+            "p90": values[min(n - 1, int(math.ceil(0.9 * n)) - 1)],
+            "max": values[-1],
+        }
+
+
+class ConsecutiveCounter:
+    """原有的连续计数确认方式（只用于离线对比）"""
+
+    def __init__(self, count=3):
+        self.count = count
+        self.reset()
+
+    def reset(self):
+        self.counter = {}
+
+    def add_frame(self, color_data, timestamp=None):
+        widest_color, max_width = None, 0
+        for color, segments in color_data.items():
+            for segment in segments:
+                width = abs(segment[1] - segment[0])
+                if width > max_width:
+                    max_width, widest_color = width, color
+        if widest_color is None:
+            self.counter = {}
+            return True
+        self.counter = {widest_color: self.counter.get(widest_color, 0) + 1}
+        return True
+
+    def decide(self):
+        for color, count in self.counter.items():
+            if count >= self.count:
+                return color
+        return None
+
+
+def evaluate_sequences(sequences, make_voter, interval=0.1):
+    """
+    离线评估：逐帧喂入图像序列的检测结果，统计误判率和判定延迟
+
+    Args:
+        sequences: [(真实颜色, [color_data, ...]), ...]
+        make_voter: 无参函数，返回新的投票器（ColorVoter或ConsecutiveCounter）
+        interval: 帧间隔（秒）
+
+    Returns:
+        dict: {"sequences", "decided", "false_accept", "false_accept_rate", "mean_latency", "p90_latency"}
+    """
+    latencies = []
+    false_accept = 0
+    decided = 0
+    for true_color, frames in sequences:
+        voter = make_voter()
+        for index, color_data in enumerate(frames):
+            voter.add_frame(color_data, index * interval)
+            color = voter.decide()
+            if color is not None:
+                decided += 1
+                latencies.append((index + 1) * interval)
+                if color != true_color:
+                    false_accept += 1
+                break
+    latencies.sort()
+    n = len(latencies)
+    return {
+        "sequences": len(sequences),
+        "decided": decided,
+        "false_accept": false_accept,
+        "false_accept_rate": false_accept / decided if decided else 0.0,
+        "mean_latency": sum(latencies) / n if n else float('nan'),
+        "p90_latency": latencies[min(n - 1, int(math.ceil(0.9 * n)) - 1)] if n else float('nan'),
+    }
+
+
+def load_image_sequences(folder):
+    """
+    读取离线图像序列：folder下每个子目录是一个序列，子目录名以真实颜色开头（如red_01），
+    目录内图片按文件名排序作为帧顺序
+
+    Returns:
+        list: [(真实颜色, [color_data, ...]), ...]
+    """
+    import os
+    import cv2
+    from detect_color import detect_color
+
+    sequences = []
+    for name in sorted(os.listdir(folder)):
+        path = os.path.join(folder, name)
+        if not os.path.isdir(path):
+            continue
+        frames = []
+        for filename in sorted(os.listdir(path)):
+            frame = cv2.imread(os.path.join(path, filename))
+            if frame is not None:
+                frames.append(detect_color(frame))
+        if frames:
+            sequences.append((name.split('_')[0], frames))
+    return sequences
+
+
+def synthesize_sequences(image_folder, length=15, noise=0.3, repeats=20, seed=0):
+    """
+    没有录制序列时，用单张样本图片合成序列：每帧以noise的概率替换为
+    丢帧（空结果）或另一张图片的检测结果，真实颜色取原图最宽的颜色
+
+    Returns:
+        list: [(真实颜色, [color_data, ...]), ...]
+    """
+    import glob
+    import os
+    import random
+    import cv2
+    from detect_color import detect_color
+
+    rng = random.Random(seed)
+    detections = []
+    for path in sorted(glob.glob(os.path.join(image_folder, "*.jpg"))):
+        frame = cv2.imread(path)
+        if frame is None:
+            continue
+        color_data = detect_color(frame)
+        widest = max(((abs(s[1] - s[0]), c) for c, segs in color_data.items() for s in segs), default=None)
+        if widest is not None:
+            detections.append((widest[1], color_data))
+
+    sequences = []
+    for _ in range(repeats):
+        for true_color, color_data in detections:
+            frames = []
+            for _ in range(length):
+                if rng.random() < noise:
+                    frames.append({} if rng.random() < 0.5 else rng.choice(detections)[1])
+                else:
+                    frames.append(color_data)
+            sequences.append((true_color, frames))
+    return sequences
+
+
+# 以下仅用于测试
+
+# ===== 离线评估：误判率与判定延迟的权衡 =====
+if __name__ == "__main__":
+    import os
+    import sys
+
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    if len(sys.argv) > 1:
+        sequences = load_image_sequences(sys.argv[1])
+        print(f"已读取 {len(sequences)} 个图像序列")
+    else:
+        sequences = synthesize_sequences(os.path.join(current_dir, "color_picture"))
+        print(f"已用样本图片合成 {len(sequences)} 个序列（30%噪声帧）")
+
+    print(f"{'方法':<24}{'判定数':>8}{'误判率':>10}{'平均延迟':>10}{'p90延迟':>10}")
+    candidates = [("连续3帧计数", lambda: ConsecutiveCounter(3))]
+    for threshold in (0.6, 0.7, 0.8, 0.9):
+        candidates.append((f"投票 阈值{threshold}", lambda t=threshold: ColorVoter(threshold=t)))
+    # 合成序列只有1.5秒，回退时间按比例缩短
+    candidates.append(("投票 阈值0.7 1秒后回退", lambda: ColorVoter(threshold=0.7, fallback_after=1.0)))
+    for name, make_voter in candidates:
+        result = evaluate_sequences(sequences, make_voter)
+        print(f"{name:<24}{result['decided']:>8}{result['false_accept_rate']:>10.3f}"
+              f"{result['mean_latency']:>9.2f}s{result['p90_latency']:>9.2f}s")
@@ -0,0 +1,305 @@
+# config_watcher.py
+# 颜色阈值和视觉参数的热更新：监视hsv_thresholds.json和vision_params.json，
+# 文件变化后在监视线程中解析、编译，把完整的新配置作为一个对象提交给detect_color，
+# 检测线程在两帧之间整体替换，不重启程序、不重新初始化摄像头/GPIO/I2C，检测线程不加锁
+#
+# vision_params.json 示例（只需写要改的参数）：
+#   {"DEFAULT_ROW_PERCENT": 0.3, "DEFAULT_ROW_HEIGHT": 40}
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+
+import detect_color
+from color_table import load_compiled_thresholds, compile_color_table
+from run_recorder import mark_run
+
+# ===== 可配置参数（修改此处无需改动函数） =====
+WATCH_INTERVAL = 0.5                     # 检查文件变化的周期（秒）
+THRESHOLD_FILE = "hsv_thresholds.json"   # 颜色阈值文件（相对本文件）
+PARAMS_FILE = "vision_params.json"       # 视觉参数文件（相对本文件），不存在时不使用
+
+# 可热更新的参数及其取值检查
+TUNABLE_PARAMS = {
+    "DEFAULT_ROW_PERCENT": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool) and 0 <= v < 1,
+    "DEFAULT_ROW_HEIGHT": lambda v: isinstance(v, int) and not isinstance(v, bool) and v >= 1,
+    "USE_COLOR_TABLE": lambda v: isinstance(v, bool),
+    "ADAPTIVE_ROI": lambda v: isinstance(v, bool),
+    "ROW_SAMPLING": lambda v: v in detect_color.SAMPLING_MODES,
+    "ROW_STRIDE": lambda v: isinstance(v, int) and not isinstance(v, bool) and v >= 1,
+    "ROW_SCANLINES": lambda v: isinstance(v, int) and not isinstance(v, bool) and v >= 1,
+    "COLUMN_VOTE_FRACTION": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool) and 0 <= v <= 1,
+    "CAMERA_HFOV_DEG": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool) and 0 < v < 180,
+}
+
+# 提交给detect_color的完整配置
+VisionConfig = namedtuple("VisionConfig", ("version", "color_ranges", "table", "names", "params"))
+
+
+def _signature(path):
+    """文件的(修改时间, 大小)，不存在时为None"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def load_params(path):
+    """
+    读取并检查视觉参数文件
+
+    Returns:
+        dict: {参数名: 值}
+
+    Raises:
+        OSError, ValueError: 文件无法读取、格式错误、参数未知或取值不合法
+    """
+    with open(path, "r") as f:
+        params = json.load(f)
+    if not isinstance(params, dict):
+        raise ValueError("参数文件应为JSON对象")
+    for name, value in params.items():
+        if name not in TUNABLE_PARAMS:
+            raise ValueError(f"未知参数 {name}（可热更新: {', '.join(TUNABLE_PARAMS)}）")
+        if not TUNABLE_PARAMS[name](value):
+            raise ValueError(f"参数 {name} 的取值不合法: {value!r}")
+    return params
+
+
+class ConfigWatcher:
+    """
+    检查文件变化，生成并提交新配置
+
+    每次提交的都是完整配置（阈值、查找表和全部可热更新参数），检测线程来不及应用的
+    中间版本被后一个版本覆盖也不会丢失修改。文件有误时保留当前配置并提示，
+    修正后（修改时间或大小变化）再次加载。参数文件被删除时保留最后的参数值。
+    """
+
+    def __init__(self, threshold_path, params_path, submit=detect_color.submit_vision_config,
+                 except_colors=detect_color.EXCEPT_COLORS):
+        """
+        Args:
+            threshold_path: 阈值文件路径
+            params_path: 参数文件路径
+            submit: 提交配置的函数
+            except_colors: 阈值文件中需要排除的颜色名称
+        """
+        self.threshold_path = threshold_path
+        self.params_path = params_path
+        self.submit = submit
+        self.except_colors = except_colors
+        self.version = detect_color.vision_config_version
+        # 当前配置：启动时的阈值已由detect_color加载，参数为detect_color的当前值
+        self.color_ranges = detect_color.COLOR_RANGES
+        self.table = detect_color.COLOR_TABLE
+        self.names = detect_color.COLOR_TABLE_NAMES
+        self.params = {name: getattr(detect_color, name) for name in TUNABLE_PARAMS}
+        # 已处理的文件签名；参数文件从None开始，启动时存在即加载
+        self.signatures = {threshold_path: _signature(threshold_path), params_path: None}
+        self.failed = {}   # 加载失败的文件 -> 失败时的签名（同一签名只提示一次）
+
+    def poll(self):
+        """
+        检查一次，文件有变化时加载并提交
+
+        Returns:
+            VisionConfig: 提交的新配置，没有变化或加载失败时返回None
+        """
+        changes = []
+        signature = _signature(self.threshold_path)
+        if signature != self.signatures[self.threshold_path] and signature is not None:
+            try:
+                color_ranges, table, names, _ = load_compiled_thresholds(
+                    self.threshold_path, self.except_colors, compile_table=self.params["USE_COLOR_TABLE"])
+                self.color_ranges, self.table, self.names = color_ranges, table, names
+                self.signatures[self.threshold_path] = signature
+                changes.append(f"阈值 {len(color_ranges)} 种颜色")
+            except (OSError, ValueError, KeyError, TypeError, IndexError) as e:
+                self._report_failure(self.threshold_path, signature, e)
+
+        signature = _signature(self.params_path)
+        if signature != self.signatures[self.params_path]:
+            if signature is None:
+                self.signatures[self.params_path] = None
+            else:
+                try:
+                    params = load_params(self.params_path)
+                    updated = {name: value for name, value in params.items() if self.params[name] != value}
+                    self.params.update(params)
+                    self.signatures[self.params_path] = signature
+                    changes.extend(f"{name}={value}" for name, value in updated.items())
+                except (OSError, ValueError) as e:
+                    self._report_failure(self.params_path, signature, e)
+
+        if not changes:
+            return None
+        if self.params["USE_COLOR_TABLE"] and self.table is None:
+            self._load_table()
+        self.version += 1
+        config = VisionConfig(self.version, self.color_ranges, self.table, self.names, dict(self.params))
+        self.submit(config)
+        print(f"视觉配置 v{self.version} 已提交: {', '.join(changes)}")
+        mark_run(f"vision_config_v{self.version}")
+        return config
+
+    def _load_table(self):
+        """
+        参数改为使用查找表时编译（查找表只在用到时编译和缓存）
+
+        当前阈值来自阈值文件的当前内容时用缓存，否则（文件之后写坏了）按当前阈值在内存中编译
+        """
+        signature = _signature(self.threshold_path)
+        if signature is not None and signature == self.signatures[self.threshold_path]:
+            try:
+                _, self.table, self.names, _ = load_compiled_thresholds(self.threshold_path, self.except_colors)
+                return
+            except (OSError, ValueError, KeyError, TypeError, IndexError):
+                pass
+        self.table, self.names = compile_color_table(self.color_ranges)
+
+    def _report_failure(self, path, signature, error):
+        """加载失败时提示（同一版本的文件只提示一次），保留当前配置"""
+        if self.failed.get(path) != signature:
+            self.failed[path] = signature
+            print(f"加载 {os.path.basename(path)} 出错，保留当前配置: {error}")
+
+
+# ===== 全局实例和监视线程 =====
+watcher = None
+watcher_thread = None
+is_watching = False
+
+
+def config_watcher_thread(interval=WATCH_INTERVAL):
+    """持续检查文件变化的线程"""
+    while is_watching:
+        watcher.poll()
+        time.sleep(interval)
+
+
+def start_config_watcher(interval=WATCH_INTERVAL):
+    """
+    启动配置监视线程（参数文件存在时立即加载一次）
+
+    Returns:
+        threading.Thread: 线程对象
+    """
+    global watcher, watcher_thread, is_watching
+    if watcher_thread is not None and watcher_thread.is_alive():
+        stop_config_watcher()
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    watcher = ConfigWatcher(os.path.join(current_dir, THRESHOLD_FILE), os.path.join(current_dir, PARAMS_FILE))
+    watcher.poll()
+    is_watching = True
+    watcher_thread = threading.Thread(target=config_watcher_thread, args=(interval,))
+    watcher_thread.daemon = True
+    watcher_thread.start()
+    print("配置热更新已启动")
+    return watcher_thread
+
+
+def stop_config_watcher():
+    """停止配置监视线程"""
+    global is_watching
+    is_watching = False
+    if watcher_thread is not None:
+        watcher_thread.join(timeout=1.0)
+
+
+# 以下仅用于测试
+
+# ===== 离线检查：文件变化、出错保留、检测线程在两帧之间整体替换 =====
+if __name__ == "__main__":
+    import contextlib
+    import io
+    import shutil
+    import tempfile
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        current_dir = os.path.dirname(os.path.abspath(__file__))
+        threshold_path = os.path.join(tmp_dir, THRESHOLD_FILE)
+        params_path = os.path.join(tmp_dir, PARAMS_FILE)
+        shutil.copyfile(os.path.join(current_dir, THRESHOLD_FILE), threshold_path)
+        submitted = []
+        test_watcher = ConfigWatcher(threshold_path, params_path, submit=submitted.append)
+
+        def touch_write(path, content):
+            """写入并推进修改时间（文件系统的时间精度可能不足以区分两次写入）"""
+            with open(path, "w") as f:
+                f.write(content)
+            bump = time.time_ns() + len(submitted) * 10 ** 9
+            os.utime(path, ns=(bump, bump))
+
+        assert test_watcher.poll() is None, "没有变化不应提交"
+        touch_write(params_path, json.dumps({"DEFAULT_ROW_PERCENT": 0.4}))
+        config = test_watcher.poll()
+        assert config.version == 1 and config.params["DEFAULT_ROW_PERCENT"] == 0.4
+        assert config.params["DEFAULT_ROW_HEIGHT"] == detect_color.DEFAULT_ROW_HEIGHT, "未写的参数保持当前值"
+
+        # 阈值文件写坏：保留当前配置，只提示一次；修正后加载
+        touch_write(threshold_path, "{")
+        assert test_watcher.poll() is None and test_watcher.poll() is None
+        with open(os.path.join(current_dir, THRESHOLD_FILE)) as f:
+            thresholds = json.load(f)
+        thresholds["green"][0]["lower"][0] = 50
+        touch_write(threshold_path, json.dumps(thresholds))
+        config = test_watcher.poll()
+        assert config.version == 2 and config.color_ranges["green"][0][0][0] == 50
+        assert config.params["DEFAULT_ROW_PERCENT"] == 0.4, "阈值更新不应丢失之前的参数"
+        # 查找表只在USE_COLOR_TABLE打开时编译和缓存
+        from color_table import cache_paths
+        table_path = cache_paths(threshold_path)[0]
+        assert config.table is None and not os.path.exists(table_path), "不用查找表时不应编译查找表"
+        touch_write(params_path, json.dumps({"DEFAULT_ROW_PERCENT": 0.4, "USE_COLOR_TABLE": True}))
+        config = test_watcher.poll()
+        assert config.table is not None and os.path.exists(table_path), "打开查找表时应编译并缓存"
+        assert config.names == list(config.color_ranges)
+
+        # 未知参数、不合法的取值：拒绝
+        touch_write(params_path, json.dumps({"ROW": 1}))
+        assert test_watcher.poll() is None
+        touch_write(params_path, json.dumps({"DEFAULT_ROW_HEIGHT": 0}))
+        assert test_watcher.poll() is None
+        touch_write(params_path, json.dumps({"DEFAULT_ROW_HEIGHT": 30}))
+        assert test_watcher.poll().version == 4
+        print(f"文件变化检查通过，共提交{len(submitted)}个版本")
+
+        # 检测线程在两帧之间应用：每帧读到的阈值和参数来自同一版本，提交不阻塞检测
+        base_ranges = detect_color.COLOR_RANGES
+        detect_color.is_running = True
+        inconsistent = frames = 0
+        stop = False
+
+        def fake_detection():
+            global inconsistent, frames
+            while not stop:
+                if detect_color._pending_vision_config is not None:
+                    detect_color.apply_vision_config()
+                version = detect_color.DEFAULT_ROW_HEIGHT   # 本测试用行高编码版本
+                time.sleep(0.0001)                          # 模拟一帧的处理
+                if detect_color.COLOR_RANGES["tag"] != version or detect_color.DEFAULT_ROW_HEIGHT != version:
+                    inconsistent += 1
+                frames += 1
+
+        thread = threading.Thread(target=fake_detection)
+        detect_color.submit_vision_config(VisionConfig(100, dict(base_ranges, tag=1), None, [], {"DEFAULT_ROW_HEIGHT": 1}))
+        detect_color.apply_vision_config()
+        thread.start()
+        longest = 0.0
+        with contextlib.redirect_stdout(io.StringIO()):   # 每次生效的提示不打印
+            for version in range(101, 2101):
+                start = time.perf_counter()
+                detect_color.submit_vision_config(
+                    VisionConfig(version, dict(base_ranges, tag=version - 99), None, [], {"DEFAULT_ROW_HEIGHT": version - 99}))
+                longest = max(longest, time.perf_counter() - start)
+                time.sleep(0.0002)
+            stop = True
+            thread.join()
+        detect_color.is_running = False
+        assert inconsistent == 0, f"{inconsistent}帧读到了不同版本的配置"
+        print(f"{frames}帧、2000次提交，没有一帧读到混合的配置，提交最长 {longest * 1e6:.0f}us")
+    finally:
+        shutil.rmtree(tmp_dir)
@@ -2,21 +2,69 @@
 import cv2
 import numpy as np
 import json
+import math
 import os
 import threading
 import time
 
+from latency_trace import new_frame_id, trace_stage
+from thread_watchdog import heartbeat
+from shared_state import SharedState
+from color_table import load_compiled_thresholds, compile_color_table, classify_hsv
+
 
 # ===== 可配置参数（修改此处无需改动函数） =====
 # 1. 截取的行范围（减少计算量）
 DEFAULT_ROW_PERCENT = 0.25 # 默认在图片高度的50%位置取样，数字越小，取样行越高
 DEFAULT_ROW_HEIGHT = 50     # 默认只处理一行
 
+# 2. 摄像头参数
+FRAME_WIDTH = 640         # 采集分辨率宽度
+FRAME_HEIGHT = 480        # 采集分辨率高度
+CAMERA_HFOV_DEG = 60.0    # 摄像头水平视场角(度)，用于像素偏移换算方位角，需实测
+
+# 3. 颜色分类方式
+USE_COLOR_TABLE = False   # True: 查找表一次得到所有颜色（阈值重叠时先出现的颜色优先）；False: 逐颜色cv2.inRange
+                          # 实测640x480每帧查表约8~9.5ms，逐颜色inRange约2.4~2.7ms，查表更慢，默认关闭
+EXCEPT_COLORS = ("white", "oranges")  # 阈值文件中需要排除的颜色名称
+
+# 4. 自适应检测区域（魔方靠近时变大、上下移动，固定的行范围会浪费像素或丢失魔方）
+ADAPTIVE_ROI = False      # True: 定期低分辨率扫描全帧，把检测区域收窄到目标颜色所在的行
+ROI_SCAN_INTERVAL = 10    # 每隔多少帧扫描一次全帧
+ROI_SCAN_SCALE = 0.125    # 全帧扫描的缩放比例（640x480缩到80x60）
+ROI_ROW_FRACTION = 0.05   # 缩小后某一行目标颜色像素占比超过此值视为该行有目标
+ROI_MARGIN = 0.25         # 检测区域在目标行上下各扩展目标高度的此比例
+ROI_MIN_HEIGHT = 16       # 检测区域最小行数
+ROI_MAX_HEIGHT = 40       # 检测区域最大行数（目标更高时取其中间部分，行数再多对逐列判断帮助不大）
+ROI_SHRINK_SCANS = 3      # 扫描结果在当前区域之内且明显更小，连续此次数后才收窄（超出当前区域时立即扩大）
+ROI_SHRINK_MIN = 8        # 收窄少于此行数时不调整
+ROI_LOST_SCANS = 3        # 连续此次数扫描不到目标后回到固定区域(DEFAULT_ROW_PERCENT)
+
+# 5. 检测区域的取样方式（相邻行的颜色几乎相同，只处理部分像素可成倍减少计算量）
+ROW_SAMPLING = "all"      # "all"全部行；"stride"每ROW_STRIDE行取一行；"scanlines"均匀取ROW_SCANLINES行；
+                          # "checkerboard"每ROW_STRIDE行取一行，且相邻取样行交错隔列取样（像素再减半）
+ROW_STRIDE = 4            # stride和checkerboard的行间隔
+ROW_SCANLINES = 5         # scanlines的行数
+COLUMN_VOTE_FRACTION = 0.0  # 某列判为该颜色所需的取样行比例（0为任一取样行有该颜色即可，与逐行合并一致）
+SAMPLING_MODES = ("all", "stride", "scanlines", "checkerboard")
+SAMPLING_PARAMS = ("ROW_SAMPLING", "ROW_STRIDE", "ROW_SCANLINES", "COLUMN_VOTE_FRACTION")
+
+# 6. 目标聚焦（确认颜色后只检测目标颜色，见set_detection_focus）
+FOCUS_WINDOW_MARGIN = 0.15  # 水平窗口在上一帧目标段两侧各扩展图像宽度的此比例
+FOCUS_LOST_FRAMES = 5       # 连续多少帧检测不到目标颜色后自动恢复检测所有颜色
+
 # 全局变量
 camera = None
 color_thread = None
 is_running = False
-latest_color_data = {}  # 存储最新的颜色检测结果
+# 最新的颜色检测结果、对应帧的采集时间(time.monotonic)和帧编号（延迟追踪用），检测线程写、其他线程读
+color_state = SharedState("ColorSnapshot", ("color_data", "frame_id"), initial=({}, 0))
+color_listeners = []  # 每帧检测完成后的回调函数列表
+frame_listeners = []  # 每帧截取检测区域后的回调函数列表（用于记录原始数据）
+vision_config_version = 0      # 当前生效的视觉配置版本（热更新，见config_watcher）
+_pending_vision_config = None  # 配置监视线程提交、检测线程在两帧之间应用的完整配置
+_detection_focus = None        # 当前的目标聚焦(DetectionFocus)，None为检测所有颜色
+_focus_lock = threading.Lock()
 
 # ===== 初始化函数 =====
 def init_camera(camera_id=0):
@@ -38,8 +86,8 @@ def init_camera(camera_id=0):
         return None
     
     # 设置摄像头分辨率（可选）
-    camera.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-    camera.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+    camera.set(cv2.CAP_PROP_FRAME_WIDTH, FRAME_WIDTH)
+    camera.set(cv2.CAP_PROP_FRAME_HEIGHT, FRAME_HEIGHT)
     
     print(f"摄像头已初始化: ID={camera_id}")
     return camera
@@ -52,7 +100,7 @@ def color_detection_thread(interval=0.1):
     Args:
         interval: 检测间隔时间（秒）
     """
-    global camera, latest_color_data, is_running
+    global camera, is_running
     
     if camera is None:
         print("错误: 摄像头未初始化")
@@ -62,18 +110,33 @@ def color_detection_thread(interval=0.1):
     print("颜色检测线程已启动")
     
     while is_running:
+        # 两帧之间应用热更新的配置（不加锁，本帧使用的阈值和取样带来自同一版本）
+        if _pending_vision_config is not None:
+            apply_vision_config()
+
         # 读取一帧图像
+        read_start = time.monotonic()
         ret, frame = camera.read()
         if not ret:
             print("警告: 无法从摄像头读取图像")
             time.sleep(interval)
             continue
+        # 记录采集时间，供融合/对齐使用
+        timestamp = time.monotonic()
+        frame_id = new_frame_id()
+        trace_stage(frame_id, "read", read_start)
+        trace_stage(frame_id, "captured", timestamp)
         
-        # 调用颜色检测函数
-        color_data = detect_color(frame)
+        # 截取检测区域并调用颜色检测函数
+        roi = roi_tracker.crop(frame) if ADAPTIVE_ROI else crop_roi(frame)
+        width = frame.shape[1]
+        _notify_frame_listeners(roi, width, timestamp)
+        color_data = detect_color_roi(roi, width)
+        trace_stage(frame_id, "detected")
         
-        # 更新全局变量
-        latest_color_data = color_data
+        # 更新全局变量并通知回调函数
+        publish_color_data(color_data, timestamp, frame_id)
+        heartbeat("color")
         # 等待指定的间隔时间
         time.sleep(interval)
 
@@ -90,6 +153,10 @@ def start_color_detection(interval=0.1):
     """
     global color_thread, is_running
     
+    # 在启动时而不是第一帧加载颜色阈值
+    _ensure_thresholds()
+    roi_tracker.reset()
+
     # 如果线程已经在运行，先停止它
     if color_thread is not None and color_thread.is_alive():
         stop_color_detection()
@@ -119,8 +186,115 @@ def get_latest_color_data():
     Returns:
         dict: 颜色位置字典，格式 {"color": [(x_start, x_end, x_center), ...]}
     """
-    global latest_color_data
-    return latest_color_data
+    return color_state.read().color_data
+
+# 获取最新结果的采集时间
+def get_latest_color_timestamp():
+    """
+    获取最新颜色检测结果对应帧的采集时间
+    
+    Returns:
+        float: time.monotonic()时间戳，尚无结果时为0
+    """
+    return color_state.read().timestamp
+
+# 获取最新结果的帧编号
+def get_latest_frame_id():
+    """
+    获取最新颜色检测结果对应的帧编号
+    
+    Returns:
+        int: 帧编号，尚无结果时为0
+    """
+    return color_state.read().frame_id
+
+# 获取最新结果的完整快照
+def get_color_snapshot():
+    """
+    一次读取最新的检测结果、采集时间和帧编号（三者来自同一帧，不加锁）
+    
+    Returns:
+        namedtuple: (version, timestamp, color_data, frame_id)
+    """
+    return color_state.read()
+
+# 发布一帧检测结果
+def publish_color_data(color_data, timestamp, frame_id=None):
+    """
+    更新最新检测结果并通知回调（检测线程和离线回放共用）
+    
+    Args:
+        color_data: 检测结果
+        timestamp: 帧采集时间
+        frame_id: 帧编号，默认分配新编号
+    """
+    color_state.write(timestamp, color_data, new_frame_id() if frame_id is None else frame_id)
+    _notify_color_listeners(color_data, timestamp)
+
+# 注册每帧回调
+def add_color_listener(callback):
+    """
+    注册颜色检测回调，每帧检测完成后在检测线程中调用
+    
+    Args:
+        callback: 回调函数，参数为(color_data, timestamp)，应尽快返回
+    """
+    if callback not in color_listeners:
+        color_listeners.append(callback)
+
+# 注销每帧回调
+def remove_color_listener(callback):
+    """注销颜色检测回调"""
+    if callback in color_listeners:
+        color_listeners.remove(callback)
+
+def _notify_color_listeners(color_data, timestamp):
+    """依次调用回调函数，单个回调出错不影响检测线程（内部使用）"""
+    for callback in list(color_listeners):
+        try:
+            callback(color_data, timestamp)
+        except Exception as e:
+            print(f"颜色回调出错: {e}")
+
+# 注册检测区域回调
+def add_frame_listener(callback):
+    """
+    注册检测区域回调，每帧截取检测区域后、颜色检测前在检测线程中调用
+    
+    Args:
+        callback: 回调函数，参数为(roi, 图像宽度, timestamp)，不应修改roi，应尽快返回
+    """
+    if callback not in frame_listeners:
+        frame_listeners.append(callback)
+
+# 注销检测区域回调
+def remove_frame_listener(callback):
+    """注销检测区域回调"""
+    if callback in frame_listeners:
+        frame_listeners.remove(callback)
+
+def _notify_frame_listeners(roi, width, timestamp):
+    """依次调用检测区域回调（内部使用）"""
+    for callback in list(frame_listeners):
+        try:
+            callback(roi, width, timestamp)
+        except Exception as e:
+            print(f"检测区域回调出错: {e}")
+
+# 像素偏移换算方位角
+def pixel_to_bearing(x_offset, width=FRAME_WIDTH):
+    """
+    将相对画面中心的像素偏移换算为方位角（针孔模型）
+    
+    Args:
+        x_offset: 相对画面中心的x偏移（像素），右侧为正
+        width: 图像宽度（像素）
+    
+    Returns:
+        float: 方位角（弧度），右侧为正
+    """
+    focal_px = (width / 2.0) / math.tan(math.radians(CAMERA_HFOV_DEG) / 2.0)
+    return math.atan2(x_offset, focal_px)
 
 # 清理函数
 def cleanup():
@@ -140,8 +314,30 @@ def cleanup():
     print("摄像头资源已释放")
 
 # 2. 从JSON文件加载颜色阈值
-def load_color_ranges(json_path="hsv_thresholds.json"):
-    """从JSON文件加载HSV颜色阈值"""
+def _default_color_ranges():
+    """阈值文件不存在或出错时使用的默认阈值"""
+    return {
+        "red":    ([np.array([0, 100, 100]), np.array([10, 255, 255])], 
+                  [np.array([160, 100, 100]), np.array([179, 255, 255])]),
+        "orange": ([np.array([11, 100, 100]), np.array([20, 255, 255])],),
+        "yellow": ([np.array([21, 100, 100]), np.array([40, 255, 255])],),
+        "green":  ([np.array([41, 100, 100]), np.array([80, 255, 255])],),
+        "blue":   ([np.array([81, 100, 100]), np.array([130, 255, 255])],),
+    }
+
+def load_thresholds(json_path="hsv_thresholds.json", compile_table=None):
+    """
+    加载HSV颜色阈值和编译好的查找表（阈值文件没有变化时直接内存映射缓存，见color_table）
+
+    Args:
+        json_path: 阈值文件路径（相对本文件）
+        compile_table: 是否需要查找表，默认按USE_COLOR_TABLE；不需要时不编译、不写查找表缓存
+
+    Returns:
+        tuple: (颜色阈值 {颜色: ((lower, upper), ...)}，查找表（不需要时为None），查找表的颜色名列表)
+    """
+    if compile_table is None:
+        compile_table = USE_COLOR_TABLE
     # 获取当前文件所在目录的绝对路径
     current_dir = os.path.dirname(os.path.abspath(__file__))
     # 构建JSON文件的绝对路径
@@ -149,65 +345,176 @@ def load_color_ranges(json_path="hsv_thresholds.json"):
     
     if not os.path.exists(json_path):
         print(f"警告: HSV阈值文件不存在: {json_path}")
-        # 返回默认值
-        return {
-            "red":    ([np.array([0, 100, 100]), np.array([10, 255, 255])], 
-                      [np.array([160, 100, 100]), np.array([179, 255, 255])]),
-            "orange": ([np.array([11, 100, 100]), np.array([20, 255, 255])],),
-            "yellow": ([np.array([21, 100, 100]), np.array([40, 255, 255])],),
-            "green":  ([np.array([41, 100, 100]), np.array([80, 255, 255])],),
-            "blue":   ([np.array([81, 100, 100]), np.array([130, 255, 255])],),
-        }
+        return _compile_in_memory(_default_color_ranges(), compile_table)
     
     try:
-        with open(json_path, 'r') as f:
-            thresholds = json.load(f)
-        
-        except_colors = ["white","oranges"] # 需要排除的颜色名称
-
-        # 转换JSON数据为OpenCV可用的格式
-        color_ranges = {}
-        for color, ranges in thresholds.items():
-            if color in except_colors:
-                continue
-            color_range_list = []
-            for range_dict in ranges:
-                lower = np.array(range_dict["lower"])
-                upper = np.array(range_dict["upper"])
-                color_range_list.append((lower, upper))
-            color_ranges[color] = tuple(color_range_list)
-        
-        print(f"已从 {json_path} 加载 {len(color_ranges)} 种颜色的阈值")
-        return color_ranges
+        color_ranges, table, names, rebuilt = load_compiled_thresholds(json_path, EXCEPT_COLORS,
+                                                                       compile_table=compile_table)
+        print(f"已从 {json_path} 加载 {len(color_ranges)} 种颜色的阈值" + ("（已重新编译缓存）" if rebuilt else ""))
+        return color_ranges, table, names
     
     except Exception as e:
         print(f"加载HSV阈值文件出错: {e}")
         # 出错时返回默认值
-        return {
-            "red":    ([np.array([0, 100, 100]), np.array([10, 255, 255])], 
-                      [np.array([160, 100, 100]), np.array([179, 255, 255])]),
-            "orange": ([np.array([11, 100, 100]), np.array([20, 255, 255])],),
-            "yellow": ([np.array([21, 100, 100]), np.array([40, 255, 255])],),
-            "green":  ([np.array([41, 100, 100]), np.array([80, 255, 255])],),
-            "blue":   ([np.array([81, 100, 100]), np.array([130, 255, 255])],),
-        }
-
-# 加载颜色阈值
-COLOR_RANGES = load_color_ranges()
+        return _compile_in_memory(_default_color_ranges(), compile_table)
+
+def _compile_in_memory(color_ranges, compile_table=True):
+    """不经缓存编译查找表，不需要时查找表为None"""
+    if not compile_table:
+        return color_ranges, None, list(color_ranges)
+    return (color_ranges,) + compile_color_table(color_ranges)
+
+def load_color_ranges(json_path="hsv_thresholds.json"):
+    """从JSON文件加载HSV颜色阈值"""
+    return load_thresholds(json_path)[0]
+
+# 颜色阈值在第一次使用时加载（导入本模块不读文件）：
+# COLOR_RANGES、COLOR_TABLE（内存映射的查找表，只在USE_COLOR_TABLE时加载，否则为None）、COLOR_TABLE_NAMES
+_THRESHOLD_NAMES = ("COLOR_RANGES", "COLOR_TABLE", "COLOR_TABLE_NAMES")
+_threshold_lock = threading.Lock()
+
+def _ensure_thresholds():
+    """第一次使用时加载颜色阈值和查找表，已被赋值（热更新、离线评估）的不覆盖"""
+    if all(name in globals() for name in _THRESHOLD_NAMES):
+        return
+    with _threshold_lock:
+        if not all(name in globals() for name in _THRESHOLD_NAMES):
+            for name, value in zip(_THRESHOLD_NAMES, load_thresholds()):
+                globals().setdefault(name, value)
+
+def _ensure_color_table():
+    """
+    运行中打开USE_COLOR_TABLE而查找表未加载时（如直接修改了变量）按当前阈值编译
+
+    热更新打开时由config_watcher在监视线程中准备好查找表，不会走到这里
+    """
+    global COLOR_TABLE, COLOR_TABLE_NAMES
+    with _threshold_lock:
+        if COLOR_TABLE is None:
+            _, COLOR_TABLE, COLOR_TABLE_NAMES = _compile_in_memory(COLOR_RANGES)
+
+def __getattr__(name):
+    """模块外第一次读取COLOR_RANGES等时加载阈值"""
+    if name in _THRESHOLD_NAMES:
+        _ensure_thresholds()
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 dismiss_end = False
 
+# 3. 热更新
+def submit_vision_config(config):
+    """
+    提交新的视觉配置（配置监视线程调用）
+
+    只替换一个引用，检测线程在下一帧开始前应用；检测线程未运行时立即应用。
+
+    Args:
+        config: 完整配置，需有version、color_ranges、table、names、params属性（见config_watcher.VisionConfig）
+    """
+    global _pending_vision_config
+    _pending_vision_config = config
+    if not is_running:
+        apply_vision_config()
+
+def apply_vision_config():
+    """
+    应用已提交的视觉配置（检测线程在两帧之间调用）
+
+    Returns:
+        bool: 是否应用了新版本
+    """
+    global COLOR_RANGES, COLOR_TABLE, COLOR_TABLE_NAMES, vision_config_version
+    config = _pending_vision_config
+    if config is None or config.version == vision_config_version:
+        return False
+    COLOR_RANGES, COLOR_TABLE, COLOR_TABLE_NAMES = config.color_ranges, config.table, config.names
+    globals().update(config.params)
+    vision_config_version = config.version
+    print(f"视觉配置 v{config.version} 已生效")
+    return True
+
+# 4. 目标聚焦
+class DetectionFocus:
+    """
+    一次目标聚焦：要检测的颜色和检测线程维护的跟踪状态
+
+    主线程每次设置聚焦时创建新对象并替换全局引用；lost、window只由检测（回放）线程修改。
+    """
+
+    def __init__(self, colors, window):
+        self.colors = tuple(colors)
+        self.use_window = window
+        self.window = None   # 下一帧处理的列范围(x0, x1)，None为整行
+        self.lost = 0        # 连续检测不到目标颜色的帧数
+
+    def update(self, result, width):
+        """
+        根据本帧结果更新跟踪状态
+
+        Returns:
+            bool: 是否已连续FOCUS_LOST_FRAMES帧丢失目标
+        """
+        center_x = width // 2
+        segments = [segment for color in self.colors for segment in result.get(color, [])]
+        if not segments:
+            # 丢失时下一帧先回到整行
+            self.window = None
+            self.lost += 1
+            return self.lost >= FOCUS_LOST_FRAMES
+        self.lost = 0
+        if self.use_window:
+            # 窗口围绕最宽的目标段
+            x_start, x_end, _ = max(segments, key=lambda segment: segment[1] - segment[0])
+            margin = int(width * FOCUS_WINDOW_MARGIN)
+            self.window = (max(0, int(x_start) + center_x - margin), min(width, int(x_end) + center_x + 1 + margin))
+        return False
+
+def set_detection_focus(colors, window=False):
+    """
+    只检测指定颜色（确认目标颜色后接近时使用），连续FOCUS_LOST_FRAMES帧检测不到时自动恢复检测所有颜色
+
+    Args:
+        colors: 颜色名列表，如 ["red"]
+        window: 是否只处理上一帧目标段附近的列（目标段两侧各扩展FOCUS_WINDOW_MARGIN）
+    """
+    global _detection_focus
+    with _focus_lock:
+        _detection_focus = DetectionFocus(colors, window)
+
+def clear_detection_focus():
+    """恢复检测所有颜色"""
+    global _detection_focus
+    with _focus_lock:
+        _detection_focus = None
+
+def get_detection_focus():
+    """
+    Returns:
+        tuple: 当前聚焦的颜色，未聚焦（或已因丢失目标自动恢复）时为None
+    """
+    focus = _detection_focus
+    return None if focus is None else focus.colors
+
+def _release_focus(focus):
+    """检测线程中：目标丢失后恢复检测所有颜色（主线程已换成新的聚焦时不动）"""
+    global _detection_focus
+    with _focus_lock:
+        if _detection_focus is focus:
+            _detection_focus = None
+            print(f"连续{focus.lost}帧未检测到{'/'.join(focus.colors)}，恢复检测所有颜色")
+
 # ===== 核心函数 =====
-def detect_color(frame):
+def get_roi_rows(height):
     """
-    检测指定行中的颜色分布
+    根据图片高度计算检测区域的行范围
+    
     Args:
-        frame (np.ndarray): BGR格式的输入图像
+        height: 图片高度
+    
     Returns:
-        dict: 颜色位置字典，格式 {"color": [(x_start, x_end, x_center), ...]}
+        tuple: (start_row, end_row)
     """
-    # 1. 根据图片高度动态计算截取的行范围
-    height, width = frame.shape[:2]
     middle_row = int(height * DEFAULT_ROW_PERCENT)
     start_row = middle_row
     end_row = middle_row + DEFAULT_ROW_HEIGHT
@@ -215,26 +522,188 @@ def detect_color(frame):
     # 确保行范围在图片高度内
     start_row = max(0, min(start_row, height-1))
     end_row = max(start_row+1, min(end_row, height))
+    return start_row, end_row
+
+def crop_roi(frame):
+    """
+    截取检测区域
     
-    # 截取行区域
-    roi = frame[start_row:end_row, :]
+    Args:
+        frame (np.ndarray): BGR格式的输入图像
     
+    Returns:
+        np.ndarray: 检测区域（原图的视图，不复制）
+    """
+    start_row, end_row = get_roi_rows(frame.shape[0])
+    return frame[start_row:end_row, :]
+
+def scan_color_rows(frame, scale=ROI_SCAN_SCALE):
+    """
+    低分辨率扫描全帧，找到目标颜色所在的行范围
+
+    缩小后逐行统计任一颜色的像素占比，取占比超过ROI_ROW_FRACTION的连续行中像素最多的一段
+    （画面中有多个魔方时取最显著的一个）。
+
+    Args:
+        frame (np.ndarray): BGR格式的输入图像
+        scale: 缩放比例
+
+    Returns:
+        tuple: 原图坐标的(start_row, end_row)，没有目标时为None
+    """
+    height = frame.shape[0]
+    small = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
+    hits = np.zeros(small.shape[:2], dtype=bool)
+    focus = _detection_focus
+    for _, mask in _color_masks(hsv, None if focus is None else focus.colors):
+        hits |= mask > 0
+    row_fraction = hits.mean(axis=1)
+    active = np.flatnonzero(row_fraction > ROI_ROW_FRACTION)
+    if len(active) == 0:
+        return None
+    # 连续的行分为一段，选像素最多的一段
+    runs = np.split(active, np.flatnonzero(np.diff(active) > 1) + 1)
+    run = max(runs, key=lambda rows: row_fraction[rows].sum())
+    row_scale = height / small.shape[0]
+    return int(run[0] * row_scale), min(height, int(math.ceil((run[-1] + 1) * row_scale)))
+
+class RoiTracker:
+    """
+    自适应检测区域：每ROI_SCAN_INTERVAL帧扫描一次全帧，检测区域跟随目标所在的行
+
+    滞后：目标超出当前区域时立即扩大（不丢失魔方），明显小于当前区域时连续ROI_SHRINK_SCANS次
+    才收窄（避免区域随噪声抖动），连续ROI_LOST_SCANS次扫描不到目标时回到固定区域。
+    只在检测线程中使用，不加锁。
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """回到固定区域，下一帧立即扫描"""
+        self.band = None          # 当前区域(start_row, end_row)，None为固定区域
+        self.frame_count = 0
+        self.shrink_count = 0
+        self.lost_count = 0
+        self.scans = 0
+
+    def _fit(self, start, end, height):
+        """目标行范围加上边距并限制高度"""
+        margin = int((end - start) * ROI_MARGIN)
+        start, end = start - margin, end + margin
+        if end - start < ROI_MIN_HEIGHT:
+            center = (start + end) // 2
+            start, end = center - ROI_MIN_HEIGHT // 2, center + ROI_MIN_HEIGHT - ROI_MIN_HEIGHT // 2
+        elif end - start > ROI_MAX_HEIGHT:
+            center = (start + end) // 2
+            start, end = center - ROI_MAX_HEIGHT // 2, center + ROI_MAX_HEIGHT - ROI_MAX_HEIGHT // 2
+        # 平移到图片范围内
+        start, end = max(0, start - max(0, end - height)), min(height, end + max(0, -start))
+        return start, end
+
+    def update(self, found, height):
+        """
+        用一次扫描的结果更新检测区域
+
+        Args:
+            found: scan_color_rows的结果
+            height: 图片高度
+        """
+        self.scans += 1
+        if found is None:
+            self.shrink_count = 0
+            self.lost_count += 1
+            if self.lost_count >= ROI_LOST_SCANS:
+                self.band = None
+            return
+        self.lost_count = 0
+        proposed = self._fit(found[0], found[1], height)
+        if self.band is None:
+            self.band = proposed
+            return
+        start, end = self.band
+        if proposed[0] < start or proposed[1] > end:
+            # 目标超出当前区域：立即扩大到包含两者，超过最大高度时直接跟随目标
+            self.shrink_count = 0
+            union = (min(start, proposed[0]), max(end, proposed[1]))
+            self.band = union if union[1] - union[0] <= ROI_MAX_HEIGHT else proposed
+        elif (end - start) - (proposed[1] - proposed[0]) >= ROI_SHRINK_MIN:
+            self.shrink_count += 1
+            if self.shrink_count >= ROI_SHRINK_SCANS:
+                self.shrink_count = 0
+                self.band = proposed
+        else:
+            self.shrink_count = 0
+
+    def rows(self, frame):
+        """
+        本帧的检测区域（到扫描周期时先扫描全帧）
+
+        Returns:
+            tuple: (start_row, end_row)
+        """
+        height = frame.shape[0]
+        if self.frame_count % ROI_SCAN_INTERVAL == 0:
+            self.update(scan_color_rows(frame), height)
+        self.frame_count += 1
+        if self.band is None:
+            return get_roi_rows(height)
+        return self.band
+
+    def crop(self, frame):
+        """截取本帧的检测区域（原图的视图，不复制）"""
+        start_row, end_row = self.rows(frame)
+        return frame[start_row:end_row, :]
+
+# 检测线程使用的自适应检测区域
+roi_tracker = RoiTracker()
+
+def detect_color(frame):
+    """
+    检测指定行中的颜色分布
+    Args:
+        frame (np.ndarray): BGR格式的输入图像
+    Returns:
+        dict: 颜色位置字典，格式 {"color": [(x_start, x_end, x_center), ...]}
+    """
+    return detect_color_roi(crop_roi(frame), frame.shape[1])
+
+def detect_color_roi(roi, width):
+    """
+    检测已截取的检测区域中的颜色分布
+    Args:
+        roi (np.ndarray): BGR格式的检测区域
+        width: 原图宽度（检测区域与原图同宽）
+    Returns:
+        dict: 颜色位置字典，格式 {"color": [(x_start, x_end, x_center), ...]}
+    """
     # 计算画面中心点
     center_x = width // 2
 
+    # 0. 目标聚焦：只检测目标颜色，可只处理上一帧目标附近的列
+    focus = _detection_focus
+    colors, x_offset = None, 0
+    if focus is not None:
+        colors = focus.colors
+        if focus.window is not None:
+            x_offset, x_end = focus.window
+            roi = roi[:, x_offset:x_end]
+
+    # 1. 按取样方式取出部分像素
+    sampled, columns, min_votes = sample_roi(roi)
+
     # 2. 转换为HSV颜色空间
-    hsv = cv2.cvtColor(roi, cv2.COLOR_BGR2HSV)
+    hsv = cv2.cvtColor(sampled, cv2.COLOR_BGR2HSV)
 
-    # 3. 遍历颜色阈值，检测像素位置
+    # 3. 遍历颜色阈值，按列统计取样行中该颜色的票数，票数足够的列为该颜色
     result = {}
-    for color_name, ranges in COLOR_RANGES.items():
-        # 合并多个颜色范围（如红色需要两个区间）
-        mask = np.zeros((hsv.shape[0], hsv.shape[1]), dtype=np.uint8)
-        for lower, upper in ranges:
-            mask = cv2.bitwise_or(mask, cv2.inRange(hsv, lower, upper))
-
-        # 找到符合颜色条件的x坐标
-        x_coords = np.where(mask > 0)[1]
+    for color_name, mask in _color_masks(hsv, colors):
+        if columns is None:
+            votes = np.count_nonzero(mask, axis=0)
+        else:
+            votes = np.bincount(columns[mask > 0], minlength=roi.shape[1])
+        x_coords = np.flatnonzero(votes >= min_votes) + x_offset
         if len(x_coords) == 0:
             continue  # 无该颜色像素，跳过
             
@@ -265,8 +734,97 @@ def detect_color(frame):
         # 将所有段数据添加到结果中
         result[color_name] = segments_data
 
+    # 更新目标聚焦的窗口，连续丢失时恢复检测所有颜色
+    if focus is not None and focus.update(result, width):
+        _release_focus(focus)
     return result
 
+# 取样下标缓存：(检测区域大小, 取样参数) -> (行下标, 列下标或None, 每列所需票数)
+_sampling_cache = {}
+
+def sampling_indices(height, width):
+    """
+    按当前取样方式计算检测区域中要处理的像素
+
+    Args:
+        height: 检测区域行数
+        width: 检测区域宽度
+
+    Returns:
+        tuple: (行下标, 列下标, 每列所需票数)。列下标为None时取整行；
+               否则为与取样结果同形状的原列号（checkerboard），每列所需票数为各列的数组
+    """
+    key = (height, width, ROW_SAMPLING, ROW_STRIDE, ROW_SCANLINES, COLUMN_VOTE_FRACTION)
+    cached = _sampling_cache.get(key)
+    if cached is not None:
+        return cached
+    if ROW_SAMPLING not in SAMPLING_MODES:
+        raise ValueError(f"未知的取样方式 {ROW_SAMPLING}（可选: {', '.join(SAMPLING_MODES)}）")
+    stride = max(1, ROW_STRIDE)
+    if ROW_SAMPLING == "scanlines":
+        # 在检测区域内均匀分布，首尾各留半个间隔
+        count = max(1, min(ROW_SCANLINES, height))
+        rows = np.unique(((np.arange(count) + 0.5) * height / count).astype(np.intp))
+    elif ROW_SAMPLING in ("stride", "checkerboard"):
+        rows = np.arange(stride // 2 if height > stride // 2 else 0, height, stride)
+    else:
+        rows = np.arange(height)
+
+    columns = None
+    coverage = len(rows)
+    if ROW_SAMPLING == "checkerboard" and len(rows) > 1:
+        # 第i个取样行取 i%2, i%2+2, ... 列，每列只被一半的取样行覆盖
+        half = width // 2
+        columns = (np.arange(len(rows))[:, None] % 2) + 2 * np.arange(half)[None, :]
+        coverage = np.bincount(columns.ravel(), minlength=width)
+    min_votes = np.maximum(1, np.ceil(COLUMN_VOTE_FRACTION * coverage - 1e-9)).astype(np.intp)
+    cached = (rows, columns, min_votes)
+    _sampling_cache[key] = cached
+    return cached
+
+def sample_roi(roi):
+    """
+    按当前取样方式取出检测区域的部分像素
+
+    Returns:
+        tuple: (取样图像, 列下标（整行取样时为None）, 每列所需票数)
+    """
+    rows, columns, min_votes = sampling_indices(roi.shape[0], roi.shape[1])
+    if columns is None:
+        sampled = roi if len(rows) == roi.shape[0] else roi[rows]
+    else:
+        sampled = roi[rows[:, None], columns]
+    return sampled, columns, min_votes
+
+def _color_masks(hsv, colors=None):
+    """
+    逐个生成各颜色的掩码
+
+    Args:
+        hsv: HSV图像
+        colors: 只生成这些颜色，None为全部
+
+    Yields:
+        tuple: (颜色名, 掩码)
+    """
+    _ensure_thresholds()
+    if USE_COLOR_TABLE:
+        if COLOR_TABLE is None:
+            _ensure_color_table()
+        labels = classify_hsv(hsv, COLOR_TABLE)
+        for index, color_name in enumerate(COLOR_TABLE_NAMES):
+            if colors is None or color_name in colors:
+                yield color_name, labels == index + 1
+        return
+    for color_name, ranges in COLOR_RANGES.items():
+        if colors is not None and color_name not in colors:
+            continue
+        # 合并多个颜色范围（如红色需要两个区间）
+        mask = np.zeros((hsv.shape[0], hsv.shape[1]), dtype=np.uint8)
+        for lower, upper in ranges:
+            mask = cv2.bitwise_or(mask, cv2.inRange(hsv, lower, upper))
+        yield color_name, mask
+
 def process_color_segments(x_coords, width):
     """
     处理颜色坐标，去除离散点，识别连续段
@@ -3,8 +3,13 @@ import wiringpi as wpi
 import threading
 import time
 import os
+import json
+import math
 from collections import deque
 
+from thread_watchdog import heartbeat
+from shared_state import SharedState
+
 # ===== 可配置参数（修改此处无需改动函数） =====
 # 1. I2C设备地址和命令
 DEFAULT_I2C_ADDRESS = 0x74  # KS103超声波传感器的I2C地址
@@ -19,16 +24,31 @@ DEFAULT_DELAY_MS = 100          # 发送命令后的延迟时间，单位毫秒
 MIN_DISTANCE_CM = 20.0  # 最小安全距离，单位厘米
 MAX_DISTANCE_CM = 500.0  # 最大有效距离，单位厘米
 MAX_DEVIATION = 40.0  # 最大允许偏差cm
+MAX_DISTANCE_AGE = 0.3  # 超声波距离超过此时间未更新（秒）视为失效
+
+# 4. 单目测距（色段宽度 -> 距离，针孔模型 d = a / w + b）
+CUBE_SIZE_CM = 5.7            # 魔方边长(cm)，用于未标定时的初始模型
+MONO_DEFAULT_FOCAL_PX = 554.0  # 未标定时的焦距(像素)，640宽、60度视场角
+MONO_CALIBRATION_FILE = "mono_range_calibration.json"  # 标定结果文件
+MONO_MIN_SAMPLES = 8          # 开始使用拟合结果所需的最少样本数
+MONO_MAX_SAMPLES = 200        # 保留的最多样本数（先进先出）
+MONO_MAX_PAIR_SKEW = 0.1      # 色段与测距配对允许的最大时间差（秒）
+MONO_MIN_WIDTH_PX = 10        # 小于此宽度的色段不用于测距
+MONO_MAX_FRAME_AGE = 0.3      # 色段超过此时间未更新（秒）视为失效
+MONO_MIN_CONFIDENCE = 0.5     # 作为后备距离时要求的最低置信度
 
 
 # 全局变量
 i2c_handle = None
 distance_thread = None
 is_running = False
-latest_distance = -1.0  # 存储最新的距离测量结果，-1表示无效值
+# 最新的有效距离(cm，-1表示无效值)及其测量时间(time.monotonic)，测量线程写、其他线程读
+distance_state = SharedState("DistanceSnapshot", ("distance",), initial=(-1.0,))
+distance_listeners = []  # 每次得到有效距离后的回调函数列表
+raw_distance_listeners = []  # 每次测量（过滤前）的回调函数列表（用于记录原始数据）
 recent_distances = deque(maxlen=5)  # 存储最近5次有效的距离测量结果
 
-# 线程锁，用于保护共享数据
+# 线程锁，用于保护异常值过滤的历史
 distance_lock = threading.Lock()
 
 # ===== 初始化函数 =====
@@ -66,7 +86,7 @@ def distance_measurement_thread(interval=DEFAULT_MEASURE_INTERVAL):
     Args:
         interval: 测量间隔时间（秒）
     """
-    global i2c_handle, latest_distance, is_running, recent_distances
+    global i2c_handle, is_running
     
     if i2c_handle is None:
         print("错误: I2C设备未初始化")
@@ -77,44 +97,77 @@ def distance_measurement_thread(interval=DEFAULT_MEASURE_INTERVAL):
     
     while is_running:
         try:
-            # 测量距离
+            # 测量距离（以发出测距命令的时刻作为测量时间）
+            timestamp = time.monotonic()
             distance = measure_distance()
-            
-            # 更新全局变量（使用线程锁保护）
-            with distance_lock:
-                # 检查测量值是否有效
-                if distance >= 0:
-                    # 检查是否需要进行异常值过滤
-                    if len(recent_distances) >= 5:
-                        # 计算最近5次测量的平均值
-                        avg_distance = sum(recent_distances) / len(recent_distances)
-                        
-                        # 计算偏差百分比
-                        if avg_distance > 0:  # 避免除以零
-                            deviation = abs(distance - avg_distance)
-                            recent_distances.append(distance)
-                            # 如果偏差超过阈值，认为是测量错误
-                            if deviation > MAX_DEVIATION:
-                                print(f"测量异常: 当前值={distance:.1f}cm, 平均值={avg_distance:.1f}cm, 偏差={deviation:.1f}")
-                            else:
-                                # 更新最新距离和历史记录
-                                latest_distance = distance
-                                
-                        else:
-                            # 如果平均值为0，直接更新
-                            latest_distance = distance
-                            recent_distances.append(distance)
-                    else:
-                        # 历史记录不足5次，直接更新
-                        latest_distance = distance
-                        recent_distances.append(distance)
-            
-            # 等待指定的间隔时间
-            time.sleep(interval)
-            
+            process_distance_sample(distance, timestamp)
         except Exception as e:
             print(f"距离测量出错: {e}")
-            time.sleep(interval)  # 出错后仍然等待，避免频繁报错
+        
+        # 每完成一轮都算心跳（看门狗只判断线程是否卡住）；
+        # 测量无效时不更新距离，由各处的距离过期检查处理
+        heartbeat("distance")
+        # 等待指定的间隔时间（出错后仍然等待，避免频繁报错）
+        time.sleep(interval)
+
+# 异常值过滤
+def filter_distance(distance, recent, max_deviation=MAX_DEVIATION):
+    """
+    判断一次测量是否通过异常值过滤（纯函数，测量线程和离线回放共用）
+    
+    Args:
+        distance: 测量值(cm)，小于0表示无效
+        recent: 最近的测量值序列
+        max_deviation: 与最近5次平均值的最大允许偏差(cm)
+    
+    Returns:
+        tuple: (是否接受, 更新后的最近测量值元组, 被拒绝时的平均值或None)
+    """
+    recent = tuple(recent)
+    if distance < 0:
+        return False, recent, None
+    if len(recent) >= 5:
+        # 计算最近5次测量的平均值
+        avg_distance = sum(recent) / len(recent)
+        if avg_distance > 0:  # 避免除以零
+            # 异常值也计入历史，连续的跳变会逐渐被接受
+            recent = (recent + (distance,))[-5:]
+            if abs(distance - avg_distance) > max_deviation:
+                return False, recent, avg_distance
+            return True, recent, None
+    # 历史记录不足5次或平均值为0，直接接受
+    return True, (recent + (distance,))[-5:], None
+
+# 处理一次测量
+def process_distance_sample(distance, timestamp):
+    """
+    对一次测量做异常值过滤，更新最新距离并通知回调（测量线程和离线回放共用）
+    
+    Args:
+        distance: 测量值(cm)，小于0表示无效
+        timestamp: 测量时间
+    
+    Returns:
+        bool: 是否通过过滤
+    """
+    _notify_raw_distance_listeners(distance, timestamp)
+    
+    # 更新过滤历史（使用线程锁保护）和最新距离
+    with distance_lock:
+        accepted, recent, avg_distance = filter_distance(distance, recent_distances)
+        recent_distances.clear()
+        recent_distances.extend(recent)
+        if accepted:
+            distance_state.write(timestamp, distance)
+    
+    if avg_distance is not None:
+        print(f"测量异常: 当前值={distance:.1f}cm, 平均值={avg_distance:.1f}cm, 偏差={abs(distance - avg_distance):.1f}")
+    
+    # 在锁外通知回调函数，避免回调中读取距离时死锁
+    if accepted:
+        mono_estimator.add_ultrasonic_sample(distance, timestamp)
+        _notify_distance_listeners(distance, timestamp)
+    return accepted
 
 # 启动距离测量线程
 def start_distance_measurement(interval=DEFAULT_MEASURE_INTERVAL):
@@ -158,11 +211,67 @@ def get_latest_distance():
     Returns:
         float: 距离值（厘米），如果无效则返回-1
     """
-    global latest_distance
+    return distance_state.read().distance
+
+# 获取最新有效距离的测量时间
+def get_latest_distance_timestamp():
+    """
+    获取最新有效距离的测量时间
     
-    # 使用线程锁保护读取操作
-    with distance_lock:
-        return latest_distance
+    Returns:
+        float: time.monotonic()时间戳，尚无有效距离时为0
+    """
+    return distance_state.read().timestamp
+
+# 注册距离回调
+def add_distance_listener(callback):
+    """
+    注册距离回调，每得到一个通过异常值过滤的距离后在测量线程中调用
+    
+    Args:
+        callback: 回调函数，参数为(distance_cm, timestamp)，应尽快返回
+    """
+    if callback not in distance_listeners:
+        distance_listeners.append(callback)
+
+# 注销距离回调
+def remove_distance_listener(callback):
+    """注销距离回调"""
+    if callback in distance_listeners:
+        distance_listeners.remove(callback)
+
+def _notify_distance_listeners(distance, timestamp):
+    """依次调用回调函数，单个回调出错不影响测量线程（内部使用）"""
+    for callback in list(distance_listeners):
+        try:
+            callback(distance, timestamp)
+        except Exception as e:
+            print(f"距离回调出错: {e}")
+
+# 注册原始测量回调
+def add_raw_distance_listener(callback):
+    """
+    注册原始测量回调，每次测量后（异常值过滤前，含无效值-1）在测量线程中调用
+    
+    Args:
+        callback: 回调函数，参数为(distance_cm, timestamp)，应尽快返回
+    """
+    if callback not in raw_distance_listeners:
+        raw_distance_listeners.append(callback)
+
+# 注销原始测量回调
+def remove_raw_distance_listener(callback):
+    """注销原始测量回调"""
+    if callback in raw_distance_listeners:
+        raw_distance_listeners.remove(callback)
+
+def _notify_raw_distance_listeners(distance, timestamp):
+    """依次调用原始测量回调（内部使用）"""
+    for callback in list(raw_distance_listeners):
+        try:
+            callback(distance, timestamp)
+        except Exception as e:
+            print(f"原始测量回调出错: {e}")
 
 # 清理函数
 def cleanup():
@@ -174,6 +283,9 @@ def cleanup():
     
     # 释放I2C资源（wiringpi没有明确的关闭函数，但我们可以将句柄设为None）
     i2c_handle = None
+
+    # 保存本次运行积累的单目测距标定
+    mono_estimator.save()
     
     print("I2C资源已释放")
 
@@ -241,6 +353,218 @@ def is_collision_possible(threshold_cm=MIN_DISTANCE_CM):
     
     return True
 
+# ===== 单目测距（超声波失效时的后备距离） =====
+class MonoRangeEstimator:
+    """
+    根据魔方色段像素宽度估计距离
+
+    针孔模型下距离与像素宽度成反比：d = a / w + b。
+    运行中把有效的超声波距离与时间相近的色段宽度配对，用最小二乘拟合a、b，
+    标定结果保存到文件，下次启动时继续使用。
+    """
+
+    def __init__(self, calibration_file=MONO_CALIBRATION_FILE):
+        current_dir = os.path.dirname(os.path.abspath(__file__))
+        self.calibration_file = os.path.join(current_dir, calibration_file)
+        self.samples = deque(maxlen=MONO_MAX_SAMPLES)  # (1/w, d)
+        self.a = MONO_DEFAULT_FOCAL_PX * CUBE_SIZE_CM
+        self.b = 0.0
+        self.residual_std = None   # 拟合残差标准差(cm)，未拟合时为None
+        self.target_color = None   # 只使用该颜色的色段，None表示使用最宽色段
+        self.last_width = None     # 最近一帧的色段宽度(像素)
+        self.last_frame_time = 0.0
+        self.loaded = False
+        self.lock = threading.Lock()
+
+    def load(self):
+        """从文件加载之前的标定样本（首次使用时自动调用）"""
+        self.loaded = True
+        if not os.path.exists(self.calibration_file):
+            return
+        try:
+            with open(self.calibration_file, 'r') as f:
+                data = json.load(f)
+            for inv_width, distance in data.get("samples", []):
+                self.samples.append((inv_width, distance))
+            self._fit()
+            print(f"已加载单目测距标定: {len(self.samples)} 个样本")
+        except Exception as e:
+            print(f"加载单目测距标定出错: {e}")
+
+    def set_samples(self, samples):
+        """
+        用给定的标定样本替换当前样本并重新拟合（离线回放时恢复记录开始时的标定）
+
+        Args:
+            samples: [(1/w, d), ...]
+        """
+        with self.lock:
+            self.samples = deque(((x, y) for x, y in samples), maxlen=MONO_MAX_SAMPLES)
+            self.a = MONO_DEFAULT_FOCAL_PX * CUBE_SIZE_CM
+            self.b = 0.0
+            self.residual_std = None
+            self.target_color = None
+            self.last_width = None
+            self.last_frame_time = 0.0
+            self.loaded = True
+            self._fit()
+
+    def get_samples(self):
+        """返回当前标定样本的副本（首次使用时先加载标定文件）"""
+        with self.lock:
+            if not self.loaded:
+                self.load()
+            return [list(sample) for sample in self.samples]
+
+    def save(self):
+        """保存标定样本到文件"""
+        with self.lock:
+            if not self.samples:
+                return
+            data = {"a": self.a, "b": self.b, "samples": list(self.samples)}
+        try:
+            with open(self.calibration_file, 'w') as f:
+                json.dump(data, f, indent=4)
+        except Exception as e:
+            print(f"保存单目测距标定出错: {e}")
+
+    def on_color_frame(self, color_data, timestamp):
+        """
+        颜色检测回调：记录目标色段宽度
+
+        Args:
+            color_data: detect_color的检测结果
+            timestamp: 帧采集时间
+        """
+        if self.target_color is not None:
+            segments = color_data.get(self.target_color, [])
+        else:
+            segments = [s for segs in color_data.values() for s in segs]
+        width = max((abs(s[1] - s[0]) for s in segments), default=0)
+        with self.lock:
+            if width >= MONO_MIN_WIDTH_PX:
+                self.last_width = width
+                self.last_frame_time = timestamp
+            else:
+                self.last_width = None
+
+    def add_ultrasonic_sample(self, distance, timestamp):
+        """
+        用一次有效超声波距离和时间相近的色段宽度组成标定样本
+
+        Args:
+            distance: 超声波距离(cm)
+            timestamp: 测量时间
+        """
+        with self.lock:
+            if not self.loaded:
+                self.load()
+            if self.last_width is None or abs(timestamp - self.last_frame_time) > MONO_MAX_PAIR_SKEW:
+                return
+            inv_width = 1.0 / self.last_width
+            # 与当前拟合偏差过大的样本多半是测到了别的物体，丢弃
+            if self.residual_std is not None:
+                predicted = self.a * inv_width + self.b
+                if abs(distance - predicted) > max(3 * self.residual_std, 10.0):
+                    return
+            self.samples.append((inv_width, distance))
+            self._fit()
+
+    def _fit(self):
+        """最小二乘拟合 d = a * (1/w) + b（内部使用，调用者持有锁）"""
+        n = len(self.samples)
+        if n < MONO_MIN_SAMPLES:
+            return
+        mean_x = sum(x for x, _ in self.samples) / n
+        mean_y = sum(y for _, y in self.samples) / n
+        sxx = sum((x - mean_x) ** 2 for x, _ in self.samples)
+        if sxx <= 1e-12:
+            return  # 宽度没有变化，无法拟合
+        sxy = sum((x - mean_x) * (y - mean_y) for x, y in self.samples)
+        a = sxy / sxx
+        if a <= 0:
+            return  # 宽度越大距离越远，不符合物理，保留原模型
+        self.a = a
+        self.b = mean_y - a * mean_x
+        residual = sum((y - (self.a * x + self.b)) ** 2 for x, y in self.samples)
+        self.residual_std = math.sqrt(residual / max(n - 2, 1))
+
+    def estimate(self, now=None):
+        """
+        根据最近一帧的色段宽度估计距离
+
+        Args:
+            now: 当前时间，默认为time.monotonic()
+
+        Returns:
+            tuple: (距离cm, 置信度0~1)，无法估计时返回(-1, 0.0)
+        """
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            if not self.loaded:
+                self.load()
+            if self.last_width is None or now - self.last_frame_time > MONO_MAX_FRAME_AGE:
+                return -1, 0.0
+            distance = self.a / self.last_width + self.b
+            n = len(self.samples)
+            residual_std = self.residual_std
+
+        if distance <= 0 or distance > MAX_DISTANCE_CM:
+            return -1, 0.0
+        # 置信度：样本数量 × 拟合精度（相对误差）
+        if residual_std is None:
+            confidence = 0.2  # 未标定，只靠默认针孔模型
+        else:
+            sample_factor = n / (n + MONO_MIN_SAMPLES)
+            fit_factor = 1.0 / (1.0 + residual_std / max(distance, 1.0) * 10)
+            confidence = sample_factor * fit_factor
+        return distance, confidence
+
+
+# 全局单目测距实例，需在颜色检测中注册 mono_estimator.on_color_frame 回调
+mono_estimator = MonoRangeEstimator()
+
+def set_mono_target_color(color):
+    """
+    设置单目测距使用的目标颜色
+
+    Args:
+        color: 颜色名称，None表示使用画面中最宽的色段
+    """
+    mono_estimator.target_color = color
+
+def get_mono_distance():
+    """
+    获取单目测距结果（与get_latest_distance并列，按摄像头帧率更新）
+
+    Returns:
+        tuple: (距离cm, 置信度0~1)，无法估计时返回(-1, 0.0)
+    """
+    return mono_estimator.estimate()
+
+def get_best_distance(min_confidence=MONO_MIN_CONFIDENCE):
+    """
+    获取最可信的距离：超声波有效时用超声波，否则退回单目测距
+
+    Args:
+        min_confidence: 单目测距的最低置信度
+
+    Returns:
+        tuple: (距离cm, 来源'ultrasonic'/'mono')，都无效时返回(-1, None)
+    """
+    now = time.monotonic()
+    snapshot = distance_state.read()
+    distance = snapshot.distance
+    age = now - snapshot.timestamp
+    if distance >= 0 and age <= MAX_DISTANCE_AGE:
+        return distance, 'ultrasonic'
+
+    mono_distance, confidence = mono_estimator.estimate(now)
+    if mono_distance >= 0 and confidence >= min_confidence:
+        return mono_distance, 'mono'
+    return -1, None
+
 # 以下仅用于测试
 
 # ===== 示例调用代码（实时测距） =====
@@ -0,0 +1,435 @@
+# eval_thresholds.py
+# 阈值质量评估：用color_picture的标注作为真值，按detect_color实际的处理流程
+# （截取取样带、颜色检测、去离散点、合并相近段）得到各颜色段，沿取样带逐列比较，
+# 统计各颜色的逐列混淆矩阵、色段IoU和中心偏移误差，对多个阈值文件排序
+#
+# 真值：color_picture/labels.json（格式见learn_hsv），标注框与取样带相交的部分即该颜色的列。
+# 取样带默认穿过标注框（框中心行中穿过框最多的一行），也可以在图片的标注列表中加
+# {"band": [起始行, 结束行]}（原图坐标）指定；--band detector 使用detect_color的DEFAULT_ROW_PERCENT，
+# --band adaptive 使用detect_color自适应检测区域第一次全帧扫描的结果（并报告取样带覆盖了多少标注框）。
+#
+# 用法：
+#   python eval_thresholds.py                          评估hsv_thresholds.json（和学习结果，如果有）
+#   python eval_thresholds.py a.json b.json ...        评估并按得分排序
+#   python eval_thresholds.py --band detector --workers 1
+#   python eval_thresholds.py --band adaptive
+#   python eval_thresholds.py --sampling [阈值文件]      各取样方式（detect_color.ROW_SAMPLING）的准确度与处理像素数
+import json
+import math
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+import detect_color
+from color_table import parse_color_ranges
+from learn_hsv import load_labels, IMAGE_DIR, LABEL_FILE, EXCEPT_COLORS
+
+# ===== 可配置参数（修改此处无需改动函数） =====
+COLORS = ("red", "yellow", "blue", "green")   # 评估的颜色，同一列有多种颜色的检测段时先出现的优先
+EVAL_WIDTH = detect_color.FRAME_WIDTH         # 图片缩放到摄像头的宽度后再检测，像素误差与实车可比
+EDGE_IGNORE = 0.05      # 标注框左右两端各有此比例的列不参与统计（手画的框边缘不准）
+DEFAULT_FILES = ("hsv_thresholds.json", "hsv_thresholds_learned.json")
+# --sampling 比较的取样方式（detect_color的取样参数，未写的参数用detect_color的当前值）
+SAMPLING_CURVE = (
+    {"ROW_SAMPLING": "all"},
+    {"ROW_SAMPLING": "stride", "ROW_STRIDE": 2},
+    {"ROW_SAMPLING": "stride", "ROW_STRIDE": 4},
+    {"ROW_SAMPLING": "stride", "ROW_STRIDE": 8},
+    {"ROW_SAMPLING": "stride", "ROW_STRIDE": 16},
+    {"ROW_SAMPLING": "stride", "ROW_STRIDE": 4, "COLUMN_VOTE_FRACTION": 0.3},
+    {"ROW_SAMPLING": "scanlines", "ROW_SCANLINES": 5},
+    {"ROW_SAMPLING": "scanlines", "ROW_SCANLINES": 3},
+    {"ROW_SAMPLING": "checkerboard", "ROW_STRIDE": 1},
+    {"ROW_SAMPLING": "checkerboard", "ROW_STRIDE": 4},
+    {"ROW_SAMPLING": "checkerboard", "ROW_STRIDE": 8},
+)
+SAMPLING_LABELS = {"ROW_SAMPLING": "", "ROW_STRIDE": "间隔=", "ROW_SCANLINES": "行数=", "COLUMN_VOTE_FRACTION": "票数比例="}
+TIMING_REPEAT = 20      # --sampling 计时时每张图片重复检测的次数
+
+
+def band_rows(regions, height, scale, mode="labels"):
+    """
+    确定一张图片的取样带
+
+    Args:
+        regions: 该图片的标注列表
+        height: 缩放后的图片高度
+        scale: 缩放比例（标注为原图坐标）
+        mode: "labels"穿过标注框，"detector"使用detect_color.get_roi_rows，
+              "adaptive"需要图片，由_image_band处理
+
+    Returns:
+        tuple: (start_row, end_row)，缩放后的坐标
+    """
+    for region in regions:
+        if "band" in region:
+            start, end = region["band"]
+            return int(start * scale), max(int(start * scale) + 1, int(end * scale))
+    boxes = [region["box"] for region in regions if "box" in region]
+    if mode == "detector" or not boxes:
+        return detect_color.get_roi_rows(height)
+    # 在各框的中心行中选穿过框最多的一行，取样带以它为中心
+    centers = [y + h / 2.0 for _, y, _, h in boxes]
+    best = max(centers, key=lambda row: (sum(y <= row < y + h for _, y, _, h in boxes), -row))
+    start = int(best * scale) - detect_color.DEFAULT_ROW_HEIGHT // 2
+    start = max(0, min(start, height - detect_color.DEFAULT_ROW_HEIGHT))
+    return start, min(height, start + detect_color.DEFAULT_ROW_HEIGHT)
+
+
+def _image_band(image, regions, scale, mode):
+    """缩放后图片的取样带：adaptive模式扫描图片，其他模式见band_rows"""
+    if mode == "adaptive":
+        return detect_color.RoiTracker().rows(image)
+    return band_rows(regions, image.shape[0], scale, mode)
+
+
+def band_coverage(labels, mode):
+    """
+    取样带覆盖标注框的情况（固定取样带可能完全错过魔方，此时该图片没有真值，不计入漏检）
+
+    Returns:
+        tuple: (被取样带穿过的标注框数, 标注框总数, 每帧平均处理的行数)
+    """
+    image_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), IMAGE_DIR)
+    covered = total = 0
+    heights = []
+    for name, regions in sorted(labels.items()):
+        image = cv2.imread(os.path.join(image_dir, name))
+        if image is None:
+            continue
+        scale = EVAL_WIDTH / image.shape[1]
+        image = cv2.resize(image, (EVAL_WIDTH, int(round(image.shape[0] * scale))), interpolation=cv2.INTER_AREA)
+        rows = _image_band(image, regions, scale, mode)
+        heights.append(rows[1] - rows[0])
+        for region in regions:
+            if region.get("color") in COLORS and "box" in region:
+                _, y, _, h = region["box"]
+                total += 1
+                covered += y * scale < rows[1] and (y + h) * scale > rows[0]
+    return covered, total, float(np.mean(heights)) if heights else 0.0
+
+
+def truth_segments(regions, rows, scale, colors=COLORS):
+    """
+    标注框与取样带相交的部分
+
+    Returns:
+        list: [(颜色编号, x_start, x_end), ...]，缩放后的列坐标（闭区间），颜色编号从1开始
+    """
+    start, end = rows
+    segments = []
+    for region in regions:
+        if region.get("color") not in colors or "box" not in region:
+            continue
+        x, y, w, h = region["box"]
+        if y * scale < end and (y + h) * scale > start:
+            segments.append((colors.index(region["color"]) + 1, int(round(x * scale)), int(round((x + w) * scale)) - 1))
+    return segments
+
+
+def truth_columns(segments, width):
+    """
+    逐列真值
+
+    Returns:
+        np.ndarray: int8 (width,)，0为背景，k为颜色编号，-1为不参与统计（标注框边缘）
+    """
+    columns = np.zeros(width, dtype=np.int8)
+    for index, x_start, x_end in segments:
+        margin = int((x_end - x_start + 1) * EDGE_IGNORE)
+        columns[max(x_start, 0):x_end + 1] = -1
+        columns[max(x_start + margin, 0):max(x_end + 1 - margin, 0)] = index
+    return columns
+
+
+def detected_segments(color_data, width, colors=COLORS):
+    """
+    把detect_color的结果换成绝对列坐标
+
+    Returns:
+        list: [(颜色编号, x_start, x_end), ...]
+    """
+    center_x = width // 2
+    return [(colors.index(color) + 1, x_start + center_x, x_end + center_x)
+            for color, segments in color_data.items() if color in colors
+            for x_start, x_end, _ in segments]
+
+
+def detected_columns(segments, width):
+    """逐列检测结果（uint8，0为无颜色），同一列有多种颜色时编号小的优先"""
+    columns = np.zeros(width, dtype=np.uint8)
+    for index, x_start, x_end in sorted(segments, reverse=True):
+        columns[max(x_start, 0):x_end + 1] = index
+    return columns
+
+
+def match_segments(truth, detected):
+    """
+    每个真值段与同色检测段中IoU最大的一个配对
+
+    Returns:
+        tuple: (ious (真值段数,), 中心误差 (真值段数,)（没有同色重叠段时为nan）, 误检段数)
+    """
+    ious = np.zeros(len(truth))
+    errors = np.full(len(truth), np.nan)
+    if truth and detected:
+        t = np.array(truth, dtype=float)
+        d = np.array(detected, dtype=float)
+        intersection = np.clip(np.minimum(t[:, None, 2], d[None, :, 2]) - np.maximum(t[:, None, 1], d[None, :, 1]) + 1, 0, None)
+        union = (t[:, None, 2] - t[:, None, 1] + 1) + (d[None, :, 2] - d[None, :, 1] + 1) - intersection
+        iou = np.where(t[:, None, 0] == d[None, :, 0], intersection / union, 0.0)
+        best = iou.argmax(axis=1)
+        ious = iou[np.arange(len(t)), best]
+        centers = (d[best, 1] + d[best, 2]) / 2.0 - (t[:, 1] + t[:, 2]) / 2.0
+        errors = np.where(ious > 0, np.abs(centers), np.nan)
+        false_positives = int(np.count_nonzero(iou.max(axis=0) == 0))
+    else:
+        false_positives = len(detected)
+    return ious, errors, false_positives
+
+
+# ===== 并行评估 =====
+_worker_labels = None
+_worker_mode = None
+_worker_images = {}
+
+
+def _init_worker(labels, mode, sampling=None):
+    """进程池初始化：标注只传一次，图片在各进程中读入后缓存；设置detect_color的取样参数"""
+    global _worker_labels, _worker_mode
+    _worker_labels, _worker_mode = labels, mode
+    _apply_sampling(sampling or {})
+
+
+def _apply_sampling(sampling):
+    """
+    设置detect_color的取样参数
+
+    Returns:
+        dict: 原来的值（用于恢复）
+    """
+    saved = {name: getattr(detect_color, name) for name in sampling}
+    for name, value in sampling.items():
+        setattr(detect_color, name, value)
+    return saved
+
+
+def _load_band(name):
+    """读入图片，缩放到EVAL_WIDTH并截取取样带（缓存）"""
+    if name not in _worker_images:
+        image = cv2.imread(os.path.join(os.path.dirname(os.path.abspath(__file__)), IMAGE_DIR, name))
+        if image is None:
+            _worker_images[name] = None
+        else:
+            scale = EVAL_WIDTH / image.shape[1]
+            image = cv2.resize(image, (EVAL_WIDTH, int(round(image.shape[0] * scale))), interpolation=cv2.INTER_AREA)
+            rows = _image_band(image, _worker_labels[name], scale, _worker_mode)
+            _worker_images[name] = (image[rows[0]:rows[1]], scale, rows)
+    return _worker_images[name]
+
+
+def _run_task(task):
+    """
+    进程池任务：(阈值下标, 阈值, 图片名) -> (阈值下标, 图片名, 真值段, 检测段)
+
+    用给定阈值替换detect_color.COLOR_RANGES后调用detect_color_roi，保证与实车的处理流程一致。
+    """
+    index, thresholds, name = task
+    loaded = _load_band(name)
+    if loaded is None:
+        return index, name, None, None
+    roi, scale, rows = loaded
+    saved = detect_color.COLOR_RANGES
+    detect_color.COLOR_RANGES = parse_color_ranges(thresholds, EXCEPT_COLORS)
+    try:
+        color_data = detect_color.detect_color_roi(roi, EVAL_WIDTH)
+    finally:
+        detect_color.COLOR_RANGES = saved
+    return index, name, truth_segments(_worker_labels[name], rows, scale), detected_segments(color_data, EVAL_WIDTH)
+
+
+def summarize(path, results, colors=COLORS):
+    """
+    汇总一个阈值文件在所有图片上的结果（各图片的列和段拼在一起向量化统计）
+
+    Args:
+        results: [(真值段, 检测段), ...]
+
+    Returns:
+        dict: 混淆矩阵、各颜色逐列精确率/召回率/F1、平均IoU、中心误差、误检段数、得分
+    """
+    truth = np.stack([truth_columns(t, EVAL_WIDTH) for t, _ in results])
+    detected = np.stack([detected_columns(d, EVAL_WIDTH) for _, d in results])
+    valid = truth >= 0
+    size = len(colors) + 1
+    matrix = np.bincount(truth[valid].astype(np.int64) * size + detected[valid],
+                         minlength=size * size).reshape(size, size)
+
+    per_color = {}
+    for k, color in enumerate(colors, start=1):
+        hit = matrix[k, k]
+        predicted, actual = matrix[:, k].sum(), matrix[k].sum()
+        precision = hit / predicted if predicted else 0.0
+        recall = hit / actual if actual else 0.0
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+        per_color[color] = {"precision": precision, "recall": recall, "f1": f1, "columns": int(actual)}
+
+    ious, errors, false_positives = [], [], 0
+    for t, d in results:
+        iou, error, fp = match_segments(t, d)
+        ious.append(iou)
+        errors.append(error)
+        false_positives += fp
+    ious = np.concatenate(ious) if ious else np.zeros(0)
+    errors = np.concatenate(errors) if errors else np.zeros(0)
+    found = errors[~np.isnan(errors)]
+    mean_iou = float(ious.mean()) if len(ious) else 0.0
+    return {
+        "path": path, "matrix": matrix, "per_color": per_color,
+        "segments": len(ious), "mean_iou": mean_iou, "missed": int(np.count_nonzero(ious == 0)),
+        "center_mean": float(found.mean()) if len(found) else float('nan'),
+        "center_p90": float(np.percentile(found, 90)) if len(found) else float('nan'),
+        "false_positives": false_positives,
+        # 得分：平均IoU（漏检为0）减去每张图片平均误检段数的十分之一，越大越好
+        "score": mean_iou - 0.1 * false_positives / max(len(results), 1),
+    }
+
+
+def evaluate_files(paths, labels, mode="labels", workers=None, chunksize=4, sampling=None):
+    """
+    并行评估多个阈值文件
+
+    Args:
+        paths: 阈值文件路径列表
+        labels: 标注（load_labels的结果）
+        mode: 取样带模式，见band_rows
+        workers: 进程数，默认为CPU核数；1表示在当前进程中顺序执行
+        sampling: detect_color的取样参数，如 {"ROW_SAMPLING": "stride", "ROW_STRIDE": 4}
+
+    Returns:
+        list: 按得分从高到低排序的summarize结果
+    """
+    thresholds = []
+    for path in paths:
+        with open(path, "r") as f:
+            thresholds.append(json.load(f))
+    names = sorted(labels)
+    tasks = [(index, t, name) for index, t in enumerate(thresholds) for name in names]
+    results = [{} for _ in paths]
+
+    def collect(index, name, truth, detected):
+        if truth is None:
+            print(f"无法读取图片: {name}")
+        else:
+            results[index][name] = (truth, detected)
+
+    if workers == 1:
+        saved = _apply_sampling(sampling or {})
+        try:
+            _init_worker(labels, mode)
+            for task in tasks:
+                collect(*_run_task(task))
+        finally:
+            _apply_sampling(saved)
+    else:
+        import multiprocessing
+        with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(labels, mode, sampling)) as pool:
+            for result in pool.imap_unordered(_run_task, tasks, chunksize=chunksize):
+                collect(*result)
+    summaries = [summarize(path, [r[name] for name in sorted(r)]) for path, r in zip(paths, results)]
+    summaries.sort(key=lambda s: -s["score"])
+    return summaries
+
+
+def print_summaries(summaries, colors=COLORS, show_matrix=False):
+    """打印排序表（和混淆矩阵）"""
+    print(f"{'排名':<4}{'阈值文件':<32}{'得分':>7}{'平均IoU':>9}{'漏检':>5}{'误检':>5}{'中心误差':>10}{'p90':>7}"
+          + "".join(f"{color + ' F1':>11}" for color in colors))
+    for rank, s in enumerate(summaries, 1):
+        print(f"{rank:<4}{os.path.basename(s['path']):<32}{s['score']:>7.3f}{s['mean_iou']:>9.3f}"
+              f"{s['missed']:>5}{s['false_positives']:>5}{s['center_mean']:>8.1f}px{s['center_p90']:>5.1f}px"
+              + "".join(f"{s['per_color'][color]['f1']:>11.3f}" for color in colors))
+    if show_matrix:
+        header = ("background",) + colors
+        for s in summaries:
+            print(f"\n{os.path.basename(s['path'])} 逐列混淆矩阵（行: 真值，列: 检测）")
+            print(f"{'':<12}" + "".join(f"{name:>11}" for name in ("none",) + colors))
+            for name, row in zip(header, s["matrix"]):
+                print(f"{name:<12}" + "".join(f"{value:>11}" for value in row))
+
+
+def sampling_curve(path, labels, mode="labels", workers=None, curve=SAMPLING_CURVE):
+    """
+    各取样方式的准确度与处理像素数、检测耗时
+
+    Returns:
+        list: [(取样参数, summarize结果, 每帧处理像素数, 每帧检测耗时ms), ...]
+    """
+    with open(path, "r") as f:
+        color_ranges = parse_color_ranges(json.load(f), EXCEPT_COLORS)
+    # 计时用的取样带在当前进程中读入
+    _init_worker(labels, mode)
+    bands = [loaded[0] for loaded in map(_load_band, sorted(labels)) if loaded is not None]
+    points = []
+    for sampling in curve:
+        summary = evaluate_files([path], labels, mode, workers, sampling=sampling)[0]
+        saved = _apply_sampling(dict(sampling, COLOR_RANGES=color_ranges))
+        try:
+            pixels = np.mean([detect_color.sample_roi(band)[0].size // 3 for band in bands])
+            start = time.perf_counter()
+            for _ in range(TIMING_REPEAT):
+                for band in bands:
+                    detect_color.detect_color_roi(band, EVAL_WIDTH)
+            elapsed = (time.perf_counter() - start) / (TIMING_REPEAT * len(bands))
+        finally:
+            _apply_sampling(saved)
+        points.append((sampling, summary, pixels, elapsed * 1000))
+    return points
+
+
+def print_sampling_curve(points):
+    """打印取样方式曲线（像素和耗时相对全部行）"""
+    base_pixels, base_ms = points[0][2], points[0][3]
+    print(f"{'取样方式':<28}{'像素/帧':>8}{'比例':>7}{'耗时':>9}{'得分':>7}{'平均IoU':>9}{'漏检':>5}{'误检':>5}{'中心误差':>10}")
+    for sampling, s, pixels, ms in points:
+        name = " ".join(f"{SAMPLING_LABELS.get(key, key)}{value}" for key, value in sampling.items())
+        print(f"{name:<32}{pixels:>8.0f}{pixels / base_pixels:>7.0%}{ms:>7.2f}ms{s['score']:>7.3f}{s['mean_iou']:>9.3f}"
+              f"{s['missed']:>5}{s['false_positives']:>5}{s['center_mean']:>8.1f}px")
+    print(f"（耗时为单个进程中每帧detect_color_roi的平均时间，全部行为 {base_ms:.2f}ms）")
+
+
+def main():
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    labels = load_labels(os.path.join(current_dir, IMAGE_DIR, LABEL_FILE))
+    if not labels:
+        print("没有标注，先运行 python learn_hsv.py --annotate")
+        return
+    args = sys.argv[1:]
+    mode = args[args.index("--band") + 1] if "--band" in args else "labels"
+    workers = int(args[args.index("--workers") + 1]) if "--workers" in args else None
+    option_values = {args[i + 1] for i, arg in enumerate(args[:-1]) if arg in ("--band", "--workers")}
+    paths = [arg for arg in args if not arg.startswith("--") and arg not in option_values]
+    if not paths:
+        paths = [os.path.join(current_dir, name) for name in DEFAULT_FILES
+                 if os.path.exists(os.path.join(current_dir, name))]
+
+    if "--sampling" in args:
+        points = sampling_curve(paths[0], labels, mode, workers)
+        print(f"阈值文件: {os.path.basename(paths[0])}，取样带: {mode}")
+        print_sampling_curve(points)
+        return
+
+    start = time.perf_counter()
+    summaries = evaluate_files(paths, labels, mode, workers)
+    elapsed = time.perf_counter() - start
+    print_summaries(summaries, show_matrix="--matrix" in args)
+    covered, total, rows = band_coverage(labels, mode)
+    print(f"\n取样带({mode})穿过 {covered}/{total} 个标注框，平均每帧 {rows:.0f} 行")
+    print(f"\n{len(paths)}个阈值文件 × {len(labels)}张图片，用时 {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
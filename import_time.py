@@ -0,0 +1,133 @@
+# import_time.py
+# 导入耗时检查：用 python -X importtime 在新进程中导入控制程序，
+# 报告总耗时和自身耗时最多的模块，并检查导入时的副作用（加载不需要的重型依赖、打印输出即读文件/碰硬件）
+#
+# 用法：python import_time.py [模块 ...] [--budget 毫秒] [--top N]
+#       超出预算、导入了禁止的模块或导入时有输出时返回非0，可用于检查改动是否拖慢了启动
+import os
+import subprocess
+import sys
+
+# ===== 可配置参数（修改此处无需改动函数） =====
+DEFAULT_MODULES = ("main_controller6",)   # 默认检查的模块
+IMPORT_BUDGET_MS = 1500.0                 # 导入总耗时预算（毫秒，按树莓派设定，开发机上远低于此值）
+REPEAT = 3                                # 重复测量次数，取最短的一次（排除磁盘缓存的影响）
+TOP_MODULES = 10                          # 报告自身耗时最多的模块数
+# 控制程序不应在导入时加载的模块（只在测试菜单或离线工具中用到，应在用到时才导入）
+FORBIDDEN_MODULES = ("matplotlib", "tkinter", "PIL", "scipy", "pandas")
+
+
+def parse_importtime(stderr):
+    """
+    解析 -X importtime 的输出
+
+    Returns:
+        list: [(模块名, 自身耗时us, 累计耗时us, 嵌套深度), ...]，按导入完成的顺序
+    """
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue   # 表头
+        name = fields[2].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append((name.strip(), int(fields[0]), int(fields[1]), depth))
+    return entries
+
+
+def measure_import(module, repeat=REPEAT):
+    """
+    在新进程中导入模块并测量耗时
+
+    Args:
+        module: 模块名
+        repeat: 重复次数，取累计耗时最短的一次
+
+    Returns:
+        dict: {"total_ms": 总耗时, "entries": parse_importtime的结果, "stdout": 导入时的输出,
+               "error": 导入出错时的错误输出（否则为None）}
+    """
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    best = None
+    for _ in range(repeat):
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                              cwd=current_dir, capture_output=True, text=True)
+        if proc.returncode != 0:
+            errors = [line for line in proc.stderr.splitlines() if not line.startswith("import time:")]
+            return {"total_ms": None, "entries": [], "stdout": proc.stdout, "error": "\n".join(errors[-5:])}
+        entries = parse_importtime(proc.stderr)
+        total = next((cumulative for name, _, cumulative, depth in entries if name == module and depth == 0), 0)
+        if best is None or total < best["total_ms"] * 1000:
+            best = {"total_ms": total / 1000.0, "entries": entries, "stdout": proc.stdout, "error": None}
+    return best
+
+
+def check_import(module, budget_ms=IMPORT_BUDGET_MS, top=TOP_MODULES):
+    """
+    测量并打印报告
+
+    Returns:
+        list: 发现的问题（空表示通过）
+    """
+    result = measure_import(module)
+    if result["error"] is not None:
+        print(f"{module}: 导入出错\n{result['error']}")
+        return [f"{module} 导入出错"]
+
+    problems = []
+    print(f"{module}: 导入共 {result['total_ms']:.1f}ms（预算 {budget_ms:.0f}ms）")
+    print(f"  自身耗时最多的{top}个模块:")
+    for name, self_us, cumulative_us, _ in sorted(result["entries"], key=lambda e: -e[1])[:top]:
+        print(f"  {self_us / 1000:>8.1f}ms {cumulative_us / 1000:>8.1f}ms  {name}")
+    if result["total_ms"] > budget_ms:
+        problems.append(f"{module} 导入 {result['total_ms']:.0f}ms 超出预算 {budget_ms:.0f}ms")
+
+    imported = {name for name, _, _, _ in result["entries"]}
+    for forbidden in FORBIDDEN_MODULES:
+        if forbidden in imported:
+            chain = _import_chain(result["entries"], forbidden)
+            problems.append(f"{module} 导入时加载了 {forbidden}（{' <- '.join(chain)}）")
+    if result["stdout"].strip():
+        lines = result["stdout"].strip().splitlines()
+        problems.append(f"{module} 导入时有输出（读文件或初始化硬件应推迟到用到时）: {lines[0]}"
+                        + (f" 等{len(lines)}行" if len(lines) > 1 else ""))
+    return problems
+
+
+def _import_chain(entries, module):
+    """找到是哪个模块导入了module：返回 [module, 上一层, ...]"""
+    for index, (name, _, _, depth) in enumerate(entries):
+        if name != module:
+            continue
+        chain = [name]
+        # 子模块先于父模块完成导入，往后找深度更小的第一个就是导入它的模块
+        for parent, _, _, parent_depth in entries[index + 1:]:
+            if parent_depth < depth:
+                chain.append(parent)
+                depth = parent_depth
+        return chain
+    return [module]
+
+
+def main():
+    args = sys.argv[1:]
+    budget = float(args[args.index("--budget") + 1]) if "--budget" in args else IMPORT_BUDGET_MS
+    top = int(args[args.index("--top") + 1]) if "--top" in args else TOP_MODULES
+    option_values = {args[i + 1] for i, arg in enumerate(args[:-1]) if arg in ("--budget", "--top")}
+    modules = [arg for arg in args if not arg.startswith("--") and arg not in option_values] or DEFAULT_MODULES
+
+    problems = []
+    for module in modules:
+        problems.extend(check_import(module, budget, top))
+    if problems:
+        print("\n导入检查未通过:")
+        for problem in problems:
+            print(f"  {problem}")
+        sys.exit(1)
+    print("\n导入检查通过")
+
+
+if __name__ == "__main__":
+    main()
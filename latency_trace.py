@@ -0,0 +1,317 @@
+# latency_trace.py
+# 端到端延迟追踪：给每帧分配编号，记录该帧从读取摄像头、颜色检测、控制循环决策、
+# 下发电机指令到PWM周期实际生效的各个时刻，统计各段和总延迟的分位数，
+# 并导出Chrome trace格式的时间线（chrome://tracing 或 ui.perfetto.dev 打开）
+# 注意：摄像头驱动缓冲的帧在read之前就已曝光，这部分排队时间从read的耗时中看不出来
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# ===== 可配置参数（修改此处无需改动函数） =====
+TRACE_ENABLED = False    # 是否记录（start_latency_trace时打开），关闭时各记录函数立即返回
+TRACE_HISTORY = 3000     # 最多保留多少帧的记录
+TRACE_DIR = "runs"       # 时间线文件默认保存目录（相对本文件）
+
+# 各阶段按顺序排列，相邻两个阶段之间为一段
+STAGES = ("read", "captured", "detected", "decided", "commanded", "pwm")
+HOPS = (
+    ("camera.read", "read", "captured"),        # 等待摄像头返回一帧
+    ("detect_color", "captured", "detected"),   # 截取检测区域和颜色检测
+    ("poll_wait", "detected", "decided"),       # 检测完成到控制循环读取该帧
+    ("decision", "decided", "commanded"),       # 控制计算和指令仲裁
+    ("pwm_wait", "commanded", "pwm"),           # 指令下发到PWM周期生效
+)
+# 时间线中各段所在的行（同一线程的段放在同一行）
+HOP_LANES = {"camera.read": 1, "detect_color": 1, "poll_wait": 2, "decision": 2, "pwm_wait": 3}
+LANE_NAMES = {1: "颜色检测线程", 2: "控制循环", 3: "PWM守护线程"}
+
+
+class LatencyTracer:
+    """
+    按帧编号记录各阶段的时刻
+
+    每帧每个阶段只记录第一次（如控制循环多次读到同一帧，只记第一次读取），
+    已下发指令但还没有PWM周期生效的帧，在下一个PWM周期统一记录生效时刻。
+    """
+
+    def __init__(self, history=TRACE_HISTORY):
+        self.lock = threading.Lock()
+        self.history = history
+        self.frames = OrderedDict()   # 帧编号 -> {阶段: 时刻}
+        self.by_capture = {}          # 帧采集时间 -> 帧编号（控制循环按帧时间找到编号）
+        self.pending_pwm = []         # 已下发指令、等待PWM生效的帧编号
+
+    def stage(self, frame_id, stage, timestamp=None):
+        """
+        记录一帧到达某个阶段的时刻
+
+        Args:
+            frame_id: 帧编号，None时忽略
+            stage: STAGES中的阶段名
+            timestamp: 时刻，默认为time.monotonic()
+        """
+        if frame_id is None:
+            return
+        if timestamp is None:
+            timestamp = time.monotonic()
+        with self.lock:
+            record = self.frames.get(frame_id)
+            if record is None:
+                record = self.frames[frame_id] = {}
+                while len(self.frames) > self.history:
+                    _, old = self.frames.popitem(last=False)
+                    self.by_capture.pop(old.get("captured"), None)
+            if stage in record:
+                return
+            record[stage] = timestamp
+            if stage == "captured":
+                self.by_capture[timestamp] = frame_id
+            elif stage == "commanded":
+                self.pending_pwm.append(frame_id)
+
+    def frame_at(self, capture_time):
+        """
+        Returns:
+            int: 采集时间对应的帧编号，没有记录时返回None
+        """
+        with self.lock:
+            return self.by_capture.get(capture_time)
+
+    def on_pwm_tick(self, left_pwm, right_pwm, timestamp):
+        """PWM周期回调：等待生效的帧都在本周期生效"""
+        with self.lock:
+            pending, self.pending_pwm = self.pending_pwm, []
+            for frame_id in pending:
+                record = self.frames.get(frame_id)
+                if record is not None:
+                    record.setdefault("pwm", timestamp)
+
+    def reset(self):
+        """清空记录"""
+        with self.lock:
+            self.frames.clear()
+            self.by_capture.clear()
+            self.pending_pwm = []
+
+    def snapshot(self):
+        """
+        Returns:
+            list: [(帧编号, {阶段: 时刻}), ...]，按帧编号顺序
+        """
+        with self.lock:
+            return [(frame_id, dict(record)) for frame_id, record in self.frames.items()]
+
+    def hop_stats(self):
+        """
+        统计各段和总延迟的分布
+
+        Returns:
+            dict: {段名: {"count", "mean", "p50", "p90", "p99", "max"}（秒）}，
+                  另有"total"（读取摄像头到PWM生效，只统计走完全程的帧）
+        """
+        values = {name: [] for name, _, _ in HOPS}
+        values["total"] = []
+        for _, record in self.snapshot():
+            for name, start, end in HOPS:
+                if start in record and end in record:
+                    values[name].append(record[end] - record[start])
+            if "read" in record and "pwm" in record:
+                values["total"].append(record["pwm"] - record["read"])
+        return {name: _summarize(samples) for name, samples in values.items()}
+
+    def chrome_trace(self):
+        """
+        生成Chrome trace格式的事件列表（时间单位微秒）
+
+        Returns:
+            dict: {"traceEvents": [...], "displayTimeUnit": "ms"}
+        """
+        events = [{"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": name}}
+                  for tid, name in LANE_NAMES.items()]
+        frames = self.snapshot()
+        origin = min((min(record.values()) for _, record in frames if record), default=0.0)
+        for frame_id, record in frames:
+            for name, start, end in HOPS:
+                if start in record and end in record:
+                    events.append({
+                        "name": name, "cat": "latency", "ph": "X", "pid": 1, "tid": HOP_LANES[name],
+                        "ts": round((record[start] - origin) * 1e6, 1),
+                        "dur": round((record[end] - record[start]) * 1e6, 1),
+                        "args": {"frame": frame_id},
+                    })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def _summarize(values):
+    """计算延迟分布的统计量（内部使用，与time_alignment的统计方式一致）"""
+    if not values:
+        return {"count": 0, "mean": 0.0, "p50": 0.0, "p90": 0.0, "p99": 0.0, "max": 0.0}
+    values = sorted(values)
+    n = len(values)
+
+    def percentile(p):
+        return values[min(n - 1, int(round(p / 100.0 * (n - 1))))]
+
+    return {
+        "count": n,
+        "mean": sum(values) / n,
+        "p50": percentile(50),
+        "p90": percentile(90),
+        "p99": percentile(99),
+        "max": values[-1],
+    }
+
+
+# ===== 全局实例 =====
+tracer = LatencyTracer()
+_next_frame_id = 0
+
+
+def new_frame_id():
+    """
+    分配新的帧编号（颜色检测线程每读一帧调用一次）
+
+    Returns:
+        int: 帧编号，从1开始递增
+    """
+    global _next_frame_id
+    _next_frame_id += 1
+    return _next_frame_id
+
+
+def trace_stage(frame_id, stage, timestamp=None):
+    """记录一帧到达某个阶段的时刻，未启动追踪时立即返回"""
+    if TRACE_ENABLED:
+        tracer.stage(frame_id, stage, timestamp)
+
+
+def trace_decision(capture_time):
+    """
+    控制循环读取某帧检测结果时调用
+
+    Args:
+        capture_time: 读取到的帧采集时间
+
+    Returns:
+        int: 该帧编号，未启动追踪或找不到时返回None（之后下发指令时传给trace_stage）
+    """
+    if not TRACE_ENABLED:
+        return None
+    frame_id = tracer.frame_at(capture_time)
+    tracer.stage(frame_id, "decided")
+    return frame_id
+
+
+def start_latency_trace():
+    """打开追踪，并注册到PWM更新的回调"""
+    global TRACE_ENABLED
+    from motor_controller import add_pwm_listener
+
+    tracer.reset()
+    add_pwm_listener(tracer.on_pwm_tick)
+    TRACE_ENABLED = True
+    print("延迟追踪已启动")
+
+
+def stop_latency_trace():
+    """关闭追踪并注销回调（保留已记录的数据）"""
+    global TRACE_ENABLED
+    from motor_controller import remove_pwm_listener
+
+    TRACE_ENABLED = False
+    remove_pwm_listener(tracer.on_pwm_tick)
+
+
+def print_latency_report():
+    """打印各段和总延迟的分位数"""
+    stats = tracer.hop_stats()
+    if not stats["total"]["count"] and not stats["camera.read"]["count"]:
+        return
+    print(f"{'延迟':<14}{'帧数':>6}{'平均':>9}{'p50':>9}{'p90':>9}{'p99':>9}{'最大':>9}")
+    for name in [hop[0] for hop in HOPS] + ["total"]:
+        s = stats[name]
+        print(f"{name:<14}{s['count']:>6}{s['mean']*1000:>7.1f}ms{s['p50']*1000:>7.1f}ms"
+              f"{s['p90']*1000:>7.1f}ms{s['p99']*1000:>7.1f}ms{s['max']*1000:>7.1f}ms")
+
+
+def export_chrome_trace(path=None):
+    """
+    导出时间线
+
+    Args:
+        path: 文件路径，默认为runs/latency_日期_时间.json
+
+    Returns:
+        str: 文件路径，没有记录或写入失败时返回None
+    """
+    trace = tracer.chrome_trace()
+    if len(trace["traceEvents"]) <= len(LANE_NAMES):
+        return None
+    if path is None:
+        current_dir = os.path.dirname(os.path.abspath(__file__))
+        path = os.path.join(current_dir, TRACE_DIR, time.strftime("latency_%Y%m%d_%H%M%S.json"))
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(trace, f)
+    except OSError as e:
+        print(f"导出延迟时间线出错: {e}")
+        return None
+    print(f"延迟时间线已导出: {path}")
+    return path
+
+
+# 以下仅用于测试
+
+# ===== 离线仿真：按实车的线程结构和周期模拟一条检测到电机的流水线 =====
+if __name__ == "__main__":
+    import random
+    import tempfile
+
+    TRACE_ENABLED = True
+    running = True
+    latest = {"time": 0.0}
+
+    def camera_thread():
+        # 摄像头约30fps，检测约8ms，检测线程每帧后休息0.1秒（与detect_color一致）
+        next_frame = time.monotonic()
+        while running:
+            read_start = time.monotonic()
+            next_frame = max(next_frame + 1 / 30.0, read_start)
+            time.sleep(next_frame - read_start)
+            frame_id = new_frame_id()
+            captured = time.monotonic()
+            trace_stage(frame_id, "read", read_start)
+            trace_stage(frame_id, "captured", captured)
+            time.sleep(random.uniform(0.006, 0.010))
+            trace_stage(frame_id, "detected")
+            latest["time"] = captured
+            time.sleep(0.1)
+
+    def pwm_thread():
+        while running:
+            tracer.on_pwm_tick(0, 0, time.monotonic())
+            time.sleep(0.1)
+
+    threads = [threading.Thread(target=camera_thread, daemon=True),
+               threading.Thread(target=pwm_thread, daemon=True)]
+    for thread in threads:
+        thread.start()
+    # 控制循环：每APPROACH_INTERVAL读取最新帧并下发指令
+    end = time.monotonic() + 3.0
+    while time.monotonic() < end:
+        frame_id = trace_decision(latest["time"])
+        time.sleep(0.0005)
+        trace_stage(frame_id, "commanded")
+        time.sleep(0.02)
+    running = False
+    for thread in threads:
+        thread.join()
+
+    print_latency_report()
+    path = export_chrome_trace(os.path.join(tempfile.gettempdir(), "latency_selftest.json"))
+    with open(path) as f:
+        events = json.load(f)["traceEvents"]
+    print(f"时间线共{len(events)}个事件")
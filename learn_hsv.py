@@ -0,0 +1,407 @@
+# learn_hsv.py
+# 从标注区域自动学习HSV阈值
+# calibrate_hsv直接取手拖ROI的最小/最大值，阴影和边缘都会被包进阈值；这里按颜色汇总所有
+# 图片中标注区域的像素，以色调众数为中心剔除离群像素，再用截尾分位数得到紧凑的区间，
+# 同时报告各颜色在标注集上的像素精确率和召回率，并编译查找表(color_table)
+#
+# 标注文件 color_picture/labels.json 格式：
+#   {"图片名.jpg": [{"color": "red", "box": [x, y, w, h]}, {"color": "blue", "mask": "掩码.png"}, ...]}
+#   box为原图坐标；mask为与原图同尺寸的掩码图片（相对图片目录，非零像素为该颜色）；
+#   颜色为"ignore"的区域不参与统计。空列表表示图中没有任何目标颜色（全部像素作为反例）。
+#   {"band": [起始行, 结束行]} 为eval_thresholds使用的取样带，这里忽略。
+#
+# 用法：
+#   python learn_hsv.py               学习阈值，写入hsv_thresholds_learned.json和color_table.npz并打印对比
+#   python learn_hsv.py --loo         另外做留一图片交叉验证（每次用其余图片学习，在留出的图片上评估）
+#   python learn_hsv.py --write       学习结果覆盖hsv_thresholds.json（先备份为.backup）
+#   python learn_hsv.py --annotate    打开标注窗口
+import json
+import os
+import shutil
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from color_table import compile_color_table, classify_hsv, parse_color_ranges
+
+# ===== 可配置参数（修改此处无需改动函数） =====
+IMAGE_DIR = "color_picture"                 # 图片目录（相对本文件）
+LABEL_FILE = "labels.json"                  # 标注文件（在图片目录中）
+THRESHOLD_FILE = "hsv_thresholds.json"      # 当前使用的阈值文件
+OUTPUT_FILE = "hsv_thresholds_learned.json" # 学习结果
+TABLE_FILE = "color_table.npz"              # 编译后的查找表
+COLORS = ("green", "yellow", "blue", "red") # 学习的颜色，顺序即查找表中重叠时的优先级
+EXCEPT_COLORS = ("white", "oranges")        # 与detect_color一致，对比当前阈值时排除的颜色
+
+LEARN_SCALE = 0.25      # 读入后缩放比例（原图约1279x2275，缩小后统计结果几乎不变，速度快十几倍）
+POSITIVE_SHRINK = 0.2   # 正例区域为标注框向内收缩的比例（去掉边缘和相邻面）
+IGNORE_GROW = 0.15      # 标注框向外扩张的比例，扩张区与收缩区之间不参与统计
+HUE_BINS_SMOOTH = 5     # 求色调众数时直方图的平滑宽度
+HUE_WINDOW = 15         # 只保留与色调众数相差不超过此值的像素（剔除贴纸缝隙、反光等）
+MIN_SATURATION = 60     # 饱和度低于此值的像素不参与拟合（白色反光、阴影中的灰色）
+TRIM_PERCENT = 2.0      # 两端各剔除的百分比
+HUE_MARGIN = 2          # 色调区间两端额外放宽
+SV_MARGIN = 10          # 饱和度、亮度下限额外放宽
+OPEN_UPPER = True       # 饱和度和亮度的上限取255（更亮更艳的同色总是该颜色）
+
+# 标注窗口
+ANNOTATE_WINDOW = "Label colors"
+ANNOTATE_DISPLAY_HEIGHT = 900
+ANNOTATE_KEYS = {ord("r"): "red", ord("y"): "yellow", ord("b"): "blue", ord("g"): "green", ord("i"): "ignore"}
+ANNOTATE_DRAW_COLORS = {"red": (0, 0, 255), "yellow": (0, 255, 255), "blue": (255, 0, 0),
+                        "green": (0, 255, 0), "ignore": (128, 128, 128)}
+
+
+def load_labels(label_path):
+    """加载标注文件，不存在时返回空字典"""
+    if os.path.exists(label_path):
+        with open(label_path, "r") as f:
+            return json.load(f)
+    return {}
+
+
+def save_labels(label_path, labels):
+    """保存标注文件（每张图片一行，便于查看差异）"""
+    lines = [f"    {json.dumps(name)}: {json.dumps(regions)}" for name, regions in sorted(labels.items())]
+    with open(label_path, "w") as f:
+        f.write("{\n" + ",\n".join(lines) + "\n}\n")
+
+
+def _scale_box(box, scale, grow=0.0):
+    """把原图坐标的标注框缩放并按比例扩张（grow为负时收缩），返回(x0, y0, x1, y1)"""
+    x, y, w, h = box
+    dx, dy = w * grow, h * grow
+    return (int(round((x - dx) * scale)), int(round((y - dy) * scale)),
+            int(round((x + w + dx) * scale)), int(round((y + h + dy) * scale)))
+
+
+def label_map(shape, regions, image_dir, scale=LEARN_SCALE, colors=COLORS):
+    """
+    根据标注生成逐像素的真值
+
+    Args:
+        shape: 缩放后图像的(高, 宽)
+        regions: 该图片的标注列表
+        image_dir: 图片目录（读取mask标注）
+        scale: 图像相对原图的缩放比例（box为原图坐标）
+        colors: 颜色顺序
+
+    Returns:
+        np.ndarray: int8，-1为不参与统计，0为背景，k为colors[k-1]
+    """
+    height, width = shape
+    truth = np.zeros(shape, dtype=np.int8)
+    positives = []
+    for region in regions:
+        if "color" not in region:
+            continue  # 取样带等其他标注（见eval_thresholds）
+        color = region["color"]
+        index = colors.index(color) + 1 if color in colors else -1
+        if "mask" in region:
+            mask = cv2.imread(os.path.join(image_dir, region["mask"]), cv2.IMREAD_GRAYSCALE)
+            if mask is None:
+                print(f"无法读取掩码: {region['mask']}")
+                continue
+            mask = cv2.resize(mask, (width, height), interpolation=cv2.INTER_NEAREST) > 0
+            # 掩码边缘同样不参与统计
+            kernel = np.ones((3, 3), np.uint8)
+            edge = cv2.dilate(mask.astype(np.uint8), kernel, iterations=2) > 0
+            core = cv2.erode(mask.astype(np.uint8), kernel, iterations=2) > 0
+            truth[edge] = -1
+            positives.append((core, index))
+        else:
+            x0, y0, x1, y1 = _scale_box(region["box"], scale, IGNORE_GROW)
+            truth[max(y0, 0):max(y1, 0), max(x0, 0):max(x1, 0)] = -1
+            x0, y0, x1, y1 = _scale_box(region["box"], scale, -POSITIVE_SHRINK)
+            core = (slice(max(y0, 0), max(y1, 0)), slice(max(x0, 0), max(x1, 0)))
+            positives.append((core, index))
+    # 先整体标记不参与区，再写入各区域内部，避免相邻区域的外扩覆盖另一区域的正例
+    for core, index in positives:
+        truth[core] = index
+    return truth
+
+
+def load_dataset(image_dir, labels, scale=LEARN_SCALE, colors=COLORS):
+    """
+    读入所有已标注图片
+
+    Returns:
+        list: [(图片名, HSV图像, 真值), ...]
+    """
+    dataset = []
+    for name in sorted(labels):
+        image = cv2.imread(os.path.join(image_dir, name))
+        if image is None:
+            print(f"无法读取图片: {name}")
+            continue
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+        dataset.append((name, hsv, label_map(hsv.shape[:2], labels[name], image_dir, scale, colors)))
+    return dataset
+
+
+def fit_color(pixels):
+    """
+    拟合一种颜色的HSV区间
+
+    以色调直方图（首尾相接）的众数为中心，只保留色调相差不超过HUE_WINDOW且饱和度足够的像素，
+    再取截尾分位数。区间跨过0/180时拆成两段（红色）。
+
+    Args:
+        pixels: (N, 3) uint8 HSV像素
+
+    Returns:
+        list: [{"lower": [h, s, v], "upper": [h, s, v]}, ...]，像素不足时为空列表
+    """
+    pixels = pixels[pixels[:, 1] >= MIN_SATURATION]
+    if len(pixels) < 100:
+        return []
+    hue = pixels[:, 0].astype(int)
+    histogram = np.bincount(hue, minlength=180).astype(float)
+    kernel = np.ones(HUE_BINS_SMOOTH)
+    half = HUE_BINS_SMOOTH // 2
+    wrapped = np.concatenate([histogram[-half:], histogram, histogram[:half]])
+    mode = int(np.argmax(np.convolve(wrapped, kernel, mode="valid")))
+
+    # 平移到以众数为中心，避免红色跨0/180时分位数出错
+    shifted = (hue - mode + 90) % 180 - 90
+    keep = np.abs(shifted) <= HUE_WINDOW
+    shifted, kept = shifted[keep], pixels[keep]
+    low, high = np.percentile(shifted, [TRIM_PERCENT, 100 - TRIM_PERCENT])
+    h_low = mode + int(np.floor(low)) - HUE_MARGIN
+    h_high = mode + int(np.ceil(high)) + HUE_MARGIN
+    s_low, s_high = np.percentile(kept[:, 1], [TRIM_PERCENT, 100 - TRIM_PERCENT])
+    v_low, v_high = np.percentile(kept[:, 2], [TRIM_PERCENT, 100 - TRIM_PERCENT])
+    s_low = max(int(s_low) - SV_MARGIN, 0)
+    v_low = max(int(v_low) - SV_MARGIN, 0)
+    s_high = 255 if OPEN_UPPER else min(int(np.ceil(s_high)) + SV_MARGIN, 255)
+    v_high = 255 if OPEN_UPPER else min(int(np.ceil(v_high)) + SV_MARGIN, 255)
+
+    if h_low < 0:
+        hue_ranges = [(h_low + 180, 179), (0, h_high)]
+    elif h_high > 179:
+        hue_ranges = [(h_low, 179), (0, h_high - 180)]
+    else:
+        hue_ranges = [(h_low, h_high)]
+    return [{"lower": [int(lo), s_low, v_low], "upper": [int(hi), s_high, v_high]} for lo, hi in hue_ranges]
+
+
+def learn_thresholds(dataset, colors=COLORS):
+    """
+    从数据集学习各颜色阈值
+
+    Returns:
+        dict: 阈值文件格式 {颜色: [{"lower": ..., "upper": ...}, ...]}
+    """
+    thresholds = {}
+    for index, color in enumerate(colors, start=1):
+        pixels = [hsv[truth == index] for _, hsv, truth in dataset]
+        pixels = np.concatenate(pixels) if pixels else np.empty((0, 3), np.uint8)
+        ranges = fit_color(pixels)
+        if ranges:
+            thresholds[color] = ranges
+        else:
+            print(f"{color} 的标注像素不足，跳过")
+    return thresholds
+
+
+def confusion_matrix(dataset, table, names, colors=COLORS):
+    """
+    统计逐像素混淆矩阵
+
+    Args:
+        dataset: load_dataset的结果
+        table, names: compile_color_table的结果
+        colors: 真值颜色顺序
+
+    Returns:
+        np.ndarray: (len(colors)+1, len(names)+1)，行为真值（0为背景），列为预测（0为无颜色）
+    """
+    matrix = np.zeros((len(colors) + 1, len(names) + 1), dtype=np.int64)
+    for _, hsv, truth in dataset:
+        predicted = classify_hsv(hsv, table)
+        valid = truth >= 0
+        index = truth[valid].astype(np.int64) * (len(names) + 1) + predicted[valid]
+        matrix += np.bincount(index, minlength=matrix.size).reshape(matrix.shape)
+    return matrix
+
+
+def precision_recall(matrix, names, colors=COLORS):
+    """
+    Returns:
+        dict: {颜色: (精确率, 召回率, 真值像素数)}，阈值中没有该颜色时精确率和召回率为0
+    """
+    result = {}
+    for row, color in enumerate(colors, start=1):
+        total = int(matrix[row].sum())
+        if color not in names:
+            result[color] = (0.0, 0.0, total)
+            continue
+        column = names.index(color) + 1
+        hit = matrix[row, column]
+        predicted = matrix[:, column].sum()
+        result[color] = (hit / predicted if predicted else 0.0, hit / total if total else 0.0, total)
+    return result
+
+
+def evaluate(dataset, thresholds, colors=COLORS):
+    """用阈值文件格式的阈值评估，返回precision_recall的结果"""
+    table, names = compile_color_table(parse_color_ranges(thresholds, EXCEPT_COLORS))
+    return precision_recall(confusion_matrix(dataset, table, names, colors), names, colors)
+
+
+def leave_one_out(dataset, colors=COLORS):
+    """
+    留一图片交叉验证：每次用其余图片学习，在留出的图片上统计，最后汇总
+
+    Returns:
+        dict: precision_recall格式的结果
+    """
+    matrix = np.zeros((len(colors) + 1, len(colors) + 1), dtype=np.int64)
+    for i in range(len(dataset)):
+        thresholds = learn_thresholds(dataset[:i] + dataset[i + 1:], colors)
+        # 按colors的顺序编译，缺失的颜色补空区间，保证各次的列一致
+        ranges = parse_color_ranges({color: thresholds.get(color, []) for color in colors})
+        table, names = compile_color_table(ranges)
+        matrix += confusion_matrix(dataset[i:i + 1], table, names, colors)
+    return precision_recall(matrix, list(colors), colors)
+
+
+def save_table(path, thresholds):
+    """编译查找表并保存为npz（table、names）"""
+    table, names = compile_color_table(parse_color_ranges(thresholds, EXCEPT_COLORS))
+    np.savez_compressed(path, table=table, names=np.array(names))
+    return path
+
+
+def print_report(results, colors=COLORS):
+    """
+    打印对比表
+
+    Args:
+        results: [(名称, precision_recall结果), ...]
+    """
+    header = f"{'颜色':<8}{'像素':>8}" + "".join(f"{name + ' P':>12}{name + ' R':>12}" for name, _ in results)
+    print(header)
+    for color in colors:
+        total = results[0][1][color][2]
+        line = f"{color:<8}{total:>8}"
+        for _, result in results:
+            precision, recall, _ = result[color]
+            line += f"{precision:>12.3f}{recall:>12.3f}"
+        print(line)
+
+
+def annotate(image_dir, label_path):
+    """
+    标注窗口：拖动鼠标画框，按颜色键确认
+
+    按键: r/y/b/g 标为红/黄/蓝/绿，i 标为不参与统计，u 撤销本图最后一个框，
+          n 下一张，p 上一张，q 保存并退出（切换图片时自动保存）
+    """
+    labels = load_labels(label_path)
+    names = sorted(f for f in os.listdir(image_dir) if f.lower().endswith((".jpg", ".png")))
+    if not names:
+        print(f"没有图片: {image_dir}")
+        return
+    state = {"start": None, "box": None, "scale": 1.0}
+
+    def on_mouse(event, x, y, flags, param):
+        x, y = int(x / state["scale"]), int(y / state["scale"])
+        if event == cv2.EVENT_LBUTTONDOWN:
+            state["start"], state["box"] = (x, y), None
+        elif event == cv2.EVENT_MOUSEMOVE and state["start"] is not None:
+            x0, y0 = state["start"]
+            state["box"] = [min(x0, x), min(y0, y), abs(x - x0), abs(y - y0)]
+        elif event == cv2.EVENT_LBUTTONUP:
+            state["start"] = None
+
+    cv2.namedWindow(ANNOTATE_WINDOW, cv2.WINDOW_NORMAL)
+    cv2.setMouseCallback(ANNOTATE_WINDOW, on_mouse)
+    index = 0
+    image = None
+    while True:
+        name = names[index]
+        if image is None:
+            image = cv2.imread(os.path.join(image_dir, name))
+            state["scale"] = min(ANNOTATE_DISPLAY_HEIGHT / image.shape[0], 1.0)
+            state["box"] = None
+            print(f"[{index + 1}/{len(names)}] {name}")
+        regions = labels.setdefault(name, [])
+        display = image.copy()
+        for region in regions:
+            if "box" in region:
+                x, y, w, h = region["box"]
+                cv2.rectangle(display, (x, y), (x + w, y + h), ANNOTATE_DRAW_COLORS.get(region["color"], (255, 255, 255)), 4)
+        if state["box"] is not None:
+            x, y, w, h = state["box"]
+            cv2.rectangle(display, (x, y), (x + w, y + h), (255, 255, 255), 2)
+        cv2.imshow(ANNOTATE_WINDOW, cv2.resize(display, None, fx=state["scale"], fy=state["scale"]))
+        key = cv2.waitKey(20) & 0xFF
+
+        if key in ANNOTATE_KEYS and state["box"] is not None and state["box"][2] > 2 and state["box"][3] > 2:
+            regions.append({"color": ANNOTATE_KEYS[key], "box": state["box"]})
+            print(f"  {ANNOTATE_KEYS[key]}: {state['box']}")
+            state["box"] = None
+        elif key == ord("u") and regions:
+            print(f"  撤销: {regions.pop()}")
+        elif key in (ord("n"), ord("p")):
+            save_labels(label_path, labels)
+            index = (index + (1 if key == ord("n") else -1)) % len(names)
+            image = None
+        elif key == ord("q"):
+            save_labels(label_path, labels)
+            print(f"标注已保存到 {label_path}")
+            break
+    cv2.destroyAllWindows()
+
+
+def main():
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    image_dir = os.path.join(current_dir, IMAGE_DIR)
+    label_path = os.path.join(image_dir, LABEL_FILE)
+    threshold_path = os.path.join(current_dir, THRESHOLD_FILE)
+
+    if "--annotate" in sys.argv:
+        annotate(image_dir, label_path)
+        return
+
+    labels = load_labels(label_path)
+    if not labels:
+        print(f"没有标注: {label_path}，先运行 python learn_hsv.py --annotate")
+        return
+    start = time.perf_counter()
+    dataset = load_dataset(image_dir, labels)
+    load_time = time.perf_counter() - start
+    start = time.perf_counter()
+    thresholds = learn_thresholds(dataset)
+    learn_time = time.perf_counter() - start
+    print(f"读入{len(dataset)}张图片 {load_time:.2f}s，学习 {learn_time * 1000:.0f}ms")
+    for color, ranges in thresholds.items():
+        for r in ranges:
+            print(f"  {color:<8} lower={r['lower']} upper={r['upper']}")
+
+    with open(threshold_path, "r") as f:
+        current = json.load(f)
+    results = [("当前", evaluate(dataset, current)), ("学习", evaluate(dataset, thresholds))]
+    if "--loo" in sys.argv:
+        results.append(("留一", leave_one_out(dataset)))
+    print_report(results)
+
+    if "--write" in sys.argv:
+        backup_path = threshold_path + ".backup"
+        shutil.copyfile(threshold_path, backup_path)
+        print(f"已创建备份文件: {backup_path}")
+        output_path = threshold_path
+    else:
+        output_path = os.path.join(current_dir, OUTPUT_FILE)
+    with open(output_path, "w") as f:
+        json.dump(thresholds, f, indent=4)
+    print(f"阈值已保存到 {output_path}")
+    print(f"查找表已保存到 {save_table(os.path.join(current_dir, TABLE_FILE), thresholds)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,105 +1,142 @@
 #! /usr/bin/env python3
 # main_controller6.py
 # 顺序执行版本的控制器 - 使用矩形路径绕行
+# 各状态、搜索方式和绕行动作由任务文件(mission_plan.json)描述，启动前编译成步骤表
+# 实车默认入口；mission_runtime.py是复用本模块子系统的事件驱动版本，两者的阶段划分须保持一致
 
 import RPi.GPIO as GPIO
+import math
 import time
 import threading
+from functools import partial
 import cv2
 
 # 导入电机控制模块
 from motor_controller import init_gpio, start_speed_monitor, start_pwm_update_daemon, \
-    set_motor_speed, rotate_in_place, drive_straight, drive_with_color, \
-    stop_motor, cleanup as cleanup_motor
+    add_encoder_listener, remove_encoder_listener, set_motor_speed, rotate_in_place, \
+    stop_motor, get_odometry_pose, release_motor, safety_reflex, safety_raw_sample, \
+    print_owner_stats, get_motor_owner, cleanup as cleanup_motor
 
 # 导入颜色检测模块
 from detect_color import init_camera, start_color_detection, \
-    get_latest_color_data, cleanup as cleanup_camera
+    get_latest_color_data, get_color_snapshot, add_color_listener, \
+    remove_color_listener, add_frame_listener, remove_frame_listener, set_detection_focus, \
+    clear_detection_focus, cleanup as cleanup_camera
 
 # 导入超声波模块
 from detect_distance import init_i2c, measure_distance, \
-    start_distance_measurement, get_latest_distance, \
-    cleanup as cleanup_distance
+    start_distance_measurement, get_latest_distance, get_latest_distance_timestamp, \
+    get_best_distance, add_distance_listener, remove_distance_listener, add_raw_distance_listener, \
+    MIN_DISTANCE_CM, mono_estimator, set_mono_target_color, CUBE_SIZE_CM, cleanup as cleanup_distance
+
+# 导入状态估计模块
+from state_estimator import start_state_estimation, stop_state_estimation, \
+    set_target_color, get_cube_estimate
+
+# 导入时间对齐模块
+from time_alignment import start_time_alignment, stop_time_alignment, \
+    get_aligned_color_and_distance, print_skew_stats
+
+# 导入方位图模块
+from bearing_map import SweepRecorder, rotate_to_heading
+
+# 导入任务文件模块
+from mission_plan import load_mission, run_manoeuvre, lateness_stats
+
+# 导入颜色投票模块
+from color_voting import ColorVoter
+
+# 导入接近控制模块
+from approach_controller import ApproachController, target_bearing
+
+# 导入圆弧绕行模块
+from bypass_path import plan_bypass, follow_path
+
+# 导入运行记录模块
+from run_recorder import start_recording, stop_recording, mark_run
+
+# 导入延迟追踪模块
+from latency_trace import start_latency_trace, stop_latency_trace, trace_decision, trace_stage, \
+    print_latency_report, export_chrome_trace
+
+# 导入看门狗模块
+from thread_watchdog import watchdog, start_watchdog, stop_watchdog, print_watchdog_stats
+from config_watcher import start_config_watcher, stop_config_watcher
+
+# 导入启动编排模块
+from startup import StartupOrchestrator, ExposureMonitor
 
 # ===== 可配置参数（修改此处无需改动函数） =====
 # 1. 状态控制参数
-COLOR_CONFIRM_COUNT = 3  # 需要连续识别相同颜色的次数
+COLOR_CONFIDENCE_THRESHOLD = 0.7  # 多帧投票判定颜色所需的后验置信度
+CONFIRM_FALLBACK_TIME = 3.0  # 确认颜色超过此时间(秒)仍未达到置信度时（如宽度相近的两个魔方），判定为置信度最高的颜色
 DISTANCE_THRESHOLD = 55.0  # 接近魔方的距离阈值(cm)
-SEARCH_SPEED = 0.4  # 搜索魔方时的旋转速度
-FORWARD_SPEED = 1.0  # 直行速度
-TURN_SPEED = 0.8  # 转弯速度
-turn_time = 1.2
-
-# 2. 绕行参数
-# TURN_LEFT_TIME = 0.3  # 原地转弯时间(秒)，大约90度
-# TURN_RIGHT_TIME = 0.4
-# left参数
-LEFT_TIME_1 = 0.45
-LEFT_TIME_2 = 0.35
-LEFT_TIME_3 = 0#0.3
-LEFT_TIME_4 = 0#0.4
-
-# right参数
-RIGHT_TIME_1 = 0.25 
-RIGHT_TIME_2 = 0.35
-RIGHT_TIME_3 = 0#0.4
-RIGHT_TIME_4 = 0#0.4
-
-SIDE_A_TIME = 0.85  # 矩形短边行驶时间(秒)
-SIDE_B_TIME = 3  # 矩形长边行驶时间(秒)
-FINAL_SPRINT_SPEED = 0.5  # 最终冲刺速度
-
-# 3. 颜色分类
-LEFT_TURN_COLORS = ["red", "yellow"]  # 左转颜色
-RIGHT_TURN_COLORS = ["blue", "green"]  # 右转颜色
+BYPASS_MODE = 'rectangular'  # 绕行方式：'rectangular'任务文件中的矩形动作，'arc'圆弧路径跟踪（不停车；bypass_path仿真中比矩形慢，5.97s对5.66s）
+APPROACH_MAX_SPEED = 1.5  # 接近魔方时远处的最高速度，靠近时按距离和碰撞时间减速
+USE_STATE_ESTIMATE = True  # 超声波无效时是否使用融合估计的距离
+USE_TIME_ALIGNMENT = True  # 接近魔方时是否使用帧采集时刻插值得到的距离
+APPROACH_INTERVAL = 0.02  # 接近魔方时的控制周期(秒)，融合估计可按控制频率更新
+USE_BEARING_MAP = True  # 搜索时建立方位图，明确后直接转向最佳方位（否则按时间回正）
+SEARCH_SAMPLE_INTERVAL = 0.02  # 搜索时航向采样周期(秒)
+FOCUS_ON_TARGET = True  # 接近魔方时只检测已确认的颜色（丢失目标若干帧后检测线程自动恢复检测所有颜色）
+FOCUS_WINDOW = True  # 接近魔方时只处理上一帧目标附近的列（见detect_color.FOCUS_WINDOW_MARGIN）
+
+# 2. 任务文件（状态顺序、搜索扫描、绕行和冲刺的速度与时间都在其中配置）
+MISSION_FILE = "mission_plan.json"
 
 global dismiss_end
 
-# 4. 显示参数
+# 3. 显示参数
 DISPLAY_CAMERA = False # 是否显示摄像头画面
 
+# 4. 运行记录（记录全部传感器输入，可用run_recorder.py离线回放）
+RECORD_RUN = True  # 是否记录本次运行，记录文件保存在runs/目录
+USE_WATCHDOG = True  # 是否监视各传感器和电机线程的心跳（截止时间和动作见thread_watchdog.py）
+TRACE_LATENCY = True  # 是否追踪每帧从读取摄像头到PWM生效的延迟，结束时打印分位数并导出时间线到runs/目录
+HOT_RELOAD = True  # 运行中修改hsv_thresholds.json或vision_params.json后自动生效（见config_watcher.py）
+READY_TIMEOUT = 10.0  # 启动时等待各子系统就绪的最长时间(秒)，超时照常开始并提示未就绪的子系统
+
 # 状态管理类
 class StateManager:
     def __init__(self):
         # 基本状态
         self.current_state = 1  # 当前状态(1,2,3)
         self.detected_color = None  # 当前检测到的颜色
-        self.color_confirm_counter = {}  # 颜色确认计数器
+        self.color_voter = ColorVoter(threshold=COLOR_CONFIDENCE_THRESHOLD,
+                                      fallback_after=CONFIRM_FALLBACK_TIME)  # 颜色投票器
         self.last_bypass_direction = None  # 上一次绕行方向('left'或'right')
         
-        # 阶段完成标志
-        self.state1_done = False
-        self.state2_done = False
-        self.state3_done = False
-
-    def determine_bypass_direction(self):
-        """确定绕行方向"""
-        if self.current_state == 1:
-            # 状态1: 根据颜色决定
-            if self.detected_color in LEFT_TURN_COLORS:
-                direction = 'left'
-            else:
-                direction = 'right'
-        elif self.current_state == 2:
-            # 状态2: 与上一次相反
+        # 已完成的状态
+        self.completed_states = []
+
+    def determine_bypass_direction(self, rule='color'):
+        """
+        确定绕行方向
+        
+        Args:
+            rule: 'color'按颜色决定，'opposite'与上一次相反（任务文件中各状态的bypass字段）
+        """
+        if rule == 'opposite':
+            # 与上一次相反
             if self.last_bypass_direction == 'left':
                 direction = 'right'
             else:
                 direction = 'left'
-        else:  # 状态3
-            # 状态3: 根据颜色决定
-            if self.detected_color in LEFT_TURN_COLORS:
-                direction = 'left'
-            else:
-                direction = 'right'
+        else:
+            # 根据颜色决定
+            direction = mission.bypass_direction_for_color(self.detected_color)
                 
         self.last_bypass_direction = direction
         return direction
 
 # 全局变量
 running = True
+mission = None  # 编译后的任务(MissionSchedule)，由load_mission_plan加载
 state_manager = StateManager()
 display_thread = None
+# 安全反射：每个测距样本到达时检查，前进中距离过近立即停车（停车期间只拦截前进指令，
+# 只有足够远的新测距能解除）
+safety_listener = partial(safety_reflex, threshold_cm=MIN_DISTANCE_CM)
 global camera
 # 显示摄像头画面的线程函数
 def display_camera_thread():
@@ -199,291 +236,271 @@ def start_display_camera():
         return display_thread
     return None
 
-# # 顺序执行的矩形路径绕行函数
-# def execute_bypass_rectangular_old(direction):
-#     """
-#     使用矩形路径顺序执行绕行动作，不使用循环
-    
-#     Args:
-#         direction: 绕行方向，'left'或'right'
-#     """
-#     print(f"开始{direction}侧矩形路径绕行")
-    
-#     # 第1步：原地转向90度
-#     print("执行第1步：原地转向90度")
-#     if direction == 'left':
-#         # 左转90度
-#         rotate_in_place('counterclockwise', TURN_SPEED)
-#         time.sleep(TURN_LEFT_TIME)
-#     else:
-#         # 右转90度
-#         rotate_in_place('clockwise', TURN_SPEED)
-#         time.sleep(TURN_RIGHT_TIME)
-    
-#     # 第2步：直行短边A
-#     print("执行第2步：直行短边A")
-#     drive_straight(FORWARD_SPEED)
-#     time.sleep(SIDE_A_TIME)
-    
-#     # 第3步：原地转向90度（转回朝向与魔方平行的方向）
-#     print("执行第3步：原地转向90度")
-#     if direction == 'left':
-#         # 右转90度
-#         rotate_in_place('clockwise', TURN_SPEED)
-#         time.sleep(TURN_RIGHT_TIME)
-#     else:
-#         # 左转90度
-#         rotate_in_place('counterclockwise', TURN_SPEED)
-#         time.sleep(TURN_LEFT_TIME)
-    
-#     # 第4步：直行长边B
-#     print("执行第4步：直行长边B")
-#     drive_straight(FORWARD_SPEED)
-#     time.sleep(SIDE_B_TIME)
-    
-#     # 第5步：原地转向90度（准备回到原来的路线）
-#     print("执行第5步：原地转向90度")
-#     if direction == 'left':
-#         # 右转90度
-#         rotate_in_place('clockwise', TURN_SPEED)
-#         time.sleep(TURN_RIGHT_TIME)
-#     else:
-#         # 左转90度
-#         rotate_in_place('counterclockwise', TURN_SPEED)
-#         time.sleep(TURN_LEFT_TIME)
-    
-#     # 第6步：直行短边A
-#     print("执行第6步：直行短边A")
-#     drive_straight(FORWARD_SPEED)
-#     time.sleep(SIDE_A_TIME)
-    
-#     # 第7步：原地转向90度（回到原来的前进方向）
-#     print("执行第7步：原地转向90度")
-#     if direction == 'left':
-#         # 左转90度
-#         rotate_in_place('counterclockwise', TURN_SPEED+0.2)
-#         time.sleep(TURN_LEFT_TIME)
-#     else:
-#         # 右转90度
-#         rotate_in_place('clockwise', TURN_SPEED)
-#         time.sleep(TURN_RIGHT_TIME)
-    
-#     set_motor_speed(0.5,0.5)
-#     time.sleep(1)
-
-#     # 绕行完成，停车
-#     #set_motor_speed(0, 0)
-#     print("矩形路径绕行完成")
-
-# 顺序执行的矩形路径绕行函数（改进版，每个转弯时间独立可调）
+# 加载任务文件
+def load_mission_plan(json_path=MISSION_FILE):
+    """
+    读取并编译任务文件，出错时抛出ValueError（在初始化硬件之前调用）
+    
+    Returns:
+        MissionSchedule: 编译后的任务
+    """
+    global mission
+    mission = load_mission(json_path)
+    print(f"任务文件已编译: {mission.source}，共{len(mission.left)}步")
+    return mission
+
+# 执行任务文件中的一个动作
+def run_mission_manoeuvre(name):
+    """
+    执行任务文件中的动作（绕行、冲刺等）
+    
+    Args:
+        name: 动作名，如'bypass_left'
+    """
+    try:
+        run_manoeuvre(mission, name, set_motor_speed)
+    finally:
+        # 动作结束后释放电机，保持最后一步的速度直到下一个来源接手
+        release_motor('manoeuvre')
+    stats = lateness_stats(mission, name)
+    print(f"{name}完成，每步启动延迟 平均{stats['mean_us']:.0f}us，最大{stats['max_us']:.0f}us")
+
+# 顺序执行的矩形路径绕行函数
 def execute_bypass_rectangular(direction):
     """
-    使用矩形路径顺序执行绕行动作，每个转弯时间独立可调
+    按任务文件中的bypass_left/bypass_right执行矩形路径绕行
     
     Args:
         direction: 绕行方向，'left'或'right'
     """
     print(f"开始{direction}侧矩形路径绕行")
+    run_mission_manoeuvre(f"bypass_{direction}")
+    print("矩形路径绕行完成")
+
+# 规划圆弧绕行路径
+def plan_arc_bypass(direction):
+    """
+    围绕魔方的估计位置生成圆弧绕行路径
     
-    if direction == 'left':
-        # 左侧绕行路径
-        
-        # 第1步：原地左转90度
-        print("执行第1步：原地左转90度")
-        rotate_in_place('counterclockwise', TURN_SPEED)
-        time.sleep(LEFT_TIME_1)  # 左转第1次时间
-        
-        # 第2步：直行短边A
-        print("执行第2步：直行短边A")
-        drive_straight(FORWARD_SPEED)
-        time.sleep(SIDE_A_TIME)
-        
-        # 第3步：原地右转90度（转回朝向与魔方平行的方向）
-        print("执行第3步：原地右转90度")
-        rotate_in_place('clockwise', TURN_SPEED)
-        time.sleep(LEFT_TIME_2)  # 右转第1次时间
-        
-        # 第4步：直行长边B
-        print("执行第4步：直行长边B")
-        drive_straight(FORWARD_SPEED)
-        time.sleep(SIDE_B_TIME)
-        
-        # # 第5步：原地右转90度（准备回到原来的路线）
-        # print("执行第5步：原地右转90度")
-        # rotate_in_place('clockwise', TURN_SPEED)
-        # time.sleep(LEFT_TIME_3)  # 右转第2次时间
-        
-        # # 第6步：直行短边A
-        # print("执行第6步：直行短边A")
-        # drive_straight(FORWARD_SPEED)
-        # time.sleep(SIDE_A_TIME)
-        
-        # # 第7步：原地左转90度（回到原来的前进方向）
-        # print("执行第7步：原地左转90度")
-        # rotate_in_place('counterclockwise', TURN_SPEED)
-        # time.sleep(LEFT_TIME_4)  # 左转第2次时间
-        
-    elif direction == 'right':
-        # 右侧绕行路径
-        
-        # 第1步：原地右转90度
-        print("执行第1步：原地右转90度")
-        rotate_in_place('clockwise', TURN_SPEED)
-        time.sleep(RIGHT_TIME_1)  # 右转第1次时间
-        
-        # 第2步：直行短边A
-        print("执行第2步：直行短边A")
-        drive_straight(FORWARD_SPEED)
-        time.sleep(SIDE_A_TIME)
-        
-        # 第3步：原地左转90度（转回朝向与魔方平行的方向）
-        print("执行第3步：原地左转90度")
-        rotate_in_place('counterclockwise', TURN_SPEED)
-        time.sleep(RIGHT_TIME_2)  # 左转第1次时间
-        
-        # 第4步：直行长边B
-        print("执行第4步：直行长边B")
-        drive_straight(FORWARD_SPEED)
-        time.sleep(SIDE_B_TIME)
-        
-        # # 第5步：原地左转90度（准备回到原来的路线）
-        # print("执行第5步：原地左转90度")
-        # rotate_in_place('counterclockwise', TURN_SPEED)
-        # time.sleep(RIGHT_TIME_3)  # 左转第2次时间
-        
-        # # 第6步：直行短边A
-        # print("执行第6步：直行短边A")
-        # drive_straight(FORWARD_SPEED)
-        # time.sleep(SIDE_A_TIME)
-        
-        # # 第7步：原地右转90度（回到原来的前进方向）
-        # print("执行第7步：原地右转90度")
-        # rotate_in_place('clockwise', TURN_SPEED)
-        # time.sleep(RIGHT_TIME_4)  # 右转第2次时间
+    魔方位置优先使用融合估计，估计不可用时假设在正前方停车距离处
     
-    # 最后稳定一下
-    set_motor_speed(0.5, 0.5)
-    time.sleep(1)
-
-    # 绕行完成，停车
-    # #set_motor_speed(0, 0)
-    print("矩形路径绕行完成")
+    Args:
+        direction: 绕行方向，'left'或'right'
+    
+    Returns:
+        PurePursuit: 路径跟踪器，路径放不下时返回None
+    """
+    estimate = get_cube_estimate() if USE_STATE_ESTIMATE else None
+    if estimate is not None:
+        # 估计的y轴向右，路径的y轴向左
+        cube_x, cube_y = estimate["x"], -estimate["y"]
+    else:
+        cube_x, cube_y = DISTANCE_THRESHOLD + CUBE_SIZE_CM / 2.0, 0.0
+    return plan_bypass(direction, cube_x, cube_y, get_odometry_pose())
+
+# 顺序执行的绕行函数
+def execute_bypass(direction):
+    """
+    按BYPASS_MODE绕行魔方，圆弧路径放不下或跟踪超时时退回矩形绕行
+    
+    Args:
+        direction: 绕行方向，'left'或'right'
+    """
+    if BYPASS_MODE == 'arc':
+        tracker = plan_arc_bypass(direction)
+        if tracker is not None:
+            print(f"开始{direction}侧圆弧路径绕行")
+            try:
+                completed = follow_path(tracker, get_odometry_pose, set_motor_speed)
+            finally:
+                release_motor('manoeuvre')
+            if completed:
+                print("圆弧路径绕行完成")
+                return
+            print("圆弧路径跟踪超时，改为矩形绕行")
+        else:
+            print("魔方太近，圆弧路径放不下，改为矩形绕行")
+    execute_bypass_rectangular(direction)
 
 # 颜色检测函数
-def detect_and_confirm_color():
+def detect_and_confirm_color(color_data=None, timestamp=None):
     """
     检测并确认颜色
     
+    每帧按色段宽度、居中程度加权投票，窗口内某颜色的后验置信度达到阈值即确认，
+    单帧丢失或误检不会让确认从头开始。同一帧重复读取时不重复计票。
+    
+    Args:
+        color_data: 颜色检测结果，默认读取最新结果
+        timestamp: 帧采集时间，默认读取最新结果的采集时间
+    
     Returns:
         str: 确认的颜色，如果未确认则返回None
     """
     # 获取最新的颜色检测结果
-    color_data = get_latest_color_data()
-    
-    if not color_data:
-        # 重置颜色计数器
-        state_manager.color_confirm_counter = {}
-        return None
-    
-    # 找到最宽的颜色块作为目标魔方
-    widest_color = None
-    max_width = 0
-    
-    for color, segments in color_data.items():
-        if segments:  # 确保有检测到该颜色
-            for segment in segments:  
-                width = abs(segment[1] - segment[0])  # 计算宽度
-                if width > max_width:
-                    max_width = width
-                    widest_color = color
-    
-    if widest_color:
-        # 颜色确认逻辑
-        if widest_color not in state_manager.color_confirm_counter:
-            state_manager.color_confirm_counter[widest_color] = 1
-        else:
-            state_manager.color_confirm_counter[widest_color] += 1
-        
-        # 重置其他颜色的计数
-        for color in list(state_manager.color_confirm_counter.keys()):
-            if color != widest_color:
-                state_manager.color_confirm_counter[color] = 0
-        
-        # 检查是否达到确认阈值
-        if state_manager.color_confirm_counter.get(widest_color, 0) >= COLOR_CONFIRM_COUNT:
-            return widest_color
+    if color_data is None:
+        snapshot = get_color_snapshot()
+        color_data, timestamp = snapshot.color_data, snapshot.timestamp
+    if timestamp is None:
+        timestamp = time.monotonic()
     
-    return None
+    state_manager.color_voter.add_frame(color_data or {}, timestamp)
+    return state_manager.color_voter.decide()
 
 # 顺序执行的搜索魔方函数
 def search_for_cube_sequential():
     """
-    顺序执行搜索魔方，先左转一段时间，再右转一段时间
+    按任务文件中的搜索扫描依次原地旋转，边转边建立方位图
+    
+    每帧记录拍摄时的航向和各颜色色段，方位图明确后立即停止扫描，
+    并闭环转向得分最高的目标方位，不再按时间回正。
+    
+    Returns:
+        str: 目标魔方颜色，未找到返回None
     """
-    print("开始搜索魔方，第1阶段：左转")
+    if not USE_BEARING_MAP:
+        return search_for_cube_timed()
     
-    # 第1阶段：左转
-    rotate_in_place('counterclockwise', SEARCH_SPEED)
-    search_start_time = time.time()
-    turn_back_time = 0
+    recorder = SweepRecorder()
+    add_color_listener(recorder.on_color_frame)
+    search_rotation = partial(rotate_in_place, source='search')
+    try:
+        speed = None
+        for index, (sign, speed, sweep_time) in enumerate(mission.search):
+            direction = 'counterclockwise' if sign > 0 else 'clockwise'
+            print(f"搜索魔方，第{index + 1}阶段：{direction}")
+            search_rotation(direction, speed)
+            search_start_time = time.time()
+            while time.time() - search_start_time < sweep_time:
+                recorder.update()
+                if recorder.map.is_unambiguous():
+                    break
+                time.sleep(SEARCH_SAMPLE_INTERVAL)
+            if recorder.map.is_unambiguous():
+                break
+    finally:
+        remove_color_listener(recorder.on_color_frame)
     
-    # 在左转过程中检测颜色
-    while time.time() - search_start_time < turn_time:  # 最多左转3秒
-        confirmed_color = detect_and_confirm_color()
-        if confirmed_color:
-            # set_motor_speed(0, 0)
-            print(f"在左转过程中找到魔方颜色: {confirmed_color}")
-            turn_back_time = time.time() - search_start_time
-            # return confirmed_color
-            break
-        time.sleep(0.1)
+    target = recorder.map.best_target()
+    if target is None:
+        release_motor('search', hold=False)
+        print(f"搜索结束，未找到魔方（共处理{recorder.map.frames}帧）")
+        return None
     
-    # 回正
-    if confirmed_color and turn_back_time > 0:
-        print("开始回正")
-        rotate_in_place('clockwise', SEARCH_SPEED)
-        time.sleep(turn_back_time)
-        # set_motor_speed(0, 0)
-        return confirmed_color
-    
-    # 如果左转没找到，切换到右转
-    print("切换到第2阶段：右转")
-    rotate_in_place('clockwise', SEARCH_SPEED)
-    search_start_time = time.time()
-    
-    # 在右转过程中检测颜色
-    while time.time() - search_start_time < 2*turn_time:  # 最多右转6秒(覆盖整个360度)
-        confirmed_color = detect_and_confirm_color()
+    print(f"方位图确定目标: {target['color']}，方位{math.degrees(target['bearing']):.1f}度，"
+          f"{target['hits']}帧，共处理{recorder.map.frames}帧")
+    try:
+        if not rotate_to_heading(recorder.tracker, target["bearing"], speed, search_rotation):
+            print("转向目标方位超时")
+    finally:
+        release_motor('search', hold=False)
+    return target["color"]
+
+# 按时间回正的搜索魔方函数
+def search_for_cube_timed():
+    """
+    按任务文件中的搜索扫描依次原地旋转搜索魔方，找到后转回搜索开始时的朝向
+    
+    Returns:
+        str: 确认的颜色，未找到返回None
+    """
+    # 累计的转动量（速度×时间，逆时针为正），用于找到后回正
+    net_rotation = 0.0
+    confirmed_color = None
+    
+    for index, (sign, speed, sweep_time) in enumerate(mission.search):
+        direction = 'counterclockwise' if sign > 0 else 'clockwise'
+        print(f"搜索魔方，第{index + 1}阶段：{direction}")
+        rotate_in_place(direction, speed, source='search')
+        search_start_time = time.time()
+        
+        # 在旋转过程中检测颜色
+        while time.time() - search_start_time < sweep_time:
+            confirmed_color = detect_and_confirm_color()
+            if confirmed_color:
+                print(f"在第{index + 1}阶段找到魔方颜色: {confirmed_color}")
+                break
+            time.sleep(0.1)
+        net_rotation += sign * speed * (time.time() - search_start_time)
+        
         if confirmed_color:
-            # set_motor_speed(0, 0)
-            print(f"在右转过程中找到魔方颜色: {confirmed_color}")
-            turn_back_time = 2 * turn_time + search_start_time - time.time()
-            # return confirmed_color
             break
-        time.sleep(0.1)
-
-    # 回正
-    if confirmed_color and turn_back_time != 0:
+    
+    if not confirmed_color:
+        release_motor('search', hold=False)
+        print("搜索结束，未找到魔方")
+        return None
+    
+    # 回正：以最后一次扫描的速度反向转回
+    if net_rotation != 0:
         print("开始回正")
-        if turn_back_time > 0:
-            rotate_in_place('clockwise', SEARCH_SPEED)
-            time.sleep(turn_back_time)
-        else:
-            rotate_in_place('counterclockwise', SEARCH_SPEED)
-            time.sleep(-turn_back_time)
-        # set_motor_speed(0, 0)
-        return confirmed_color
-    
-    # 如果还是没找到，停止搜索
-    # set_motor_speed(0, 0)
-    print("搜索结束，未找到魔方")
-    return None
+        direction = 'clockwise' if net_rotation > 0 else 'counterclockwise'
+        rotate_in_place(direction, speed, source='search')
+        time.sleep(abs(net_rotation) / speed)
+    release_motor('search', hold=False)
+    return confirmed_color
+
+# 获取接近魔方时使用的颜色结果和距离
+def get_approach_distance():
+    """
+    获取最新的颜色检测结果，以及该帧采集时刻的距离（转向和停车基于同一时刻）
+    
+    距离来源优先级：帧时刻插值的超声波 > 最新超声波/单目测距 > 融合估计
+    
+    Returns:
+        tuple: (color_data, 帧采集时间, 距离cm, 距离采集时间, 来源)，
+               距离都无效时距离为-1、来源为None
+    """
+    distance, source = -1, None
+    if USE_TIME_ALIGNMENT:
+        color_data, frame_time, distance = get_aligned_color_and_distance()
+        source = 'aligned'
+        distance_time = frame_time
+    else:
+        snapshot = get_color_snapshot()
+        color_data, frame_time = snapshot.color_data, snapshot.timestamp
+    
+    # 获取距离：超声波无效或为异常值时退回单目测距
+    if distance <= 0:
+        distance, source = get_best_distance()
+        distance_time = get_latest_distance_timestamp() if source == 'ultrasonic' else time.monotonic()
+
+    # 都无效时使用融合估计的距离（两次测距之间也能持续更新）
+    if USE_STATE_ESTIMATE and distance <= 0:
+        estimate = get_cube_estimate()
+        if estimate is not None:
+            distance, source = estimate["range"], 'estimate'
+            distance_time = time.monotonic()
+    return color_data, frame_time, distance, distance_time, source
+
+# 接近魔方的一个控制周期
+def approach_step(controller, color):
+    """
+    读取目标方位角和距离，更新接近控制器并下发轮速
+    
+    Args:
+        controller: ApproachController
+        color: 目标魔方颜色
+    
+    Returns:
+        tuple: (使用的距离cm, 来源)
+    """
+    color_data, frame_time, distance, distance_time, source = get_approach_distance()
+    frame_id = trace_decision(frame_time)
+    bearing = target_bearing(color, color_data)
+    left, right = controller.update(time.monotonic(), bearing, frame_time,
+                                    distance if distance > 0 else None, distance_time)
+    set_motor_speed(left, right, source='approach')
+    trace_stage(frame_id, "commanded")
+    return distance, source
 
 # 顺序执行的接近魔方函数
 def approach_cube_sequential(color):
     """
     顺序执行接近魔方，直到达到指定距离
     
+    PD转向对准目标方位，前进速度按剩余距离和碰撞时间规划，到达时平滑减速停车
+    
     Args:
         color: 目标魔方颜色
     
@@ -491,247 +508,323 @@ def approach_cube_sequential(color):
         bool: 是否成功接近魔方
     """
     print(f"开始接近{color}魔方")
+    controller = ApproachController(stop_distance=DISTANCE_THRESHOLD, max_speed=APPROACH_MAX_SPEED)
     
     # 设置超时时间，防止无限循环
     approach_start_time = time.time()
     max_approach_time = 30.0  # 最多接近30秒
     
-    while time.time() - approach_start_time < max_approach_time:
-        # 获取最新的颜色检测结果
-        color_data = get_latest_color_data()
-        
-        # 获取超声波距离
-        distance = get_latest_distance()
-        
-        # 检查是否已经接近魔方
-        if distance <= DISTANCE_THRESHOLD and distance > 0:
-            #set_motor_speed(0, 0)
-            print(f"已接近魔方，距离: {distance}cm")
-            return True
-        
-        # 使用颜色偏移量控制小车行驶
-        color_segments = color_data.get(color, [])
-        if color_segments:
-            # 使用最宽的颜色段的中心点作为导航目标
-            widest_segment = max(color_segments, key=lambda s: abs(s[1] - s[0]))
-            x_center = widest_segment[2]  # 获取中心点偏移量
-            drive_with_color(x_center, FORWARD_SPEED)
-        else:
-            # 如果看不到目标颜色，直行
-            drive_straight(FORWARD_SPEED)
-        
-        # 短暂暂停，避免CPU占用过高
-        time.sleep(0.1)
+    try:
+        while time.time() - approach_start_time < max_approach_time:
+            distance, source = approach_step(controller, color)
+            
+            # 检查是否已经接近魔方
+            if controller.arrived:
+                print(f"已接近魔方，距离: {controller.predicted_distance():.1f}cm（来源: {source}）")
+                return True
+            
+            # 短暂暂停，避免CPU占用过高
+            time.sleep(APPROACH_INTERVAL)
+    finally:
+        # 到达时速度已降到0；超时则停车
+        release_motor('approach', hold=False)
     
-    # 如果超时，停车
-    #set_motor_speed(0, 0)
     print("接近魔方超时")
     return False
 
-# 顺序执行的状态1处理函数
-def handle_state1_sequential():
-    """
-    顺序执行状态1：识别并通过第一个魔方
+# 顺序执行的状态处理函数
+def handle_state_sequential(state_plan):
     """
-    print("开始执行状态1: 识别并通过第一个魔方")
-    set_motor_speed(1, 1)
-    time.sleep(0.5)
-    print("启动")
-    set_motor_speed(0.3,0.3)
-
-    # 步骤1: 检测并确认颜色
-    while True:
-        confirmed_color = detect_and_confirm_color()
-        if confirmed_color:
-            state_manager.detected_color = confirmed_color
-            print(f"确认魔方颜色: {confirmed_color}")
-            break
-        time.sleep(0.1)
-    #set_motor_speed(0,0)
-
-    # 步骤2: 接近魔方
-    approach_success = approach_cube_sequential(state_manager.detected_color)
-    if not approach_success:
-        print("接近魔方失败，状态1未完成")
-        return False
-    
-    # 步骤3: 确定绕行方向
-    bypass_direction = state_manager.determine_bypass_direction()
-    print(f"决定{bypass_direction}侧绕行")
+    顺序执行一个状态：识别并通过一个魔方
     
-    # 步骤4: 执行矩形路径绕行
-    execute_bypass_rectangular(bypass_direction)
+    Args:
+        state_plan: 任务文件中编译后的状态 (id, acquire, bypass, start, on_search_fail)
     
-    # 状态1完成
-    state_manager.state1_done = True
-    print("状态1完成")
-    return True
-
-# 顺序执行的状态2处理函数
-def handle_state2_sequential():
-    """
-    顺序执行状态2：识别并通过第二个魔方
+    Returns:
+        bool: 状态是否完成
     """
-    print("开始执行状态2: 识别并通过第二个魔方")
-
-    dismiss_end = True
-    
-    # 步骤1: 搜索并确认颜色
-    set_motor_speed(0.3,0.3)
-
-    confirmed_color = search_for_cube_sequential()
-    if not confirmed_color:
-        print("搜索魔方失败，状态2未完成，保持直行")
-        set_motor_speed(1.0, 1.0)
-        time.sleep(2)
-        print("阶段2直行完成")
-        state_manager.state2_done = True
-        # return False
-        return True
+    state_id, acquire, bypass_rule, start, on_search_fail = state_plan
+    print(f"开始执行状态{state_id}: 识别并通过第{state_id}个魔方")
+    if start:
+        run_manoeuvre(mission, start, set_motor_speed, verbose=False)
+        # 保持起始动作最后一步的速度（如缓慢前进），直到搜索或接近接手
+        release_motor('manoeuvre')
+
+    # 步骤1: 确认颜色（原地等待确认或旋转搜索）
+    state_manager.color_voter.reset()
+    if acquire == 'confirm':
+        while True:
+            confirmed_color = detect_and_confirm_color()
+            if confirmed_color:
+                break
+            time.sleep(0.1)
+    else:
+        confirmed_color = search_for_cube_sequential()
+        if not confirmed_color:
+            print(f"搜索魔方失败，状态{state_id}未完成，保持直行")
+            if on_search_fail:
+                run_mission_manoeuvre(on_search_fail)
+            state_manager.completed_states.append(state_id)
+            return True
     
     state_manager.detected_color = confirmed_color
+    set_target_color(confirmed_color)
+    set_mono_target_color(confirmed_color)
+    print(f"确认魔方颜色: {confirmed_color}")
     
-    # 步骤2: 接近魔方
-    approach_success = approach_cube_sequential(state_manager.detected_color)
+    # 步骤2: 接近魔方（只检测目标颜色）
+    if FOCUS_ON_TARGET:
+        set_detection_focus([confirmed_color], window=FOCUS_WINDOW)
+    try:
+        approach_success = approach_cube_sequential(state_manager.detected_color)
+    finally:
+        clear_detection_focus()
     if not approach_success:
-        print("接近魔方失败，状态2未完成")
+        print(f"接近魔方失败，状态{state_id}未完成")
         return False
     
-    # 步骤3: 确定绕行方向（与状态1相反）
-    bypass_direction = state_manager.determine_bypass_direction()
+    # 步骤3: 确定绕行方向
+    bypass_direction = state_manager.determine_bypass_direction(bypass_rule)
     print(f"决定{bypass_direction}侧绕行")
     
-    # 步骤4: 执行矩形路径绕行
-    execute_bypass_rectangular(bypass_direction)
+    # 步骤4: 绕行
+    execute_bypass(bypass_direction)
     
-    # 状态2完成
-    state_manager.state2_done = True
-    print("状态2完成")
+    # 状态完成
+    state_manager.completed_states.append(state_id)
+    print(f"状态{state_id}完成")
     return True
 
-# 顺序执行的状态3处理函数
-def handle_state3_sequential():
+# 顺序执行的最终冲刺函数
+def final_sprint_sequential():
     """
-    顺序执行状态3：识别并通过第三个魔方
+    顺序执行最终冲刺
     """
-    print("开始执行状态3: 识别并通过第三个魔方")
-
-    dismiss_end = False
+    print("开始最终冲刺")
+    run_mission_manoeuvre("final_sprint")
+    print("最终冲刺完成")
 
-    set_motor_speed(0.3,0.3)
-    time.sleep(0.5)
-    # 步骤1: 搜索并确认颜色
-    confirmed_color = search_for_cube_sequential()
-    if not confirmed_color:
-        print("搜索魔方失败，状态3未完成，保持直行")
-        set_motor_speed(1.0, 1.0)
-        time.sleep(2)
-        state_manager.state3_done = True
-        # return False
-        return True
-    
-    state_manager.detected_color = confirmed_color
-    
-    # 步骤2: 接近魔方
-    approach_success = approach_cube_sequential(state_manager.detected_color)
-    if not approach_success:
-        print("接近魔方失败，状态3未完成")
-        return False
+# 执行任务文件中的全部状态
+def run_mission_states():
+    """
+    按任务文件顺序执行各个状态和最终冲刺（实车和离线回放共用）
     
-    # 步骤3: 确定绕行方向
-    bypass_direction = state_manager.determine_bypass_direction()
-    print(f"决定{bypass_direction}侧绕行")
+    Returns:
+        bool: 任务是否完成
+    """
+    for state_plan in mission.states:
+        state_manager.current_state = state_plan[0]
+        if not handle_state_sequential(state_plan):
+            print(f"状态{state_plan[0]}执行失败，程序退出")
+            return False
     
-    # 步骤4: 执行矩形路径绕行
-    execute_bypass_rectangular(bypass_direction)
+    # 最终冲刺
+    final_sprint_sequential()
     
-    # 状态3完成
-    state_manager.state3_done = True
-    print("状态3完成")
+    print("任务完成！")
     return True
 
-# 顺序执行的最终冲刺函数
-def final_sprint_sequential():
+# 注册传感器回调
+def register_sensor_listeners():
+    """注册安全反射、单目测距和时间对齐的回调（实车和离线回放共用）"""
+    add_distance_listener(safety_listener)
+    # 原始测距只用于判断安全停车期间传感器是否还有读数（测距中断时全部停车，不解除）
+    add_raw_distance_listener(safety_raw_sample)
+
+    # 单目测距：每帧记录色段宽度，并与超声波距离配对自动标定
+    add_color_listener(mono_estimator.on_color_frame)
+
+    # 时间对齐：记录帧和距离的历史，按帧时间插值距离
+    if USE_TIME_ALIGNMENT:
+        start_time_alignment()
+
+# 看门狗：颜色检测失效时的降级和恢复
+def on_vision_lost():
+    """颜色检测线程失效：接近和搜索依赖视觉，立即停车；绕行、冲刺等动作不受影响"""
+    if get_motor_owner() in ('approach', 'search'):
+        set_motor_speed(0, 0, source='watchdog')
+        print("视觉失效，接近/搜索已暂停")
+
+def on_vision_recovered():
+    """颜色检测恢复：电机线程也正常时解除停车"""
+    if watchdog.is_healthy("pwm") and watchdog.is_healthy("speed_monitor"):
+        release_motor('watchdog', hold=False)
+
+# 运行记录中保存的控制参数（回放时与当前参数不同会提示）
+def recorded_config():
     """
-    顺序执行最终冲刺
+    Returns:
+        dict: 影响控制行为的参数
     """
-    print("开始最终冲刺")
+    return {
+        "COLOR_CONFIDENCE_THRESHOLD": COLOR_CONFIDENCE_THRESHOLD,
+        "CONFIRM_FALLBACK_TIME": CONFIRM_FALLBACK_TIME,
+        "DISTANCE_THRESHOLD": DISTANCE_THRESHOLD,
+        "BYPASS_MODE": BYPASS_MODE,
+        "APPROACH_MAX_SPEED": APPROACH_MAX_SPEED,
+        "USE_STATE_ESTIMATE": USE_STATE_ESTIMATE,
+        "USE_TIME_ALIGNMENT": USE_TIME_ALIGNMENT,
+        "APPROACH_INTERVAL": APPROACH_INTERVAL,
+        "USE_BEARING_MAP": USE_BEARING_MAP,
+        "SEARCH_SAMPLE_INTERVAL": SEARCH_SAMPLE_INTERVAL,
+        "FOCUS_ON_TARGET": FOCUS_ON_TARGET,
+        "FOCUS_WINDOW": FOCUS_WINDOW,
+    }
+
+# 初始化所有子系统
+def init_subsystems():
+    """
+    初始化电机、超声波、摄像头并启动各传感器线程
     
-    # 直行一段时间
-    drive_straight(FINAL_SPRINT_SPEED)
-    time.sleep(3.0)  # 冲刺3秒
+    Returns:
+        bool: 是否初始化成功
+    """
+    global camera
     
-    # 停车
-    #set_motor_speed(0, 0)
-    print("最终冲刺完成")
+    # 运行记录：在各传感器线程启动前开始，记录完整的输入
+    if RECORD_RUN:
+        start_recording(mission_file=mission.source, config=recorded_config())
 
-# 主控制函数（顺序执行版本）
-def main_control_sequential():
-    """顺序执行的主控制函数"""
-    global running, camera
-    
-    try:
-        # 初始化电机
+    # 电机、超声波、摄像头并行初始化，各自按真实信号判定就绪
+    orchestrator = StartupOrchestrator()
+    threads = {}
+
+    def init_motor():
+        """初始化电机并启动测速和PWM更新，测速线程第一次计算轮速时（编码器中断已挂上）就绪"""
         init_gpio()
-        print("电机已初始化")
-        
-        # 启动电机速度监测和PWM更新
-        start_speed_monitor()
-        start_pwm_update_daemon()
+        if TRACE_LATENCY:
+            start_latency_trace()
+
+        def on_encoder(left_count, right_count, dt, timestamp):
+            orchestrator.signal("motor", "encoder")
+            remove_encoder_listener(on_encoder)
+
+        add_encoder_listener(on_encoder)
+        threads["speed_monitor"] = start_speed_monitor()
+        threads["pwm"] = start_pwm_update_daemon()
         print("电机速度监测和PWM更新已启动")
-        
-        # 初始化I2C设备（超声波）
+
+    def init_distance():
+        """初始化I2C设备并启动距离测量，第一次有效测距时就绪"""
         init_i2c()
-        print("I2C设备已初始化")
-        
-        # 启动距离测量线程
-        start_distance_measurement()
+
+        def on_distance(distance, timestamp):
+            orchestrator.signal("distance", "first_range")
+            remove_distance_listener(on_distance)
+
+        add_distance_listener(on_distance)
+        threads["distance"] = start_distance_measurement()
         print("距离测量线程已启动")
-        
-        # 初始化摄像头
+
+    def init_vision():
+        """初始化摄像头并启动颜色检测，曝光稳定时就绪"""
+        global camera
         camera = init_camera()
         if camera is None:
-            print("摄像头初始化失败，程序退出")
-            return
-        print("摄像头已初始化")
-        
-        # 启动颜色检测线程
-        start_color_detection()
+            return False
+
+        def on_stable():
+            orchestrator.signal("camera", "exposure")
+            remove_frame_listener(monitor.on_frame)
+
+        monitor = ExposureMonitor(on_stable)
+        add_frame_listener(monitor.on_frame)
+        threads["color"] = start_color_detection()
         print("颜色检测线程已启动")
-        
-        # 启动显示摄像头画面的线程
-        if DISPLAY_CAMERA:
-            start_display_camera()
-            print("摄像头画面显示已启动")
-        
-        # 等待系统稳定
-        print("系统初始化中，请稍候...")
-        time.sleep(2)
-        
-        # 顺序执行各个状态
-        
-        # 状态1: 识别并通过第一个魔方
-        state_manager.current_state = 1
-        if not handle_state1_sequential():
-            print("状态1执行失败，程序退出")
-            return
-        
-        # 状态2: 识别并通过第二个魔方
-        state_manager.current_state = 2
-        if not handle_state2_sequential():
-            print("状态2执行失败，程序退出")
-            return
-        
-        # 状态3: 识别并通过第三个魔方
-        state_manager.current_state = 3
-        if not handle_state3_sequential():
-            print("状态3执行失败，程序退出")
+
+    orchestrator.add("motor", init_motor, signals=("encoder",))
+    orchestrator.add("distance", init_distance, signals=("first_range",))
+    orchestrator.add("camera", init_vision, signals=("exposure",))
+    print("系统初始化中，请稍候...")
+    ok = orchestrator.run(timeout=READY_TIMEOUT)
+    orchestrator.report()
+    if not ok:
+        print("子系统初始化失败，程序退出")
+        return False
+
+    # 阈值和视觉参数热更新
+    if HOT_RELOAD:
+        start_config_watcher()
+
+    # 看门狗：各线程停止心跳或退出时按配置记录、降级或停车
+    if USE_WATCHDOG:
+        watchdog.register("speed_monitor", thread=threads.get("speed_monitor"))
+        watchdog.register("pwm", thread=threads.get("pwm"))
+        watchdog.register("distance", thread=threads.get("distance"))
+        watchdog.register("color", thread=threads.get("color"),
+                          on_degrade=on_vision_lost, on_recover=on_vision_recovered)
+        start_watchdog()
+
+    # 安全反射、单目测距和时间对齐的回调
+    register_sensor_listeners()
+
+    # 启动状态估计（融合里程计、测距和视觉方位角）
+    if USE_STATE_ESTIMATE:
+        start_state_estimation()
+        print("状态估计线程已启动")
+    
+    # 启动显示摄像头画面的线程
+    if DISPLAY_CAMERA:
+        start_display_camera()
+        print("摄像头画面显示已启动")
+    return True
+
+# 清理所有子系统
+def cleanup_subsystems():
+    """停止各线程并释放硬件资源"""
+    # 先停止看门狗，各线程正常停止不触发动作
+    if USE_WATCHDOG:
+        stop_watchdog()
+        print_watchdog_stats()
+
+    # 打印帧和距离的时间差、插值样本间隔的分布
+    if USE_TIME_ALIGNMENT:
+        print_skew_stats()
+        stop_time_alignment()
+
+    # 打印颜色确认用时
+    stats = state_manager.color_voter.decision_stats()
+    if stats["count"]:
+        print(f"颜色确认用时: {stats['count']}次, 平均 {stats['mean']:.2f}s, "
+              f"p90 {stats['p90']:.2f}s, 最大 {stats['max']:.2f}s, "
+              f"超时回退 {state_manager.color_voter.fallback_count}次")
+
+    # 打印各来源拥有电机的周期数
+    print_owner_stats()
+
+    # 打印各段延迟并导出时间线
+    if TRACE_LATENCY:
+        stop_latency_trace()
+        print_latency_report()
+        export_chrome_trace()
+
+    if HOT_RELOAD:
+        stop_config_watcher()
+
+    # 结束运行记录
+    stop_recording()
+
+    # 清理资源
+    stop_state_estimation()
+    cleanup_motor()
+    cleanup_camera()
+    cleanup_distance()
+
+# 主控制函数（顺序执行版本）
+def main_control_sequential():
+    """顺序执行的主控制函数"""
+    global running
+    
+    try:
+        # 先编译任务文件，文件有误时不初始化硬件
+        load_mission_plan()
+
+        if not init_subsystems():
             return
         
-        # 最终冲刺
-        final_sprint_sequential()
-        
-        print("任务完成！")
+        # 按任务文件顺序执行各个状态（回放从此标记开始执行任务）
+        mark_run("mission_start")
+        run_mission_states()
     
     except KeyboardInterrupt:
         print("\n程序被用户中断")
@@ -741,10 +834,7 @@ def main_control_sequential():
         # 停止电机
         #set_motor_speed(0, 0)
         
-        # 清理资源
-        cleanup_motor()
-        cleanup_camera()
-        cleanup_distance()
+        cleanup_subsystems()
         
         print("程序结束，资源已清理")
 
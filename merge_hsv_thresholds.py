@@ -1,14 +1,19 @@
 import json
 import os
+import sys
+import time
 import numpy as np
 
+# ===== 可配置参数（修改此处无需改动函数） =====
+HUE_PERIOD = 180     # OpenCV的色调取值0~179，首尾相接
+
 def is_overlapping(range1, range2):
     """判断两个HSV范围是否重叠"""
     # 检查每个通道是否有重叠
     h_overlap = max(range1["lower"][0], range2["lower"][0]) <= min(range1["upper"][0], range2["upper"][0])
     s_overlap = max(range1["lower"][1], range2["lower"][1]) <= min(range1["upper"][1], range2["upper"][1])
     v_overlap = max(range1["lower"][2], range2["lower"][2]) <= min(range1["upper"][2], range2["upper"][2])
-    
+
     # 所有通道都重叠才算重叠
     return h_overlap and s_overlap and v_overlap
 
@@ -28,80 +33,367 @@ def merge_ranges(range1, range2):
     }
     return merged
 
-def merge_hsv_thresholds(json_path):
-    """合并HSV阈值文件中相交的颜色区域"""
+def _to_arrays(ranges):
+    """
+    把阈值列表转换为lower、upper数组 (N, 3)，并去除完全相同的区间
+
+    色调下限可以大于上限（如 170~10，表示跨过0/180的区间）。色调上限180按179处理（OpenCV的色调不会取到180）。
+    """
+    lower = np.array([r["lower"] for r in ranges], dtype=np.int32).reshape(-1, 3)
+    upper = np.array([r["upper"] for r in ranges], dtype=np.int32).reshape(-1, 3)
+    lower[:, 0] = np.clip(lower[:, 0], 0, HUE_PERIOD - 1)
+    upper[:, 0] = np.clip(upper[:, 0], 0, HUE_PERIOD - 1)
+    boxes = np.unique(np.concatenate([lower, upper], axis=1), axis=0)
+    return boxes[:, :3], boxes[:, 3:]
+
+def _hue_cut(lower, upper):
+    """
+    找到没有被任何区间覆盖的最宽色调空档，返回空档中点（作为展开色调环的切口），没有空档时返回None
+
+    在切口处展开后，每个区间（包括跨过0/180的红色区间）都是一个连续区间，可以与两侧的区间正常合并。
+    """
+    coverage = np.zeros(HUE_PERIOD + 1, dtype=np.int32)
+    wrapped = lower[:, 0] > upper[:, 0]
+    np.add.at(coverage, lower[:, 0], 1)
+    np.add.at(coverage, upper[:, 0] + 1, -1)
+    # 跨0/180的区间覆盖 lower~179 和 0~upper
+    coverage[0] += np.count_nonzero(wrapped)
+    coverage[HUE_PERIOD] -= np.count_nonzero(wrapped)
+    free = np.cumsum(coverage[:-1]) == 0
+    if not np.any(free):
+        return None
+    if np.all(free):
+        return 0
+    # 从一个被覆盖的色调开始绕一圈，找最长的连续空档
+    start = int(np.argmin(free))
+    rolled = np.roll(free, -start)
+    edges = np.diff(np.concatenate([[0], rolled.astype(np.int8), [0]]))
+    run_starts = np.flatnonzero(edges == 1)
+    run_ends = np.flatnonzero(edges == -1)
+    longest = int(np.argmax(run_ends - run_starts))
+    middle = (run_starts[longest] + run_ends[longest]) // 2
+    return int((middle + start) % HUE_PERIOD)
+
+def _split_wrapped(lower, upper):
+    """把跨过0/180的区间拆成 lower~179 和 0~upper 两段"""
+    wrapped = lower[:, 0] > upper[:, 0]
+    if not np.any(wrapped):
+        return lower, upper
+    head_upper = upper[wrapped].copy()
+    head_upper[:, 0] = HUE_PERIOD - 1
+    tail_lower = lower[wrapped].copy()
+    tail_lower[:, 0] = 0
+    return (np.concatenate([lower[~wrapped], lower[wrapped], tail_lower]),
+            np.concatenate([upper[~wrapped], head_upper, upper[wrapped]]))
+
+def _join_seam(lower, upper, seam):
+    """
+    展开后把在原0/180处被拆成两段的同一区间接回一个（色调在接缝处相接、饱和度和亮度完全相同）
+
+    Args:
+        seam: 原色调0在展开后的位置
+    """
+    heads = {}
+    for i in np.flatnonzero(upper[:, 0] == seam - 1):
+        heads.setdefault((tuple(lower[i, 1:]), tuple(upper[i, 1:])), []).append(i)
+    drop = []
+    for j in np.flatnonzero(lower[:, 0] == seam):
+        candidates = heads.get((tuple(lower[j, 1:]), tuple(upper[j, 1:])))
+        if candidates:
+            i = candidates.pop()
+            upper[i, 0] = upper[j, 0]
+            drop.append(j)
+    keep = np.ones(len(lower), dtype=bool)
+    keep[drop] = False
+    return lower[keep], upper[keep]
+
+def _overlaps(lower, upper, box_lower, box_upper):
+    """向量化检测一组区间与一个框是否重叠（三个通道都相交）"""
+    return np.all(np.maximum(lower, box_lower) <= np.minimum(upper, box_upper), axis=1)
+
+def _merge_boxes(lower, upper):
+    """
+    反复合并重叠的区间直到互不重叠（与原来逐对合并的结果相同：合并后的外包框可能又与其他区间重叠）
+
+    按色调下限排序后依次取未处理的区间作为当前框，与剩余区间和已完成的框做向量化的重叠检测，
+    把重叠的全部并入当前框后再检测，直到不再有重叠。每个区间只被并入一次，
+    不会像原实现那样一有合并就从头再来。剩余区间只需检查色调下限不超过当前框色调上限的一段，
+    已完成的框先按色调筛选再检查三个通道。
+    """
+    order = np.argsort(lower[:, 0], kind="stable")
+    lower, upper = lower[order], upper[order]
+    n = len(lower)
+    alive = np.ones(n, dtype=bool)
+    done_lower = np.empty((n, 3), dtype=lower.dtype)
+    done_upper = np.empty((n, 3), dtype=upper.dtype)
+    done_alive = np.zeros(n, dtype=bool)
+    count = 0
+    for seed in range(n):
+        if not alive[seed]:
+            continue
+        alive[seed] = False
+        current_lower, current_upper = lower[seed].copy(), upper[seed].copy()
+        while True:
+            # 排在seed之前的区间都已处理，之后的只看色调下限不超过当前色调上限的部分
+            end = int(np.searchsorted(lower[:, 0], current_upper[0], side="right"))
+            window = slice(seed + 1, end)
+            hits = np.flatnonzero(alive[window] & _overlaps(lower[window], upper[window], current_lower, current_upper)) + seed + 1
+            candidates = np.flatnonzero(done_alive[:count] & (done_upper[:count, 0] >= current_lower[0])
+                                        & (done_lower[:count, 0] <= current_upper[0]))
+            done_hits = candidates[_overlaps(done_lower[candidates], done_upper[candidates], current_lower, current_upper)]
+            if not len(hits) and not len(done_hits):
+                break
+            alive[hits] = False
+            done_alive[done_hits] = False
+            current_lower = np.concatenate([current_lower[None], lower[hits], done_lower[done_hits]]).min(axis=0)
+            current_upper = np.concatenate([current_upper[None], upper[hits], done_upper[done_hits]]).max(axis=0)
+        done_lower[count], done_upper[count] = current_lower, current_upper
+        done_alive[count] = True
+        count += 1
+    keep = done_alive[:count]
+    return done_lower[:count][keep], done_upper[:count][keep]
+
+def _coalesce_boxes(lower, upper):
+    """
+    精简：把在两个通道上完全相同、在第三个通道上相接的区间拼成一个（覆盖范围不变），
+    反复进行直到不能再拼（贪心，不保证数量最少）
+    """
+    changed = True
+    while changed and len(lower) > 1:
+        changed = False
+        for axis in range(3):
+            others = [a for a in range(3) if a != axis]
+            keys = np.concatenate([lower[:, others], upper[:, others]], axis=1)
+            order = np.lexsort((lower[:, axis],) + tuple(keys[:, k] for k in reversed(range(4))))
+            lower, upper, keys = lower[order], upper[order], keys[order]
+            # 与前一个区间其他通道相同且相接时属于同一段
+            same = np.all(keys[1:] == keys[:-1], axis=1) & (lower[1:, axis] <= upper[:-1, axis] + 1)
+            if not np.any(same):
+                continue
+            group = np.concatenate([[0], np.cumsum(~same)])
+            merged_lower = lower[np.concatenate([[True], ~same])]
+            merged_upper = upper[np.concatenate([~same, [True]])].copy()
+            merged_upper[:, axis] = np.maximum.reduceat(upper[:, axis], np.flatnonzero(np.diff(np.concatenate([[-1], group]))))
+            lower, upper = merged_lower, merged_upper
+            changed = True
+    return lower, upper
+
+def merge_color_ranges(ranges, simplify=False):
+    """
+    合并一种颜色的HSV阈值列表
+
+    Args:
+        ranges: [{"lower": [h, s, v], "upper": [h, s, v]}, ...]
+        simplify: 合并后是否再把相接的区间拼成一个（覆盖范围不变，区间数更少）
+
+    Returns:
+        list: 合并后的阈值列表，按色调、饱和度、亮度下限排序；跨过0/180的区间输出为两段
+    """
+    if not ranges:
+        return []
+    lower, upper = _to_arrays(ranges)
+    # 在最宽的色调空档处展开色调环；色调全被覆盖时不展开，跨0/180的区间拆成两段按直线处理
+    cut = _hue_cut(lower, upper)
+    if cut is None:
+        cut = 0
+        lower, upper = _split_wrapped(lower, upper)
+    else:
+        lower[:, 0] = (lower[:, 0] - cut) % HUE_PERIOD
+        upper[:, 0] = (upper[:, 0] - cut) % HUE_PERIOD
+        if cut:
+            lower, upper = _join_seam(lower, upper, HUE_PERIOD - cut)
+    lower, upper = _merge_boxes(lower, upper)
+    if simplify:
+        lower, upper = _coalesce_boxes(lower, upper)
+    lower[:, 0] += cut
+    upper[:, 0] += cut
+
+    result = []
+    for low, high in zip(lower.tolist(), upper.tolist()):
+        if low[0] < HUE_PERIOD <= high[0]:
+            result.append({"lower": [low[0], low[1], low[2]], "upper": [HUE_PERIOD - 1, high[1], high[2]]})
+            result.append({"lower": [0, low[1], low[2]], "upper": [high[0] - HUE_PERIOD, high[1], high[2]]})
+        elif low[0] >= HUE_PERIOD:
+            result.append({"lower": [low[0] - HUE_PERIOD, low[1], low[2]], "upper": [high[0] - HUE_PERIOD, high[1], high[2]]})
+        else:
+            result.append({"lower": low, "upper": high})
+    result.sort(key=lambda r: (r["lower"], r["upper"]))
+    return result
+
+def merged_output_path(json_path):
+    """默认输出路径：输入文件旁的 <文件名>_merged.json，不覆盖输入"""
+    stem, ext = os.path.splitext(json_path)
+    return f"{stem}_merged{ext or '.json'}"
+
+def merge_hsv_thresholds(json_path, output_path=None, simplify=False):
+    """
+    合并HSV阈值文件中相交的颜色区域
+
+    Args:
+        json_path: 输入阈值文件
+        output_path: 输出文件，None时写到merged_output_path(json_path)；与输入相同时先备份为.backup
+        simplify: 见merge_color_ranges
+    """
     # 加载JSON文件
     if not os.path.exists(json_path):
         print(f"文件不存在: {json_path}")
         return
-    
+    if output_path is None:
+        output_path = merged_output_path(json_path)
+
     with open(json_path, 'r') as f:
         thresholds = json.load(f)
-    
-    # 备份原始文件
-    backup_path = json_path + '.backup'
-    with open(backup_path, 'w') as f:
-        json.dump(thresholds, f, indent=4)
-    print(f"已创建备份文件: {backup_path}")
-    
+
+    # 明确要求覆盖输入时才备份原始文件
+    if os.path.abspath(output_path) == os.path.abspath(json_path):
+        backup_path = json_path + '.backup'
+        with open(backup_path, 'w') as f:
+            json.dump(thresholds, f, indent=4)
+        print(f"已创建备份文件: {backup_path}")
+
     # 处理每种颜色
     merged_thresholds = {}
     for color, ranges in thresholds.items():
         print(f"处理颜色: {color}, 原始阈值数量: {len(ranges)}")
-        
-        # 去除完全相同的阈值
-        unique_ranges = []
-        for r in ranges:
-            if r not in unique_ranges:
-                unique_ranges.append(r)
-        
-        # 合并重叠的阈值
-        merged_ranges = []
-        while unique_ranges:
-            current = unique_ranges.pop(0)
-            merged = False
-            
-            i = 0
-            while i < len(unique_ranges):
-                if is_overlapping(current, unique_ranges[i]):
-                    current = merge_ranges(current, unique_ranges[i])
-                    unique_ranges.pop(i)
-                    merged = True
-                else:
-                    i += 1
-            
-            # 检查是否可以与已合并的范围合并
-            i = 0
-            while i < len(merged_ranges):
-                if is_overlapping(current, merged_ranges[i]):
-                    current = merge_ranges(current, merged_ranges[i])
-                    merged_ranges.pop(i)
-                    merged = True
-                else:
-                    i += 1
-            
-            merged_ranges.append(current)
-            
-            # 如果有合并，重新检查所有范围
-            if merged:
-                unique_ranges = merged_ranges + unique_ranges
-                merged_ranges = []
-        
-        merged_thresholds[color] = merged_ranges
-        print(f"处理完成: {color}, 合并后阈值数量: {len(merged_ranges)}")
-    
+        merged_thresholds[color] = merge_color_ranges(ranges, simplify)
+        print(f"处理完成: {color}, 合并后阈值数量: {len(merged_thresholds[color])}")
+
     # 保存合并后的阈值
-    with open(json_path, 'w') as f:
+    with open(output_path, 'w') as f:
         json.dump(merged_thresholds, f, indent=4)
-    
-    print(f"已保存合并后的阈值到: {json_path}")
-    
+
+    print(f"已保存合并后的阈值到: {output_path}")
+
     # 输出统计信息
     total_original = sum(len(ranges) for ranges in thresholds.values())
     total_merged = sum(len(ranges) for ranges in merged_thresholds.values())
     print(f"总计: 原始阈值数量: {total_original}, 合并后阈值数量: {total_merged}")
     print(f"减少了 {total_original - total_merged} 个重复或重叠的阈值")
 
+def _merge_pairwise(ranges):
+    """原来的逐对合并实现（仅用于对照和基准测试）：去重用列表in检查，有合并就从头再来"""
+    unique_ranges = []
+    for r in ranges:
+        if r not in unique_ranges:
+            unique_ranges.append(r)
+    merged_ranges = []
+    while unique_ranges:
+        current = unique_ranges.pop(0)
+        merged = False
+        i = 0
+        while i < len(unique_ranges):
+            if is_overlapping(current, unique_ranges[i]):
+                current = merge_ranges(current, unique_ranges[i])
+                unique_ranges.pop(i)
+                merged = True
+            else:
+                i += 1
+        i = 0
+        while i < len(merged_ranges):
+            if is_overlapping(current, merged_ranges[i]):
+                current = merge_ranges(current, merged_ranges[i])
+                merged_ranges.pop(i)
+                merged = True
+            else:
+                i += 1
+        merged_ranges.append(current)
+        if merged:
+            unique_ranges = merged_ranges + unique_ranges
+            merged_ranges = []
+    return merged_ranges
+
+def _synthetic_ranges(n, seed=0, scattered=False):
+    """
+    生成模拟自动标定输出的阈值
+
+    Args:
+        scattered: False时为围绕几个颜色中心的小框（其中红色跨过0/180，大部分会合并）；
+                   True时为散布在整个HSV空间的小框（合并后仍剩很多区间，是合并的最坏情况）
+    """
+    rng = np.random.default_rng(seed)
+    if scattered:
+        middle = rng.uniform([0, 0, 0], [HUE_PERIOD, 256, 256], (n, 3))
+        half = rng.uniform([0, 1, 1], [0.5, 4, 4], (n, 3))
+    else:
+        centers = np.array([[2, 200, 180], [28, 200, 200], [102, 200, 150], [65, 180, 150]])
+        center = centers[rng.integers(0, len(centers), n)]
+        middle = center + rng.normal(0, [4, 30, 40], (n, 3))
+        half = rng.uniform([1, 3, 3], [4, 20, 25], (n, 3))
+    lower = np.rint(middle - half).astype(int)
+    upper = np.rint(middle + half).astype(int)
+    lower[:, 1:] = np.clip(lower[:, 1:], 0, 255)
+    upper[:, 1:] = np.clip(upper[:, 1:], 0, 255)
+    # 色调按环取模，下限大于上限的为跨0/180的区间
+    lower[:, 0] %= HUE_PERIOD
+    upper[:, 0] %= HUE_PERIOD
+    return [{"lower": lo, "upper": hi} for lo, hi in zip(lower.tolist(), upper.tolist())]
+
+def _same_coverage(ranges_a, ranges_b, samples=200000, seed=1):
+    """随机取HSV点检查两组阈值覆盖的点是否相同"""
+    rng = np.random.default_rng(seed)
+    points = np.column_stack([rng.integers(0, HUE_PERIOD, samples), rng.integers(0, 256, (samples, 2))])
+
+    def covered(ranges):
+        mask = np.zeros(samples, dtype=bool)
+        for r in ranges:
+            mask |= np.all((points >= r["lower"]) & (points <= r["upper"]), axis=1)
+        return mask
+
+    return np.array_equal(covered(ranges_a), covered(ranges_b))
+
+def benchmark():
+    """合成数据基准：与原实现对照结果，并测量10000个区间的耗时"""
+    # 不跨0/180时与原实现结果完全相同
+    for seed in range(6):
+        ranges = [r for r in _synthetic_ranges(300, seed, scattered=seed % 2 == 1)
+                  if r["lower"][0] <= r["upper"][0] and (seed % 2 == 1 or r["lower"][0] > 20)]
+        expected = sorted(_merge_pairwise(ranges), key=lambda r: (r["lower"], r["upper"]))
+        assert merge_color_ranges(ranges) == expected, f"与原实现结果不同 (seed={seed})"
+        simplified = merge_color_ranges(ranges, simplify=True)
+        assert _same_coverage(simplified, expected), "精简改变了覆盖范围"
+    # 跨0/180：拆成两半的同一区间应当与两侧重叠的区间合并
+    ranges = [{"lower": [175, 100, 100], "upper": [179, 200, 200]},
+              {"lower": [0, 100, 100], "upper": [5, 200, 200]},
+              {"lower": [3, 150, 150], "upper": [8, 255, 255]},
+              {"lower": [170, 10, 10], "upper": [4, 60, 60]}]
+    merged = merge_color_ranges(ranges)
+    assert merged == [{"lower": [0, 10, 10], "upper": [4, 60, 60]},
+                      {"lower": [0, 100, 100], "upper": [8, 255, 255]},
+                      {"lower": [170, 10, 10], "upper": [179, 60, 60]},
+                      {"lower": [175, 100, 100], "upper": [179, 255, 255]}], merged
+    # 精简：相接且其余通道相同的区间拼成一个
+    ranges = [{"lower": [10, 100, 100], "upper": [20, 200, 200]},
+              {"lower": [10, 201, 100], "upper": [20, 255, 200]},
+              {"lower": [10, 100, 201], "upper": [20, 255, 255]}]
+    assert len(merge_color_ranges(ranges)) == 3
+    assert merge_color_ranges(ranges, simplify=True) == [{"lower": [10, 100, 100], "upper": [20, 255, 255]}]
+    print("与原实现对照通过，跨0/180合并正确，精简不改变覆盖范围")
+
+    print(f"{'分布':<6}{'区间数':>8}{'原实现':>12}{'新实现':>12}{'精简':>12}{'合并后':>8}{'精简后':>8}")
+    for scattered, n in [(False, n) for n in (100, 1000, 3000, 10000)] + [(True, n) for n in (100, 1000, 3000, 10000)]:
+        ranges = _synthetic_ranges(n, scattered=scattered)
+        linear = [r for r in ranges if r["lower"][0] <= r["upper"][0]]
+        if n <= 1000:
+            start = time.perf_counter()
+            _merge_pairwise(linear)
+            old = f"{time.perf_counter() - start:>10.2f}s"
+        else:
+            old = f"{'-':>11}"
+        start = time.perf_counter()
+        merged = merge_color_ranges(ranges)
+        new = time.perf_counter() - start
+        start = time.perf_counter()
+        simplified = merge_color_ranges(ranges, simplify=True)
+        simplify_time = time.perf_counter() - start
+        print(f"{'散布' if scattered else '聚集':<6}{n:>8}{old}{new:>11.2f}s{simplify_time:>11.2f}s{len(merged):>8}{len(simplified):>8}")
+
 if __name__ == "__main__":
-    json_path = r"D:\1\desktop\IES_project\hsv_thresholds.json"
-    merge_hsv_thresholds(json_path)
\ No newline at end of file
+    # 用法: python merge_hsv_thresholds.py [阈值文件] [输出文件] [--simplify] | --bench
+    # 不给输出文件时写到输入旁的 <文件名>_merged.json，不改动受版本管理的hsv_thresholds.json
+    if "--bench" in sys.argv:
+        benchmark()
+    else:
+        paths = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+        json_path = paths[0] if paths else os.path.join(os.path.dirname(os.path.abspath(__file__)), "hsv_thresholds.json")
+        output_path = paths[1] if len(paths) > 1 else None
+        merge_hsv_thresholds(json_path, output_path, simplify="--simplify" in sys.argv)
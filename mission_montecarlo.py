@@ -0,0 +1,632 @@
+# mission_montecarlo.py
+# 任务参数的蒙特卡洛评估：在car_sim中按main_controller6的流程跑完整任务，
+# 随机化魔方摆放、光照（漏检、误认、像素噪声）和地面摩擦（打滑、牵引、电机响应），
+# 用进程池并行评估大量参数组合，按成功率和任务用时排序写出结果表
+import copy
+import csv
+import itertools
+import json
+import math
+import os
+import random
+import time
+
+from car_sim import CarSim, COLORS, CUBE_SIZE_CM
+from mission_plan import compile_mission
+from color_voting import ColorVoter
+from approach_controller import ApproachController, target_bearing
+from bypass_path import plan_bypass, TRACK_INTERVAL, TRACK_TIMEOUT
+from bearing_map import BearingMap, wrap_angle, HEADING_TOLERANCE_DEG, ROTATE_TIMEOUT, ROTATE_LEAD_TIME
+from state_estimator import CubeEstimator, MAX_POSITION_STD_CM, ODOMETRY_INTERVAL
+from time_alignment import TimestampedHistory
+
+# ===== 可配置参数（修改此处无需改动函数） =====
+# 1. 仿真
+SIM_DT = 0.01               # 仿真步长（秒）
+MISSION_TIMEOUT = 60.0      # 整个任务的最长时间（秒）
+CONFIRM_TIMEOUT = 10.0      # 状态1确认颜色的最长时间（秒），实车等待到投票器超时回退
+APPROACH_TIMEOUT = 30.0     # 接近魔方的最长时间（秒），与approach_cube_sequential一致
+APPROACH_INTERVAL = 0.02    # 接近控制周期（秒）
+SEARCH_SAMPLE_INTERVAL = 0.02  # 搜索时检查方位图的周期（秒）
+MAX_DISTANCE_AGE = 0.3      # 超声波距离超过此时间未更新视为失效（秒）
+COLLISION_CLEARANCE_CM = 12.0  # 车体中心到魔方中心小于此距离视为碰撞（魔方半边长+车体半宽）
+
+# 2. 场地随机化
+FIRST_CUBE_X_CM = (120.0, 170.0)  # 第一个魔方的纵向距离范围
+CUBE_SPACING_CM = (140.0, 190.0)  # 相邻魔方的纵向间距范围
+CUBE_LATERAL_CM = (-15.0, 15.0)   # 魔方的横向偏移范围
+TRACTION = (0.95, 1.05)           # 实际速度/编码器轮速（以实车标定的任务文件为准，低于0.95时矩形绕行短边不够宽）
+SLIP_NOISE = (0.02, 0.08)         # 车轮速度的相对噪声
+MOTOR_TAU = (0.1, 0.25)           # 电机一阶时间常数（秒）
+DROP_RATE = (0.0, 0.25)           # 色段漏检概率（光照）
+CONFUSION = (0.0, 0.05)           # 色段误认概率（光照）
+PIXEL_NOISE = (2.0, 10.0)         # 色段中心像素噪声（光照）
+
+# 3. 评估
+RUNS_PER_CANDIDATE = 100    # 每组参数的仿真次数（各组使用相同的场景，便于比较）
+FAILURE_PENALTY = 60.0      # 排序得分中每次失败折合的秒数
+RESULTS_FILE = "montecarlo_results.csv"
+
+# 控制参数的默认值（与main_controller6一致），大写名称为控制参数，其余为任务文件中的路径
+CONTROLLER_DEFAULTS = {
+    "COLOR_CONFIDENCE_THRESHOLD": 0.7,
+    "CONFIRM_FALLBACK_TIME": 3.0,
+    "DISTANCE_THRESHOLD": 55.0,
+    "APPROACH_MAX_SPEED": 1.5,
+    "BYPASS_MODE": 'rectangular',
+    "USE_STATE_ESTIMATE": True,
+}
+
+# 默认的参数网格：任务文件路径用点号分隔（列表用下标），如manoeuvres.bypass_left.0.time
+DEFAULT_SPACE = {
+    "speeds.search": [0.3, 0.4, 0.6],
+    "speeds.creep": [0.3, 0.5],
+    "DISTANCE_THRESHOLD": [45.0, 55.0, 65.0],
+    "APPROACH_MAX_SPEED": [1.2, 1.5],
+    "BYPASS_MODE": ['arc', 'rectangular'],
+}
+
+
+# ===== 场景 =====
+def make_scenario(seed, cube_count=3):
+    """
+    随机生成一个场地
+
+    Args:
+        seed: 随机种子（同一种子生成相同场地）
+        cube_count: 魔方数量，与任务状态数一致
+
+    Returns:
+        dict: {"seed", "cubes": [(x, y, 颜色), ...], "traction", "slip_noise", "motor_tau",
+               "drop_rate", "confusion", "pixel_noise"}
+    """
+    rng = random.Random(seed)
+    cubes = []
+    x = rng.uniform(*FIRST_CUBE_X_CM)
+    for i in range(cube_count):
+        # 第一个魔方手动放在正前方
+        y = 0.0 if i == 0 else rng.uniform(*CUBE_LATERAL_CM)
+        cubes.append((x, y, rng.choice(COLORS)))
+        x += rng.uniform(*CUBE_SPACING_CM)
+    return {
+        "seed": seed,
+        "cubes": cubes,
+        "traction": rng.uniform(*TRACTION),
+        "slip_noise": rng.uniform(*SLIP_NOISE),
+        "motor_tau": rng.uniform(*MOTOR_TAU),
+        "drop_rate": rng.uniform(*DROP_RATE),
+        "confusion": rng.uniform(*CONFUSION),
+        "pixel_noise": rng.uniform(*PIXEL_NOISE),
+    }
+
+
+def expected_sides(mission, cubes):
+    """按任务文件的绕行规则和魔方的真实颜色计算每个魔方应从哪侧通过"""
+    sides = []
+    for (_, _, rule, _, _), (_, _, color) in zip(mission.states, cubes):
+        if rule == 'opposite' and sides:
+            sides.append('right' if sides[-1] == 'left' else 'left')
+        else:
+            sides.append(mission.bypass_direction_for_color(color))
+    return sides
+
+
+# ===== 参数 =====
+def apply_params(plan, params):
+    """
+    把参数组合应用到任务描述和控制参数
+
+    Args:
+        plan: 任务描述（JSON字典）
+        params: {名称: 值}，大写名称为控制参数，其余为任务文件中的点号路径
+
+    Returns:
+        tuple: (新的任务描述, 控制参数字典)
+
+    Raises:
+        ValueError: 路径在任务文件中不存在
+    """
+    plan = copy.deepcopy(plan)
+    config = dict(CONTROLLER_DEFAULTS)
+    for name, value in params.items():
+        if name.isupper():
+            if name not in config:
+                raise ValueError(f"未知的控制参数: {name}")
+            config[name] = value
+            continue
+        node = plan
+        keys = name.split('.')
+        try:
+            for key in keys[:-1]:
+                node = node[int(key)] if isinstance(node, list) else node[key]
+            last = int(keys[-1]) if isinstance(node, list) else keys[-1]
+            node[last]  # 只允许修改已有的项
+        except (KeyError, IndexError, ValueError, TypeError):
+            raise ValueError(f"任务文件中没有参数: {name}")
+        node[last] = value
+    return plan, config
+
+
+# ===== 任务仿真 =====
+class MissionTimeout(Exception):
+    """任务超过MISSION_TIMEOUT"""
+
+
+class MissionSim:
+    """
+    在car_sim中按main_controller6.handle_state_sequential的流程执行任务
+
+    颜色确认、方位图搜索、接近控制、圆弧/矩形绕行都使用实车的同一套类，
+    传感器回调在每个仿真步中按数据到达的时间调用。
+    """
+
+    def __init__(self, plan, config, scenario, dt=SIM_DT):
+        self.mission = compile_mission(plan)
+        self.config = config
+        self.scenario = scenario
+        self.dt = dt
+        self.sim = CarSim(scenario["cubes"], seed=scenario["seed"], motor_tau=scenario["motor_tau"],
+                          slip_noise=scenario["slip_noise"], traction=scenario["traction"],
+                          pixel_noise=scenario["pixel_noise"], drop_rate=scenario["drop_rate"],
+                          confusion=scenario["confusion"])
+        self.estimator = CubeEstimator()
+        self.headings = TimestampedHistory(max_age=5.0)
+        self.target_color = None
+        self.frame_listener = None   # 搜索或确认颜色时接收新帧的函数
+        self.last_frame_time = None
+        self.last_distance_time = None
+        self.next_odometry = 0.0
+        self.passes = {}             # 魔方下标 -> (通过的一侧, 通过时的横向距离)
+        self.last_bypass_direction = None
+
+    # ===== 仿真推进和传感器回调 =====
+    def tick(self):
+        sim = self.sim
+        sim.step(self.dt)
+        heading = sim.get_odometry_pose()[2]
+        self.headings.add(sim.t, heading)
+        # 里程计按状态估计线程的频率采样；设置目标颜色时估计会被重置，之前的采样不影响结果
+        if sim.t >= self.next_odometry:
+            self.next_odometry += ODOMETRY_INTERVAL
+            if self.target_color is not None and self.config["USE_STATE_ESTIMATE"]:
+                v, omega = sim.get_body_velocity()
+                self.estimator.add_odometry(sim.t, v, omega)
+
+        frame_time = sim.get_latest_color_timestamp()
+        if frame_time is not None and frame_time != self.last_frame_time:
+            self.last_frame_time = frame_time
+            color_data = sim.get_latest_color_data()
+            if self.target_color is not None and self.config["USE_STATE_ESTIMATE"]:
+                bearing = target_bearing(self.target_color, color_data)
+                if bearing is not None:
+                    self.estimator.add_bearing(frame_time, bearing)
+            if self.frame_listener is not None:
+                self.frame_listener(color_data, frame_time)
+
+        distance_time = sim.get_latest_distance_timestamp()
+        if distance_time is not None and distance_time != self.last_distance_time:
+            self.last_distance_time = distance_time
+            distance = sim.get_latest_distance()
+            if distance > 0 and self.target_color is not None and self.config["USE_STATE_ESTIMATE"]:
+                self.estimator.add_range(distance_time, distance)
+
+        # 记录车体经过每个魔方时在哪一侧
+        for index, (cx, cy, _) in enumerate(sim.cubes):
+            if index not in self.passes and sim.x >= cx:
+                self.passes[index] = ('left' if sim.y > cy else 'right', abs(sim.y - cy))
+        if sim.t > MISSION_TIMEOUT:
+            raise MissionTimeout()
+
+    def wait(self, seconds):
+        end = self.sim.t + seconds - 1e-9
+        while self.sim.t < end:
+            self.tick()
+
+    def run_manoeuvre(self, name):
+        mission = self.mission
+        start, end = mission.manoeuvres[name]
+        for i in range(start, end):
+            self.sim.set_motor_speed(mission.left[i], mission.right[i])
+            self.wait(mission.duration[i])
+
+    # ===== 各步骤 =====
+    def confirm_color(self):
+        voter = ColorVoter(threshold=self.config["COLOR_CONFIDENCE_THRESHOLD"],
+                           fallback_after=self.config["CONFIRM_FALLBACK_TIME"])
+        self.frame_listener = voter.add_frame
+        try:
+            start = self.sim.t
+            while self.sim.t - start < CONFIRM_TIMEOUT:
+                color = voter.decide()
+                if color:
+                    return color
+                self.wait(0.1)
+        finally:
+            self.frame_listener = None
+        return None
+
+    def search(self):
+        bearing_map = BearingMap()
+
+        def on_frame(color_data, timestamp):
+            heading = self.headings.interpolate(timestamp)
+            if heading is None:
+                heading = self.sim.get_odometry_pose()[2]
+            bearing_map.add_frame(heading, color_data, timestamp)
+
+        self.frame_listener = on_frame
+        speed = None
+        try:
+            for sign, speed, sweep_time in self.mission.search:
+                self.sim.rotate_in_place('counterclockwise' if sign > 0 else 'clockwise', speed)
+                start = self.sim.t
+                while self.sim.t - start < sweep_time and not bearing_map.is_unambiguous():
+                    self.wait(SEARCH_SAMPLE_INTERVAL)
+                if bearing_map.is_unambiguous():
+                    break
+        finally:
+            self.frame_listener = None
+
+        target = bearing_map.best_target()
+        if target is None:
+            self.sim.set_motor_speed(0, 0)
+            return None
+        # 闭环转向目标方位（同bearing_map.rotate_to_heading）
+        tolerance = math.radians(HEADING_TOLERANCE_DEG)
+        start = self.sim.t
+        direction = None
+        while self.sim.t - start < ROTATE_TIMEOUT:
+            error = wrap_angle(target["bearing"] - self.sim.get_odometry_pose()[2])
+            omega = (self.sim.right_target - self.sim.left_target) * math.pi * 6.5 / 15.0
+            if abs(error) <= tolerance + abs(omega) * ROTATE_LEAD_TIME:
+                break
+            wanted = 'counterclockwise' if error > 0 else 'clockwise'
+            if wanted != direction:
+                direction = wanted
+                self.sim.rotate_in_place(direction, speed)
+            self.wait(0.02)
+        self.sim.set_motor_speed(0, 0)
+        return target["color"]
+
+    def approach(self, color):
+        sim = self.sim
+        controller = ApproachController(stop_distance=self.config["DISTANCE_THRESHOLD"],
+                                        max_speed=self.config["APPROACH_MAX_SPEED"])
+        start = sim.t
+        try:
+            while sim.t - start < APPROACH_TIMEOUT:
+                distance = sim.get_latest_distance()
+                distance_time = sim.get_latest_distance_timestamp()
+                if distance <= 0 or distance_time is None or sim.t - distance_time > MAX_DISTANCE_AGE:
+                    distance, distance_time = None, None
+                    if self.config["USE_STATE_ESTIMATE"]:
+                        estimate = self._estimate()
+                        if estimate is not None:
+                            distance, distance_time = estimate["range"], sim.t
+                bearing = target_bearing(color, sim.get_latest_color_data())
+                left, right = controller.update(sim.t, bearing, sim.get_latest_color_timestamp(),
+                                                distance, distance_time)
+                sim.set_motor_speed(left, right)
+                if controller.arrived:
+                    return True
+                self.wait(APPROACH_INTERVAL)
+        finally:
+            sim.set_motor_speed(0, 0)
+        return False
+
+    def _estimate(self):
+        estimate = self.estimator.get_estimate(self.sim.t)
+        if estimate is None or estimate["position_std"] > MAX_POSITION_STD_CM:
+            return None
+        return estimate
+
+    def bypass(self, direction):
+        if self.config["BYPASS_MODE"] == 'arc':
+            estimate = self._estimate() if self.config["USE_STATE_ESTIMATE"] else None
+            if estimate is not None:
+                cube_x, cube_y = estimate["x"], -estimate["y"]
+            else:
+                cube_x, cube_y = self.config["DISTANCE_THRESHOLD"] + CUBE_SIZE_CM / 2.0, 0.0
+            tracker = plan_bypass(direction, cube_x, cube_y, self.sim.get_odometry_pose())
+            if tracker is not None:
+                start = self.sim.t
+                while self.sim.t - start < TRACK_TIMEOUT:
+                    left, right = tracker.update(self.sim.get_odometry_pose())
+                    if tracker.done:
+                        return
+                    self.sim.set_motor_speed(left, right)
+                    self.wait(TRACK_INTERVAL)
+        self.run_manoeuvre(f"bypass_{direction}")
+
+    def run_state(self, state_plan):
+        """
+        Returns:
+            str: None表示状态完成，否则为失败原因
+        """
+        _, acquire, bypass_rule, start, on_search_fail = state_plan
+        if start:
+            self.run_manoeuvre(start)
+        if acquire == 'confirm':
+            color = self.confirm_color()
+            if color is None:
+                return 'confirm_timeout'
+        else:
+            color = self.search()
+            if color is None:
+                if on_search_fail:
+                    self.run_manoeuvre(on_search_fail)
+                return None
+        self.target_color = color
+        self.estimator.reset()
+        if not self.approach(color):
+            return 'approach_timeout'
+        if bypass_rule == 'opposite':
+            direction = 'right' if self.last_bypass_direction == 'left' else 'left'
+        else:
+            direction = self.mission.bypass_direction_for_color(color)
+        self.last_bypass_direction = direction
+        self.bypass(direction)
+        self.target_color = None
+        return None
+
+    def run(self):
+        """
+        执行整个任务
+
+        Returns:
+            dict: {"success", "time", "reason", "min_clearance"}
+        """
+        reason = None
+        try:
+            for state_plan in self.mission.states:
+                reason = self.run_state(state_plan)
+                if reason is not None:
+                    break
+            if reason is None:
+                self.run_manoeuvre("final_sprint")
+        except MissionTimeout:
+            reason = 'timeout'
+
+        sim = self.sim
+        if reason is None and sim.min_clearance < COLLISION_CLEARANCE_CM:
+            reason = 'collision'
+        if reason is None:
+            sides = expected_sides(self.mission, sim.cubes)
+            for index, side in enumerate(sides):
+                if index not in self.passes:
+                    reason = 'missed'
+                    break
+                if self.passes[index][0] != side:
+                    reason = 'wrong_side'
+                    break
+        return {"success": reason is None, "time": sim.t, "reason": reason or '',
+                "min_clearance": sim.min_clearance}
+
+
+def run_mission(plan, params, scenario):
+    """用一组参数在一个场景中仿真一次任务"""
+    mission_plan, config = apply_params(plan, params)
+    return MissionSim(mission_plan, config, scenario).run()
+
+
+# ===== 并行评估 =====
+_worker_plan = None
+
+
+def _init_worker(plan):
+    """进程池初始化：任务描述只传一次"""
+    global _worker_plan
+    _worker_plan = plan
+
+
+def _run_task(task):
+    """进程池任务：(参数组下标, 参数, 场景种子) -> (参数组下标, 结果)"""
+    index, params, seed = task
+    scenario = make_scenario(seed, len(_worker_plan.get("states", [])))
+    return index, run_mission(_worker_plan, params, scenario)
+
+
+def grid_candidates(space):
+    """
+    参数网格的全部组合
+
+    Args:
+        space: {名称: [候选值, ...]}
+
+    Returns:
+        list: [{名称: 值}, ...]
+    """
+    names = list(space)
+    return [dict(zip(names, values)) for values in itertools.product(*(space[n] for n in names))]
+
+
+def random_candidates(space, count, seed=0):
+    """
+    在参数空间中随机采样
+
+    Args:
+        space: {名称: [候选值, ...] 或 (下限, 上限)}，元组表示连续区间
+        count: 采样数量
+
+    Returns:
+        list: [{名称: 值}, ...]
+    """
+    rng = random.Random(seed)
+    candidates = []
+    for _ in range(count):
+        params = {}
+        for name, values in space.items():
+            if isinstance(values, tuple):
+                params[name] = round(rng.uniform(*values), 3)
+            else:
+                params[name] = rng.choice(values)
+        candidates.append(params)
+    return candidates
+
+
+def summarize(params, results):
+    """
+    汇总一组参数的仿真结果
+
+    Returns:
+        dict: 参数、次数、成功率、成功任务的平均/p90用时、各失败原因次数、排序得分
+    """
+    times = sorted(r["time"] for r in results if r["success"])
+    n = len(results)
+    success = len(times)
+    reasons = {}
+    for r in results:
+        if not r["success"]:
+            reasons[r["reason"]] = reasons.get(r["reason"], 0) + 1
+    mean_time = sum(times) / success if success else float('nan')
+    p90 = times[min(success - 1, int(math.ceil(0.9 * success)) - 1)] if success else float('nan')
+    failure_rate = 1.0 - success / n if n else 1.0
+    # 得分：成功任务的平均用时 + 失败率 × 罚时，越小越好
+    score = (mean_time if success else MISSION_TIMEOUT) + FAILURE_PENALTY * failure_rate
+    return {"params": params, "runs": n, "success_rate": success / n if n else 0.0,
+            "mean_time": mean_time, "p90_time": p90, "reasons": reasons,
+            "min_clearance": min((r["min_clearance"] for r in results), default=float('nan')),
+            "score": score}
+
+
+def evaluate_candidates(plan, candidates, runs=RUNS_PER_CANDIDATE, workers=None, seed=0, chunksize=8):
+    """
+    用进程池评估所有参数组合，每组在相同的runs个场景上仿真
+
+    Args:
+        plan: 基准任务描述
+        candidates: [{名称: 值}, ...]
+        runs: 每组的仿真次数
+        workers: 进程数，默认为CPU核数；1表示在当前进程中顺序执行
+        seed: 场景种子的起点
+
+    Returns:
+        list: 按得分排序的summarize结果
+    """
+    tasks = [(index, params, seed + run) for index, params in enumerate(candidates) for run in range(runs)]
+    results = [[] for _ in candidates]
+    if workers == 1:
+        _init_worker(plan)
+        for task in tasks:
+            index, result = _run_task(task)
+            results[index].append(result)
+    else:
+        import multiprocessing
+        with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(plan,)) as pool:
+            for index, result in pool.imap_unordered(_run_task, tasks, chunksize=chunksize):
+                results[index].append(result)
+    summaries = [summarize(params, r) for params, r in zip(candidates, results)]
+    summaries.sort(key=lambda s: s["score"])
+    return summaries
+
+
+def refine_candidates(summaries, space, count, top=3, seed=0):
+    """
+    在排名靠前的参数附近采样（局部搜索）：每个新组合从前top名中选一个，
+    随机改变一个参数为网格中的相邻值，连续区间则在±10%内扰动
+
+    Returns:
+        list: 新的参数组合（不含已评估过的）
+    """
+    rng = random.Random(seed)
+    seen = {json.dumps(s["params"], sort_keys=True) for s in summaries}
+    candidates = []
+    for _ in range(count * 10):
+        if len(candidates) >= count:
+            break
+        params = dict(rng.choice(summaries[:top])["params"])
+        name = rng.choice(list(space))
+        values = space[name]
+        if isinstance(values, tuple):
+            low, high = values
+            params[name] = round(min(high, max(low, params[name] * rng.uniform(0.9, 1.1))), 3)
+        else:
+            i = values.index(params[name]) if params[name] in values else 0
+            params[name] = values[max(0, min(len(values) - 1, i + rng.choice((-1, 1))))]
+        key = json.dumps(params, sort_keys=True)
+        if key not in seen:
+            seen.add(key)
+            candidates.append(params)
+    return candidates
+
+
+def write_results(summaries, path=RESULTS_FILE):
+    """把排序后的结果写成CSV"""
+    names = sorted({name for s in summaries for name in s["params"]})
+    reasons = sorted({reason for s in summaries for reason in s["reasons"]})
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(["rank"] + names + ["runs", "success_rate", "mean_time", "p90_time",
+                                            "min_clearance", "score"] + reasons)
+        for rank, s in enumerate(summaries, 1):
+            writer.writerow([rank] + [s["params"].get(name, '') for name in names]
+                            + [s["runs"], f"{s['success_rate']:.3f}", f"{s['mean_time']:.2f}",
+                               f"{s['p90_time']:.2f}", f"{s['min_clearance']:.1f}", f"{s['score']:.2f}"]
+                            + [s["reasons"].get(reason, 0) for reason in reasons])
+
+
+def load_plan(json_path="mission_plan.json"):
+    """读取任务描述（JSON字典，不编译）"""
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    with open(os.path.join(current_dir, json_path), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+# 以下仅用于测试
+
+# ===== 命令行：参数扫描 =====
+# python mission_montecarlo.py [--runs N] [--workers K] [--random N] [--refine N] [--out 文件] [--scaling]
+if __name__ == "__main__":
+    import sys
+
+    def option(name, default, cast=int):
+        if name in sys.argv:
+            return cast(sys.argv[sys.argv.index(name) + 1])
+        return default
+
+    plan = load_plan()
+    runs = option("--runs", RUNS_PER_CANDIDATE)
+    workers = option("--workers", os.cpu_count())
+    out = option("--out", RESULTS_FILE, str)
+
+    if "--scaling" in sys.argv:
+        # 扩展性：同一批任务在不同进程数下的吞吐量
+        candidates = [{}]
+        count = option("--runs", 64)
+        print(f"{'进程数':>6}{'任务数':>8}{'用时':>8}{'任务/秒':>10}{'加速比':>8}")
+        base = None
+        k = 1
+        while k <= os.cpu_count():
+            start = time.perf_counter()
+            evaluate_candidates(plan, candidates, runs=count, workers=k)
+            elapsed = time.perf_counter() - start
+            base = base or elapsed
+            print(f"{k:>6}{count:>8}{elapsed:>7.2f}s{count / elapsed:>10.1f}{base / elapsed:>8.2f}")
+            k *= 2
+        sys.exit(0)
+
+    space = DEFAULT_SPACE
+    if "--random" in sys.argv:
+        candidates = random_candidates(space, option("--random", 20))
+    else:
+        candidates = grid_candidates(space)
+    candidates.insert(0, {})  # 当前参数作为基准
+    print(f"评估{len(candidates)}组参数 × {runs}个场景，{workers}个进程")
+    start = time.perf_counter()
+    summaries = evaluate_candidates(plan, candidates, runs=runs, workers=workers)
+    refine = option("--refine", 0)
+    if refine:
+        extra = refine_candidates(summaries, space, refine)
+        print(f"在前几名附近再评估{len(extra)}组")
+        summaries = sorted(summaries + evaluate_candidates(plan, extra, runs=runs, workers=workers),
+                           key=lambda s: s["score"])
+    elapsed = time.perf_counter() - start
+    total = sum(s["runs"] for s in summaries)
+    print(f"共{total}次任务仿真，用时{elapsed:.1f}s（{total / elapsed:.0f}次/秒）")
+    write_results(summaries, out)
+    print(f"结果已写入 {out}")
+    print(f"{'排名':>4}  {'成功率':>6}{'平均用时':>9}{'得分':>8}  参数")
+    for rank, s in enumerate(summaries[:10], 1):
+        label = ", ".join(f"{k}={v}" for k, v in s["params"].items()) or "当前参数"
+        mean_time = f"{s['mean_time']:>8.1f}s" if not math.isnan(s['mean_time']) else f"{'-':>9}"
+        print(f"{rank:>4}  {s['success_rate']:>6.1%}{mean_time}{s['score']:>8.1f}  {label}")
@@ -0,0 +1,334 @@
+# mission_plan.py
+# 声明式任务文件：用JSON描述各状态、搜索方式和绕行等动作分段，
+# 启动前校验并编译成扁平的预分配步骤表，由紧凑的执行器按绝对截止时间执行
+import json
+import os
+import time
+from array import array
+
+# ===== 可配置参数（修改此处无需改动函数） =====
+DEFAULT_MISSION_FILE = "mission_plan.json"  # 默认任务文件
+SPIN_THRESHOLD = 0.001  # 截止时间前最后这段时间（秒）改为忙等，减小sleep的唤醒误差
+
+# 支持的取值
+STEP_TYPES = ("straight", "rotate", "drive")
+DIRECTIONS = ("clockwise", "counterclockwise")
+ACQUIRE_MODES = ("confirm", "search")
+BYPASS_RULES = ("color", "opposite")
+
+
+class MissionSchedule:
+    """
+    编译后的任务：所有动作的步骤展开到同一组预分配数组中
+
+    第i步为：左轮速度left[i]、右轮速度right[i]，保持duration[i]秒。
+    manoeuvres把动作名映射到步骤区间[start, end)。
+    """
+
+    def __init__(self, step_count):
+        self.left = array('d', [0.0]) * step_count
+        self.right = array('d', [0.0]) * step_count
+        self.duration = array('d', [0.0]) * step_count
+        self.lateness = array('d', [0.0]) * step_count  # 最近一次执行时每步的启动延迟（秒）
+        self.labels = [""] * step_count
+        self.manoeuvres = {}   # 名称 -> (start, end)
+        self.states = []       # 每个状态的 (id, acquire, bypass, start, on_search_fail)
+        self.search = []       # 搜索扫描 (符号, 速度, 时间)，逆时针为+1
+        self.color_sides = {}  # 颜色 -> 'left'/'right'
+        self.source = None     # 任务文件路径
+
+    def bypass_direction_for_color(self, color):
+        """按颜色决定绕行方向，未配置的颜色默认右侧"""
+        return self.color_sides.get(color, 'right')
+
+
+def load_mission(json_path=DEFAULT_MISSION_FILE):
+    """
+    读取、校验并编译任务文件
+
+    Args:
+        json_path: 任务文件路径，相对路径以本文件所在目录为基准
+
+    Returns:
+        MissionSchedule: 编译后的任务
+
+    Raises:
+        ValueError: 任务文件内容不合法
+    """
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    json_path = os.path.join(current_dir, json_path)
+    with open(json_path, 'r', encoding='utf-8') as f:
+        plan = json.load(f)
+    schedule = compile_mission(plan)
+    schedule.source = json_path
+    return schedule
+
+
+def compile_mission(plan):
+    """
+    校验任务描述并编译成步骤表
+
+    Args:
+        plan: 任务描述（load后的JSON字典）
+
+    Returns:
+        MissionSchedule: 编译后的任务
+
+    Raises:
+        ValueError: 任务描述不合法，消息中包含出错位置
+    """
+    errors = []
+    speeds = plan.get("speeds", {})
+    if not isinstance(speeds, dict):
+        errors.append("speeds: 应为对象")
+        speeds = {}
+    for name, value in speeds.items():
+        if not _is_number(value):
+            errors.append(f"speeds.{name}: 应为数字")
+
+    manoeuvres = plan.get("manoeuvres")
+    if not isinstance(manoeuvres, dict) or not manoeuvres:
+        errors.append("manoeuvres: 至少需要一个动作")
+        manoeuvres = {}
+
+    # 第一遍：校验并展开所有步骤
+    compiled = []  # (动作名, [(left, right, duration, label), ...])
+    for name, steps in manoeuvres.items():
+        if not isinstance(steps, list):
+            errors.append(f"manoeuvres.{name}: 应为步骤列表")
+            continue
+        expanded = []
+        for i, step in enumerate(steps):
+            where = f"manoeuvres.{name}[{i}]"
+            result = _compile_step(step, speeds, where, errors)
+            if result is not None:
+                expanded.append(result)
+        compiled.append((name, expanded))
+
+    # 搜索扫描
+    search = []
+    sweeps = plan.get("search", [])
+    if not isinstance(sweeps, list):
+        errors.append("search: 应为扫描列表")
+        sweeps = []
+    for i, sweep in enumerate(sweeps):
+        where = f"search[{i}]"
+        if not isinstance(sweep, dict):
+            errors.append(f"{where}: 应为对象")
+            continue
+        if sweep.get("direction") not in DIRECTIONS:
+            errors.append(f"{where}.direction: 应为{DIRECTIONS}之一")
+            continue
+        speed = _resolve_speed(sweep.get("speed"), speeds, f"{where}.speed", errors)
+        duration = sweep.get("time")
+        if not _is_number(duration) or duration <= 0:
+            errors.append(f"{where}.time: 应为正数")
+            continue
+        if speed is not None:
+            sign = 1 if sweep["direction"] == "counterclockwise" else -1
+            search.append((sign, speed, float(duration)))
+
+    # 各状态
+    states = []
+    state_plans = plan.get("states", [])
+    if not isinstance(state_plans, list):
+        errors.append("states: 应为状态列表")
+        state_plans = []
+    for i, state in enumerate(state_plans):
+        where = f"states[{i}]"
+        if not isinstance(state, dict):
+            errors.append(f"{where}: 应为对象")
+            continue
+        if state.get("acquire") not in ACQUIRE_MODES:
+            errors.append(f"{where}.acquire: 应为{ACQUIRE_MODES}之一")
+        if state.get("bypass") not in BYPASS_RULES:
+            errors.append(f"{where}.bypass: 应为{BYPASS_RULES}之一")
+        if state.get("acquire") == "search" and not search:
+            errors.append(f"{where}: 使用search但未定义搜索扫描")
+        if i == 0 and state.get("bypass") == "opposite":
+            errors.append(f"{where}.bypass: 第一个状态没有上一次绕行方向")
+        for key in ("start", "on_search_fail"):
+            ref = state.get(key)
+            if ref is not None and ref not in manoeuvres:
+                errors.append(f"{where}.{key}: 未定义的动作'{ref}'")
+        states.append((state.get("id", i + 1), state.get("acquire"), state.get("bypass"),
+                       state.get("start"), state.get("on_search_fail")))
+    if not states:
+        errors.append("states: 至少需要一个状态")
+
+    for name in ("bypass_left", "bypass_right"):
+        if name not in manoeuvres:
+            errors.append(f"manoeuvres.{name}: 缺少绕行动作")
+    if "final_sprint" not in manoeuvres:
+        errors.append("manoeuvres.final_sprint: 缺少最终冲刺动作")
+
+    color_sides = {}
+    sides = plan.get("color_sides", {})
+    if not isinstance(sides, dict):
+        errors.append("color_sides: 应为对象")
+        sides = {}
+    for side, colors in sides.items():
+        if side not in ("left", "right"):
+            errors.append(f"color_sides.{side}: 应为left或right")
+            continue
+        if not isinstance(colors, list):
+            errors.append(f"color_sides.{side}: 应为颜色名列表")
+            continue
+        for color in colors:
+            if not isinstance(color, str):
+                errors.append(f"color_sides.{side}: 颜色名应为字符串，得到{color!r}")
+                continue
+            if color in color_sides:
+                errors.append(f"color_sides: 颜色'{color}'同时出现在两侧")
+            color_sides[color] = side
+
+    if errors:
+        raise ValueError("任务文件错误:\n  " + "\n  ".join(errors))
+
+    # 第二遍：写入预分配数组
+    total = sum(len(steps) for _, steps in compiled)
+    schedule = MissionSchedule(total)
+    index = 0
+    for name, steps in compiled:
+        start = index
+        for left, right, duration, label in steps:
+            schedule.left[index] = left
+            schedule.right[index] = right
+            schedule.duration[index] = duration
+            schedule.labels[index] = label
+            index += 1
+        schedule.manoeuvres[name] = (start, index)
+    schedule.states = states
+    schedule.search = search
+    schedule.color_sides = color_sides
+    return schedule
+
+
+def _compile_step(step, speeds, where, errors):
+    """把一个步骤描述编译成(left, right, duration, label)，出错时记录并返回None"""
+    if not isinstance(step, dict):
+        errors.append(f"{where}: 应为对象")
+        return None
+    step_type = step.get("type")
+    if step_type not in STEP_TYPES:
+        errors.append(f"{where}.type: 应为{STEP_TYPES}之一")
+        return None
+    duration = step.get("time")
+    if not _is_number(duration) or duration < 0:
+        errors.append(f"{where}.time: 应为非负数")
+        return None
+
+    if step_type == "drive":
+        left = _resolve_speed(step.get("left"), speeds, f"{where}.left", errors, signed=True)
+        right = _resolve_speed(step.get("right"), speeds, f"{where}.right", errors, signed=True)
+    else:
+        speed = _resolve_speed(step.get("speed"), speeds, f"{where}.speed", errors)
+        if speed is None:
+            return None
+        if step_type == "straight":
+            left = right = speed
+        elif step.get("direction") == "clockwise":
+            left, right = speed, -speed
+        elif step.get("direction") == "counterclockwise":
+            left, right = -speed, speed
+        else:
+            errors.append(f"{where}.direction: 应为{DIRECTIONS}之一")
+            return None
+    if left is None or right is None:
+        return None
+    label = step.get("label", step_type)
+    return float(left), float(right), float(duration), label
+
+
+def _resolve_speed(value, speeds, where, errors, signed=False):
+    """速度可以是数字或speeds中的名称"""
+    if isinstance(value, str):
+        if value not in speeds:
+            errors.append(f"{where}: 未定义的速度'{value}'")
+            return None
+        value = speeds[value]
+    if not _is_number(value) or (value < 0 and not signed):
+        errors.append(f"{where}: 应为{'数字' if signed else '非负数'}或speeds中的名称")
+        return None
+    return value
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+# ===== 执行器 =====
+def run_manoeuvre(schedule, name, set_speed, verbose=True):
+    """
+    执行一个编译好的动作
+
+    每步按绝对截止时间推进，避免sleep误差累积；截止前SPIN_THRESHOLD秒内忙等。
+    每步的启动延迟（实际下发时间减去截止时间）记录在schedule.lateness中。
+
+    Args:
+        schedule: MissionSchedule
+        name: 动作名
+        set_speed: 下发轮速的函数，参数为(left, right)
+        verbose: 是否打印每步说明
+    """
+    start, end = schedule.manoeuvres[name]
+    left, right, duration, lateness = schedule.left, schedule.right, schedule.duration, schedule.lateness
+    labels = schedule.labels
+    perf_counter, sleep = time.perf_counter, time.sleep
+
+    deadline = perf_counter()
+    for i in range(start, end):
+        lateness[i] = perf_counter() - deadline
+        set_speed(left[i], right[i])
+        if verbose:
+            print(f"执行第{i - start + 1}步：{labels[i]}")
+        deadline += duration[i]
+        remaining = deadline - perf_counter()
+        if remaining > SPIN_THRESHOLD:
+            sleep(remaining - SPIN_THRESHOLD)
+        while perf_counter() < deadline:
+            pass
+
+
+def lateness_stats(schedule, name):
+    """
+    统计动作最近一次执行时每步的启动延迟
+
+    Returns:
+        dict: {"steps", "mean_us", "max_us"}
+    """
+    start, end = schedule.manoeuvres[name]
+    values = schedule.lateness[start:end]
+    if not values:
+        return {"steps": 0, "mean_us": 0.0, "max_us": 0.0}
+    return {
+        "steps": len(values),
+        "mean_us": sum(values) / len(values) * 1e6,
+        "max_us": max(values) * 1e6,
+    }
+
+
+# 以下仅用于测试
+
+# ===== 校验任务文件并测量执行器开销（不驱动电机） =====
+if __name__ == "__main__":
+    import sys
+
+    path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_MISSION_FILE
+    mission = load_mission(path)
+    print(f"已编译 {mission.source}: {len(mission.left)} 步, 动作: {', '.join(mission.manoeuvres)}")
+    for name, (start, end) in mission.manoeuvres.items():
+        total = sum(mission.duration[start:end])
+        print(f"  {name}: {end - start} 步, 共 {total:.2f}s")
+
+    # 用空函数代替电机，测量执行器本身的每步开销
+    commands = []
+    for name in ("bypass_left", "bypass_right"):
+        start, end = mission.manoeuvres[name]
+        saved = mission.duration[start:end]
+        for i in range(start, end):
+            mission.duration[i] = 0.002  # 缩短时间以快速测试
+        run_manoeuvre(mission, name, lambda l, r: commands.append((l, r)), verbose=False)
+        mission.duration[start:end] = saved
+        stats = lateness_stats(mission, name)
+        print(f"  {name}: 每步启动延迟 平均 {stats['mean_us']:.1f}us, 最大 {stats['max_us']:.1f}us")
@@ -0,0 +1,415 @@
+#! /usr/bin/env python3
+# mission_runtime.py
+# 基于asyncio的任务运行时：传感器线程通过线程安全队列把数据送入事件循环，
+# 每个阶段都是等待传感器事件或运动完成（带超时）的协程，
+# 状态切换的延迟由事件到达决定，而不是time.sleep的粒度
+#
+# 与main_controller6（顺序版本）并存：两者共用任务文件、子系统初始化、传感器回调、
+# 安全反射和电机仲裁，只是阶段的等待方式不同。顺序版本仍是实车默认入口，
+# 也是run_recorder离线回放所驱动的版本；本运行时在实车上验证切换延迟的收益后再替换它，
+# 在此之前两者的阶段划分须保持一致（见MissionRuntime）
+
+import asyncio
+import math
+import time
+from collections import namedtuple
+
+from motor_controller import set_motor_speed, rotate_in_place, get_odometry_pose, \
+    release_motor, stop_motor
+
+from detect_color import add_color_listener, remove_color_listener
+from detect_distance import add_distance_listener, remove_distance_listener
+
+from approach_controller import ApproachController
+from bypass_path import TRACK_INTERVAL, TRACK_TIMEOUT
+from bearing_map import SweepRecorder, wrap_angle, HEADING_TOLERANCE_DEG, ROTATE_TIMEOUT
+from run_recorder import mark_run
+
+import main_controller6 as mc
+
+# ===== 可配置参数（修改此处无需改动函数） =====
+EVENT_QUEUE_SIZE = 32         # 事件队列长度，满了丢弃最旧的事件
+STARTUP_TIMEOUT = 5.0         # 启动时等待第一帧和第一个距离的最长时间（秒）
+CONFIRM_TIMEOUT = 10.0        # 状态1确认颜色的最长时间（秒）
+APPROACH_TIMEOUT = 30.0       # 接近魔方的最长时间（秒）
+SEARCH_SAMPLE_INTERVAL = 0.02  # 搜索时航向采样周期（秒），也是等待帧事件的最长间隔
+
+# 传感器事件：kind为'color'或'distance'，timestamp为采集时间，arrival为进入事件循环的时间
+SensorEvent = namedtuple("SensorEvent", ["kind", "value", "timestamp", "arrival"])
+
+# 阶段结果：reason为'event'/'timeout'/'done'
+PhaseResult = namedtuple("PhaseResult", ["value", "reason", "event"])
+
+
+class SensorEventBridge:
+    """
+    传感器线程到事件循环的桥
+
+    颜色检测和距离测量的回调运行在各自线程中，通过loop.call_soon_threadsafe
+    把数据放入asyncio.Queue，协程用await等待下一个事件。
+    """
+
+    def __init__(self, loop, maxsize=EVENT_QUEUE_SIZE):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0
+        self.latest = {}  # 每种事件最新的SensorEvent
+
+    # ----- 运行在传感器线程 -----
+    def on_color_frame(self, color_data, timestamp):
+        self.loop.call_soon_threadsafe(self._put, "color", color_data, timestamp)
+
+    def on_distance_sample(self, distance, timestamp):
+        self.loop.call_soon_threadsafe(self._put, "distance", distance, timestamp)
+
+    # ----- 运行在事件循环 -----
+    def _put(self, kind, value, timestamp):
+        event = SensorEvent(kind, value, timestamp, time.monotonic())
+        self.latest[kind] = event
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+    def start(self):
+        """注册传感器回调"""
+        add_color_listener(self.on_color_frame)
+        add_distance_listener(self.on_distance_sample)
+
+    def stop(self):
+        """注销传感器回调"""
+        remove_color_listener(self.on_color_frame)
+        remove_distance_listener(self.on_distance_sample)
+
+    def drain(self):
+        """丢弃队列中积压的旧事件（新阶段开始时调用）"""
+        while not self.queue.empty():
+            self.queue.get_nowait()
+
+    async def next_event(self, timeout, kinds=None):
+        """
+        等待下一个传感器事件
+
+        Args:
+            timeout: 最长等待时间（秒）
+            kinds: 只接收这些类型的事件，None表示全部
+
+        Returns:
+            SensorEvent: 事件，超时返回None
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            try:
+                event = await asyncio.wait_for(self.queue.get(), remaining)
+            except asyncio.TimeoutError:
+                return None
+            if kinds is None or event.kind in kinds:
+                return event
+
+
+class MissionRuntime:
+    """三个魔方任务的异步实现，阶段划分与main_controller6的顺序版本一致"""
+
+    def __init__(self, bridge):
+        self.bridge = bridge
+        # 与顺序版本共用状态管理器，颜色确认计数等逻辑保持一致
+        self.state_manager = mc.state_manager
+        self.transition_latencies = []  # (阶段名, 采集到决策的延迟, 到达到决策的延迟)
+
+    # ----- 工具协程 -----
+    def _record_transition(self, name, event):
+        """记录由事件触发的状态切换延迟"""
+        if event is None:
+            return
+        now = time.monotonic()
+        self.transition_latencies.append((name, now - event.timestamp, now - event.arrival))
+
+    async def motion(self, left, right, duration):
+        """
+        以指定轮速运动一段时间，等待期间让出事件循环
+
+        前方障碍由安全反射和电机仲裁处理（与顺序版本相同），这里不另做判断。
+
+        Args:
+            left: 左轮速度（转/秒）
+            right: 右轮速度（转/秒）
+            duration: 运动时间（秒）
+        """
+        if duration <= 0:
+            return
+        set_motor_speed(left, right)
+        await asyncio.sleep(duration)
+
+    async def confirm_color(self, timeout):
+        """
+        等待颜色帧并确认颜色，每帧到达立即处理
+
+        Returns:
+            PhaseResult: value为确认的颜色，超时为None
+        """
+        self.state_manager.color_voter.reset()
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            event = await self.bridge.next_event(remaining, kinds=("color",))
+            if event is None:
+                return PhaseResult(None, "timeout", None)
+            color = mc.detect_and_confirm_color(event.value, event.timestamp)
+            if color:
+                self._record_transition("confirm_color", event)
+                return PhaseResult(color, "event", event)
+
+    async def search(self):
+        """
+        按任务文件中的搜索扫描依次原地旋转，每帧到达时加入方位图，
+        方位图明确后立即停止并转向最佳方位
+
+        Returns:
+            str: 目标魔方颜色，未找到返回None
+        """
+        recorder = SweepRecorder()
+        self.bridge.drain()
+        speed = None
+        for index, (sign, speed, sweep_time) in enumerate(mc.mission.search):
+            direction = 'counterclockwise' if sign > 0 else 'clockwise'
+            print(f"搜索魔方，第{index + 1}阶段：{direction}")
+            rotate_in_place(direction, speed, source='search')
+            deadline = time.monotonic() + sweep_time
+            recorder.update()
+            while time.monotonic() < deadline:
+                event = await self.bridge.next_event(min(deadline - time.monotonic(), SEARCH_SAMPLE_INTERVAL))
+                if event is not None and event.kind == "color":
+                    recorder.on_color_frame(event.value, event.timestamp)
+                recorder.update()
+                if recorder.map.is_unambiguous():
+                    self._record_transition("search_done", event)
+                    break
+            if recorder.map.is_unambiguous():
+                break
+
+        target = recorder.map.best_target()
+        if target is None:
+            release_motor('search', hold=False)
+            print("搜索结束，未找到魔方")
+            return None
+        print(f"方位图确定目标: {target['color']}，{target['hits']}帧")
+        try:
+            await self._rotate_to_heading(recorder.tracker, target["bearing"], speed)
+        finally:
+            release_motor('search', hold=False)
+        return target["color"]
+
+    async def _rotate_to_heading(self, tracker, target, speed):
+        """闭环原地旋转到目标航向（异步版本的bearing_map.rotate_to_heading）"""
+        tolerance = math.radians(HEADING_TOLERANCE_DEG)
+        deadline = time.monotonic() + ROTATE_TIMEOUT
+        direction = None
+        while time.monotonic() < deadline:
+            error = wrap_angle(target - tracker.sample())
+            if abs(error) <= tolerance:
+                return True
+            wanted = 'counterclockwise' if error > 0 else 'clockwise'
+            if wanted != direction:
+                direction = wanted
+                rotate_in_place(direction, speed, source='search')
+            await asyncio.sleep(SEARCH_SAMPLE_INTERVAL)
+        print("转向目标方位超时")
+        return False
+
+    async def run_manoeuvre(self, name):
+        """
+        执行任务文件中的动作
+
+        Returns:
+            bool: 是否完成
+        """
+        schedule = mc.mission
+        start, end = schedule.manoeuvres[name]
+        try:
+            for i in range(start, end):
+                await self.motion(schedule.left[i], schedule.right[i], schedule.duration[i])
+        finally:
+            release_motor('manoeuvre')
+        return True
+
+    async def approach(self, color):
+        """
+        接近魔方：每个颜色或距离事件到达时（最长间隔一个控制周期）更新接近控制器
+
+        Returns:
+            bool: 是否成功接近魔方
+        """
+        print(f"开始接近{color}魔方")
+        self.bridge.drain()
+        controller = ApproachController(stop_distance=mc.DISTANCE_THRESHOLD, max_speed=mc.APPROACH_MAX_SPEED)
+        deadline = time.monotonic() + APPROACH_TIMEOUT
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    print("接近魔方超时")
+                    return False
+                event = await self.bridge.next_event(min(remaining, mc.APPROACH_INTERVAL))
+                distance, source = mc.approach_step(controller, color)
+                if controller.arrived:
+                    if event is not None:
+                        self._record_transition("approach_done", event)
+                    print(f"已接近魔方，距离: {controller.predicted_distance():.1f}cm（来源: {source}）")
+                    return True
+        finally:
+            # 到达时速度已降到0；超时则停车
+            release_motor('approach', hold=False)
+
+    async def bypass(self, direction):
+        """按mc.BYPASS_MODE绕行，圆弧路径放不下或跟踪超时时执行任务文件中的矩形绕行"""
+        if mc.BYPASS_MODE == 'arc':
+            tracker = mc.plan_arc_bypass(direction)
+            if tracker is not None:
+                print(f"开始{direction}侧圆弧路径绕行")
+                if await self.follow_path(tracker):
+                    print("圆弧路径绕行完成")
+                    return True
+                print("圆弧路径跟踪超时，改为矩形绕行")
+        print(f"开始{direction}侧矩形路径绕行")
+        if not await self.run_manoeuvre(f"bypass_{direction}"):
+            return False
+        print("矩形路径绕行完成")
+        return True
+
+    async def follow_path(self, tracker):
+        """
+        按控制周期跟踪圆弧路径，两次控制之间让出事件循环
+
+        Returns:
+            bool: 是否在超时前到达终点
+        """
+        deadline = time.monotonic() + TRACK_TIMEOUT
+        try:
+            while time.monotonic() < deadline:
+                left, right = tracker.update(get_odometry_pose())
+                if tracker.done:
+                    return True
+                set_motor_speed(left, right)
+                await asyncio.sleep(TRACK_INTERVAL)
+        finally:
+            # 保持最后的速度继续前进，直到下一个来源接手
+            release_motor('manoeuvre')
+        return False
+
+    async def pass_cube(self, color, bypass_rule):
+        """接近并绕过已确认颜色的魔方"""
+        self.state_manager.detected_color = color
+        mc.set_target_color(color)
+        mc.set_mono_target_color(color)
+        if not await self.approach(color):
+            return False
+        direction = self.state_manager.determine_bypass_direction(bypass_rule)
+        print(f"决定{direction}侧绕行")
+        return await self.bypass(direction)
+
+    async def run_state(self, state_plan):
+        """
+        执行任务文件中的一个状态
+
+        Returns:
+            bool: 状态是否完成
+        """
+        state_id, acquire, bypass_rule, start, on_search_fail = state_plan
+        print(f"开始执行状态{state_id}: 识别并通过第{state_id}个魔方")
+        if start and not await self.run_manoeuvre(start):
+            return False
+
+        if acquire == 'confirm':
+            self.bridge.drain()
+            result = await self.confirm_color(CONFIRM_TIMEOUT)
+            color = result.value
+            if not color:
+                print(f"未能确认魔方颜色，状态{state_id}未完成")
+                return False
+        else:
+            color = await self.search()
+            if not color:
+                print(f"搜索魔方失败，状态{state_id}未完成，保持直行")
+                return await self.run_manoeuvre(on_search_fail) if on_search_fail else True
+        print(f"确认魔方颜色: {color}")
+        return await self.pass_cube(color, bypass_rule)
+
+    async def run(self):
+        """按任务文件依次执行各状态和最终冲刺"""
+        for state_plan in mc.mission.states:
+            self.state_manager.current_state = state_plan[0]
+            if not await self.run_state(state_plan):
+                print(f"状态{state_plan[0]}执行失败，程序退出")
+                return False
+            print(f"状态{state_plan[0]}完成")
+        print("开始最终冲刺")
+        await self.run_manoeuvre("final_sprint")
+        print("任务完成！")
+        return True
+
+    def print_latency_stats(self):
+        """打印各状态切换的延迟"""
+        for name, capture_latency, arrival_latency in self.transition_latencies:
+            print(f"{name}: 采集->决策 {capture_latency*1000:.1f}ms, 到达->决策 {arrival_latency*1000:.2f}ms")
+        if self.bridge.dropped:
+            print(f"事件队列溢出丢弃: {self.bridge.dropped}")
+
+
+async def wait_until_ready(bridge, timeout=STARTUP_TIMEOUT):
+    """
+    等待第一帧颜色结果和第一个有效距离，替代固定的启动等待
+
+    Returns:
+        bool: 是否在超时前收到两类数据
+    """
+    start = time.monotonic()
+    seen = set()
+    while seen != {"color", "distance"}:
+        event = await bridge.next_event(timeout - (time.monotonic() - start))
+        if event is None:
+            print(f"启动超时，已收到: {sorted(seen)}")
+            return False
+        seen.add(event.kind)
+    print(f"传感器就绪，用时 {time.monotonic() - start:.2f}s")
+    return True
+
+
+async def main_async():
+    """异步版本的主控制函数"""
+    bridge = SensorEventBridge(asyncio.get_running_loop())
+    bridge.start()
+    runtime = MissionRuntime(bridge)
+    try:
+        if not await wait_until_ready(bridge):
+            return
+        # 回放和延迟追踪以此标记为任务开始（与顺序版本一致）
+        mark_run("mission_start")
+        await runtime.run()
+    finally:
+        stop_motor()
+        bridge.stop()
+        runtime.print_latency_stats()
+
+
+def main():
+    try:
+        # 先编译任务文件，文件有误时不初始化硬件
+        mc.load_mission_plan()
+        if not mc.init_subsystems():
+            return
+        asyncio.run(main_async())
+    except KeyboardInterrupt:
+        print("\n程序被用户中断")
+    except Exception as e:
+        print(f"程序出错: {e}")
+    finally:
+        mc.cleanup_subsystems()
+        print("程序结束，资源已清理")
+
+
+# 程序入口
+if __name__ == "__main__":
+    main()
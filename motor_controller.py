@@ -1,22 +1,46 @@
 # motor_controller.py
-from sys import set_asyncgen_hooks
 import RPi.GPIO as GPIO
 import time
 import threading
+import math
+from collections import deque
 import numpy as np
-import matplotlib.pyplot as plt
+
+from thread_watchdog import heartbeat
+from shared_state import SharedState
 
 # 引脚定义
 EA, I2, I1, EB, I3, I4, LS, RS = (13, 19, 26, 16, 20, 21, 6, 12)
 #EA, I4, I3, EB, I1, I2, LS, RS = (13, 19, 26, 16, 20, 21, 6, 12)
 FREQUENCY = 100  # PWM频率100Hz，使电机转动更平滑
 
+# 车体几何参数（用于里程计，需实测后修改）
+WHEEL_DIAMETER_CM = 6.5   # 车轮直径(cm)
+WHEEL_BASE_CM = 15.0      # 左右轮间距(cm)
+ENCODER_PULSES_PER_REV = 585.0  # 编码器每圈脉冲数
+
+# 电机指令仲裁（优先级高的来源抢占低的）
+SOURCE_PRIORITIES = {'watchdog': 4, 'safety': 3, 'manoeuvre': 2, 'approach': 1, 'search': 0}
+DEFAULT_SOURCE = 'manoeuvre'     # 未指定来源的set_motor_speed调用视为动作
+SAFETY_DISTANCE_CM = 20.0        # 前进时距离低于此值立即停车，与detect_distance.MIN_DISTANCE_CM一致
+SAFETY_HYSTERESIS_CM = 5.0       # 距离超过安全距离加此余量后解除停车
+SAFETY_BLIND_SEC = 1.0           # 安全停车期间超过此时间没有原始测距（传感器失效）时连旋转、后退也停下，不解除停车
+OWNER_LOG_SIZE = 600             # 保留最近多少个周期的电机归属记录
+
 # 速度计数器变量
-lspeed = 0  # 左轮实际速度
-rspeed = 0  # 右轮实际速度
+# 左右轮每个测速周期的转数（不分方向），PID速度环的测量值（目标速度按同一标度整定），测速线程写、其他线程读
+wheel_state = SharedState("WheelSpeeds", ("left", "right"), initial=(0.0, 0.0))
+# 左右轮实际转速（转/秒，不分方向，即每周期转数除以周期时长），用于里程计和状态估计
+wheel_rate_state = SharedState("WheelRates", ("left", "right"), initial=(0.0, 0.0))
 lcounter = 0
 rcounter = 0
 
+# 里程计位姿（以启动时为原点，x向前，y向左，heading逆时针为正，单位cm/弧度）
+odom_x = 0.0
+odom_y = 0.0
+odom_heading = 0.0
+odom_lock = threading.Lock()
+
 # 全局PWM对象
 pwma_global = None
 pwmb_global = None
@@ -28,9 +52,24 @@ right_pid_global = None
 # 运行标志
 running = True
 
-# 目标速度变量
-left_target_speed = 0
-right_target_speed = 0
+# 目标速度变量（转/秒，正值前进），只在持有arbiter_lock时写
+target_state = SharedState("TargetSpeeds", ("left", "right"), initial=(0, 0))
+
+# 指令仲裁状态
+motor_commands = {}      # 来源 -> (left, right, 过期时间或None)
+held_command = None      # 最近释放的指令 (left, right, 来源)，没有其他指令时继续保持
+motor_owner = 'idle'     # 当前拥有电机的来源
+safety_stop = None       # 安全停车开始的时间，None为未停车（停车期间只拦截前进，只有足够远的新测距能解除）
+safety_blind = False     # 安全停车期间测距中断（此时拦截所有运动）
+last_raw_distance = None # 最近一次有读数的原始测距（过滤前）到达的时间
+owner_ticks = {}         # 来源 -> 拥有电机的周期数
+owner_log = deque(maxlen=OWNER_LOG_SIZE)  # 每个周期的 (时间, 来源)
+arbiter_lock = threading.RLock()
+
+# 回调函数列表（用于记录原始数据）
+encoder_listeners = []   # 每个测速周期的回调，参数为(左轮脉冲数, 右轮脉冲数, dt, 时间)
+command_listeners = []   # 下发到电机的目标速度或归属变化时的回调，参数为(left, right, 来源, 时间)
+pwm_listeners = []       # 每个PWM周期设置占空比后的回调，参数为(左PWM, 右PWM, 时间)
 
 # 初始化GPIO
 def init_gpio()-> tuple:
@@ -62,20 +101,142 @@ def encoder_callback(channel)-> None:
 
 # 速度监测线程函数
 def speed_monitor(interval=0.1):
-    global rspeed, lspeed, lcounter, rcounter
+    global lcounter, rcounter
     GPIO.add_event_detect(LS, GPIO.RISING, callback=encoder_callback)
     GPIO.add_event_detect(RS, GPIO.RISING, callback=encoder_callback)
     
+    last_time = time.monotonic()
     while running:
-        # 计算每秒转速
-        rspeed = (rcounter / 585.0)  # 585脉冲/圈
-        lspeed = (lcounter / 585.0)
+        left_count, right_count = lcounter, rcounter
         rcounter = 0
         lcounter = 0
-        # print(rspeed, " ",lspeed)
-        # print(left_target_speed," ",right_target_speed)
+        # print(get_wheel_speeds())
+        # print(get_target_speeds())
+
+        # 计算轮速并积分里程计位姿
+        now = time.monotonic()
+        update_wheel_speeds(left_count, right_count, now - last_time, now)
+        last_time = now
+        heartbeat("speed_monitor")
         time.sleep(interval)
 
+def update_wheel_speeds(left_count, right_count, dt, timestamp=None):
+    """
+    根据一个测速周期的编码器脉冲数更新轮速并积分里程计（测速线程和离线回放共用）
+    
+    Args:
+        left_count: 左轮脉冲数
+        right_count: 右轮脉冲数
+        dt: 距离上次积分的时间（秒）
+        timestamp: 本周期结束的时间，默认为time.monotonic()
+    """
+    if timestamp is None:
+        timestamp = time.monotonic()
+    
+    # 计算每个测速周期的转数（PID速度环使用）
+    rspeed = (right_count / ENCODER_PULSES_PER_REV)  # 585脉冲/圈
+    lspeed = (left_count / ENCODER_PULSES_PER_REV)
+    wheel_state.write(timestamp, lspeed, rspeed)
+    # 除以周期时长得到每秒转速（里程计、状态估计使用）
+    if dt > 0:
+        wheel_rate_state.write(timestamp, lspeed / dt, rspeed / dt)
+    _integrate_odometry(dt)
+    
+    if encoder_listeners:
+        for callback in list(encoder_listeners):
+            try:
+                callback(left_count, right_count, dt, timestamp)
+            except Exception as e:
+                print(f"编码器回调出错: {e}")
+
+def _integrate_odometry(dt):
+    """
+    根据当前轮速积分里程计位姿（内部使用）
+    
+    Args:
+        dt: 距离上次积分的时间（秒）
+    """
+    global odom_x, odom_y, odom_heading
+    
+    v, omega = get_body_velocity()
+    with odom_lock:
+        # 用中点航向积分，转弯时误差更小
+        mid_heading = odom_heading + omega * dt / 2
+        odom_x += v * math.cos(mid_heading) * dt
+        odom_y += v * math.sin(mid_heading) * dt
+        odom_heading += omega * dt
+
+# 获取车体速度
+def get_body_velocity():
+    """
+    根据编码器轮速计算车体线速度和角速度
+    
+    编码器只计脉冲数不分方向，转动方向取自目标速度的正负
+    
+    Returns:
+        tuple: (线速度cm/s，向前为正；角速度rad/s，逆时针为正)
+    """
+    wheel_circumference = math.pi * WHEEL_DIAMETER_CM
+    wheels, targets = wheel_rate_state.read(), target_state.read()
+    v_left = math.copysign(wheels.left, targets.left) * wheel_circumference
+    v_right = math.copysign(wheels.right, targets.right) * wheel_circumference
+    v = (v_left + v_right) / 2.0
+    omega = (v_right - v_left) / WHEEL_BASE_CM
+    return v, omega
+
+# 获取指令车体速度
+def get_commanded_body_velocity():
+    """
+    根据目标轮速计算指令车体速度（编码器不可用时用“指令角速度×时间”估计航向）
+    
+    Returns:
+        tuple: (线速度cm/s，向前为正；角速度rad/s，逆时针为正)
+    """
+    wheel_circumference = math.pi * WHEEL_DIAMETER_CM
+    targets = target_state.read()
+    v_left = targets.left * wheel_circumference
+    v_right = targets.right * wheel_circumference
+    return (v_left + v_right) / 2.0, (v_right - v_left) / WHEEL_BASE_CM
+
+# 获取轮速
+def get_wheel_speeds():
+    """
+    获取编码器测得的左右轮速度（同一测速周期，不加锁）
+    
+    Returns:
+        namedtuple: (version, timestamp, left, right)，每个测速周期的转数（PID速度环的标度），不分方向；
+                    每秒转速见wheel_rate_state
+    """
+    return wheel_state.read()
+
+# 获取目标速度
+def get_target_speeds():
+    """
+    获取当前下发的左右轮目标速度（同一次仲裁，不加锁）
+    
+    Returns:
+        namedtuple: (version, timestamp, left, right)，转/秒，正值前进
+    """
+    return target_state.read()
+
+# 获取里程计位姿
+def get_odometry_pose():
+    """
+    获取里程计积分得到的位姿
+    
+    Returns:
+        tuple: (x cm, y cm, heading 弧度)
+    """
+    with odom_lock:
+        return odom_x, odom_y, odom_heading
+
+# 重置里程计位姿
+def reset_odometry(x=0.0, y=0.0, heading=0.0):
+    """将里程计位姿重置为指定值"""
+    global odom_x, odom_y, odom_heading
+    with odom_lock:
+        odom_x, odom_y, odom_heading = x, y, heading
+
 # 启动速度监测
 def start_speed_monitor():
     thread = threading.Thread(target=speed_monitor)
@@ -91,23 +252,30 @@ def pwm_update_daemon(interval=0.1):
     Args:
         interval: 更新间隔时间（秒）
     """
-    global left_pid_global, right_pid_global, lspeed, rspeed, left_target_speed, right_target_speed
+    global left_pid_global, right_pid_global
     
     while running:
+        # 仲裁本周期由哪个来源控制电机（处理过期指令并记录归属）
+        _arbiter_tick()
+
         # 如果PID控制器已初始化且有目标速度
         if left_pid_global is not None and right_pid_global is not None:
             # 计算PWM值
-            left_pwm = left_pid_global.update(lspeed)
-            right_pwm = right_pid_global.update(rspeed)
+            wheels, targets = wheel_state.read(), target_state.read()
+            left_pwm = left_pid_global.update(wheels.left)
+            right_pwm = right_pid_global.update(wheels.right)
             
             # 根据目标速度的正负设置方向
-            if left_target_speed < 0:
+            if targets.left < 0:
                 left_pwm = -left_pwm
-            if right_target_speed < 0:
+            if targets.right < 0:
                 right_pwm = -right_pwm
             
             # 设置电机PWM
             _set_motor_pwm(left_pwm, right_pwm)
+            if pwm_listeners:
+                _notify_pwm_listeners(left_pwm, right_pwm, time.monotonic())
+        heartbeat("pwm")
             
         # 等待指定的间隔时间
         time.sleep(interval)
@@ -205,19 +373,19 @@ def _set_motor_pwm(left=0, right=0):
         pwma_global.ChangeDutyCycle(min(abs(right), 100))
 
 # 基于速度的电机控制（使用PID）
-def set_motor_speed(left_target=0.5, right_target=0.5):
+def _apply_target_speed(left_target, right_target, timestamp=None):
     """
-    设置左右电机的目标速度（使用PID控制）
+    设置左右电机的目标速度（内部使用，只由仲裁调用，调用前需持有arbiter_lock）
     
     Args:
         left_target: 左电机目标速度（转/秒），正值表示前进，负值表示后退
         right_target: 右电机目标速度（转/秒），正值表示前进，负值表示后退
+        timestamp: 下发时间，默认为time.monotonic()
     """
-    global left_pid_global, right_pid_global, left_target_speed, right_target_speed
+    global left_pid_global, right_pid_global
     
-    # 更新全局目标速度变量
-    left_target_speed = left_target
-    right_target_speed = right_target
+    # 更新目标速度
+    target_state.write(time.monotonic() if timestamp is None else timestamp, left_target, right_target)
     
     # 如果PID控制器未初始化，创建新的
     if left_pid_global is None:
@@ -232,39 +400,301 @@ def set_motor_speed(left_target=0.5, right_target=0.5):
     
     # 注意：不再在这里直接计算PWM值和调用_set_motor_pwm
     # PWM更新由守护进程负责
+
+def _arbitrate(now=None):
+    """
+    选出优先级最高的有效指令并下发（内部使用，调用前需持有arbiter_lock）
+    
+    Returns:
+        str: 当前拥有电机的来源，没有指令时为'idle'，保持已释放指令时为'hold:来源'
+    """
+    global motor_owner
+    
+    if now is None:
+        now = time.monotonic()
+    for source in [s for s, (_, _, expires) in motor_commands.items() if expires is not None and expires <= now]:
+        del motor_commands[source]
+    
+    if motor_commands:
+        owner = max(motor_commands, key=lambda s: SOURCE_PRIORITIES.get(s, -1))
+        left, right, _ = motor_commands[owner]
+    elif held_command is not None:
+        left, right, source = held_command
+        owner = 'hold:' + source
+    else:
+        left, right, owner = 0, 0, 'idle'
+    # 安全停车期间只拦截前进：原地旋转、后退照常下发，车可以自己离开障碍；
+    # 测距中断时看不到障碍，所有运动都拦截
+    if safety_stop is not None and owner != 'watchdog' and (safety_blind or _is_forward(left, right)):
+        left, right, owner = 0, 0, 'safety'
+    
+    targets = target_state.read()
+    changed = (left, right) != (targets.left, targets.right) or owner != motor_owner
+    if changed or left_pid_global is None:
+        _apply_target_speed(left, right, now)
+    motor_owner = owner
+    if changed:
+        for callback in list(command_listeners):
+            try:
+                callback(left, right, owner, now)
+            except Exception as e:
+                print(f"电机指令回调出错: {e}")
+    return owner
+
+def _arbiter_tick():
+    """PWM周期调用：重新仲裁并记录本周期的电机归属"""
+    global safety_blind
+    
+    with arbiter_lock:
+        now = time.monotonic()
+        if safety_stop is not None:
+            blind = last_raw_distance is None or now - last_raw_distance > SAFETY_BLIND_SEC
+            if blind != safety_blind:
+                safety_blind = blind
+                print("\n安全停车期间测距中断，全部停车" if blind else "\n测距恢复，安全停车只拦截前进")
+        owner = _arbitrate(now)
+        owner_ticks[owner] = owner_ticks.get(owner, 0) + 1
+        owner_log.append((now, owner))
+
+def set_motor_speed(left_target=0.5, right_target=0.5, source=DEFAULT_SOURCE, ttl=None):
+    """
+    设置左右电机的目标速度（使用PID控制）
+    
+    指令先交给仲裁：来源优先级为 watchdog > safety > manoeuvre > approach > search，
+    只有当前优先级最高的来源的指令会下发到电机，其余来源的指令保留到被抢占结束。
+    安全停车期间（见safety_reflex）除watchdog外的前进指令下发为停车。
+    
+    Args:
+        left_target: 左电机目标速度（转/秒），正值表示前进，负值表示后退
+        right_target: 右电机目标速度（转/秒），正值表示前进，负值表示后退
+        source: 指令来源，SOURCE_PRIORITIES中的名称
+        ttl: 指令有效时间（秒），None表示直到释放或被同来源的新指令替换
+    
+    Returns:
+        tuple: 目标速度的绝对值
+    """
+    global held_command
+    
+    with arbiter_lock:
+        expires = None if ttl is None else time.monotonic() + ttl
+        motor_commands[source] = (left_target, right_target, expires)
+        if source not in ('safety', 'watchdog'):
+            # 新的来源接手后，之前释放时保持的速度不再有效
+            held_command = None
+        _arbitrate()
     
     return abs(left_target), abs(right_target)  # 返回目标速度的绝对值
 
+def release_motor(source=DEFAULT_SOURCE, hold=True):
+    """
+    释放来源对电机的控制
+    
+    Args:
+        source: 指令来源
+        hold: 是否让电机保持该来源最后的速度，直到其他来源下发指令（与原来不释放时的行为一致）
+    """
+    global held_command
+    
+    with arbiter_lock:
+        command = motor_commands.pop(source, None)
+        if hold and command is not None:
+            held_command = (command[0], command[1], source)
+        elif held_command is not None and held_command[2] == source:
+            held_command = None
+        _arbitrate()
+
+def get_motor_owner():
+    """
+    Returns:
+        str: 当前拥有电机的来源
+    """
+    return motor_owner
+
+def get_owner_stats():
+    """
+    Returns:
+        dict: {来源: 拥有电机的周期数}
+    """
+    with arbiter_lock:
+        return dict(owner_ticks)
+
+def print_owner_stats():
+    """打印各来源拥有电机的周期数"""
+    stats = get_owner_stats()
+    total = sum(stats.values())
+    if total == 0:
+        return
+    print("电机归属: " + ", ".join(f"{source} {count}周期({count / total:.0%})"
+                                  for source, count in sorted(stats.items(), key=lambda item: -item[1])))
+
+# 安全反射
+def _is_forward(left, right):
+    """指令是否在前进（两轮都不后退且合成速度向前；原地旋转、后退不算）"""
+    return left + right > 0 and min(left, right) >= 0
+
+def _release_safety(reason):
+    """解除安全停车并恢复被拦截的来源（调用前需持有arbiter_lock）"""
+    global safety_stop, safety_blind
+    safety_stop = None
+    safety_blind = False
+    owner = _arbitrate()
+    print(f"\n障碍解除（{reason}），恢复{owner}")
+
+def safety_reflex(distance, timestamp=None, threshold_cm=SAFETY_DISTANCE_CM):
+    """
+    测距回调（在测距线程中以传感器频率运行）：前进时距离过近立即停车
+    
+    停车期间拦截所有来源（看门狗除外）的前进指令，原地旋转、后退不受影响；
+    只有通过过滤、且超过阈值加余量的新测距才解除停车。传感器失效或读数被过滤时
+    不会有回调，停车一直保持；SAFETY_BLIND_SEC内没有原始测距（见safety_raw_sample）
+    时连旋转、后退也拦截，直到测距恢复。
+    
+    Args:
+        distance: 通过过滤的距离(cm)
+        timestamp: 采集时间（未使用，与距离回调的参数一致）
+        threshold_cm: 安全距离(cm)
+    """
+    global safety_stop, last_raw_distance
+    
+    with arbiter_lock:
+        last_raw_distance = time.monotonic()
+        if safety_stop is not None:
+            if distance > threshold_cm + SAFETY_HYSTERESIS_CM:
+                _release_safety(f"距离: {distance:.1f}cm")
+            return
+        if not 0 < distance < threshold_cm:
+            return
+        # 当前在前进时才停车
+        owner = motor_owner
+        if owner == 'watchdog':
+            return
+        targets = target_state.read()
+        if _is_forward(targets.left, targets.right):
+            safety_stop = time.monotonic()
+            _arbitrate()
+            print(f"\n安全停车: 距离 {distance:.1f}cm，拦截{owner}的前进指令")
+
+def safety_raw_sample(distance, timestamp=None):
+    """
+    原始测距回调（过滤前的每次测量，注册到detect_distance.add_raw_distance_listener）
+
+    只记录传感器是否还有读数，供安全停车判断测距是否中断；不解除停车
+
+    Args:
+        distance: 测量值(cm)，小于0表示无效
+        timestamp: 采集时间（未使用，与距离回调的参数一致）
+    """
+    global last_raw_distance
+    if distance >= 0:
+        last_raw_distance = time.monotonic()
+
+# 注册编码器回调
+def add_encoder_listener(callback):
+    """
+    注册编码器回调，每个测速周期在测速线程中调用
+    
+    Args:
+        callback: 回调函数，参数为(左轮脉冲数, 右轮脉冲数, dt, timestamp)，应尽快返回
+    """
+    if callback not in encoder_listeners:
+        encoder_listeners.append(callback)
+
+# 注销编码器回调
+def remove_encoder_listener(callback):
+    """注销编码器回调"""
+    if callback in encoder_listeners:
+        encoder_listeners.remove(callback)
+
+# 注册电机指令回调
+def add_command_listener(callback):
+    """
+    注册电机指令回调，仲裁后下发的目标速度或电机归属变化时调用（持有arbiter_lock）
+    
+    Args:
+        callback: 回调函数，参数为(left, right, 来源, timestamp)，应尽快返回
+    """
+    if callback not in command_listeners:
+        command_listeners.append(callback)
+
+# 注销电机指令回调
+def remove_command_listener(callback):
+    """注销电机指令回调"""
+    if callback in command_listeners:
+        command_listeners.remove(callback)
+
+# 注册PWM周期回调
+def add_pwm_listener(callback):
+    """
+    注册PWM周期回调，每个PWM周期设置占空比后在PWM守护线程中调用
+    
+    Args:
+        callback: 回调函数，参数为(左PWM, 右PWM, timestamp)，应尽快返回
+    """
+    if callback not in pwm_listeners:
+        pwm_listeners.append(callback)
+
+# 注销PWM周期回调
+def remove_pwm_listener(callback):
+    """注销PWM周期回调"""
+    if callback in pwm_listeners:
+        pwm_listeners.remove(callback)
+
+def _notify_pwm_listeners(left_pwm, right_pwm, timestamp):
+    """依次调用PWM周期回调（内部使用）"""
+    for callback in list(pwm_listeners):
+        try:
+            callback(left_pwm, right_pwm, timestamp)
+        except Exception as e:
+            print(f"PWM回调出错: {e}")
+
+# 重置指令仲裁状态
+def reset_arbiter():
+    """清空所有来源的指令、保持的速度和归属统计（离线回放开始时调用）"""
+    global held_command, motor_owner, safety_stop, safety_blind, last_raw_distance
+    
+    with arbiter_lock:
+        motor_commands.clear()
+        safety_stop = None
+        safety_blind = False
+        last_raw_distance = None
+        held_command = None
+        motor_owner = 'idle'
+        owner_ticks.clear()
+        owner_log.clear()
+        _apply_target_speed(0, 0)
+
 # 使用原地转向函数
-def rotate_in_place(direction, speed=0.5):
+def rotate_in_place(direction, speed=0.5, source=DEFAULT_SOURCE):
     """
     控制小车原地转向
     
     Args:
         direction: 转向方向，'clockwise'顺时针，'counterclockwise'逆时针
         speed: 转向速度（转/秒）
+        source: 指令来源
     """
     if direction == 'clockwise':
         # 左轮正转，右轮反转
-        set_motor_speed(speed, -speed)
+        set_motor_speed(speed, -speed, source)
     elif direction == 'counterclockwise':
         # 左轮反转，右轮正转
-        set_motor_speed(-speed, speed)
+        set_motor_speed(-speed, speed, source)
     else:
         print("方向参数错误，应为'clockwise'或'counterclockwise'")
 
 # 直线行驶函数
-def drive_straight(speed=0.5):
+def drive_straight(speed=0.5, source=DEFAULT_SOURCE):
     """
     控制小车直线行驶
     
     Args:
         speed: 行驶速度（转/秒），正值表示前进，负值表示后退
+        source: 指令来源
     """
-    set_motor_speed(speed, speed)
+    set_motor_speed(speed, speed, source)
 
 # 基于颜色检测的直线行驶函数
-def drive_with_color(color_offset, speed=0.5, offset_factor=0.2):
+def drive_with_color(color_offset, speed=0.5, offset_factor=0.2, source='approach'):
     """
     根据颜色检测的偏移量控制小车行驶
     
@@ -272,6 +702,7 @@ def drive_with_color(color_offset, speed=0.5, offset_factor=0.2):
         color_offset: 颜色中心相对于画面中心的偏移量
         speed: 基础速度（转/秒）
         offset_factor: 偏移影响因子，范围0到1
+        source: 指令来源
     """
     left_speed = speed
     right_speed = speed
@@ -286,17 +717,38 @@ def drive_with_color(color_offset, speed=0.5, offset_factor=0.2):
         # 目标在左侧，减小左轮速度
         left_speed = speed * (1 - offset_factor * normalized_offset)
     
-    set_motor_speed(left_speed, right_speed)
+    set_motor_speed(left_speed, right_speed, source)
 
 # 停止电机
 def stop_motor():
-    """停止电机"""
+    """停止电机，清除所有来源的指令"""
+    global held_command
+    
+    with arbiter_lock:
+        motor_commands.clear()
+        held_command = None
+        _arbitrate()
     if left_pid_global is not None:
         left_pid_global.reset()
     if right_pid_global is not None:
         right_pid_global.reset()
     _set_motor_pwm(0, 0)
 
+# 紧急停车
+def emergency_stop():
+    """
+    看门狗安全停车：以watchdog来源抢占电机，并直接把PWM置零（PWM守护线程可能已停止）
+    
+    之后release_motor('watchdog', hold=False)解除，其他来源的指令仍然保留
+    """
+    set_motor_speed(0, 0, source='watchdog')
+    if left_pid_global is not None:
+        left_pid_global.reset()
+    if right_pid_global is not None:
+        right_pid_global.reset()
+    if pwma_global is not None and pwmb_global is not None:
+        _set_motor_pwm(0, 0)
+
 # 清理函数
 def cleanup():
     """清理资源"""
@@ -314,6 +766,32 @@ def cleanup():
 
 # ===== 测试代码 =====
 if __name__ == "__main__":
+    import sys
+
+    # 离线检查（不需要硬件）：里程计积分的距离与编码器脉冲数换算的距离一致
+    if "--check" in sys.argv:
+        reset_odometry()
+        with arbiter_lock:
+            _apply_target_speed(1.0, 1.0)
+        interval = 0.1
+        pulses = 0
+        for count in (40, 80, 117, 117, 117, 117, 90, 50):
+            update_wheel_speeds(count, count, interval)
+            pulses += count
+        expected = pulses / ENCODER_PULSES_PER_REV * math.pi * WHEEL_DIAMETER_CM
+        x, y, heading = get_odometry_pose()
+        assert abs(x - expected) < 1e-6 and abs(y) < 1e-9 and abs(heading) < 1e-12, (x, expected)
+        # 原地旋转：两轮反向相同脉冲数，转过的角度 = 轮子走过的弧长×2/轮距
+        reset_odometry()
+        with arbiter_lock:
+            _apply_target_speed(-0.5, 0.5)
+        for _ in range(5):
+            update_wheel_speeds(60, 60, interval)
+        arc = 5 * 60 / ENCODER_PULSES_PER_REV * math.pi * WHEEL_DIAMETER_CM
+        assert abs(get_odometry_pose()[2] - 2 * arc / WHEEL_BASE_CM) < 1e-9
+        print(f"里程计检查通过: {pulses}个脉冲 -> {x:.1f}cm（车轮周长换算 {expected:.1f}cm）")
+        sys.exit(0)
+
     try:
         # 初始化GPIO和PWM
         pwma, pwmb = init_gpio()
@@ -355,15 +833,16 @@ if __name__ == "__main__":
         # 主循环
         while True:
             # 显示当前速度
+            wheels = get_wheel_speeds()
             print("\r左轮速度: {:.2f} 右轮速度: {:.2f} 当前设置: {:.2f}转/秒 偏移: {}".format(
-                lspeed, rspeed, speed, color_offset), end="")
+                wheels.left, wheels.right, speed, color_offset), end="")
             
             # 记录数据
             if record_data:
                 current_time = time.time() - start_time
                 time_data.append(current_time)
-                left_speed_data.append(lspeed)
-                right_speed_data.append(rspeed)
+                left_speed_data.append(wheels.left)
+                right_speed_data.append(wheels.right)
                 if left_pid_global and right_pid_global:
                     left_pwm_data.append(left_pid_global.u)
                     right_pwm_data.append(right_pid_global.u)
@@ -435,7 +914,8 @@ if __name__ == "__main__":
                     print("输入无效，请输入一个数字")
             
             elif cmd == 'p':
-                print("当前速度 - 左轮: {:.2f}转/秒, 右轮: {:.2f}转/秒".format(lspeed, rspeed))
+                wheels = get_wheel_speeds()
+                print("当前速度 - 左轮: {:.2f}转/秒, 右轮: {:.2f}转/秒".format(wheels.left, wheels.right))
                 if not record_data:
                     record_data = True
                     start_time = time.time()
@@ -448,7 +928,8 @@ if __name__ == "__main__":
                 else:
                     record_data = False
                     print("停止记录数据...")
-                    # 绘制速度曲线
+                    # 绘制速度曲线（matplotlib只在此处用到，导入需要数秒，用到时才导入）
+                    import matplotlib.pyplot as plt
                     plt.figure(figsize=(10, 8))
                     plt.subplot(2, 1, 1)
                     plt.plot(time_data, left_speed_data, 'b-', label='左轮速度')
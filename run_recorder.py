@@ -0,0 +1,753 @@
+# run_recorder.py
+# 运行记录与离线回放：把摄像头检测区域、超声波原始测距、编码器脉冲和电机指令
+# 按time.monotonic时间戳写入一个带索引的文件；回放时在虚拟时钟下把这些输入
+# 重新送入detect_color、距离过滤和main_controller6的任务逻辑，结果逐位可复现
+import hashlib
+import json
+import os
+import queue
+import struct
+import threading
+import time
+
+# ===== 可配置参数（修改此处无需改动函数） =====
+RECORD_DIR = "runs"          # 记录文件目录（相对本文件）
+RECORD_QUEUE_SIZE = 2000     # 写入队列长度，满了丢弃新记录（不阻塞传感器线程）
+FRAME_FORMAT = ".png"        # 检测区域的压缩格式（无损，回放的检测结果与实车一致）
+REPLAY_TICK = 1e-6           # 回放时每次读取时钟虚拟时间前进的秒数（使忙等循环能结束）
+REPLAY_GRACE = 1.0           # 记录结束后继续回放的时间（秒），之后停止
+ARBITER_INTERVAL = 0.1       # 回放时电机仲裁的周期（秒），与pwm_update_daemon一致
+
+# 文件格式：MAGIC + 若干记录 + 索引 + 尾部
+# 记录 = 头部(类型, 时间, 数据长度) + 数据；时间为数据可用（回调发生）的time.monotonic
+MAGIC = b"IESRUN1\n"
+RECORD_HEADER = struct.Struct("<BdI")
+INDEX_ENTRY = struct.Struct("<BdQ")   # (类型, 时间, 记录在文件中的位置)
+FOOTER = struct.Struct("<QI4s")       # (索引位置, 记录数, 标记)
+FOOTER_TAG = b"RIDX"
+
+REC_META = 0      # JSON：颜色阈值、任务文件、单目测距标定、控制参数
+REC_FRAME = 1     # 采集时间、原图宽度 + 压缩后的检测区域
+REC_DISTANCE = 2  # 测量时间、原始距离（过滤前，含-1）
+REC_ENCODER = 3   # 左右轮脉冲数、测速周期
+REC_COMMAND = 4   # 仲裁后下发的左右轮速度 + 来源
+REC_MARK = 5      # 标记名，如mission_start
+REC_STATS = 6     # JSON：各类型记录数、丢弃数（停止记录时写入）
+
+RECORD_NAMES = {REC_META: "meta", REC_FRAME: "frame", REC_DISTANCE: "distance",
+                REC_ENCODER: "encoder", REC_COMMAND: "command", REC_MARK: "mark", REC_STATS: "stats"}
+
+FRAME_HEADER = struct.Struct("<dI")
+DISTANCE_DATA = struct.Struct("<dd")
+ENCODER_DATA = struct.Struct("<iid")
+COMMAND_DATA = struct.Struct("<dd")
+
+
+# ===== 记录 =====
+class RunRecorder:
+    """
+    运行记录器
+
+    各传感器回调只把数据放进队列，压缩和写文件在单独的写入线程中完成。
+    检测区域在检测线程调用颜色回调时入队，记录时间即检测结果可用的时间。
+    """
+
+    def __init__(self, path, queue_size=RECORD_QUEUE_SIZE):
+        self.path = path
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.file = None
+        self.thread = None
+        self.index = []            # (类型, 时间, 位置)
+        self.counts = {}
+        self.dropped = 0
+        self.pending_frame = None  # 检测区域回调到颜色回调之间暂存的 (采集时间, 宽度, 检测区域)
+
+    def open(self, meta):
+        """
+        创建记录文件，写入元数据并启动写入线程
+
+        Args:
+            meta: 元数据字典，见build_meta
+        """
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(self.path, 'wb')
+        self.file.write(MAGIC)
+        self._write(REC_META, time.monotonic(), json.dumps(meta).encode('utf-8'))
+
+        self.thread = threading.Thread(target=self._writer)
+        self.thread.daemon = True  # 设为守护线程，主程序结束时自动结束
+        self.thread.start()
+
+    def close(self):
+        """写完队列中的记录，写入统计、索引和尾部后关闭文件"""
+        if self.file is None:
+            return
+        self.queue.put(None)
+        self.thread.join(timeout=5.0)
+
+        stats = {"counts": {RECORD_NAMES[kind]: n for kind, n in sorted(self.counts.items())},
+                 "dropped": self.dropped}
+        self._write(REC_STATS, time.monotonic(), json.dumps(stats).encode('utf-8'))
+        index_offset = self.file.tell()
+        for entry in self.index:
+            self.file.write(INDEX_ENTRY.pack(*entry))
+        self.file.write(FOOTER.pack(index_offset, len(self.index), FOOTER_TAG))
+        self.file.close()
+        self.file = None
+
+    def start(self, meta):
+        """创建记录文件并注册各传感器回调"""
+        import detect_color
+        import detect_distance
+        import motor_controller
+
+        self.open(meta)
+        detect_color.add_frame_listener(self.on_frame)
+        detect_color.add_color_listener(self.on_color_frame)
+        detect_distance.add_raw_distance_listener(self.on_raw_distance)
+        motor_controller.add_encoder_listener(self.on_encoder)
+        motor_controller.add_command_listener(self.on_command)
+        print(f"开始记录运行: {self.path}")
+
+    def stop(self):
+        """注销回调并关闭文件"""
+        import detect_color
+        import detect_distance
+        import motor_controller
+
+        detect_color.remove_frame_listener(self.on_frame)
+        detect_color.remove_color_listener(self.on_color_frame)
+        detect_distance.remove_raw_distance_listener(self.on_raw_distance)
+        motor_controller.remove_encoder_listener(self.on_encoder)
+        motor_controller.remove_command_listener(self.on_command)
+        self.close()
+        print(f"运行记录已保存: {self.path}，{len(self.index)}条记录"
+              + (f"，丢弃{self.dropped}条" if self.dropped else ""))
+
+    def mark(self, name):
+        """写入一个标记（如任务开始）"""
+        self._put(REC_MARK, time.monotonic(), name)
+
+    # ===== 传感器回调（在各传感器线程中调用，只入队） =====
+    def on_frame(self, roi, width, timestamp):
+        self.pending_frame = (timestamp, width, roi.copy())
+
+    def on_color_frame(self, color_data, timestamp):
+        pending = self.pending_frame
+        if pending is not None and pending[0] == timestamp:
+            self.pending_frame = None
+            self._put(REC_FRAME, time.monotonic(), pending)
+
+    def on_raw_distance(self, distance, timestamp):
+        self._put(REC_DISTANCE, time.monotonic(), (timestamp, distance))
+
+    def on_encoder(self, left_count, right_count, dt, timestamp):
+        self._put(REC_ENCODER, timestamp, (left_count, right_count, dt))
+
+    def on_command(self, left, right, owner, timestamp):
+        self._put(REC_COMMAND, timestamp, (left, right, owner))
+
+    def _put(self, kind, timestamp, data):
+        try:
+            self.queue.put_nowait((kind, timestamp, data))
+        except queue.Full:
+            self.dropped += 1
+
+    # ===== 写入线程 =====
+    def _writer(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            kind, timestamp, data = item
+            try:
+                self._write(kind, timestamp, encode_record(kind, data))
+            except Exception as e:
+                print(f"写入运行记录出错: {e}")
+
+    def _write(self, kind, timestamp, payload):
+        offset = self.file.tell()
+        self.file.write(RECORD_HEADER.pack(kind, timestamp, len(payload)))
+        self.file.write(payload)
+        self.index.append((kind, timestamp, offset))
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+
+
+def encode_record(kind, data):
+    """把回调数据编码为记录内容"""
+    if kind == REC_FRAME:
+        import cv2
+        timestamp, width, roi = data
+        ok, encoded = cv2.imencode(FRAME_FORMAT, roi)
+        if not ok:
+            raise ValueError("检测区域压缩失败")
+        return FRAME_HEADER.pack(timestamp, width) + encoded.tobytes()
+    if kind == REC_DISTANCE:
+        return DISTANCE_DATA.pack(*data)
+    if kind == REC_ENCODER:
+        return ENCODER_DATA.pack(*data)
+    if kind == REC_COMMAND:
+        left, right, owner = data
+        return COMMAND_DATA.pack(left, right) + owner.encode('utf-8')
+    if kind == REC_MARK:
+        return data.encode('utf-8')
+    raise ValueError(f"未知记录类型: {kind}")
+
+
+def decode_frame(payload):
+    """
+    Returns:
+        tuple: (采集时间, 原图宽度, 检测区域BGR图像)
+    """
+    import cv2
+    import numpy as np
+    timestamp, width = FRAME_HEADER.unpack_from(payload)
+    roi = cv2.imdecode(np.frombuffer(payload, dtype=np.uint8, offset=FRAME_HEADER.size), cv2.IMREAD_COLOR)
+    return timestamp, width, roi
+
+
+def decode_command(payload):
+    """
+    Returns:
+        tuple: (left, right, 来源)
+    """
+    left, right = COMMAND_DATA.unpack_from(payload)
+    return left, right, bytes(payload[COMMAND_DATA.size:]).decode('utf-8')
+
+
+def build_meta(mission_file=None, config=None):
+    """
+    收集回放所需的元数据
+
+    Args:
+        mission_file: 任务文件路径
+        config: 控制参数字典
+
+    Returns:
+        dict: 颜色阈值、任务描述、单目测距标定样本、控制参数和时钟对应关系
+    """
+    import numpy as np
+    import detect_color
+    import detect_distance
+
+    mission = None
+    if mission_file is not None:
+        with open(mission_file, 'r', encoding='utf-8') as f:
+            mission = json.load(f)
+    return {
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "wall_time": time.time(),
+        "monotonic": time.monotonic(),
+        "color_ranges": {color: [[np.asarray(lower).tolist(), np.asarray(upper).tolist()]
+                                 for lower, upper in ranges]
+                         for color, ranges in detect_color.COLOR_RANGES.items()},
+        "roi": [detect_color.DEFAULT_ROW_PERCENT, detect_color.DEFAULT_ROW_HEIGHT],
+        "sampling": {name: getattr(detect_color, name) for name in detect_color.SAMPLING_PARAMS},
+        "mission_file": mission_file,
+        "mission": mission,
+        "mono_samples": detect_distance.mono_estimator.get_samples(),
+        "config": config or {},
+    }
+
+
+# 全局记录器
+recorder = None
+
+
+def start_recording(path=None, mission_file=None, config=None):
+    """
+    开始记录本次运行
+
+    Args:
+        path: 记录文件路径，默认为runs/run_日期_时间.rec
+        mission_file: 任务文件路径（内容保存在记录中）
+        config: 控制参数（保存在记录中，回放时与当前参数比较）
+
+    Returns:
+        RunRecorder: 记录器，创建失败时返回None
+    """
+    global recorder
+    if recorder is not None:
+        stop_recording()
+    if path is None:
+        current_dir = os.path.dirname(os.path.abspath(__file__))
+        path = os.path.join(current_dir, RECORD_DIR, time.strftime("run_%Y%m%d_%H%M%S.rec"))
+    try:
+        recorder = RunRecorder(path)
+        recorder.start(build_meta(mission_file, config))
+    except Exception as e:
+        print(f"开始运行记录出错: {e}")
+        recorder = None
+    return recorder
+
+
+def stop_recording():
+    """停止记录并写入索引"""
+    global recorder
+    if recorder is not None:
+        recorder.stop()
+        recorder = None
+
+
+def mark_run(name):
+    """在记录中写入标记，未在记录时忽略"""
+    if recorder is not None:
+        recorder.mark(name)
+
+
+# ===== 读取 =====
+class RunReader:
+    """
+    读取记录文件
+
+    有索引时按索引定位；文件没有正常结束（断电、程序崩溃）时顺序扫描，
+    截断的最后一条记录被忽略。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.data = f.read()
+        if not self.data.startswith(MAGIC):
+            raise ValueError(f"不是运行记录文件: {path}")
+        self.indexed = True
+        self.entries = self._load_index()
+        if self.entries is None:
+            self.indexed = False
+            self.entries = self._scan()
+        self.meta = {}
+        self.stats = None
+        for kind, _, payload in self.records((REC_META, REC_STATS)):
+            if kind == REC_META:
+                self.meta = json.loads(bytes(payload).decode('utf-8'))
+            else:
+                self.stats = json.loads(bytes(payload).decode('utf-8'))
+
+    def _load_index(self):
+        if len(self.data) < len(MAGIC) + FOOTER.size:
+            return None
+        index_offset, count, tag = FOOTER.unpack_from(self.data, len(self.data) - FOOTER.size)
+        if tag != FOOTER_TAG or index_offset + count * INDEX_ENTRY.size != len(self.data) - FOOTER.size:
+            return None
+        return [INDEX_ENTRY.unpack_from(self.data, index_offset + i * INDEX_ENTRY.size) for i in range(count)]
+
+    def _scan(self):
+        entries = []
+        offset = len(MAGIC)
+        end = len(self.data)
+        while offset + RECORD_HEADER.size <= end:
+            kind, timestamp, length = RECORD_HEADER.unpack_from(self.data, offset)
+            if kind not in RECORD_NAMES or offset + RECORD_HEADER.size + length > end:
+                break
+            entries.append((kind, timestamp, offset))
+            offset += RECORD_HEADER.size + length
+        return entries
+
+    def payload(self, offset):
+        """读取指定位置记录的内容（不复制）"""
+        _, _, length = RECORD_HEADER.unpack_from(self.data, offset)
+        start = offset + RECORD_HEADER.size
+        return memoryview(self.data)[start:start + length]
+
+    def records(self, kinds=None):
+        """
+        按文件顺序遍历记录
+
+        Args:
+            kinds: 只返回这些类型，None表示全部
+
+        Yields:
+            tuple: (类型, 时间, 内容)
+        """
+        for kind, timestamp, offset in self.entries:
+            if kinds is None or kind in kinds:
+                yield kind, timestamp, self.payload(offset)
+
+    def mark_time(self, name):
+        """第一个名为name的标记的时间，没有时返回None"""
+        for _, timestamp, payload in self.records((REC_MARK,)):
+            if bytes(payload).decode('utf-8') == name:
+                return timestamp
+        return None
+
+    def time_range(self):
+        """
+        Returns:
+            tuple: (第一条传感器记录的时间, 最后一条记录的时间)
+        """
+        times = [t for kind, t, _ in self.entries if kind not in (REC_META, REC_STATS)]
+        if not times:
+            return 0.0, 0.0
+        return min(times), max(times)
+
+    def commands(self):
+        """
+        Returns:
+            list: 记录中的电机指令 [(时间, left, right, 来源), ...]
+        """
+        return [(t,) + decode_command(payload) for _, t, payload in self.records((REC_COMMAND,))]
+
+
+# ===== 回放 =====
+class ReplayFinished(Exception):
+    """记录的输入已全部回放完"""
+
+
+class ReplayClock:
+    """
+    回放用的虚拟时钟
+
+    替换time.monotonic/time/perf_counter/sleep：sleep时按时间顺序派发到期的记录
+    和周期任务（代替各后台线程），然后把虚拟时间推进到唤醒时刻；每次读取时钟
+    前进REPLAY_TICK，使忙等循环也能结束。整个回放在单线程中进行，结果可复现。
+    """
+
+    def __init__(self, start, events, periodic, end_time, wall_offset=0.0):
+        """
+        Args:
+            start: 起始虚拟时间
+            events: [(时间, 处理函数, 参数), ...]，按时间排序
+            periodic: [(周期, 函数), ...]
+            end_time: 超过此时间后sleep抛出ReplayFinished
+            wall_offset: time.time()与time.monotonic()之差
+        """
+        self.now = start
+        self.events = events
+        self.next_event = 0
+        self.periodic = [[start + period, period, task] for period, task in periodic]
+        self.end_time = end_time
+        self.wall_offset = wall_offset
+        self.saved = None
+
+    def __enter__(self):
+        self.saved = (time.monotonic, time.time, time.perf_counter, time.sleep)
+        time.monotonic = self.monotonic
+        time.perf_counter = self.monotonic
+        time.time = self.time
+        time.sleep = self.sleep
+        return self
+
+    def __exit__(self, *exc):
+        time.monotonic, time.time, time.perf_counter, time.sleep = self.saved
+        return False
+
+    def monotonic(self):
+        self.now += REPLAY_TICK
+        return self.now
+
+    def time(self):
+        return self.monotonic() + self.wall_offset
+
+    def sleep(self, seconds):
+        self.advance_to(self.now + max(0.0, seconds))
+
+    def advance_to(self, target):
+        """派发target之前到期的记录和周期任务，并把虚拟时间推进到target"""
+        while True:
+            event_time = self.events[self.next_event][0] if self.next_event < len(self.events) else None
+            task = min(self.periodic, key=lambda item: item[0]) if self.periodic else None
+            if event_time is not None and (task is None or event_time <= task[0]):
+                if event_time > target:
+                    break
+                self.now = max(self.now, event_time)
+                _, handler, args = self.events[self.next_event]
+                self.next_event += 1
+                handler(*args)
+            elif task is not None:
+                if task[0] > target:
+                    break
+                self.now = max(self.now, task[0])
+                task[0] += task[1]
+                task[2]()
+            else:
+                break
+        self.now = max(self.now, target)
+        if self.now > self.end_time:
+            raise ReplayFinished()
+
+
+def _reset_modules(meta):
+    """把各模块恢复到刚启动的状态，并载入记录中的颜色阈值、任务和单目测距标定（内部使用）"""
+    import numpy as np
+    import detect_color
+    import detect_distance
+    import motor_controller
+    import state_estimator
+    import time_alignment
+    import main_controller6
+    from mission_plan import compile_mission
+
+    detect_color.COLOR_RANGES = {
+        color: tuple((np.array(lower), np.array(upper)) for lower, upper in ranges)
+        for color, ranges in meta["color_ranges"].items()
+    }
+    detect_color.DEFAULT_ROW_PERCENT, detect_color.DEFAULT_ROW_HEIGHT = meta["roi"]
+    # 早期的记录没有取样参数，当时处理全部行
+    for name, value in meta.get("sampling", {"ROW_SAMPLING": "all"}).items():
+        setattr(detect_color, name, value)
+    detect_color.color_state.reset()
+    detect_color.clear_detection_focus()
+    del detect_color.color_listeners[:]
+    del detect_color.frame_listeners[:]
+
+    with detect_distance.distance_lock:
+        detect_distance.distance_state.reset()
+        detect_distance.recent_distances.clear()
+    del detect_distance.distance_listeners[:]
+    del detect_distance.raw_distance_listeners[:]
+    detect_distance.mono_estimator.set_samples(meta.get("mono_samples", []))
+
+    del motor_controller.encoder_listeners[:]
+    del motor_controller.command_listeners[:]
+    motor_controller.reset_arbiter()
+    motor_controller.reset_odometry()
+    motor_controller.update_wheel_speeds(0, 0, 0.0)
+
+    state_estimator.set_target_color(None)
+    time_alignment.aligner = time_alignment.SensorAligner()
+
+    if meta.get("mission") is not None:
+        main_controller6.mission = compile_mission(meta["mission"])
+        main_controller6.mission.source = meta.get("mission_file")
+    else:
+        main_controller6.load_mission_plan()
+    main_controller6.state_manager = main_controller6.StateManager()
+
+
+def replay_run(path, grace=REPLAY_GRACE):
+    """
+    在虚拟时钟下回放一次运行：记录的检测区域重新经过detect_color检测，原始测距重新经过
+    异常值过滤，编码器脉冲重新积分里程计，从mission_start标记开始执行main_controller6的任务
+
+    Args:
+        path: 记录文件路径
+        grace: 记录结束后继续回放的时间（秒）
+
+    Returns:
+        dict: {"completed": 任务是否完成（记录提前结束为None）, "commands": 回放产生的电机指令,
+               "digest": 指令序列的sha256, "virtual_seconds", "wall_seconds", "config_diff"}
+    """
+    import detect_color
+    import detect_distance
+    import motor_controller
+    import state_estimator
+    import main_controller6
+
+    reader = RunReader(path)
+    meta = reader.meta
+    mission_start = reader.mark_time("mission_start")
+    if mission_start is None:
+        raise ValueError("记录中没有mission_start标记，任务没有开始")
+
+    saved_ranges = detect_color.COLOR_RANGES
+    saved_roi = (detect_color.DEFAULT_ROW_PERCENT, detect_color.DEFAULT_ROW_HEIGHT)
+    saved_sampling = {name: getattr(detect_color, name) for name in detect_color.SAMPLING_PARAMS}
+    _reset_modules(meta)
+
+    commands = []
+    motor_controller.add_command_listener(
+        lambda left, right, owner, timestamp: commands.append((timestamp, left, right, owner)))
+    main_controller6.register_sensor_listeners()
+    periodic = [(ARBITER_INTERVAL, motor_controller._arbiter_tick)]
+    if main_controller6.USE_STATE_ESTIMATE:
+        detect_color.add_color_listener(state_estimator.on_color_frame)
+        detect_distance.add_distance_listener(state_estimator.on_distance_sample)
+        periodic.append((state_estimator.ODOMETRY_INTERVAL, state_estimator.sample_odometry))
+
+    def on_frame(payload):
+        timestamp, width, roi = decode_frame(payload)
+        detect_color.publish_color_data(detect_color.detect_color_roi(roi, width), timestamp)
+
+    def on_distance(payload):
+        timestamp, distance = DISTANCE_DATA.unpack_from(payload)
+        detect_distance.process_distance_sample(distance, timestamp)
+
+    def on_encoder(payload, timestamp):
+        left_count, right_count, dt = ENCODER_DATA.unpack_from(payload)
+        motor_controller.update_wheel_speeds(left_count, right_count, dt, timestamp)
+
+    # 记录按入队顺序写入，各线程之间的先后可能交错，这里按时间稳定排序
+    events = []
+    for kind, timestamp, payload in reader.records((REC_FRAME, REC_DISTANCE, REC_ENCODER)):
+        if kind == REC_FRAME:
+            events.append((timestamp, on_frame, (payload,)))
+        elif kind == REC_DISTANCE:
+            events.append((timestamp, on_distance, (payload,)))
+        else:
+            events.append((timestamp, on_encoder, (payload, timestamp)))
+    events.sort(key=lambda event: event[0])
+
+    start, end = reader.time_range()
+    clock = ReplayClock(start, events, periodic, end + grace,
+                        wall_offset=meta.get("wall_time", 0.0) - meta.get("monotonic", 0.0))
+    wall_start = time.perf_counter()
+    completed = None
+    try:
+        with clock:
+            try:
+                clock.advance_to(mission_start)
+                completed = main_controller6.run_mission_states()
+            except ReplayFinished:
+                pass
+    finally:
+        detect_color.COLOR_RANGES = saved_ranges
+        detect_color.DEFAULT_ROW_PERCENT, detect_color.DEFAULT_ROW_HEIGHT = saved_roi
+        for name, value in saved_sampling.items():
+            setattr(detect_color, name, value)
+        del detect_color.color_listeners[:]
+        del detect_distance.distance_listeners[:]
+        del motor_controller.command_listeners[:]
+    wall_seconds = time.perf_counter() - wall_start
+
+    recorded_config = meta.get("config", {})
+    current_config = main_controller6.recorded_config()
+    config_diff = {name: (recorded_config.get(name), value) for name, value in current_config.items()
+                   if recorded_config.get(name) != value}
+    return {
+        "completed": completed,
+        "commands": commands,
+        "digest": command_digest(commands),
+        "virtual_seconds": clock.now - start,
+        "wall_seconds": wall_seconds,
+        "config_diff": config_diff,
+    }
+
+
+def command_digest(commands):
+    """电机指令序列（含虚拟时间）的sha256，两次回放相同即逐位一致"""
+    digest = hashlib.sha256()
+    for timestamp, left, right, owner in commands:
+        digest.update(struct.pack("<ddd", timestamp, left, right))
+        digest.update(owner.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def first_divergence(recorded, replayed, places=4):
+    """
+    比较实车和回放的电机指令序列（不比较时间，实车线程调度有抖动）
+
+    Returns:
+        int: 第一条不同指令的下标，完全相同时返回None
+    """
+    def key(command):
+        _, left, right, owner = command
+        return owner, round(left, places), round(right, places)
+
+    for i, (a, b) in enumerate(zip(recorded, replayed)):
+        if key(a) != key(b):
+            return i
+    if len(recorded) != len(replayed):
+        return min(len(recorded), len(replayed))
+    return None
+
+
+def print_info(reader):
+    """打印记录文件概要"""
+    meta = reader.meta
+    start, end = reader.time_range()
+    counts = {}
+    for kind, _, _ in reader.entries:
+        counts[RECORD_NAMES[kind]] = counts.get(RECORD_NAMES[kind], 0) + 1
+    print(f"记录文件: {reader.path}（{len(reader.data) / 1024:.0f}KB，"
+          f"{'有索引' if reader.indexed else '无索引，已顺序扫描'}）")
+    print(f"记录时间: {meta.get('created')}，时长 {end - start:.1f}s")
+    print("记录数: " + ", ".join(f"{name} {n}" for name, n in counts.items()))
+    if reader.stats is not None and reader.stats.get("dropped"):
+        print(f"警告: 记录时丢弃了{reader.stats['dropped']}条记录，回放可能与实车不一致")
+    for _, timestamp, payload in reader.records((REC_MARK,)):
+        print(f"标记 {bytes(payload).decode('utf-8')}: {timestamp - start:.2f}s")
+
+
+# 以下仅用于测试
+
+# ===== 命令行：查看记录、回放并检查可复现性；不带参数时自检文件格式 =====
+if __name__ == "__main__":
+    import sys
+    import tempfile
+
+    if len(sys.argv) > 1:
+        reader = RunReader(sys.argv[1])
+        print_info(reader)
+        if "--replay" in sys.argv or "--check" in sys.argv:
+            import contextlib
+            import io
+
+            runs = 2 if "--check" in sys.argv else 1
+            results = []
+            for _ in range(runs):
+                output = io.StringIO()
+                with contextlib.redirect_stdout(output if "--quiet" in sys.argv else sys.stdout):
+                    results.append(replay_run(sys.argv[1]))
+            result = results[0]
+            for name, (recorded, current) in result["config_diff"].items():
+                print(f"参数与记录时不同: {name} 记录={recorded} 当前={current}")
+            state = {True: "任务完成", False: "任务失败", None: "记录结束时任务未完成"}[result["completed"]]
+            print(f"回放{state}: 虚拟时间 {result['virtual_seconds']:.1f}s，用时 {result['wall_seconds']:.2f}s"
+                  f"（{result['virtual_seconds'] / max(result['wall_seconds'], 1e-9):.0f}倍速）")
+            recorded = reader.commands()
+            index = first_divergence(recorded, result["commands"])
+            if index is None:
+                print(f"电机指令与实车一致（{len(recorded)}条）")
+            elif index < len(recorded):
+                when = recorded[index][0] - reader.time_range()[0]
+                print(f"电机指令从第{index + 1}条开始与实车不同（实车{when:.2f}s），"
+                      f"实车{len(recorded)}条，回放{len(result['commands'])}条")
+            else:
+                print(f"实车记录只有{len(recorded)}条电机指令，回放{len(result['commands'])}条，前{index}条一致")
+            print(f"指令摘要: {result['digest']}")
+            if runs > 1:
+                same = all(r["digest"] == result["digest"] for r in results)
+                print("两次回放" + ("逐位一致" if same else "不一致！"))
+                sys.exit(0 if same else 1)
+        sys.exit(0)
+
+    # 自检：写入合成记录，检查索引读取和截断文件的顺序扫描
+    import numpy as np
+
+    path = os.path.join(tempfile.mkdtemp(), "selftest.rec")
+    import glob
+    import cv2
+    from detect_color import crop_roi
+
+    # 用样本图片的检测区域作为帧，压缩率与实车接近
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    images = [cv2.imread(p) for p in sorted(glob.glob(os.path.join(current_dir, "color_picture", "*.jpg")))]
+    rois = [crop_roi(image) for image in images if image is not None][:20]
+    if not rois:
+        rng = np.random.default_rng(0)
+        rois = [rng.integers(0, 256, size=(50, 640, 3), dtype=np.uint8) for _ in range(20)]
+
+    rec = RunRecorder(path)
+    rec.open({"created": "selftest"})
+    base = time.monotonic()
+    rec.mark("mission_start")
+    for i, roi in enumerate(rois):
+        t = base + i * 0.1
+        rec.on_frame(roi, roi.shape[1], t)
+        rec.on_color_frame({}, t)
+        rec.on_raw_distance(60.0 - i, t)
+        rec.on_command(1.0, 1.0 - i * 0.01, 'approach', t)
+    rec.close()
+
+    reader = RunReader(path)
+    n = len(rois)
+    assert reader.indexed and len(reader.entries) == 3 * n + 3
+    frames = [decode_frame(payload) for _, _, payload in reader.records((REC_FRAME,))]
+    assert all(np.array_equal(roi, frame[2]) for roi, frame in zip(rois, frames)), "检测区域解码不一致"
+    assert reader.mark_time("mission_start") is not None
+    assert [c[1:] for c in reader.commands()[:2]] == [(1.0, 1.0, 'approach'), (1.0, 0.99, 'approach')]
+    assert reader.stats["counts"]["frame"] == n and reader.stats["dropped"] == 0
+    raw_size = sum(roi.nbytes for roi in rois)
+    print(f"带索引读取: {len(reader.entries)}条记录，检测区域无损还原，文件{len(reader.data) / 1024:.0f}KB"
+          f"（原始检测区域{raw_size / 1024:.0f}KB）")
+
+    # 模拟断电：去掉统计、索引和尾部，并截断最后一条记录
+    stats_offset = reader.entries[-1][2]
+    with open(path, 'wb') as f:
+        f.write(reader.data[:stats_offset - 3])
+    reader = RunReader(path)
+    assert not reader.indexed and len(reader.entries) == 3 * n + 1
+    print(f"截断文件顺序扫描: {len(reader.entries)}条记录（最后一条不完整，已忽略）")
+    print_info(reader)
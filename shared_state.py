@@ -0,0 +1,195 @@
+# shared_state.py
+# 跨线程共享的最新值：单写多读的版本化快照（seqlock风格）
+# 写线程把新值写入预先分配的槽位后再发布版本号，读线程按版本号取槽位并复制，
+# 复制后检查槽位在此期间没有被重用，否则重试。读线程不加锁，也不会阻塞写线程。
+import threading
+import time
+from collections import namedtuple
+
+# ===== 可配置参数（修改此处无需改动函数） =====
+SNAPSHOT_SLOTS = 4   # 槽位数，读线程复制一个槽位期间写线程最多可再发布SNAPSHOT_SLOTS-2次而不需重试
+
+
+class SharedState:
+    """
+    单写多读的版本化快照
+
+    写入必须串行（同一时刻只有一个写线程，多个来源写入时由调用方的锁保证），
+    读取可以在任意线程并发进行。每次读取得到同一次写入的全部字段及其时间戳。
+
+    示例:
+        wheel_state = SharedState("WheelSpeeds", ("left", "right"), initial=(0.0, 0.0))
+        wheel_state.write(time.monotonic(), 1.2, 1.1)   # 写线程
+        snapshot = wheel_state.read()                    # 任意线程
+        snapshot.left, snapshot.right, snapshot.timestamp, snapshot.version
+    """
+
+    def __init__(self, name, fields, initial=None, slots=SNAPSHOT_SLOTS):
+        """
+        Args:
+            name: 快照类型名（用于打印）
+            fields: 字段名元组
+            initial: 各字段初始值，默认为None；初始时间戳为0.0、版本为0
+            slots: 槽位数（至少2）
+        """
+        self.fields = tuple(fields)
+        self.snapshot_type = namedtuple(name, ("version", "timestamp") + self.fields)
+        self.initial = tuple(initial) if initial is not None else (None,) * len(self.fields)
+        if len(self.initial) != len(self.fields):
+            raise ValueError("初始值与字段数量不一致")
+        if slots < 2:
+            raise ValueError("槽位数至少为2")
+        # 每个槽位为[版本, 时间戳, 字段...]，写入时原地修改，不分配新对象
+        self._slots = [[0, 0.0] + list(self.initial) for _ in range(slots)]
+        self._make = self.snapshot_type._make
+        self._version = 0
+        self.retries = 0   # 读取重试次数（用于统计竞争）
+
+    @property
+    def version(self):
+        """最新发布的版本号（每次写入加1）"""
+        return self._version
+
+    def write(self, timestamp, *values):
+        """
+        写入一组新值（只能由一个线程调用，或由调用方加锁）
+
+        Args:
+            timestamp: 数据时间(time.monotonic)
+            *values: 按字段顺序的值
+        """
+        version = self._version + 1
+        slot = self._slots[version % len(self._slots)]
+        slot[2:] = values
+        slot[1] = timestamp
+        slot[0] = version
+        # 槽位写完后再发布版本号，读线程只会看到完整的槽位
+        self._version = version
+
+    def reset(self, timestamp=0.0):
+        """写入初始值（版本号继续递增，读线程可以看出发生过重置）"""
+        self.write(timestamp, *self.initial)
+
+    def read(self):
+        """
+        读取最新的完整快照（不加锁）
+
+        Returns:
+            namedtuple: (version, timestamp, 各字段)
+        """
+        slots = self._slots
+        n = len(slots)
+        while True:
+            version = self._version
+            snapshot = self._make(slots[version % n])
+            # 复制期间写线程最多发布到version+n-2，此时槽位尚未被重用
+            if snapshot[0] == version and self._version - version < n - 1:
+                return snapshot
+            self.retries += 1
+
+    def __repr__(self):
+        return repr(self.read())
+
+
+# 以下仅用于测试
+
+# ===== 一致性检查和微基准：加锁的全局变量与版本化快照的读写开销 =====
+if __name__ == "__main__":
+    import sys
+
+    class LockedState:
+        """对照组：原来的写法，全局变量加threading.Lock"""
+
+        def __init__(self):
+            self.lock = threading.Lock()
+            self.timestamp = 0.0
+            self.left = 0.0
+            self.right = 0.0
+
+        def write(self, timestamp, left, right):
+            with self.lock:
+                self.timestamp, self.left, self.right = timestamp, left, right
+
+        def read(self):
+            with self.lock:
+                return self.timestamp, self.left, self.right
+
+    def bench(state, readers, seconds=0.5):
+        """一个写线程持续写入(i, i, -i)，readers个读线程持续读取并检查一致性"""
+        running = True
+        counts = {"write": 0, "read": 0, "torn": 0, "write_p99": 0.0, "write_max": 0.0}
+        start_barrier = threading.Barrier(readers + 2)
+
+        def writer():
+            start_barrier.wait()
+            i = 0
+            durations = []
+            clock = time.perf_counter
+            while running:
+                i += 1
+                start = clock()
+                state.write(float(i), float(i), float(-i))
+                durations.append(clock() - start)
+            durations.sort()
+            counts["write"] = i
+            counts["write_p99"] = durations[int(0.99 * (len(durations) - 1))]
+            counts["write_max"] = durations[-1]
+
+        def reader():
+            start_barrier.wait()
+            n = torn = 0
+            while running:
+                snapshot = state.read()
+                timestamp, left, right = snapshot[-3:]
+                if not (timestamp == left == -right):
+                    torn += 1
+                n += 1
+            counts["read"] += n
+            counts["torn"] += torn
+
+        threads = [threading.Thread(target=writer)] + [threading.Thread(target=reader) for _ in range(readers)]
+        for thread in threads:
+            thread.start()
+        start_barrier.wait()
+        time.sleep(seconds)
+        running = False
+        for thread in threads:
+            thread.join()
+        return counts
+
+    def single_thread_cost(state, n=200000):
+        start = time.perf_counter()
+        for i in range(n):
+            state.write(float(i), float(i), float(-i))
+        write_ns = (time.perf_counter() - start) / n * 1e9
+        start = time.perf_counter()
+        for _ in range(n):
+            state.read()
+        read_ns = (time.perf_counter() - start) / n * 1e9
+        return write_ns, read_ns
+
+    # 缩短线程切换间隔，让读写在复制槽位的中途更频繁地被打断
+    sys.setswitchinterval(1e-5)
+    print(f"{'实现':<14}{'单线程写':>10}{'单线程读':>10}{'读线程':>8}{'写/秒':>10}{'读/秒':>10}"
+          f"{'写p99':>10}{'写最大':>10}{'不一致':>8}{'重试':>6}")
+    for name, make in (("Lock", LockedState),
+                       ("SharedState", lambda: SharedState("Wheel", ("left", "right"), initial=(0.0, 0.0)))):
+        write_ns, read_ns = single_thread_cost(make())
+        for readers in (1, 3):
+            state = make()
+            counts = bench(state, readers)
+            retries = getattr(state, "retries", 0)
+            print(f"{name:<14}{write_ns:>8.0f}ns{read_ns:>8.0f}ns{readers:>8}{counts['write'] / 0.5:>10.0f}"
+                  f"{counts['read'] / 0.5:>10.0f}{counts['write_p99'] * 1e6:>8.1f}us{counts['write_max'] * 1e6:>8.0f}us"
+                  f"{counts['torn']:>8}{retries:>6}")
+            assert counts["torn"] == 0, "读到了不一致的快照"
+
+    # 版本和重置
+    state = SharedState("Wheel", ("left", "right"), slots=2)
+    state.write(1.0, 1.0, -1.0)
+    version = state.version
+    state.write(2.0, 2.0, -2.0)
+    assert state.read().version == version + 1
+    state.reset()
+    assert state.read()[1:] == (0.0, None, None)
+    print("一致性检查通过")
@@ -0,0 +1,227 @@
+# startup.py
+# 启动编排：电机、超声波、摄像头各子系统在各自线程中并行初始化，
+# 按真实信号判定就绪（编码器回调已挂上且PWM开始更新、第一次有效测距、摄像头曝光稳定），
+# 全部就绪即开始任务，代替初始化后固定等待time.sleep(2)，并报告各子系统的初始化和就绪用时
+import threading
+import time
+
+import numpy as np
+
+# ===== 可配置参数（修改此处无需改动函数） =====
+READY_TIMEOUT = 10.0          # 等待全部就绪的最长时间（秒），超时后照常开始并提示未就绪的子系统
+EXPOSURE_STABLE_FRAMES = 3    # 连续多少帧亮度稳定视为曝光稳定
+EXPOSURE_TOLERANCE = 3.0      # 相邻帧检测区域平均亮度(0~255)之差小于此值视为稳定
+
+
+class Subsystem:
+    """单个子系统的初始化函数、就绪条件和各时刻"""
+
+    def __init__(self, name, init, signals=(), required=True):
+        self.name = name
+        self.init = init
+        self.signals = set(signals)   # 尚未收到的就绪信号
+        self.required = required      # 初始化失败时是否放弃启动
+        self.ready = threading.Event()
+        self.init_start = None
+        self.init_done = None
+        self.ready_at = None
+        self.error = None
+
+
+class StartupOrchestrator:
+    """
+    并行初始化并等待就绪
+
+    每个子系统的初始化函数在单独的线程中执行，返回False或抛出异常视为失败；
+    初始化成功且所有就绪信号都到达（signal(名称, 信号)）后该子系统就绪。
+    就绪信号可能在初始化函数返回之前到达（如初始化函数中启动的线程已开始工作）。
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.subsystems = {}
+        self.start_time = None
+        self.changed = threading.Condition(self.lock)
+
+    def add(self, name, init, signals=(), required=True):
+        """
+        添加子系统
+
+        Args:
+            name: 名称
+            init: 初始化函数（无参数），返回False表示失败
+            signals: 就绪前需要收到的信号名称
+            required: 初始化失败时是否放弃启动
+        """
+        self.subsystems[name] = Subsystem(name, init, signals, required)
+
+    def signal(self, name, signal):
+        """子系统发出就绪信号（可在任意线程调用，重复信号忽略）"""
+        with self.lock:
+            subsystem = self.subsystems[name]
+            if signal not in subsystem.signals:
+                return
+            subsystem.signals.discard(signal)
+            self._check_ready(subsystem)
+
+    def _check_ready(self, subsystem):
+        """初始化完成且信号到齐时标记就绪（调用方持有锁）"""
+        if subsystem.init_done is not None and subsystem.error is None and not subsystem.signals \
+                and not subsystem.ready.is_set():
+            subsystem.ready_at = self.clock()
+            subsystem.ready.set()
+        self.changed.notify_all()
+
+    def _run_init(self, subsystem):
+        """初始化线程"""
+        subsystem.init_start = self.clock()
+        try:
+            ok = subsystem.init()
+            error = "初始化失败" if ok is False else None
+        except Exception as e:
+            error = f"初始化出错: {e}"
+        with self.lock:
+            subsystem.init_done = self.clock()
+            subsystem.error = error
+            self._check_ready(subsystem)
+
+    def run(self, timeout=READY_TIMEOUT):
+        """
+        并行初始化全部子系统并等待就绪
+
+        Returns:
+            bool: False表示有必需的子系统初始化失败（应放弃启动）；
+                  就绪超时不算失败，照常开始并由report提示
+        """
+        self.start_time = self.clock()
+        threads = [threading.Thread(target=self._run_init, args=(subsystem,), daemon=True)
+                   for subsystem in self.subsystems.values()]
+        for thread in threads:
+            thread.start()
+        deadline = time.monotonic() + timeout
+        with self.lock:
+            while True:
+                if any(s.error is not None and s.required for s in self.subsystems.values()):
+                    return False
+                if all(s.ready.is_set() or s.error is not None for s in self.subsystems.values()):
+                    return True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return True
+                self.changed.wait(remaining)
+
+    def elapsed(self):
+        """
+        Returns:
+            dict: {名称: {"init": 初始化用时, "ready": 从开始到就绪的用时（未就绪为None）,
+                         "error": 错误, "waiting": 未就绪时在等待的信号}}
+        """
+        result = {}
+        for name, s in self.subsystems.items():
+            result[name] = {
+                "init": None if s.init_done is None else s.init_done - s.init_start,
+                "ready": None if s.ready_at is None else s.ready_at - self.start_time,
+                "error": s.error,
+                "waiting": ["初始化"] if s.init_done is None else sorted(s.signals),
+            }
+        return result
+
+    def report(self):
+        """打印各子系统的初始化和就绪用时"""
+        elapsed = self.elapsed()
+        total = max((e["ready"] for e in elapsed.values() if e["ready"] is not None), default=0.0)
+        print(f"{'子系统':<10}{'初始化':>9}{'就绪':>9}")
+        for name, e in elapsed.items():
+            init = f"{e['init']:>8.2f}s" if e["init"] is not None else f"{'-':>9}"
+            if e["error"]:
+                status = f"  {e['error']}"
+            elif e["ready"] is not None:
+                status = f"{e['ready']:>8.2f}s"
+            else:
+                status = f"  未就绪（等待: {', '.join(e['waiting'])}）"
+            print(f"{name:<10}{init}{status}")
+        print(f"启动到就绪共 {total:.2f}s")
+
+
+class ExposureMonitor:
+    """
+    摄像头曝光稳定检测（注册为detect_color的检测区域回调）
+
+    相邻帧检测区域的平均亮度连续EXPOSURE_STABLE_FRAMES帧变化小于EXPOSURE_TOLERANCE时
+    调用on_stable一次。摄像头刚打开时自动曝光和白平衡还在调整，颜色阈值不可靠。
+    """
+
+    def __init__(self, on_stable, frames=EXPOSURE_STABLE_FRAMES, tolerance=EXPOSURE_TOLERANCE):
+        self.on_stable = on_stable
+        self.frames = frames
+        self.tolerance = tolerance
+        self.last_mean = None
+        self.stable_count = 0
+        self.done = False
+
+    def on_frame(self, roi, width, timestamp):
+        """检测区域回调"""
+        if self.done or roi is None or roi.size == 0:
+            return
+        # 隔行隔列取样，计算量只有检测区域的1/16
+        mean = float(np.mean(roi[::4, ::4]))
+        if self.last_mean is not None and abs(mean - self.last_mean) < self.tolerance:
+            self.stable_count += 1
+        else:
+            self.stable_count = 0
+        self.last_mean = mean
+        if self.stable_count >= self.frames - 1:
+            self.done = True
+            self.on_stable()
+
+
+# 以下仅用于测试
+
+# ===== 离线检查：模拟各子系统的初始化耗时和就绪信号，比较顺序初始化加固定等待 =====
+if __name__ == "__main__":
+    delays = {"motor": (0.05, 0.15), "distance": (0.2, 0.1), "camera": (0.6, 0.3)}   # (初始化, 初始化后到就绪)
+
+    def simulated(orchestrator, name):
+        init_delay, ready_delay = delays[name]
+
+        def init():
+            time.sleep(init_delay)
+            # 模拟初始化中启动的线程稍后发出就绪信号
+            threading.Timer(ready_delay, orchestrator.signal, args=(name, "ready")).start()
+
+        return init
+
+    orchestrator = StartupOrchestrator()
+    for name in delays:
+        orchestrator.add(name, simulated(orchestrator, name), signals=("ready",))
+    start = time.monotonic()
+    assert orchestrator.run()
+    parallel = time.monotonic() - start
+    orchestrator.report()
+    sequential = sum(init for init, _ in delays.values()) + 2.0
+    print(f"并行+就绪信号 {parallel:.2f}s，顺序初始化+固定等待2秒 {sequential:.2f}s")
+    assert parallel < max(init + ready for init, ready in delays.values()) + 0.1
+
+    # 必需的子系统初始化失败：立即返回False，不等待超时
+    orchestrator = StartupOrchestrator()
+    orchestrator.add("camera", lambda: False, signals=("ready",))
+    orchestrator.add("distance", lambda: time.sleep(0.05), signals=("ready",), required=False)
+    start = time.monotonic()
+    assert not orchestrator.run(timeout=2.0) and time.monotonic() - start < 0.5
+    # 就绪超时：照常开始，报告中提示
+    orchestrator = StartupOrchestrator()
+    orchestrator.add("distance", lambda: None, signals=("first_range",))
+    assert orchestrator.run(timeout=0.2)
+    assert orchestrator.elapsed()["distance"]["waiting"] == ["first_range"]
+    orchestrator.report()
+
+    # 曝光稳定：亮度收敛后才触发
+    fired = []
+    monitor = ExposureMonitor(lambda: fired.append(True))
+    for brightness in (30, 80, 120, 140, 141, 140, 142, 141):
+        monitor.on_frame(np.full((50, 640, 3), brightness, np.uint8), 640, 0.0)
+        if fired:
+            break
+    assert fired and brightness == 140 and monitor.stable_count == 2, brightness
+    print("检查通过")
@@ -0,0 +1,474 @@
+# state_estimator.py
+# 扩展卡尔曼滤波：融合编码器里程计、KS103超声波测距和摄像头方位角，
+# 连续估计目标魔方相对小车的位置和速度
+import bisect
+import math
+import threading
+import time
+
+import numpy as np
+
+from shared_state import SharedState
+
+# ===== 可配置参数（修改此处无需改动函数） =====
+# 1. 过程噪声
+POSITION_PROCESS_NOISE = 4.0     # 位置过程噪声谱密度 (cm^2/s)，吸收里程计打滑等误差
+VELOCITY_PROCESS_NOISE = 25.0    # 残余速度过程噪声谱密度 (cm^2/s^3)
+VELOCITY_DECAY = 2.0             # 残余速度衰减率 (1/s)，魔方通常静止
+
+# 2. 测量噪声
+RANGE_NOISE_CM = 3.0             # 超声波测距标准差 (cm)
+BEARING_NOISE_RAD = 0.03         # 视觉方位角标准差 (弧度)，约1.7度
+
+# 3. 初始化和门限
+INITIAL_RANGE_CM = 100.0         # 只有方位角时假设的初始距离 (cm)
+INITIAL_RANGE_STD_CM = 80.0      # 初始距离的不确定度 (cm)
+INITIAL_VELOCITY_STD = 10.0      # 初始残余速度的不确定度 (cm/s)
+GATE_CHI2 = 9.0                  # 单维马氏距离门限（约3σ），超出视为异常值丢弃
+MAX_POSITION_STD_CM = 60.0       # 位置不确定度超过此值认为估计失效
+
+# 4. 时间对齐
+HISTORY_WINDOW = 0.5             # 保留事件的时间窗口（秒），晚到的测量在窗口内按自身时间重算
+ODOMETRY_INTERVAL = 0.02         # 里程计采样周期（秒），即控制频率50Hz
+
+# 状态向量下标：相对位置(x向前, y向右)和残余相对速度
+PX, PY, VX, VY = range(4)
+
+# 事件类型
+EVENT_ODOMETRY = 0
+EVENT_RANGE = 1
+EVENT_BEARING = 2
+
+
+class CubeEstimator:
+    """
+    目标魔方相对位置的扩展卡尔曼滤波器
+
+    状态为车体坐标系下的 [px, py, vx, vy]：x轴向前，y轴向右（与x_center方向一致），
+    vx/vy为里程计无法解释的残余相对速度（魔方被碰动、车轮打滑等）。
+    里程计(v, ω)作为控制输入，测距和方位角作为观测。所有输入都按各自的时间戳排序应用，
+    晚到的测量会从窗口起点的检查点开始重新滤波。
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """清空状态和事件历史"""
+        self.initialized = False
+        self.x = np.zeros(4)
+        self.P = np.eye(4)
+        self.t = None                 # 当前状态对应的时间
+        self.control = (0.0, 0.0)     # 当前里程计输入(v cm/s, ω rad/s)
+        self.events = []              # 按时间排序的事件 (t, seq, kind, value)
+        self._seq = 0
+        # 窗口起点检查点：(initialized, x, P, t, control)
+        self._checkpoint = (False, self.x.copy(), self.P.copy(), None, self.control)
+        self.rejected = 0             # 被门限丢弃的测量数量
+
+    # ----- 输入接口 -----
+    def add_odometry(self, timestamp, v, omega):
+        """
+        加入一次里程计输入
+
+        Args:
+            timestamp: 采样时间(time.monotonic)
+            v: 车体线速度 (cm/s)，向前为正
+            omega: 车体角速度 (rad/s)，逆时针为正
+        """
+        self._add_event(timestamp, EVENT_ODOMETRY, (v, omega))
+
+    def add_range(self, timestamp, distance_cm):
+        """加入一次超声波测距（cm）"""
+        if distance_cm is None or distance_cm <= 0:
+            return
+        self._add_event(timestamp, EVENT_RANGE, distance_cm)
+
+    def add_bearing(self, timestamp, bearing_rad):
+        """加入一次视觉方位角（弧度，右侧为正）"""
+        self._add_event(timestamp, EVENT_BEARING, bearing_rad)
+
+    # ----- 输出接口 -----
+    def get_estimate(self, timestamp=None):
+        """
+        获取指定时刻的估计（只做预测，不修改滤波器状态）
+
+        Args:
+            timestamp: 查询时间，默认为当前时间
+
+        Returns:
+            dict: {"x", "y", "vx", "vy", "range", "bearing", "range_std", "position_std", "timestamp"}，
+                  未初始化时返回None。vx/vy为包含自车运动在内的总相对速度
+        """
+        if not self.initialized:
+            return None
+        return _estimate_at(self.x, self.P, self.t, self.control, timestamp)
+
+    def is_valid(self, timestamp=None):
+        """估计是否可用（已初始化且不确定度在允许范围内）"""
+        estimate = self.get_estimate(timestamp)
+        return estimate is not None and estimate["position_std"] <= MAX_POSITION_STD_CM
+
+    # ----- 内部实现 -----
+    def _add_event(self, timestamp, kind, value):
+        self._seq += 1
+        event = (timestamp, self._seq, kind, value)
+        checkpoint_t = self._checkpoint[3]
+        if checkpoint_t is not None and timestamp < checkpoint_t:
+            # 比窗口还早的测量无法按自身时间应用，直接丢弃
+            return
+
+        if self.t is None or timestamp >= self.t:
+            # 按时间顺序到达：增量处理
+            self.events.append(event)
+            self._process(event)
+        else:
+            # 晚到的测量：插入历史并从检查点重新滤波
+            bisect.insort(self.events, event)
+            self._replay()
+        self._advance_checkpoint()
+
+    def _replay(self):
+        """从检查点开始按时间顺序重新处理窗口内的所有事件"""
+        initialized, x, P, t, control = self._checkpoint
+        self.initialized = initialized
+        self.x, self.P, self.t, self.control = x.copy(), P.copy(), t, control
+        for event in self.events:
+            self._process(event)
+
+    def _advance_checkpoint(self):
+        """把窗口外的旧事件合并进检查点"""
+        if not self.events or self.t is None:
+            return
+        horizon = self.t - HISTORY_WINDOW
+        if self.events[0][0] >= horizon:
+            return
+        keep = bisect.bisect_left(self.events, (horizon,))
+        old_events = self.events[:keep]
+        self.events = self.events[keep:]
+
+        # 在检查点上重放旧事件得到新的检查点
+        saved = (self.initialized, self.x, self.P, self.t, self.control)
+        initialized, x, P, t, control = self._checkpoint
+        self.initialized, self.x, self.P, self.t, self.control = initialized, x.copy(), P.copy(), t, control
+        for event in old_events:
+            self._process(event)
+        self._checkpoint = (self.initialized, self.x.copy(), self.P.copy(), self.t, self.control)
+        self.initialized, self.x, self.P, self.t, self.control = saved
+
+    def _process(self, event):
+        timestamp, _, kind, value = event
+        if self.t is not None and timestamp > self.t:
+            if self.initialized:
+                self.x, self.P = self._predict(self.x, self.P, timestamp - self.t, self.control)
+        if self.t is None or timestamp > self.t:
+            self.t = timestamp
+
+        if kind == EVENT_ODOMETRY:
+            self.control = value
+        elif kind == EVENT_RANGE:
+            if not self.initialized:
+                self._initialize(value, 0.0, RANGE_NOISE_CM, INITIAL_RANGE_STD_CM)
+            else:
+                self._update_range(value)
+        elif kind == EVENT_BEARING:
+            if not self.initialized:
+                self._initialize(INITIAL_RANGE_CM, value, INITIAL_RANGE_STD_CM, None)
+            else:
+                self._update_bearing(value)
+
+    def _initialize(self, rng, bearing, range_std, lateral_std):
+        """用第一次测量初始化状态，未观测的方向给较大的不确定度"""
+        if lateral_std is None:
+            lateral_std = rng * BEARING_NOISE_RAD
+        c, s = math.cos(bearing), math.sin(bearing)
+        self.x = np.array([rng * c, rng * s, 0.0, 0.0])
+        # 极坐标协方差旋转到直角坐标
+        R = np.array([[c, -s], [s, c]])
+        polar = np.diag([range_std ** 2, lateral_std ** 2])
+        self.P = np.zeros((4, 4))
+        self.P[:2, :2] = R @ polar @ R.T
+        self.P[2:, 2:] = np.eye(2) * INITIAL_VELOCITY_STD ** 2
+        self.initialized = True
+
+    @staticmethod
+    def _predict(x, P, dt, control):
+        """
+        状态预测：静止目标在旋转平动的车体坐标系中的运动
+
+        px' = px + dt * (-v - ω*py + vx)
+        py' = py + dt * ( ω*px + vy)
+        """
+        v, omega = control
+        px, py, vx, vy = x
+        decay = math.exp(-VELOCITY_DECAY * dt)
+        x_new = np.array([
+            px + dt * (-v - omega * py + vx),
+            py + dt * (omega * px + vy),
+            vx * decay,
+            vy * decay,
+        ])
+        F = np.array([
+            [1.0, -omega * dt, dt, 0.0],
+            [omega * dt, 1.0, 0.0, dt],
+            [0.0, 0.0, decay, 0.0],
+            [0.0, 0.0, 0.0, decay],
+        ])
+        Q = np.diag([
+            POSITION_PROCESS_NOISE * dt,
+            POSITION_PROCESS_NOISE * dt,
+            VELOCITY_PROCESS_NOISE * dt,
+            VELOCITY_PROCESS_NOISE * dt,
+        ])
+        return x_new, F @ P @ F.T + Q
+
+    def _update_range(self, distance_cm):
+        px, py = self.x[PX], self.x[PY]
+        rng = math.hypot(px, py)
+        if rng < 1e-6:
+            return
+        H = np.array([px / rng, py / rng, 0.0, 0.0])
+        self._scalar_update(distance_cm - rng, H, RANGE_NOISE_CM ** 2)
+
+    def _update_bearing(self, bearing_rad):
+        px, py = self.x[PX], self.x[PY]
+        r2 = px * px + py * py
+        if r2 < 1e-6:
+            return
+        H = np.array([-py / r2, px / r2, 0.0, 0.0])
+        innovation = bearing_rad - math.atan2(py, px)
+        innovation = (innovation + math.pi) % (2 * math.pi) - math.pi
+        self._scalar_update(innovation, H, BEARING_NOISE_RAD ** 2)
+
+    def _scalar_update(self, innovation, H, noise_var):
+        """一维观测的EKF更新，带马氏距离门限"""
+        PHt = self.P @ H
+        S = float(H @ PHt) + noise_var
+        if innovation * innovation / S > GATE_CHI2:
+            self.rejected += 1
+            return
+        K = PHt / S
+        self.x = self.x + K * innovation
+        # Joseph形式，保持协方差对称正定
+        I_KH = np.eye(4) - np.outer(K, H)
+        self.P = I_KH @ self.P @ I_KH.T + np.outer(K, K) * noise_var
+
+
+def _estimate_at(x, P, t, control, timestamp=None):
+    """
+    由滤波器状态预测指定时刻的估计（纯函数，CubeEstimator.get_estimate和快照读取共用）
+
+    Returns:
+        dict: 见CubeEstimator.get_estimate
+    """
+    if timestamp is None:
+        timestamp = time.monotonic()
+    if timestamp > t:
+        x, P = CubeEstimator._predict(x, P, timestamp - t, control)
+
+    px, py, vx, vy = x
+    v, omega = control
+    rng = math.hypot(px, py)
+    # 总相对速度 = 残余速度 + 自车运动引起的速度
+    rel_vx = vx - v - omega * py
+    rel_vy = vy + omega * px
+    if rng > 1e-6:
+        jr = np.array([px / rng, py / rng])
+        range_var = float(jr @ P[:2, :2] @ jr)
+    else:
+        range_var = float(P[PX, PX])
+    return {
+        "x": float(px),
+        "y": float(py),
+        "vx": float(rel_vx),
+        "vy": float(rel_vy),
+        "range": rng,
+        "bearing": math.atan2(py, px),
+        "range_std": math.sqrt(max(range_var, 0.0)),
+        "position_std": math.sqrt(max(float(P[PX, PX] + P[PY, PY]), 0.0)),
+        "timestamp": timestamp,
+    }
+
+
+# ===== 全局实例和后台线程 =====
+estimator = CubeEstimator()
+estimator_lock = threading.Lock()
+# 滤波器状态快照（持有estimator_lock时写），get_cube_estimate不加锁读取，不会等待滤波器重算
+filter_state = SharedState("FilterSnapshot", ("initialized", "x", "P", "t", "control"),
+                           initial=(False, None, None, None, (0.0, 0.0)))
+estimation_thread = None
+is_running = False
+target_color = None  # 用于提取方位角的目标颜色
+
+
+def _publish_state():
+    """发布滤波器状态快照（内部使用，调用前需持有estimator_lock）"""
+    if estimator.initialized:
+        filter_state.write(estimator.t, True, estimator.x.copy(), estimator.P.copy(),
+                           estimator.t, estimator.control)
+    else:
+        filter_state.reset()
+
+
+def set_target_color(color):
+    """
+    设置跟踪的目标颜色，并清空之前的估计
+
+    Args:
+        color: 颜色名称（如'red'），None表示暂停视觉观测
+    """
+    global target_color
+    with estimator_lock:
+        target_color = color
+        estimator.reset()
+        _publish_state()
+
+
+def on_color_frame(color_data, timestamp):
+    """颜色检测回调：取目标颜色最宽色段的中心作为方位角观测"""
+    # 延迟导入，避免本模块依赖摄像头
+    from detect_color import pixel_to_bearing
+
+    color = target_color
+    if color is None:
+        return
+    segments = color_data.get(color, [])
+    if not segments:
+        return
+    widest_segment = max(segments, key=lambda s: abs(s[1] - s[0]))
+    bearing = pixel_to_bearing(widest_segment[2])
+    with estimator_lock:
+        estimator.add_bearing(timestamp, bearing)
+        _publish_state()
+
+
+def on_distance_sample(distance, timestamp):
+    """超声波测距回调"""
+    if target_color is None:
+        return
+    with estimator_lock:
+        estimator.add_range(timestamp, distance)
+        _publish_state()
+
+
+def state_estimation_thread(interval=ODOMETRY_INTERVAL):
+    """
+    以控制频率采样里程计并推进滤波器
+
+    Args:
+        interval: 采样间隔（秒）
+    """
+    global is_running
+
+    is_running = True
+    print("状态估计线程已启动")
+    while is_running:
+        sample_odometry()
+        time.sleep(interval)
+
+
+def sample_odometry():
+    """采样一次车体速度并推进滤波器（采样线程和离线回放共用）"""
+    from motor_controller import get_body_velocity
+
+    v, omega = get_body_velocity()
+    with estimator_lock:
+        estimator.add_odometry(time.monotonic(), v, omega)
+        _publish_state()
+
+
+def start_state_estimation(interval=ODOMETRY_INTERVAL):
+    """
+    启动状态估计：注册颜色和距离回调，并启动里程计采样线程
+
+    Returns:
+        threading.Thread: 线程对象
+    """
+    global estimation_thread
+    from detect_color import add_color_listener
+    from detect_distance import add_distance_listener
+
+    if estimation_thread is not None and estimation_thread.is_alive():
+        stop_state_estimation()
+
+    add_color_listener(on_color_frame)
+    add_distance_listener(on_distance_sample)
+
+    estimation_thread = threading.Thread(target=state_estimation_thread, args=(interval,))
+    estimation_thread.daemon = True  # 设为守护线程，主程序结束时自动结束
+    estimation_thread.start()
+    return estimation_thread
+
+
+def stop_state_estimation():
+    """停止状态估计线程并注销回调"""
+    global is_running
+    from detect_color import remove_color_listener
+    from detect_distance import remove_distance_listener
+
+    remove_color_listener(on_color_frame)
+    remove_distance_listener(on_distance_sample)
+    if estimation_thread is not None and estimation_thread.is_alive():
+        is_running = False
+        estimation_thread.join(timeout=1.0)
+        print("状态估计线程已停止")
+
+
+def get_cube_estimate(timestamp=None):
+    """
+    获取目标魔方的相对位置估计
+
+    Args:
+        timestamp: 查询时间，默认为当前时间
+
+    Returns:
+        dict: 见CubeEstimator.get_estimate，估计不可用时返回None
+    """
+    snapshot = filter_state.read()
+    if not snapshot.initialized:
+        return None
+    estimate = _estimate_at(snapshot.x, snapshot.P, snapshot.t, snapshot.control, timestamp)
+    if estimate["position_std"] > MAX_POSITION_STD_CM:
+        return None
+    return estimate
+
+
+# 以下仅用于测试
+
+# ===== 离线仿真：小车朝静止魔方直行并转弯，测量乱序到达 =====
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    test = CubeEstimator()
+    cube = np.array([150.0, 20.0])   # 世界坐标系下的魔方位置（y向右）
+    car = np.array([0.0, 0.0])
+    heading = 0.0                    # 逆时针为正
+    v, omega = 30.0, 0.1
+    delayed = []
+    errors = []
+    t = 0.0
+    for step in range(200):
+        t = step * ODOMETRY_INTERVAL
+        # 真实运动（y向右坐标系下逆时针转动使航向向左）
+        car = car + v * ODOMETRY_INTERVAL * np.array([math.cos(heading), -math.sin(heading)])
+        heading += omega * ODOMETRY_INTERVAL
+        rel = cube - car
+        c, s = math.cos(heading), math.sin(heading)
+        body = np.array([c * rel[0] - s * rel[1], s * rel[0] + c * rel[1]])
+        test.add_odometry(t, v * (1 + rng.normal(0, 0.05)), omega)
+        if step % 5 == 0:
+            # 超声波测距，延迟60ms到达
+            delayed.append((t + 0.06, "range", t, np.hypot(*body) + rng.normal(0, RANGE_NOISE_CM)))
+        if step % 5 == 2:
+            # 视觉方位角，延迟30ms到达
+            delayed.append((t + 0.03, "bearing", t, math.atan2(body[1], body[0]) + rng.normal(0, BEARING_NOISE_RAD)))
+        for item in [d for d in delayed if d[0] <= t]:
+            delayed.remove(item)
+            _, kind, stamp, value = item
+            if kind == "range":
+                test.add_range(stamp, value)
+            else:
+                test.add_bearing(stamp, value)
+        estimate = test.get_estimate(t)
+        if estimate is not None and step > 50:
+            errors.append(math.hypot(estimate["x"] - body[0], estimate["y"] - body[1]))
+    print(f"位置误差: 平均 {np.mean(errors):.2f}cm, 最大 {np.max(errors):.2f}cm, 丢弃测量 {test.rejected}")
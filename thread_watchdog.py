@@ -0,0 +1,385 @@
+# thread_watchdog.py
+# 工作线程看门狗：颜色检测、距离测量、测速和PWM更新线程每完成一次有效循环就发一次心跳，
+# 监视线程按各线程的截止时间检查心跳，超时或线程退出时执行配置的动作（记录、降级、安全停车），
+# 心跳恢复后自动解除，并统计各线程的实际周期和抖动
+import math
+import threading
+import time
+from collections import deque
+
+# ===== 可配置参数（修改此处无需改动函数） =====
+CHECK_INTERVAL = 0.05      # 监视线程检查周期（秒）
+STATS_WINDOW = 500         # 周期统计保留的心跳间隔数
+STARTUP_GRACE = 3.0        # 注册后到第一次心跳允许额外等待的时间（秒），如摄像头启动
+
+# 各线程的标称周期、截止时间（秒，超过此时间没有心跳视为失效）和失效动作
+# 动作：'log'只记录，'degrade'调用注册时给出的降级函数，'safe_stop'立即停车直到心跳恢复
+WORKER_PERIODS = {"color": 0.13, "distance": 0.2, "speed_monitor": 0.1, "pwm": 0.1}
+WORKER_DEADLINES = {"color": 0.6, "distance": 1.0, "speed_monitor": 0.4, "pwm": 0.4}
+WORKER_ACTIONS = {
+    "color": "degrade",        # 视觉失效：停止依赖视觉的来源，动作照常执行
+    "distance": "log",         # 超声波失效：距离超过MAX_DISTANCE_AGE后已自动退回单目测距
+    "speed_monitor": "safe_stop",  # 轮速不再更新，PID会按旧轮速持续加大占空比
+    "pwm": "safe_stop",        # PWM不再更新，电机保持最后的占空比
+}
+
+ACTIONS = ("log", "degrade", "safe_stop")
+
+
+class WorkerStatus:
+    """单个工作线程的心跳记录"""
+
+    def __init__(self, name, period, deadline, action, thread=None, on_degrade=None, on_recover=None):
+        self.name = name
+        self.period = period
+        self.deadline = deadline
+        self.action = action
+        self.thread = thread
+        self.on_degrade = on_degrade
+        self.on_recover = on_recover
+        self.last_beat = None       # 最近一次心跳时间，None表示还没有心跳
+        self.registered_at = None
+        self.intervals = deque(maxlen=STATS_WINDOW)
+        self.beats = 0
+        self.misses = 0             # 失效次数（每次从正常变为失效计一次）
+        self.failed = False
+        self.failed_since = None
+        self.reason = None          # 'deadline'或'dead'
+
+
+class Watchdog:
+    """
+    心跳看门狗
+
+    工作线程调用heartbeat(名称)，check()比较各线程距上次心跳的时间和截止时间，
+    状态变化时执行动作。check()只依赖传入的时间，监视线程和离线测试共用。
+    """
+
+    def __init__(self, clock=time.monotonic, safe_stop=None, release_stop=None):
+        """
+        Args:
+            clock: 时钟函数
+            safe_stop: 安全停车函数，默认为motor_controller.emergency_stop
+            release_stop: 解除停车函数，默认为释放motor_controller的'watchdog'指令
+        """
+        self.clock = clock
+        self.safe_stop = safe_stop
+        self.release_stop = release_stop
+        self.lock = threading.Lock()
+        self.workers = {}
+        self.events = deque(maxlen=STATS_WINDOW)  # (时间, 名称, 'failed'/'recovered', 原因)
+        self.thread = None
+        self.running = False
+
+    def register(self, name, period=None, deadline=None, action=None, thread=None,
+                 on_degrade=None, on_recover=None):
+        """
+        注册工作线程，未给出的参数取WORKER_PERIODS/WORKER_DEADLINES/WORKER_ACTIONS中的值
+
+        Args:
+            name: 线程名，工作线程心跳时使用
+            period: 标称周期（秒），用于抖动统计
+            deadline: 截止时间（秒）
+            action: 'log'、'degrade'或'safe_stop'
+            thread: 线程对象，给出时线程退出也视为失效
+            on_degrade: 降级函数（action为'degrade'时调用）
+            on_recover: 恢复函数（心跳恢复时调用）
+        """
+        period = period if period is not None else WORKER_PERIODS.get(name, 0.1)
+        deadline = deadline if deadline is not None else WORKER_DEADLINES.get(name, 4 * period)
+        action = action or WORKER_ACTIONS.get(name, "log")
+        if action not in ACTIONS:
+            raise ValueError(f"未知的看门狗动作: {action}")
+        worker = WorkerStatus(name, period, deadline, action, thread, on_degrade, on_recover)
+        with self.lock:
+            worker.registered_at = self.clock()
+            self.workers[name] = worker
+
+    def unregister(self, name):
+        """注销工作线程（线程正常停止前调用，避免被判为失效）"""
+        with self.lock:
+            self.workers.pop(name, None)
+
+    def heartbeat(self, name, timestamp=None):
+        """
+        记录一次心跳，未注册的名称忽略
+
+        Args:
+            name: 线程名
+            timestamp: 心跳时间，默认为clock()
+        """
+        worker = self.workers.get(name)
+        if worker is None:
+            return
+        if timestamp is None:
+            timestamp = self.clock()
+        if worker.last_beat is not None:
+            worker.intervals.append(timestamp - worker.last_beat)
+        worker.last_beat = timestamp
+        worker.beats += 1
+
+    def check(self, now=None):
+        """
+        检查所有线程，状态变化时执行动作
+
+        Args:
+            now: 当前时间，默认为clock()
+
+        Returns:
+            list: 本次状态变化 [(名称, 'failed'/'recovered', 原因), ...]
+        """
+        if now is None:
+            now = self.clock()
+        changes = []
+        with self.lock:
+            workers = list(self.workers.values())
+        for worker in workers:
+            if worker.last_beat is not None:
+                since, limit = worker.last_beat, worker.deadline
+            else:
+                since, limit = worker.registered_at, worker.deadline + STARTUP_GRACE
+            if worker.thread is not None and not worker.thread.is_alive():
+                reason = "dead"
+            elif now - since > limit:
+                reason = "deadline"
+            else:
+                reason = None
+
+            if reason is not None and not worker.failed:
+                worker.failed, worker.failed_since, worker.reason = True, now, reason
+                worker.misses += 1
+                changes.append((worker.name, "failed", reason))
+                self._on_failed(worker, now - since)
+            elif reason is None and worker.failed:
+                worker.failed, worker.reason = False, None
+                changes.append((worker.name, "recovered", None))
+                self._on_recovered(worker, now - worker.failed_since)
+        for name, event, reason in changes:
+            self.events.append((now, name, event, reason))
+        return changes
+
+    def _on_failed(self, worker, silent):
+        """执行失效动作（内部使用）"""
+        what = "线程已退出" if worker.reason == "dead" else f"{silent:.2f}s无心跳"
+        print(f"\n看门狗: {worker.name} {what}（截止{worker.deadline:.2f}s），动作: {worker.action}")
+        try:
+            if worker.action == "degrade" and worker.on_degrade is not None:
+                worker.on_degrade()
+            elif worker.action == "safe_stop":
+                (self.safe_stop or _default_safe_stop)()
+        except Exception as e:
+            print(f"看门狗动作出错: {e}")
+
+    def _on_recovered(self, worker, duration):
+        """心跳恢复后解除动作（内部使用）"""
+        print(f"\n看门狗: {worker.name} 心跳恢复，失效{duration:.2f}s")
+        try:
+            if worker.on_recover is not None:
+                worker.on_recover()
+            # 所有要求停车的线程都恢复后才解除停车
+            if worker.action == "safe_stop" and not any(
+                    w.failed and w.action == "safe_stop" for w in list(self.workers.values())):
+                (self.release_stop or _default_release_stop)()
+        except Exception as e:
+            print(f"看门狗动作出错: {e}")
+
+    def is_healthy(self, name=None):
+        """
+        Args:
+            name: 线程名，None表示全部线程
+
+        Returns:
+            bool: 是否没有失效
+        """
+        with self.lock:
+            workers = [self.workers[name]] if name in self.workers else \
+                list(self.workers.values()) if name is None else []
+        return not any(worker.failed for worker in workers)
+
+    def stats(self):
+        """
+        各线程的周期和抖动统计
+
+        Returns:
+            dict: {名称: {"beats", "period", "mean", "jitter", "p99", "max", "misses", "failed"}}，
+                  mean为实际平均周期，jitter为周期标准差，p99/max为心跳间隔分位数（秒）
+        """
+        with self.lock:
+            workers = list(self.workers.values())
+        result = {}
+        for worker in workers:
+            intervals = sorted(worker.intervals)
+            n = len(intervals)
+            mean = sum(intervals) / n if n else 0.0
+            result[worker.name] = {
+                "beats": worker.beats,
+                "period": worker.period,
+                "mean": mean,
+                "jitter": math.sqrt(sum((v - mean) ** 2 for v in intervals) / n) if n else 0.0,
+                "p99": intervals[min(n - 1, int(round(0.99 * (n - 1))))] if n else 0.0,
+                "max": intervals[-1] if n else 0.0,
+                "misses": worker.misses,
+                "failed": worker.failed,
+            }
+        return result
+
+    def _run(self):
+        while self.running:
+            self.check()
+            time.sleep(CHECK_INTERVAL)
+
+    def start(self):
+        """启动监视线程"""
+        if self.thread is not None and self.thread.is_alive():
+            return self.thread
+        self.running = True
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True  # 设为守护线程，主程序结束时自动结束
+        self.thread.start()
+        return self.thread
+
+    def stop(self):
+        """停止监视线程"""
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(timeout=1.0)
+            self.thread = None
+
+
+def _default_safe_stop():
+    """默认安全停车：抢占电机并直接把PWM置零（PWM线程可能已停止）"""
+    from motor_controller import emergency_stop
+    emergency_stop()
+
+
+def _default_release_stop():
+    """默认解除停车：释放看门狗的停车指令"""
+    from motor_controller import release_motor
+    release_motor('watchdog', hold=False)
+
+
+# ===== 全局实例 =====
+watchdog = Watchdog()
+
+
+def heartbeat(name):
+    """工作线程每完成一次有效循环调用一次，未注册时立即返回"""
+    if name in watchdog.workers:
+        watchdog.heartbeat(name)
+
+
+def start_watchdog():
+    """启动全局看门狗的监视线程"""
+    watchdog.start()
+    print("看门狗已启动")
+
+
+def stop_watchdog():
+    """停止全局看门狗的监视线程（正常退出时各线程停止不应触发动作），统计保留"""
+    watchdog.stop()
+
+
+def print_watchdog_stats():
+    """打印各线程的周期、抖动和失效次数"""
+    stats = watchdog.stats()
+    if not stats:
+        return
+    print(f"{'线程':<14}{'心跳':>6}{'标称':>9}{'平均':>9}{'抖动':>9}{'p99':>9}{'最大':>9}{'失效':>6}")
+    for name, s in stats.items():
+        print(f"{name:<14}{s['beats']:>6}{s['period']*1000:>7.0f}ms{s['mean']*1000:>7.1f}ms"
+              f"{s['jitter']*1000:>7.1f}ms{s['p99']*1000:>7.1f}ms{s['max']*1000:>7.1f}ms{s['misses']:>6}")
+
+
+# 以下仅用于测试
+
+# ===== 离线自检：用假时钟和假工作线程注入卡顿和线程退出 =====
+if __name__ == "__main__":
+
+    class FakeClock:
+        def __init__(self):
+            self.now = 0.0
+
+        def __call__(self):
+            return self.now
+
+    class FakeThread:
+        def __init__(self):
+            self.alive = True
+
+        def is_alive(self):
+            return self.alive
+
+    clock = FakeClock()
+    stops = []
+    degraded = []
+    dog = Watchdog(clock=clock, safe_stop=lambda: stops.append("stop"),
+                   release_stop=lambda: stops.append("release"))
+    pwm_thread = FakeThread()
+    dog.register("pwm", thread=pwm_thread)
+    dog.register("speed_monitor")
+    dog.register("color", on_degrade=lambda: degraded.append("down"),
+                 on_recover=lambda: degraded.append("up"))
+    dog.register("distance")
+
+    def run(seconds, stalled=(), step=0.01):
+        """按标称周期发心跳，stalled中的线程不发心跳，返回期间的状态变化"""
+        changes = []
+        end = clock.now + seconds
+        next_beat = {name: clock.now for name in dog.workers}
+        while clock.now < end:
+            clock.now = round(clock.now + step, 6)
+            for name, worker in dog.workers.items():
+                if name not in stalled and clock.now >= next_beat[name]:
+                    dog.heartbeat(name)
+                    next_beat[name] = clock.now + worker.period
+            changes.extend(dog.check())
+        return changes
+
+    # 1. 正常运行：没有状态变化
+    assert run(2.0) == [], "正常运行不应触发"
+    assert dog.is_healthy()
+
+    # 2. 颜色检测卡顿0.4s：未超过截止时间，不触发
+    assert run(0.4, stalled=("color",)) == []
+
+    # 3. 颜色检测卡顿1s：触发降级，恢复后解除
+    changes = run(1.0, stalled=("color",)) + run(0.5)
+    assert changes == [("color", "failed", "deadline"), ("color", "recovered", None)], changes
+    assert degraded == ["down", "up"] and stops == []
+
+    # 4. 测速线程和PWM线程同时卡顿：只停车一次，两者都恢复后才解除
+    changes = run(0.6, stalled=("speed_monitor", "pwm")) + run(0.05, stalled=("pwm",))
+    assert stops == ["stop", "stop"], stops  # 每个失效线程各调用一次停车（停车可重复调用）
+    assert [c[1] for c in changes] == ["failed", "failed", "recovered"], changes
+    run(0.5)
+    assert stops[-1] == "release" and stops.count("release") == 1, stops
+
+    # 5. PWM线程退出：即使心跳仍在（例如异常前刚发过心跳）也立即触发
+    pwm_thread.alive = False
+    changes = run(0.05)
+    assert changes == [("pwm", "failed", "dead")], changes
+    assert not dog.is_healthy("pwm") and dog.is_healthy("color")
+
+    # 6. 未知动作在注册时报错
+    try:
+        dog.register("bad", action="reboot")
+        raise AssertionError("应拒绝未知动作")
+    except ValueError:
+        pass
+
+    # 7. 真实线程的周期和抖动统计
+    watchdog = Watchdog()
+    watchdog.register("worker", period=0.01, deadline=0.1, action="log")
+
+    def worker():
+        for _ in range(100):
+            heartbeat("worker")
+            time.sleep(0.01)
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    thread.join()
+    print_watchdog_stats()
+    s = watchdog.stats()["worker"]
+    assert s["beats"] == 100 and 0.009 < s["mean"] < 0.02, s
+    print("看门狗自检通过")
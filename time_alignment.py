@@ -0,0 +1,309 @@
+# time_alignment.py
+# 摄像头帧和超声波距离的时间对齐：保存两路数据的短时历史，
+# 按帧采集时间插值出当时的距离，并统计两路数据的时间差分布
+import bisect
+import threading
+from collections import deque
+
+# ===== 可配置参数（修改此处无需改动函数） =====
+HISTORY_SECONDS = 2.0        # 历史数据保留时长（秒）
+MAX_INTERPOLATION_GAP = 0.35  # 两个距离样本间隔超过此值（秒）不再插值
+MAX_EXTRAPOLATION = 0.15     # 查询时间超出最新样本的最大外推时长（秒）
+SKEW_HISTORY_SIZE = 500      # 时间差统计保留的样本数
+
+
+class TimestampedHistory:
+    """按时间排序的短时历史，支持线性插值"""
+
+    def __init__(self, max_age=HISTORY_SECONDS):
+        self.max_age = max_age
+        self.times = deque()
+        self.values = deque()
+
+    def add(self, timestamp, value):
+        """
+        加入一个样本（允许轻微乱序）
+
+        Args:
+            timestamp: 样本时间(time.monotonic)
+            value: 样本值
+        """
+        if not self.times or timestamp >= self.times[-1]:
+            self.times.append(timestamp)
+            self.values.append(value)
+        else:
+            index = bisect.bisect_right(self.times, timestamp)
+            self.times.insert(index, timestamp)
+            self.values.insert(index, value)
+        # 删除过期样本
+        while self.times and self.times[-1] - self.times[0] > self.max_age:
+            self.times.popleft()
+            self.values.popleft()
+
+    def latest(self):
+        """
+        Returns:
+            tuple: 最新的(timestamp, value)，没有样本时返回None
+        """
+        if not self.times:
+            return None
+        return self.times[-1], self.values[-1]
+
+    def bracket_span(self, timestamp):
+        """
+        Returns:
+            float: 查询时间前后两个样本的时间间隔（秒，即插值跨越的时间，与样本时间相同时为0），
+                   前后不都有样本时返回None
+        """
+        index = bisect.bisect_left(self.times, timestamp)
+        if index < len(self.times) and self.times[index] == timestamp:
+            return 0.0
+        if 0 < index < len(self.times):
+            return self.times[index] - self.times[index - 1]
+        return None
+
+    def interpolate(self, timestamp):
+        """
+        线性插值得到指定时刻的数值（样本值须为数字）
+
+        查询时间在两个样本之间时插值；晚于最新样本时用最后两个样本外推，
+        外推时长受MAX_EXTRAPOLATION限制。
+
+        Args:
+            timestamp: 查询时间
+
+        Returns:
+            float: 插值结果，数据不足或间隔过大时返回None
+        """
+        n = len(self.times)
+        if n == 0:
+            return None
+        index = bisect.bisect_left(self.times, timestamp)
+        if index < n and self.times[index] == timestamp:
+            return self.values[index]
+        if 0 < index < n:
+            t0, t1 = self.times[index - 1], self.times[index]
+            if t1 - t0 > MAX_INTERPOLATION_GAP:
+                return None
+            v0, v1 = self.values[index - 1], self.values[index]
+            return v0 + (v1 - v0) * (timestamp - t0) / (t1 - t0)
+        if index == 0:
+            # 早于所有样本，只允许很小的外推
+            if self.times[0] - timestamp > MAX_EXTRAPOLATION:
+                return None
+            return self.values[0]
+        # 晚于所有样本：用最后两个样本线性外推
+        t1, v1 = self.times[-1], self.values[-1]
+        if timestamp - t1 > MAX_EXTRAPOLATION:
+            return None
+        if n >= 2:
+            t0, v0 = self.times[-2], self.values[-2]
+            if 0 < t1 - t0 <= MAX_INTERPOLATION_GAP:
+                return v1 + (v1 - v0) * (timestamp - t1) / (t1 - t0)
+        return v1
+
+
+class SensorAligner:
+    """
+    颜色帧与超声波距离的时间对齐服务
+
+    注册到颜色检测和距离测量的回调后，可以查询“帧采集时刻的距离”，
+    使视觉转向和测距停车基于同一时刻的数据。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.frames = TimestampedHistory()
+        self.distances = TimestampedHistory()
+        # 每帧插值所用的前后两个距离样本的间隔（插值只在这段时间内假设匀速，间隔越短误差越小）
+        self.interpolation_spans = deque(maxlen=SKEW_HISTORY_SIZE)
+        # 每帧与当时最新距离样本的时间差（不对齐直接取最新值时的误差来源）
+        self.naive_skews = deque(maxlen=SKEW_HISTORY_SIZE)
+        self.pending_frames = deque()  # 还没有等到之后距离样本的帧时间
+        self.unaligned_frames = 0      # 前后距离样本间隔超过MAX_INTERPOLATION_GAP、无法插值的帧数
+
+    def on_color_frame(self, color_data, timestamp):
+        """颜色检测回调"""
+        with self.lock:
+            self.frames.add(timestamp, color_data)
+            # 等待超过MAX_INTERPOLATION_GAP仍没有之后的距离样本，该帧已不可能插值（测距停止时不会无限增长）
+            while self.pending_frames and timestamp - self.pending_frames[0] > MAX_INTERPOLATION_GAP:
+                self.pending_frames.popleft()
+                self.unaligned_frames += 1
+            self.pending_frames.append(timestamp)
+            latest = self.distances.latest()
+            if latest is not None:
+                self.naive_skews.append(timestamp - latest[0])
+
+    def on_distance_sample(self, distance, timestamp):
+        """距离测量回调"""
+        with self.lock:
+            self.distances.add(timestamp, distance)
+            # 帧前后都有距离样本后，记录该帧插值跨越的时间
+            still_pending = deque()
+            for frame_time in self.pending_frames:
+                if frame_time > timestamp:
+                    still_pending.append(frame_time)
+                    continue
+                span = self.distances.bracket_span(frame_time)
+                if span is None or span > MAX_INTERPOLATION_GAP:
+                    self.unaligned_frames += 1
+                else:
+                    self.interpolation_spans.append(span)
+            self.pending_frames = still_pending
+
+    def distance_at(self, timestamp):
+        """
+        获取指定时刻的距离
+
+        Args:
+            timestamp: 查询时间（通常是帧采集时间）
+
+        Returns:
+            float: 插值得到的距离(cm)，无法对齐时返回-1
+        """
+        with self.lock:
+            distance = self.distances.interpolate(timestamp)
+        if distance is None:
+            return -1
+        return distance
+
+    def latest_aligned(self):
+        """
+        获取最新一帧及其采集时刻的距离
+
+        Returns:
+            tuple: (color_data, 帧时间, 距离cm)，没有帧时返回({}, 0.0, -1)
+        """
+        with self.lock:
+            latest = self.frames.latest()
+            if latest is None:
+                return {}, 0.0, -1
+            frame_time, color_data = latest
+            distance = self.distances.interpolate(frame_time)
+        return color_data, frame_time, -1 if distance is None else distance
+
+    def skew_stats(self):
+        """
+        统计两路数据的时间差分布
+
+        naive为直接取最新距离时与帧的时间差；span为插值对齐时前后两个距离样本的间隔
+        （对齐的误差来自这段时间内速度的变化，不是时间差）
+
+        Returns:
+            dict: {"naive": {...}, "span": {...}, "unaligned": 无法插值的帧数}，
+                  naive、span包含count、mean、p50、p90、p99、max（秒）
+        """
+        with self.lock:
+            naive = list(self.naive_skews)
+            spans = list(self.interpolation_spans)
+            unaligned = self.unaligned_frames
+        return {"naive": _summarize(naive), "span": _summarize(spans), "unaligned": unaligned}
+
+
+def _summarize(values):
+    """计算时间差分布的统计量（内部使用）"""
+    if not values:
+        return {"count": 0, "mean": 0.0, "p50": 0.0, "p90": 0.0, "p99": 0.0, "max": 0.0}
+    values = sorted(abs(v) for v in values)
+    n = len(values)
+
+    def percentile(p):
+        return values[min(n - 1, int(round(p / 100.0 * (n - 1))))]
+
+    return {
+        "count": n,
+        "mean": sum(values) / n,
+        "p50": percentile(50),
+        "p90": percentile(90),
+        "p99": percentile(99),
+        "max": values[-1],
+    }
+
+
+# ===== 全局实例 =====
+aligner = SensorAligner()
+
+
+def start_time_alignment():
+    """把全局对齐服务注册到颜色检测和距离测量的回调"""
+    from detect_color import add_color_listener
+    from detect_distance import add_distance_listener
+
+    add_color_listener(aligner.on_color_frame)
+    add_distance_listener(aligner.on_distance_sample)
+    print("时间对齐服务已启动")
+
+
+def stop_time_alignment():
+    """注销回调"""
+    from detect_color import remove_color_listener
+    from detect_distance import remove_distance_listener
+
+    remove_color_listener(aligner.on_color_frame)
+    remove_distance_listener(aligner.on_distance_sample)
+
+
+def get_aligned_color_and_distance():
+    """
+    获取最新一帧颜色结果及该帧采集时刻的距离
+
+    Returns:
+        tuple: (color_data, 帧时间, 距离cm)，距离无法对齐时为-1
+    """
+    return aligner.latest_aligned()
+
+
+def print_skew_stats():
+    """打印时间差统计"""
+    stats = aligner.skew_stats()
+    for name, label in (("naive", "直接取最新值的时间差"), ("span", "插值对齐的样本间隔")):
+        s = stats[name]
+        print(f"{label}: n={s['count']}, 平均={s['mean']*1000:.0f}ms, "
+              f"p50={s['p50']*1000:.0f}ms, p90={s['p90']*1000:.0f}ms, "
+              f"p99={s['p99']*1000:.0f}ms, 最大={s['max']*1000:.0f}ms")
+    print(f"无法插值的帧: {stats['unaligned']}")
+
+
+# 以下仅用于测试
+
+# ===== 离线仿真：两个不同步的10Hz数据流，小车匀速接近魔方 =====
+if __name__ == "__main__":
+    import random
+
+    test = SensorAligner()
+    speed = 50.0  # cm/s
+    start_distance = 200.0
+    naive_errors = []
+    aligned_errors = []
+    events = []
+    for i in range(60):
+        events.append((i * 0.1 + 0.013, "frame"))
+        events.append((i * 0.1 + 0.071 + random.uniform(-0.01, 0.01), "distance"))
+    events.sort()
+    last_distance = -1
+    for t, kind in events:
+        true_distance = start_distance - speed * t
+        if kind == "frame":
+            test.on_color_frame({"red": [(-20, 20, 0)]}, t)
+            if last_distance > 0:
+                naive_errors.append(abs(last_distance - true_distance))
+        else:
+            last_distance = true_distance + random.gauss(0, 0.5)
+            test.on_distance_sample(last_distance, t)
+            # 距离到达后查询上一帧时刻的距离
+            frame = test.frames.latest()
+            if frame is not None:
+                estimate = test.distance_at(frame[0])
+                if estimate > 0:
+                    aligned_errors.append(abs(estimate - (start_distance - speed * frame[0])))
+    print(f"直接配对误差: 平均 {sum(naive_errors)/len(naive_errors):.2f}cm")
+    print(f"对齐插值误差: 平均 {sum(aligned_errors)/len(aligned_errors):.2f}cm")
+    aligner = test
+    print_skew_stats()
+
+    # 测距停止（超声波断线）时等待插值的帧不会无限增长
+    for i in range(1000):
+        test.on_color_frame({}, 10.0 + i * 0.033)
+    assert len(test.pending_frames) <= MAX_INTERPOLATION_GAP / 0.033 + 1, len(test.pending_frames)
+    print(f"测距停止后等待插值的帧: {len(test.pending_frames)}，无法插值的帧: {test.unaligned_frames}")